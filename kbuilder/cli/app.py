@@ -14,6 +14,7 @@ from kbuilder.cli.interface.database import IDatabase
 from kbuilder.cli.interface.linux import ILinuxBuild
 from kbuilder.cli.interface.compiler import ICompiler
 from kbuilder.core.android import AndroidKernel
+from kbuilder.core.hooks import HookPipeline, HookResult
 from kbuilder.core.linux import LinuxKernel
 
 COLORS = {
@@ -26,7 +27,11 @@ COLORS = {
 
 # Application default.  Should update config/kbuilder.conf to reflect any
 # changes, or additions here.
-defaults = init_defaults('kbuilder')
+defaults = init_defaults('kbuilder', 'modules', 'clang', 'tmpfs', 'watch',
+                         'prepare_cache', 'hooks', 'report', 'fail_fast', 'priority',
+                         'toolchains', 'history', 'serve',
+                         'remote_cache', 'sizes', 'reproducible',
+                         'ota_signing', 'worktrees', 'progress')
 
 # All internal/external plugin configurations are loaded from here
 defaults['kbuilder']['plugin_config_dir'] = '/etc/kbuilder/plugins.d'
@@ -37,6 +42,104 @@ defaults['kbuilder']['plugin_dir'] = '/var/lib/kbuilder/plugins'
 # External templates (generally, do not ship with application code)
 defaults['kbuilder']['template_dir'] = '/var/lib/kbuilder/templates'
 
+# Loadable module staging, stripping and signing
+defaults['modules']['staging_dir'] = ''
+defaults['modules']['strip'] = True
+defaults['modules']['sign'] = False
+defaults['modules']['sign_hash'] = 'sha256'
+defaults['modules']['sign_key'] = 'certs/signing_key.pem'
+defaults['modules']['sign_cert'] = 'certs/signing_key.x509'
+defaults['modules']['ota_dir'] = 'modules'
+
+# Managed ThinLTO caches of clang builds
+defaults['clang']['thinlto_cache_dir'] = '~/.cache/kbuilder/thinlto'
+defaults['clang']['thinlto_cache_size'] = '10G'
+
+# Object directories on tmpfs
+defaults['tmpfs']['enable'] = False
+defaults['tmpfs']['root'] = '/dev/shm/kbuilder'
+defaults['tmpfs']['writeback_dir'] = ''
+defaults['tmpfs']['min_available'] = '2G'
+defaults['tmpfs']['max_pressure'] = 10.0
+
+# Rebuilds on change
+defaults['watch']['debounce'] = 0.5
+
+# Snapshots of `make prepare` outputs
+defaults['prepare_cache']['enable'] = True
+defaults['prepare_cache']['dir'] = '~/.cache/kbuilder/prepare'
+defaults['prepare_cache']['max_entries'] = 8
+
+# Post-build hooks registered by plugins
+defaults['hooks']['max_workers'] = 4
+
+# Machine readable build results
+defaults['report']['result_json'] = ''
+defaults['report']['metrics_dir'] = ''
+
+# Stopping builds at the first failing target
+defaults['fail_fast']['enable'] = False
+defaults['fail_fast']['reproduce'] = True
+
+# Priority classes and cgroup limits of builds
+defaults['priority']['class'] = ''
+defaults['priority']['cgroup_parent'] = ''
+defaults['priority']['memory_high'] = ''
+
+# Toolchains extracted on demand from archives
+defaults['toolchains']['mirror_dir'] = ''
+defaults['toolchains']['cache_dir'] = '~/.cache/kbuilder/toolchains'
+defaults['toolchains']['max_size'] = '30G'
+
+# Build history and regression detection
+defaults['history']['enable'] = True
+defaults['history']['window'] = 50
+defaults['history']['significance'] = 0.01
+defaults['history']['time_threshold'] = 5.0
+defaults['history']['size_threshold'] = '16K'
+
+# HTTP server of the export directory
+defaults['serve']['host'] = ''
+defaults['serve']['port'] = 8000
+
+# Team cache shared over HTTP, and its reference server
+defaults['remote_cache']['url'] = ''
+defaults['remote_cache']['upload'] = True
+defaults['remote_cache']['artifacts'] = False
+defaults['remote_cache']['jobs'] = 8
+defaults['remote_cache']['timeout'] = 30.0
+defaults['remote_cache']['token'] = ''
+defaults['remote_cache']['server_dir'] = '~/.cache/kbuilder/remote'
+defaults['remote_cache']['server_port'] = 8090
+defaults['remote_cache']['server_max_size'] = '50G'
+
+# Section and symbol sizes of vmlinux
+defaults['sizes']['top'] = 20
+defaults['sizes']['keep'] = 10
+
+# Builds whose outputs only depend on their sources
+defaults['reproducible']['enable'] = False
+defaults['reproducible']['user'] = 'kbuilder'
+defaults['reproducible']['host'] = 'kbuilder'
+
+# Whole-file signatures of OTA packages
+defaults['ota_signing']['enable'] = False
+defaults['ota_signing']['key'] = ''
+defaults['ota_signing']['cert'] = ''
+defaults['ota_signing']['openssl'] = 'openssl'
+
+# Pooled git worktrees of build --rev
+defaults['worktrees']['dir'] = '~/.cache/kbuilder/worktrees'
+defaults['worktrees']['size'] = 4
+
+# Progress and ETA of kbuild image builds
+defaults['progress']['enable'] = True
+defaults['progress']['interval'] = 0.5
+
+# Hook points at which plugins can register build hooks
+BUILD_HOOKS = ['post_kbuild_image',
+               'post_ota_package']
+
 
 class App(CementApp):
     class Meta:
@@ -87,6 +190,26 @@ class App(CementApp):
                     kernel.__class__))
         self._active_kernel = kernel
 
+    @cached_property
+    def build_hooks(self):
+        """Post-build hooks which run concurrently.
+
+        Plugins register callbacks with
+        ``app.build_hooks.register('post_kbuild_image', func, required=False)``.
+        """
+        return HookPipeline(BUILD_HOOKS,
+                            max_workers=int(self.config.get('hooks', 'max_workers')),
+                            on_background_result=self.log_hook_result)
+
+    def log_hook_result(self, result: HookResult) -> None:
+        """Log the outcome of a build hook."""
+        if result.ok:
+            self.log.info('hook {0.name} finished in {0.duration:.2f}s'.format(result))
+        elif result.required:
+            self.log.error('hook {0.name} failed: {0.error}'.format(result))
+        else:
+            self.log.warning('optional hook {0.name} failed: {0.error}'.format(result))
+
     @cached_property
     def compiler_manager(self):
         manager = self.handler.resolve('compiler', 'gcc_handler')
@@ -5,6 +5,7 @@
 
 from kbuilder.cli.controller.android import AndroidBuildController
 from kbuilder.cli.controller.base import BaseController
+from kbuilder.cli.controller.config import ConfigController
 from kbuilder.cli.controller.gcc import GccController
 from kbuilder.cli.controller.linux import LinuxBuildController
 
@@ -14,3 +15,4 @@ def load(app):
     app.handler.register(LinuxBuildController)
     app.handler.register(AndroidBuildController)
     app.handler.register(GccController)
+    app.handler.register(ConfigController)
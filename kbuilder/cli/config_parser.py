@@ -19,9 +19,19 @@ def parse_kernel_config(app):
     defconfig = app.config.get(kernel_name, 'defconfig')
     arch = Arch[app.config.get(kernel_name, 'arch')]
     kernel = derive_kernel(kernel_root, arch, defconfig)
+    if 'output_dir' in app.config.keys(kernel_name):
+        output_dir = app.config.get(kernel_name, 'output_dir')
+        if output_dir:
+            kernel.output_dir = kernel_root / os.path.expanduser(output_dir)
     app.active_kernel = kernel
 
 
+def get_bool(config, section: str, key: str) -> bool:
+    """Return a config value interpreted as a boolean."""
+    value = config.get(section, key)
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 def derive_kernel(kernel_root: str, arch: Arch, defconfig: str) -> LinuxKernel:
     """Determine which type of kernel that needs to be created."""
     #  To be implemented later
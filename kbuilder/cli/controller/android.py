@@ -13,6 +13,12 @@ class AndroidBuildController(ArgparseController):
         arguments = [(['-t', '--compiler'],
                       dict(help='The compiler to use',
                            dest='compiler',
+                           action='store')),
+                     (['--delta-from'],
+                      dict(help='Also create a delta package against an OTA package in '
+                                "the export directory, or 'previous'",
+                           dest='delta_from',
+                           metavar='OTA',
                            action='store'))
                     ]
 
@@ -31,4 +37,5 @@ class AndroidBuildController(ArgparseController):
     @expose(help='Build an OTA packge', aliases=['ota'],)
     def otapackage(self):
         """Build an OTA packge."""
-        self.builder.build_ota_package()
+        with self.builder.revision(self.app.pargs.rev):
+            self.builder.build_ota_package()
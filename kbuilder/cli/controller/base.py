@@ -42,7 +42,47 @@ class BaseController(ArgparseController):
     def clean(self):
         """Clean build files."""
         self.app.log.info('Cleaning build files')
-        self.app.active_kernel.clean()
+        self.app.builder.clean()
+
+    @expose(help='Show files changed since the last successful build')
+    def status(self):
+        """Show files changed since the last successful build."""
+        self.app.builder.status()
+
+    @expose(help='Show the latest builds and regressions of build time and image size')
+    def history(self):
+        """Show the build history."""
+        self.app.builder.history(self.app.pargs.extra_arguments)
+
+    @expose(help='Show the section and symbol sizes of vmlinux or a module')
+    def sizes(self):
+        """Show the section and symbol sizes."""
+        self.app.builder.sizes(self.app.pargs.extra_arguments)
+
+    @expose(help='Compare the symbol sizes of vmlinux with a previous build')
+    def bloat(self):
+        """Compare the symbol sizes of two builds."""
+        self.app.builder.bloat(self.app.pargs.extra_arguments)
+
+    @expose(help='Verify the signatures of OTA packages, by default of the latest one')
+    def verifyota(self):
+        """Verify the signatures of OTA packages."""
+        self.app.android_builder.verify_ota_packages(self.app.pargs.extra_arguments)
+
+    @expose(help='Serve the artifacts in the export directory over HTTP')
+    def serve(self):
+        """Serve the export directory."""
+        self.app.builder.serve(self.app.pargs.extra_arguments)
+
+    @expose(help='Run a remote cache server for a team')
+    def cacheserver(self):
+        """Run the reference remote cache server."""
+        self.app.builder.cache_server(self.app.pargs.extra_arguments)
+
+    @expose(help='Show how many objects changing files rebuilds, or rank headers by it')
+    def impact(self):
+        """Show the rebuild cost of changing files."""
+        self.app.builder.impact(self.app.pargs.extra_arguments)
 
     @expose(help='Initialize the build environment')
     def init(self):
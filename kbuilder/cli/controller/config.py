@@ -0,0 +1,41 @@
+"""Kernel configuration controllers."""
+
+from cement.ext.ext_argparse import ArgparseController, expose
+
+
+class ConfigController(ArgparseController):
+    """Provides options for querying and changing the kernel configuration."""
+    class Meta:
+        label = 'config'
+        description = 'Query and change the kernel configuration'
+        stacked_on = 'base'
+        stacked_type = 'nested'
+        arguments = [
+            (['extra_arguments'],
+             dict(action='store', nargs='*'))
+        ]
+
+    @expose(hide=True)
+    def default(self):
+        """Show the defconfig settings which differ in .config."""
+        self.app.builder.config_diff([])
+
+    @expose(help='Show config symbols, e.g. USB_STORAGE or USB_*')
+    def get(self):
+        """Show the values and definitions of config symbols."""
+        self.app.builder.config_get(self.app.pargs.extra_arguments)
+
+    @expose(help='Set config symbols in the defconfig, e.g. USB_STORAGE=m')
+    def set(self):
+        """Set config symbols in the defconfig and .config."""
+        self.app.builder.config_set(self.app.pargs.extra_arguments)
+
+    @expose(help='Compare the defconfig or a config file with .config, or two config files')
+    def diff(self):
+        """Compare kernel configurations."""
+        self.app.builder.config_diff(self.app.pargs.extra_arguments)
+
+    @expose(help='Explain which dependencies and selects set config symbols')
+    def why(self):
+        """Explain the values of config symbols."""
+        self.app.builder.config_why(self.app.pargs.extra_arguments)
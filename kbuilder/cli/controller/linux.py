@@ -10,7 +10,35 @@ class LinuxBuildController(ArgparseController):
         stacked_on = 'base'
         stacked_type = 'nested'
         description = 'Build the Linux kernel'
-        arguments = []
+        arguments = [(['--tmpfs'],
+                      dict(help='Build with the object directory on tmpfs',
+                           dest='tmpfs',
+                           action='store_true')),
+                     (['-w', '--watch'],
+                      dict(help='Rebuild the kbuild image whenever a source file changes',
+                           dest='watch',
+                           action='store_true')),
+                     (['--fail-fast'],
+                      dict(help='Stop at the first failing target and rebuild it alone',
+                           dest='fail_fast',
+                           action='store_true')),
+                     (['--priority'],
+                      dict(help='Priority class of the build',
+                           dest='priority',
+                           choices=['interactive', 'normal', 'batch'],
+                           action='store')),
+                     (['--result-json'],
+                      dict(help='Write the results of the build to a JSON file',
+                           dest='result_json',
+                           metavar='FILE',
+                           action='store')),
+                     (['--rev'],
+                      dict(help='Build a commit in a git worktree, leaving the kernel '
+                                'tree untouched',
+                           dest='rev',
+                           metavar='COMMIT',
+                           action='store'))
+                    ]
 
     def __init__(self, *args, **kw):
         """Init the controller."""
@@ -34,9 +62,20 @@ class LinuxBuildController(ArgparseController):
             aliases=['kbuildimage', 'zimage'],)
     def kernel(self):
         """Build a kernel image."""
-        self.builder.build_kbuild_image()
+        with self.builder.revision(self.app.pargs.rev):
+            if self.app.pargs.watch:
+                self.builder.watch_kbuild_image()
+            else:
+                self.builder.build_kbuild_image()
+
+    @expose(help='Build, strip and sign loadable modules')
+    def modules(self):
+        """Build the loadable modules."""
+        with self.builder.revision(self.app.pargs.rev):
+            self.builder.build_modules()
 
     @expose(help='Build a default configuration file')
     def defconfig(self):
         """Build a default configuration file."""
-        self.builder.build_defconfig()
+        with self.builder.revision(self.app.pargs.rev):
+            self.builder.build_defconfig()
@@ -1,10 +1,18 @@
 """Handlers for Android."""
 
+import shutil
 import subprocess
 from pathlib import Path
+from typing import Dict, List
 
+from kbuilder.cli.config_parser import get_bool
 from kbuilder.cli.handler.linux import LinuxBuildHandler
 from kbuilder.cli.interface.android import IAndroidBuild
+from kbuilder.core import delta, modules
+from kbuilder.core.exc import KbuilderArgumentError, KbuilderConfigError, KbuilderRuntimeError
+from kbuilder.core.ota_signing import OtaSigner
+from kbuilder.core.report import BuildReport
+from kbuilder.core.worktree import Worktree
 
 
 class AndroidBuildHandler(LinuxBuildHandler, IAndroidBuild):
@@ -23,12 +31,167 @@ class AndroidBuildHandler(LinuxBuildHandler, IAndroidBuild):
         super()._setup(app)
         self.ota_source_dir = Path(app.config.get('android', 'ota_dir')).expanduser()
 
+    def worktree_dirs(self, worktree: Worktree) -> Dict[str, Path]:
+        """Stage OTA packages of a worktree in a fresh copy of the OTA tree."""
+        dirs = super().worktree_dirs(worktree)
+        ota_dir = worktree.object_dir.parent / 'ota'
+        shutil.rmtree(str(ota_dir), ignore_errors=True)
+        if self.ota_source_dir.is_dir():
+            shutil.copytree(str(self.ota_source_dir), str(ota_dir), symlinks=True)
+        else:
+            ota_dir.mkdir()
+        dirs['ota_source_dir'] = ota_dir
+        return dirs
+
     def build_ota_package(self):
-        if self.build_kbuild_image():
-            ota = self.kernel.make_ota_package(kbuild_image_dir='boot',
-                                                source_dir=self.ota_source_dir,
-                                                output_dir=self.export_path)
-            self.log.info('created ' + ota)
+        with self.reporting('ota_package') as report:
+            if self.build_kbuild_image():
+                if self.kernel.modules_enabled:
+                    self.add_ota_modules()
+                with report.phase('package'):
+                    ota = self.make_ota_package(report)
+                self.log.info('created {}'.format(ota))
+                delta_from = getattr(self.app.pargs, 'delta_from', None)
+                if delta_from:
+                    with report.phase('delta'):
+                        package = self.make_delta_package(Path(ota), delta_from)
+                    report.add_artifact(package, 'delta_package')
+                with report.phase('hooks'):
+                    self.run_hooks('post_ota_package', ota)
+
+    @property
+    def ota_signer(self) -> OtaSigner:
+        """The signer of OTA packages, if enabled.
+
+        Raises:
+            KbuilderConfigError: If no key or certificate is configured.
+        """
+        config = self.app.config
+        if not get_bool(config, 'ota_signing', 'enable'):
+            return None
+        key, cert = config.get('ota_signing', 'key'), config.get('ota_signing', 'cert')
+        if not key or not cert:
+            raise KbuilderConfigError('Signing OTA packages needs a key and a certificate')
+        return OtaSigner(Path(key).expanduser(), Path(cert).expanduser(),
+                         openssl=config.get('ota_signing', 'openssl'))
+
+    def make_ota_package(self, report: BuildReport) -> Path:
+        """Package the OTA tree into the export directory, signed if enabled.
+
+        Returns:
+            The path of the OTA package.
+
+        Raises:
+            KbuilderConfigError: If the certificate cannot be used.
+            KbuilderRuntimeError: If the package cannot be signed.
+        """
+        options = dict(kbuild_image_dir='boot', source_dir=self.ota_source_dir,
+                       output_dir=self.export_path, epoch=self.source_date_epoch)
+        signer = self.ota_signer
+        if not signer:
+            ota = self.kernel.make_ota_package(**options)
+            report.add_artifact(ota, 'ota_package')
+            return ota
+        try:
+            signed = self.kernel.make_signed_ota_package(signer, **options)
+        except ValueError as error:
+            raise KbuilderConfigError('Failed to sign the OTA package: {}'.format(error))
+        report.add_artifact(signed.path, 'ota_package', sha256=signed.sha256,
+                            signed_sha256=signed.signed_sha256,
+                            chunk_sha256=signed.chunk_sha256)
+        return signed.path
+
+    def verify_ota_packages(self, arguments: List[str]) -> None:
+        """Verify the signatures of OTA packages.
+
+        Args:
+            arguments: Paths or names of packages in the export directory,
+                by default the latest package.
+
+        Raises:
+            KbuilderArgumentError: If a package does not exist.
+            KbuilderRuntimeError: If a package is not signed by the key.
+        """
+        signer = self.ota_signer
+        if not signer:
+            raise KbuilderConfigError('OTA signing is not enabled')
+        if arguments:
+            packages = [self.find_package(name) for name in arguments]
+        else:
+            packages = self.ota_packages()[-1:]
+            if not packages:
+                raise KbuilderArgumentError('No OTA package in {}'.format(self.export_path))
+        failed = 0
+        for package in packages:
+            try:
+                signed = signer.verify(package)
+            except ValueError as error:
+                print('{}: FAILED, {}'.format(package, error))
+                failed += 1
+                continue
+            print('{}: OK, {} chunks, sha256 {}'.format(package, len(signed.chunk_sha256),
+                                                      signed.sha256))
+        if failed:
+            raise KbuilderRuntimeError('{} of {} packages failed verification'.format(
+                failed, len(packages)))
+
+    def find_package(self, name: str) -> Path:
+        """Find an OTA package by path or by name in the export directory.
+
+        Raises:
+            KbuilderArgumentError: If no such package exists.
+        """
+        for path in (Path(name).expanduser(), self.export_path / name):
+            if path.is_file():
+                return path
+        raise KbuilderArgumentError('No such OTA package: {}'.format(name))
+
+    def find_base_package(self, ota: Path, name: str) -> Path:
+        """Find the OTA package a delta package is based on.
+
+        Args:
+            ota: The OTA package the delta package updates to.
+            name: A path, a file name in the export directory, or 'previous'
+                for the most recent other OTA package in the export directory.
+
+        Raises:
+            KbuilderArgumentError: If no such package exists.
+        """
+        if name == 'previous':
+            packages = [path for path in self.ota_packages() if path.name != ota.name]
+            if not packages:
+                raise KbuilderArgumentError('No previous OTA package in {}'.format(
+                    self.export_path))
+            return packages[-1]
+        return self.find_package(name)
+
+    def ota_packages(self) -> List[Path]:
+        """Return the OTA packages in the export directory, oldest first."""
+        packages = [path for path in self.export_path.glob('*.zip')
+                    if not path.stem.endswith('-delta')]
+        return sorted(packages, key=lambda path: path.stat().st_mtime)
+
+    def make_delta_package(self, ota: Path, base_name: str) -> Path:
+        """Create a delta package updating a previous OTA package to a new one.
+
+        Returns:
+            The path of the delta package.
+        """
+        base = self.find_base_package(ota, base_name)
+        package = self.export_path / '{}-from-{}-delta.zip'.format(ota.stem, base.stem)
+        manifest = delta.make_delta_package(base, ota, package)
+        patched = sum(entry['action'] == 'patch' for entry in manifest['entries'])
+        self.log.info('created {} ({} patched files, {} of {} bytes)'.format(
+            package, patched, package.stat().st_size, ota.stat().st_size))
+        return package
+
+    def add_ota_modules(self) -> None:
+        """Build the loadable modules and copy them into the OTA tree."""
+        modules_dir = self.ota_source_dir / self.app.config.get('modules', 'ota_dir')
+        built = self.build_modules()
+        modules.copy_modules(built, modules_dir,
+                             metadata_dir=self.module_staging_dir / 'processed')
+        self.log.info('added {} modules to {}'.format(len(built), modules_dir))
 
     def build_kbuild_image(self) -> Path:
         """Build a kbuild image with the default compiler.
@@ -36,27 +199,34 @@ class AndroidBuildHandler(LinuxBuildHandler, IAndroidBuild):
         Returns:
             The Path to the kbuild image if successful, None otherwise
         """
-        self.compiler.set_as_active()
-        self.kernel.extra_version = self.compiler.name
-        info = 'Compiling {0} with {1}'.format(self.kernel.release_version,
-                                               self.compiler)
-        self.log.info(info)
-        self.kernel.arch_clean()
+        with self.reporting('kbuild_image') as report:
+            with report.phase('prepare'):
+                self.prepare_build()
+            self.kernel.extra_version = self.compiler.name
+            info = 'Compiling {0} with {1}'.format(self.kernel.release_version,
+                                                   self.compiler)
+            self.log.info(info)
+            try:
+                self.make_kbuild_image(report)
+                self.prune_compiler_caches()
+                self.finish_build(self.kernel.kbuild_image)
+                report.add_artifact(self.kernel.kbuild_image, 'kbuild_image')
+                self.log.info('{0.kbuild_image} created'.format(self.kernel))
+                with report.phase('hooks'):
+                    self.run_hooks('post_kbuild_image', self.kernel.kbuild_image)
+                return self.kernel.kbuild_image
 
-        try:
-            self.kernel.build_kbuild_image(self.build_log_dir)
-            self.log.info('{0.kbuild_image} created'.format(self.kernel))
-            return self.kernel.kbuild_image
-
-        except subprocess.CalledProcessError:
-            self.log.error('Failed to compile {0.release_version}'.format(
-                    self.kernel))
-            return None
+            except subprocess.CalledProcessError as error:
+                self.log.error('Failed to compile {0.release_version}'.format(
+                        self.kernel))
+                report.fail(error)
+                return None
 
     def build_boot_image(self):
         raise NotImplementedError
 
     def init(self) -> None:
         "Initialize the build environment."
-        self.compiler.set_as_active()
-        self.kernel.prepare()
+        self.prepare_build()
+        self.prepare_kernel()
+        self.wait_for_uploads()
@@ -7,6 +7,8 @@ from cement.utils.shell import Prompt
 
 from kbuilder.cli.interface.compiler import ICompiler
 from kbuilder.core import gcc
+from kbuilder.core.toolchain_cache import ToolchainCache
+from kbuilder.utils.units import parse_size
 
 
 class GccHandler(ICompiler, CementBaseHandler):
@@ -21,13 +23,21 @@ class GccHandler(ICompiler, CementBaseHandler):
         super().__init__(**kw_args)
         self.compiler_dir = None
         self.compilers = None
+        self.toolchain_cache = None
 
     def _setup(self, app):
         super()._setup(app)
         self.app = app
         kernel = self.app.active_kernel
         self.compiler_dir = Path(self.app.config.get('general', 'compiler_dir'))
-        self.compilers = gcc.scandir(self.compiler_dir.expanduser(), kernel.arch)
+        mirror_dir = self.app.config.get('toolchains', 'mirror_dir')
+        if mirror_dir:
+            self.toolchain_cache = ToolchainCache(
+                Path(self.app.config.get('toolchains', 'cache_dir')).expanduser(),
+                Path(mirror_dir).expanduser(),
+                parse_size(self.app.config.get('toolchains', 'max_size')))
+        self.compilers = gcc.scandir(self.compiler_dir.expanduser(), kernel.arch,
+                                     cache=self.toolchain_cache)
         self.log = app.log
 
     @property
@@ -39,7 +49,12 @@ class GccHandler(ICompiler, CementBaseHandler):
         print(self.app.db['default_compiler'])
 
     def list_compilers(self) -> None:
-        compiler_names = [x.name for x in self.compilers]
+        compiler_names = []
+        for compiler in self.compilers:
+            if isinstance(compiler, gcc.ArchivedCompiler) and not compiler.extracted:
+                compiler_names.append('{} (archived)'.format(compiler.name))
+            else:
+                compiler_names.append(compiler.name)
         names = "\n".join(compiler_names)
         print("Local compilers:\n\n{}".format(names))
 
@@ -1,8 +1,40 @@
 """Handlers for Linux."""
 
+import fnmatch
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 
+from kbuilder.cli.config_parser import get_bool
 from kbuilder.cli.interface.linux import ILinuxBuild
+from kbuilder.core import kconfig, modules
+from kbuilder.core.artifact_cache import ArtifactCache
+from kbuilder.core.depindex import DependencyIndex
+from kbuilder.core.exc import KbuilderArgumentError, KbuilderConfigError, KbuilderRuntimeError
+from kbuilder.core.failure import MakeTargetError
+from kbuilder.core.gcc import ArchivedCompiler, ClangCompiler, Compiler
+from kbuilder.core.history import BuildHistory, git_revision
+from kbuilder.core.lto import ThinLtoCache
+from kbuilder.core.make import MakeResult
+from kbuilder.core.prepare_cache import PrepareCache
+from kbuilder.core.remote_cache import CacheServer, CacheStore, RemoteCache
+from kbuilder.core.priority import PRIORITY_CLASSES
+from kbuilder.core.progress import BuildProgress
+from kbuilder.core.report import BuildReport
+from kbuilder.core.reproducible import build_variables, source_date_epoch
+from kbuilder.core.server import ArtifactServer, ExportIndex
+from kbuilder.core.sizes import SizeDiff, SizeProfile, section_changes
+from kbuilder.core.tmpfs import TmpfsObjectDir
+from kbuilder.core.trash import Trash, object_dir_outputs, source_tree_outputs
+from kbuilder.core.tree_index import TreeIndex
+from kbuilder.core.watch import RebuildLoop, TreeWatcher
+from kbuilder.core.worktree import Worktree, WorktreePool
+from kbuilder.utils.units import format_duration, format_size, parse_size
 
 
 class LinuxBuildHandler(ILinuxBuild):
@@ -19,6 +51,16 @@ class LinuxBuildHandler(ILinuxBuild):
         self._db = None
         self.export_path = None
         self.build_log_dir = None
+        self.module_staging_dir = None
+        self.lto_cache = None
+        self.tmpfs = None
+        self.prepare_cache = None
+        self.remote_cache = None
+        self.artifact_cache = None
+        self.worktree = None
+        self._progress_shown = 0.0
+        self._watch_cancelled = False
+        self.report = None
         self._products = []
         self.log = None
 
@@ -28,6 +70,39 @@ class LinuxBuildHandler(ILinuxBuild):
         self.export_path = Path(app.config.get('output', 'export_dir')).expanduser()
         self.export_path.mkdir(parents=True, exist_ok=True)
         self.build_log_dir = Path(app.config.get('general', 'log_dir')).expanduser()
+        staging_dir = app.config.get('modules', 'staging_dir')
+        if staging_dir:
+            self.module_staging_dir = Path(staging_dir).expanduser()
+        else:
+            self.module_staging_dir = self.kernel.root / '.kbuilder' / 'modules'
+        self.lto_cache = ThinLtoCache(
+            Path(app.config.get('clang', 'thinlto_cache_dir')).expanduser(),
+            parse_size(app.config.get('clang', 'thinlto_cache_size')))
+        writeback_dir = app.config.get('tmpfs', 'writeback_dir')
+        self.tmpfs = TmpfsObjectDir(
+            Path(app.config.get('tmpfs', 'root')).expanduser(),
+            self.kernel.name,
+            Path(writeback_dir).expanduser() if writeback_dir else
+            self.kernel.root / '.kbuilder' / 'tmpfs',
+            min_available=parse_size(app.config.get('tmpfs', 'min_available')),
+            max_pressure=float(app.config.get('tmpfs', 'max_pressure')))
+        remote_url = app.config.get('remote_cache', 'url')
+        if remote_url:
+            try:
+                self.remote_cache = RemoteCache(
+                    remote_url, jobs=int(app.config.get('remote_cache', 'jobs')),
+                    timeout=float(app.config.get('remote_cache', 'timeout')),
+                    token=app.config.get('remote_cache', 'token') or None)
+            except ValueError as error:
+                raise KbuilderConfigError(str(error))
+        self.prepare_cache = PrepareCache(
+            Path(app.config.get('prepare_cache', 'dir')).expanduser(),
+            int(app.config.get('prepare_cache', 'max_entries')),
+            remote=self.remote_cache,
+            upload=get_bool(app.config, 'remote_cache', 'upload'))
+        if self.remote_cache and get_bool(app.config, 'remote_cache', 'artifacts'):
+            self.artifact_cache = ArtifactCache(
+                self.remote_cache, upload=get_bool(app.config, 'remote_cache', 'upload'))
         self._db = app.db
         self.log = app.log
 
@@ -41,23 +116,1130 @@ class LinuxBuildHandler(ILinuxBuild):
 
     @property
     def compiler(self):
+        """The default compiler, extracted from its archive if necessary."""
         try:
-            return self._db['default_compiler']
+            compiler = self._db['default_compiler']
         except KeyError:
             self.log.warning("Compiler not set")
+            return None
+        if isinstance(compiler, ArchivedCompiler):
+            if not compiler.extracted:
+                self.log.info('Extracting {}'.format(compiler.name))
+            return compiler.compiler
+        return compiler
+
+    @property
+    def tmpfs_enabled(self) -> bool:
+        """Whether the object directory should be placed on tmpfs."""
+        return (getattr(self.app.pargs, 'tmpfs', False) or
+                get_bool(self.app.config, 'tmpfs', 'enable'))
+
+    @property
+    def fail_fast(self) -> bool:
+        """Whether builds should stop at the first failing target."""
+        return (getattr(self.app.pargs, 'fail_fast', False) or
+                get_bool(self.app.config, 'fail_fast', 'enable'))
+
+    @property
+    def log_dir(self) -> Path:
+        """Directory build logs are written to."""
+        if self.kernel.output_dir == self.tmpfs.path:
+            return self.tmpfs.path / 'logs'
+        return self.build_log_dir
+
+    def prepare_build(self) -> None:
+        """Prepare the object directory and compiler for invoking make."""
+        self.prepare_object_dir()
+        self.activate_compiler()
+        self.apply_priority()
+        self.apply_build_stamp()
+        self.configure_worktree()
+
+    def configure_worktree(self) -> None:
+        """Make the defconfig in a worktree whose object directory has no .config yet."""
+        if not self.worktree or (self.kernel.object_dir / '.config').exists():
+            return
+        self.log.info('making defconfig {} in {}'.format(self.kernel.defconfig,
+                                                         self.kernel.object_dir))
+        self.kernel.make_defconfig()
+
+    @property
+    def source_date_epoch(self) -> Optional[int]:
+        """Time recorded by reproducible builds, None unless they are enabled.
+
+        Raises:
+            KbuilderConfigError: If SOURCE_DATE_EPOCH is no timestamp.
+        """
+        if not get_bool(self.app.config, 'reproducible', 'enable'):
+            return None
+        try:
+            return source_date_epoch(self.kernel.root)
+        except ValueError as error:
+            raise KbuilderConfigError(str(error))
+
+    def apply_build_stamp(self) -> None:
+        """Fix the time, user and host the kernel records in reproducible builds."""
+        epoch = self.source_date_epoch
+        if epoch is None:
+            return
+        self.kernel.environment.env.update(build_variables(
+            epoch, self.app.config.get('reproducible', 'user'),
+            self.app.config.get('reproducible', 'host')))
+
+    def apply_priority(self) -> None:
+        """Run make with the configured priority class.
+
+        Raises:
+            KbuilderConfigError: If the priority class is unknown.
+        """
+        name = (getattr(self.app.pargs, 'priority', None) or
+                self.app.config.get('priority', 'class'))
+        if not name:
+            return
+        if name not in PRIORITY_CLASSES:
+            raise KbuilderConfigError('Unknown priority class: {}'.format(name))
+        runner = self.kernel.makefile.runner
+        runner.priority = PRIORITY_CLASSES[name]
+        cgroup_parent = self.app.config.get('priority', 'cgroup_parent')
+        runner.cgroup_parent = Path(cgroup_parent) if cgroup_parent else None
+        memory_high = self.app.config.get('priority', 'memory_high')
+        runner.memory_high = parse_size(memory_high) if memory_high else None
+        runner.on_warning = self.log.warning
+
+    def prepare_object_dir(self) -> None:
+        """Place the object directory on tmpfs if enabled.
+
+        Worktrees keep their own object directories. A source tree which was
+        built in-tree is built in place, as kbuild refuses to build it into
+        another object directory.
+        """
+        if (not self.tmpfs_enabled or self.kernel.output_dir == self.tmpfs.path or
+                self.worktree):
+            return
+        if self.kernel.built_in_tree:
+            self.log.warning('{} holds an in-tree build, building in place; run `make '
+                             'mrproper` in it to build on tmpfs'.format(self.kernel.root))
+            return
+        object_dir = self.tmpfs.acquire()
+        if object_dir:
+            self.kernel.output_dir = object_dir
+            self.log.info('Building in {}'.format(object_dir))
+        else:
+            self.log.warning('Not enough memory for a tmpfs object directory')
+
+    @contextmanager
+    def revision(self, revision: Optional[str]):
+        """Build a revision in a pooled git worktree instead of the kernel tree.
+
+        Until the context exits, the kernel of the handler is checked out
+        in the worktree and built into its object directory, while the
+        kernel tree stays untouched. The directories returned by
+        worktree_dirs() are replaced by ones of the worktree as well, so
+        builds in several worktrees do not share them.
+
+        Raises:
+            KbuilderArgumentError: If the revision names no commit.
+        """
+        if not revision:
+            yield self.kernel
+            return
+        config = self.app.config
+        pool = WorktreePool(self.kernel.root,
+                            Path(config.get('worktrees', 'dir')).expanduser() / self.kernel.name,
+                            int(config.get('worktrees', 'size')))
+        try:
+            pool.resolve(revision)
+        except ValueError as error:
+            raise KbuilderArgumentError(str(error))
+        main = self._kernel
+        with pool.acquire(revision) as worktree:
+            self.log.info('Building {} in {}'.format(worktree.commit[:12], worktree.source))
+            dirs = self.worktree_dirs(worktree)
+            saved = {name: getattr(self, name) for name in dirs}
+            self._kernel = main.at(worktree.source, output_dir=worktree.object_dir)
+            self.worktree = worktree
+            for name, path in dirs.items():
+                setattr(self, name, path)
+            try:
+                yield self._kernel
+            finally:
+                self._kernel = main
+                self.worktree = None
+                for name, path in saved.items():
+                    setattr(self, name, path)
+
+    def worktree_dirs(self, worktree: Worktree) -> Dict[str, Path]:
+        """Return the directories to use while building in a worktree, by attribute name."""
+        return {'module_staging_dir': worktree.object_dir.parent / 'modules'}
+
+    @property
+    def tree_index_path(self) -> Path:
+        """The index of the current state of the kernel tree."""
+        return self.kernel.root / '.kbuilder' / 'tree-index'
+
+    @property
+    def build_index_path(self) -> Path:
+        """The index of the kernel tree at the last successful build."""
+        return self.kernel.root / '.kbuilder' / 'tree-index-build'
+
+    def scan_tree(self) -> TreeIndex:
+        """Update and return the index of the kernel tree."""
+        exclude = []
+        if self.kernel.output_dir:
+            try:
+                exclude.append(self.kernel.output_dir.relative_to(self.kernel.root).as_posix())
+            except ValueError:
+                pass
+        index = TreeIndex.load(self.tree_index_path, self.kernel.root)
+        index = index.scan(exclude=exclude)
+        index.save(self.tree_index_path)
+        return index
+
+    def status(self) -> None:
+        """Print the files changed since the last successful build."""
+        baseline = TreeIndex.load(self.build_index_path, self.kernel.root)
+        current = self.scan_tree()
+        if not baseline.entries:
+            print('No successful build recorded, {} files indexed'.format(
+                len(current.entries)))
+            return
+        changes = baseline.diff(current)
+        if not changes:
+            print('No changes since the last successful build')
+            return
+        print('{} files changed since the last successful build:\n'.format(
+            len(changes.paths)))
+        for label, paths in (('added', changes.added),
+                             ('modified', changes.modified),
+                             ('removed', changes.removed)):
+            for path in paths:
+                print('  {:<10}{}'.format(label + ':', path))
+
+    @property
+    def built_object_dir(self) -> Path:
+        """The object directory of previous builds, which may be on tmpfs."""
+        if not self.kernel.output_dir and self.tmpfs_enabled and self.tmpfs.path.is_dir():
+            return self.tmpfs.path
+        return self.kernel.object_dir
+
+    def clean(self) -> None:
+        """Move the build outputs into the trash and delete it in the background.
+
+        The kernel configuration and the outputs of `make prepare` are kept,
+        like `make clean` does.
+        """
+        object_dir = self.built_object_dir
+        if object_dir != self.kernel.root:
+            trash = Trash(object_dir / '.kbuilder-trash')
+            ignored = {trash.directory.name, self.log_dir.name if
+                       object_dir == self.tmpfs.path else None}
+            paths = [path for path in object_dir_outputs(object_dir) if path not in ignored]
+        else:
+            object_dir = self.kernel.root
+            trash = Trash(object_dir / '.kbuilder' / 'trash')
+            paths = source_tree_outputs(object_dir)
+        entry = trash.move(object_dir, paths)
+        self.log.info('Moved {} build outputs to {}'.format(len(paths), entry))
+        trash.spawn_reaper()
+
+    @property
+    def kconfig_index_path(self) -> Path:
+        """The index of the Kconfig symbols of the kernel tree."""
+        return self.kernel.root / '.kbuilder' / 'kconfig-index'
+
+    @property
+    def defconfig_path(self) -> Path:
+        """The defconfig file of the kernel."""
+        configs_dir = self.kernel.root / 'arch' / self.kernel.arch.name / 'configs'
+        return configs_dir / self.kernel.defconfig
+
+    def load_kconfig(self) -> kconfig.KconfigIndex:
+        """Load the index of the Kconfig symbols, parsing the tree if it changed."""
+        return kconfig.KconfigIndex.load(self.kconfig_index_path, self.kernel.root,
+                                         self.kernel.arch.name)
+
+    def read_config(self, path: Path) -> Dict[str, str]:
+        """Read the symbol values of a config file, which may be missing."""
+        try:
+            return kconfig.read_config(path)
+        except FileNotFoundError:
+            return {}
+
+    def config_get(self, names: List[str]) -> None:
+        """Print the values of config symbols in .config.
+
+        Names may contain wildcards; the definitions of symbols named
+        exactly are printed as well.
+
+        Raises:
+            KbuilderArgumentError: If a symbol is not defined.
+        """
+        index = self.load_kconfig()
+        values = self.read_config(self.built_object_dir / '.config')
+        for name in names:
+            name = kconfig.strip_prefix(name)
+            if any(char in name for char in '*?['):
+                for match in fnmatch.filter(index.order, name):
+                    print('CONFIG_{}={}'.format(match, values.get(match, 'n')))
+                continue
+            symbol = index.get(name)
+            if not symbol:
+                raise KbuilderArgumentError('Unknown config symbol: {}'.format(name))
+            print('CONFIG_{}={}'.format(name, values.get(name, 'n')))
+            print('  type:        {}'.format(symbol.type))
+            if symbol.prompt:
+                print('  prompt:      {}'.format(symbol.prompt))
+            for location in symbol.locations:
+                print('  defined at:  {}'.format(location))
+            if symbol.depends:
+                print('  depends on:  {}'.format(symbol.depends))
+            for selector, condition in symbol.selected_by:
+                print('  selected by: {}{}'.format(
+                    selector, ' if ' + condition if condition else ''))
+
+    def config_set(self, assignments: List[str]) -> None:
+        """Set config symbols in the defconfig without running make.
+
+        The symbols are set in .config too, if it exists, so the next build
+        picks them up; kbuild resolves their selects then.
+
+        Raises:
+            KbuilderArgumentError: If an assignment is malformed, or names
+                an unknown symbol or an invalid value.
+        """
+        index = self.load_kconfig()
+        values = {}
+        for assignment in assignments:
+            name, separator, value = assignment.partition('=')
+            name = kconfig.strip_prefix(name)
+            symbol = index.get(name)
+            if not separator or not symbol:
+                raise KbuilderArgumentError('Expected SYMBOL=VALUE of a known symbol, not {}'
+                                            .format(assignment))
+            try:
+                values[name] = kconfig.format_value(symbol, value)
+            except ValueError as error:
+                raise KbuilderArgumentError('Invalid value for CONFIG_{}: {}'.format(
+                    name, error))
+        if not values:
+            raise KbuilderArgumentError('Nothing to set')
+
+        config_path = self.built_object_dir / '.config'
+        config = self.read_config(config_path)
+        config.update(values)
+        for name, value in values.items():
+            unmet = index.unmet_dependencies(name, config)
+            if value != 'n' and unmet:
+                self.log.warning('CONFIG_{} depends on {}, which {} not set'.format(
+                    name, ', '.join('CONFIG_' + dependency for dependency in unmet),
+                    'is' if len(unmet) == 1 else 'are'))
+        kconfig.set_config_values(self.defconfig_path, values, index.order)
+        if config_path.exists():
+            kconfig.set_config_values(config_path, values, index.order)
+        for name, value in sorted(values.items()):
+            self.log.info('CONFIG_{}={} in {}'.format(name, value, self.kernel.defconfig))
+
+    def config_diff(self, paths: List[str]) -> None:
+        """Print the differences between kernel configurations.
+
+        Without paths, the settings of the defconfig which differ in .config
+        are printed. With one path, the config file is compared to .config.
+
+        Raises:
+            KbuilderArgumentError: If more than two paths are given.
+        """
+        config_path = self.built_object_dir / '.config'
+        if len(paths) > 2:
+            raise KbuilderArgumentError('Expected at most two config files')
+        if not paths:
+            old = self.read_config(self.defconfig_path)
+            new = self.read_config(config_path)
+            new = {name: new.get(name, 'n') for name in old}
+        else:
+            old = kconfig.read_config(Path(paths[0]))
+            new = kconfig.read_config(Path(paths[1]) if len(paths) == 2 else config_path)
+        changes = kconfig.diff_configs(old, new)
+        for name, value in changes.added:
+            print('  {:<10}CONFIG_{}={}'.format('added:', name, value))
+        for name, old_value, new_value in changes.changed:
+            print('  {:<10}CONFIG_{} {} -> {}'.format('changed:', name, old_value, new_value))
+        for name, value in changes.removed:
+            print('  {:<10}CONFIG_{}={}'.format('removed:', name, value))
+
+    def config_why(self, names: List[str]) -> None:
+        """Explain the values of config symbols in .config.
+
+        Raises:
+            KbuilderArgumentError: If a symbol is not defined.
+        """
+        index = self.load_kconfig()
+        values = self.read_config(self.built_object_dir / '.config')
+        defconfig = self.read_config(self.defconfig_path)
+        for name in names:
+            if not index.get(name):
+                raise KbuilderArgumentError('Unknown config symbol: {}'.format(name))
+            print('\n'.join(index.explain(name, values, defconfig)))
+
+    def finish_build(self, *artifacts: Path) -> None:
+        """Record a successful build and write back its artifacts.
+
+        The tree index of the build is saved, and the artifacts and logs of
+        a tmpfs build are written back to disk.
+        """
+        self.scan_tree().save(self.build_index_path)
+        if self.kernel.output_dir != self.tmpfs.path:
+            return
+        self.tmpfs.finish_build(artifacts)
+        self.write_back_logs()
+        if self.tmpfs.under_pressure():
+            self.log.info('Low on memory, flushing {}'.format(self.tmpfs.path))
+            self.tmpfs.flush()
+
+    def write_back_logs(self) -> None:
+        """Copy the logs of a tmpfs build back to disk in the background."""
+        if self.kernel.output_dir != self.tmpfs.path:
+            return
+        for log in self.log_dir.glob('*'):
+            self.tmpfs.write_back.submit(log, self.build_log_dir / log.name)
+
+    def activate_compiler(self) -> None:
+        """Set the default compiler as active and link its caches."""
+        compiler = self.compiler
+        if not compiler:
+            return
+        compiler.set_as_active(self.kernel.environment, self.kernel.arch)
+        if isinstance(compiler, ClangCompiler):
+            cache_dir = self.lto_cache.activate(self.kernel.object_dir, self.kernel.name)
+            self.log.debug('ThinLTO cache: {}'.format(cache_dir))
+
+    def prune_compiler_caches(self) -> None:
+        """Shrink the caches of the default compiler to their size limit."""
+        if isinstance(self.compiler, ClangCompiler):
+            removed = self.lto_cache.prune()
+            if removed:
+                self.log.info('pruned {} ThinLTO cache entries'.format(len(removed)))
+
+    def run_hooks(self, point: str, artifact: Path) -> None:
+        """Run the build hooks registered at a hook point.
+
+        Returns once all required hooks finished or timed out; optional
+        hooks keep running in the background until the application closes.
+
+        Raises:
+            KbuilderRuntimeError: If a required hook failed or timed out.
+        """
+        failed = []
+        for result in self.app.build_hooks.run(point, self.app, artifact):
+            self.app.log_hook_result(result)
+            if not result.ok:
+                failed.append(result.name)
+        if failed:
+            raise KbuilderRuntimeError('Required {} hooks failed: {}'.format(
+                point, ', '.join(failed)))
+
+    @contextmanager
+    def reporting(self, command: str):
+        """Record a BuildReport of a build command.
+
+        Nested build commands add to the report of the outermost command.
+        The report is written once the outermost command finished, which
+        then waits for its uploads to the remote cache. The logs of a failed
+        or cancelled tmpfs build are written back to disk.
+        """
+        if self.report:
+            yield self.report
+            return
+        compiler = self.compiler
+        revision = git_revision(self.kernel.root)
+        self.report = BuildReport(command, kernel=self.kernel.name,
+                                  compiler=compiler.name if compiler else None)
+        succeeded = False
+        try:
+            yield self.report
+            succeeded = True
+        except Exception as error:
+            self.report.fail(error)
+            raise
+        finally:
+            if not succeeded:
+                self.write_back_logs()
+            self.report.finish()
+            self.write_report(self.report)
+            self.update_export_index(self.report)
+            self.record_history(self.report, revision)
+            self.report = None
+            self.wait_for_uploads()
+
+    def write_report(self, report: BuildReport) -> None:
+        """Write a build report where configured."""
+        result_json = (getattr(self.app.pargs, 'result_json', None) or
+                       self.app.config.get('report', 'result_json'))
+        if result_json:
+            report.write_json(Path(result_json).expanduser())
+        metrics_dir = self.app.config.get('report', 'metrics_dir')
+        if metrics_dir:
+            report.write_prometheus(
+                Path(metrics_dir).expanduser() / 'kbuilder-{}.prom'.format(self.kernel.name))
+
+    def update_export_index(self, report: BuildReport) -> None:
+        """Record the artifacts a successful build exported in the export index."""
+        if not report.success:
+            return
+        index = ExportIndex.load(self.export_path)
+        if index.add(report):
+            index.save()
+
+    @staticmethod
+    def parse_address(arguments: List[str], host: str, port) -> Tuple[str, int]:
+        """Parse an optional [HOST:]PORT argument of a server command.
+
+        Raises:
+            KbuilderArgumentError: If the address is no [HOST:]PORT.
+        """
+        if len(arguments) > 1:
+            raise KbuilderArgumentError('Expected at most one [HOST:]PORT')
+        if arguments:
+            address, _, port = arguments[0].rpartition(':')
+            host = address.strip('[]') or host
+        try:
+            return host, int(port)
+        except ValueError:
+            raise KbuilderArgumentError('Expected [HOST:]PORT, not {}'.format(port))
+
+    def serve(self, arguments: List[str]) -> None:
+        """Serve the export directory over HTTP until interrupted."""
+        host, port = self.parse_address(arguments, self.app.config.get('serve', 'host'),
+                                        self.app.config.get('serve', 'port'))
+
+        def started(addresses):
+            for address, bound_port in addresses:
+                self.log.info('Serving {} on http://{}:{}/'.format(
+                    self.export_path, address, bound_port))
+
+        server = ArtifactServer(self.export_path, host=host, port=port)
+        try:
+            server.serve_forever(on_start=started)
+        except KeyboardInterrupt:
+            pass
+
+    def cache_server(self, arguments: List[str]) -> None:
+        """Run the reference server of the remote cache until interrupted."""
+        config = self.app.config
+        host, port = self.parse_address(arguments, '', config.get('remote_cache', 'server_port'))
+        directory = Path(config.get('remote_cache', 'server_dir')).expanduser()
+        store = CacheStore(directory, parse_size(config.get('remote_cache', 'server_max_size')))
+        token = config.get('remote_cache', 'token') or None
+        server = CacheServer(store, host, port, token=token)
+        self.log.info('Serving the remote cache {} on http://{}:{}/'.format(
+            directory, *server.server_address[:2]))
+        if not token:
+            self.log.warning('remote_cache.token is not set, anyone who can reach the '
+                             'server can upload to it')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def wait_for_uploads(self) -> None:
+        """Wait for the uploads to the remote cache, warning about failed ones."""
+        if not self.remote_cache:
+            return
+        for error in self.remote_cache.wait():
+            self.log.warning('Failed to upload to the remote cache: {}'.format(error))
+
+    @property
+    def history_path(self) -> Path:
+        """The database of past builds of the kernel tree, including its worktrees."""
+        return self.app.active_kernel.root / '.kbuilder' / 'history.sqlite'
+
+    def open_history(self) -> BuildHistory:
+        """Open the database of past builds with the configured thresholds."""
+        config = self.app.config
+        return BuildHistory(
+            self.history_path,
+            window=int(config.get('history', 'window')),
+            significance=float(config.get('history', 'significance')),
+            time_threshold=float(config.get('history', 'time_threshold')) / 100,
+            size_threshold=parse_size(config.get('history', 'size_threshold')))
+
+    def record_history(self, report: BuildReport, revision: str) -> None:
+        """Record a finished build in the history, if enabled.
+
+        A build never fails because it could not be recorded.
+        """
+        if not get_bool(self.app.config, 'history', 'enable'):
+            return
+        try:
+            with self.open_history() as history:
+                history.record(report, revision=revision, defconfig=self.kernel.defconfig,
+                               sections=report.sections)
+        except sqlite3.Error as error:
+            self.log.warning('Failed to record the build history: {}'.format(error))
+
+    def history(self, arguments: List[str]) -> None:
+        """Print the latest builds and the regressions of their series.
+
+        Raises:
+            KbuilderArgumentError: If the amount of builds is no number.
+        """
+        try:
+            limit = int(arguments[0]) if arguments else 20
+        except ValueError:
+            raise KbuilderArgumentError('Expected an amount of builds, not {}'.format(
+                arguments[0]))
+        with self.open_history() as history:
+            builds = history.builds(self.kernel.name, limit)
+            if not builds:
+                print('No builds recorded')
+                return
+            compile_times = history.phases([build.id for build in builds], 'compile')
+            print('{:<17} {:<13} {:<13} {:<8} {:>8} {:>8} {:>8} {:>8}'.format(
+                'started', 'commit', 'command', 'result', 'time', 'compile', 'image',
+                'warnings'))
+            for build in builds:
+                compile_time = compile_times.get(build.id)
+                print('{:<17} {:<13} {:<13} {:<8} {:>8} {:>8} {:>8} {:>8}'.format(
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(build.started)),
+                    build.revision or '-', build.command,
+                    'success' if build.success else 'failure',
+                    format_duration(build.duration) if build.duration is not None else '-',
+                    format_duration(compile_time) if compile_time is not None else '-',
+                    format_size(build.image_size) if build.image_size else '-',
+                    build.warnings))
+
+            series = sorted({(build.command, build.defconfig) for build in builds})
+            regressions = [(command, regression) for command, defconfig in series
+                           for regression in history.regressions(self.kernel.name, command,
+                                                                 defconfig)]
+        if not regressions:
+            print('\nNo regressions')
+            return
+        print('\nRegressions:')
+        for command, regression in regressions:
+            if regression.unit == 's':
+                change = '{:+.0%} {} ({} -> {}, p={:.3f})'.format(
+                    regression.change, regression.metric,
+                    format_duration(regression.before), format_duration(regression.after),
+                    regression.p_value)
+            else:
+                change = '+{} {} ({} -> {})'.format(
+                    format_size(regression.after - regression.before), regression.metric,
+                    format_size(regression.before), format_size(regression.after))
+            since = ' since {}'.format(regression.revision) if regression.revision else ''
+            compiler = (', compiler changed to {}'.format(regression.compiler)
+                        if regression.compiler else '')
+            print('  {}: {}{}{}'.format(command, change, since, compiler))
+
+    def size_profiles(self) -> List[Path]:
+        """Return the size profiles of the kernel in the export directory, oldest first."""
+        pattern = '{}-{}-{}{}'.format(self.kernel.name, '[0-9]' * 8, '[0-9]' * 6,
+                                      SizeProfile.suffix)
+        return sorted(self.export_path.glob(pattern))
+
+    def export_size_profile(self, report: BuildReport, profile: SizeProfile) -> None:
+        """Save the size profile of vmlinux into the export directory.
+
+        Only the configured amount of the latest profiles is kept.
+        """
+        keep = int(self.app.config.get('sizes', 'keep'))
+        if keep < 1:
+            return
+        path = self.export_path / '{}-{}{}'.format(
+            self.kernel.name, time.strftime('%Y%m%d-%H%M%S', time.localtime(report.started)),
+            SizeProfile.suffix)
+        profile.save(path)
+        report.add_artifact(path, 'size_profile')
+        for old in self.size_profiles()[:-keep]:
+            old.unlink()
+
+    def read_size_profile(self, name: str) -> SizeProfile:
+        """Measure an ELF file or load a size profile.
+
+        Args:
+            name: A path, or the name of a profile in the export directory.
+
+        Raises:
+            KbuilderArgumentError: If the file is neither.
+        """
+        for path in (Path(name).expanduser(), self.export_path / name):
+            if path.is_file():
+                try:
+                    return SizeProfile.read(path)
+                except ValueError as error:
+                    raise KbuilderArgumentError(str(error))
+        raise KbuilderArgumentError('No such file: {}'.format(name))
+
+    def sizes(self, arguments: List[str]) -> None:
+        """Print the section sizes and the largest symbols of vmlinux or a module.
+
+        Raises:
+            KbuilderArgumentError: If the file is no ELF file or size profile.
+        """
+        name = arguments[0] if arguments else str(self.built_object_dir / 'vmlinux')
+        profile = self.read_size_profile(name)
+        print('{:<24} {:>12} {:>8}'.format('section', 'bytes', 'size'))
+        for section, size in sorted(profile.sections.items(), key=lambda item: -item[1]):
+            print('{:<24} {:>12} {:>8}'.format(section, size, format_size(size)))
+        print('\nLargest symbols:')
+        for symbol, kind, size in profile.largest(int(self.app.config.get('sizes', 'top'))):
+            print('  {:>10} {} {}'.format(size, kind, symbol))
+
+    def bloat(self, arguments: List[str]) -> None:
+        """Print the symbol size changes between two builds like bloat-o-meter.
+
+        Without arguments, the two latest exported builds of the kernel are
+        compared. A single argument is compared with the latest build.
+
+        Raises:
+            KbuilderArgumentError: If the builds to compare are not found.
+        """
+        if len(arguments) > 2:
+            raise KbuilderArgumentError('Expected at most two builds to compare')
+        names = list(arguments)
+        if len(names) < 2:
+            profiles = [path.name for path in self.size_profiles()]
+            names.extend(profiles[-(2 - len(names)):])
+        if len(names) < 2:
+            raise KbuilderArgumentError(
+                'No previous build of {} exported, give the files to compare'.format(
+                    self.kernel.name))
+        old, new = (self.read_size_profile(name) for name in names)
+        print('{} -> {}\n'.format(*names))
+        changes = section_changes(old, new)
+        for section, (before, after) in changes.items():
+            print('{:<24} {:>12} {:>12} {:>+10}'.format(section, before, after,
+                                                        after - before))
+        if changes:
+            print()
+        print('\n'.join(SizeDiff(old, new).lines()))
+
+    def compile_kbuild_image(self, report: BuildReport) -> MakeResult:
+        """Make the kbuild image, counting warnings into a report.
+
+        With fail-fast, the build is cancelled at the first failing target,
+        which is then rebuilt alone into an error report. After a successful
+        build, the dependencies of the objects are indexed.
+
+        Raises:
+            CalledProcessError: If the kbuild image fails to build.
+        """
+        start = time.time()
+        progress = self.start_progress(report)
+
+        def on_line(line: str) -> None:
+            report.count_warnings(line)
+            if progress:
+                progress.feed(line)
+                self.show_progress(progress)
+
+        try:
+            with report.phase('compile'):
+                success = False
+                try:
+                    result = self.kernel.build_kbuild_image(self.log_dir, on_line=on_line,
+                                                            fail_fast=self.fail_fast,
+                                                            silent=progress is None)
+                    success = True
+                finally:
+                    if progress:
+                        self.finish_progress(report, progress, success)
+        except MakeTargetError as error:
+            self.log.error('{} failed, stopped the build'.format(error.target))
+            if not get_bool(self.app.config, 'fail_fast', 'reproduce'):
+                print('\n'.join(error.errors))
+                raise
+            with report.phase('reproduce'):
+                error_report = self.kernel.reproduce_failure(error.target, self.log_dir,
+                                                             error.errors)
+            print(error_report.read_text())
+            self.log.error('Error report written to {}'.format(error_report))
+            raise
+        if result.cgroup:
+            report.cgroup = result.cgroup
+            usage = ['{:.1f}s CPU'.format(result.cgroup.get('cpu_usage_usec', 0) / 1e6)]
+            for key, label in (('memory_peak', 'peak memory'), ('io_rbytes', 'read'),
+                               ('io_wbytes', 'written')):
+                if key in result.cgroup:
+                    usage.append('{} {}'.format(format_size(result.cgroup[key]), label))
+            self.log.info('cgroup: {}'.format(', '.join(usage)))
+        try:
+            with report.phase('sizes'):
+                profile = SizeProfile.from_elf(self.kernel.object_dir / 'vmlinux')
+        except (OSError, ValueError):
+            profile = None
+        if profile:
+            report.sections = profile.sections
+            self.export_size_profile(report, profile)
+        with report.phase('dependency_index'):
+            self.update_dependency_index(result, start)
+        return result
+
+    def start_progress(self, report: BuildReport) -> Optional[BuildProgress]:
+        """Start following the progress of a kbuild image build, if enabled.
+
+        The estimates are based on recent successful builds of the same
+        command, defconfig and compiler in the history, starting with the
+        latest until the build compiles more objects than it did.
+        """
+        if not get_bool(self.app.config, 'progress', 'enable'):
+            return None
+        references = []
+        if get_bool(self.app.config, 'history', 'enable'):
+            try:
+                with self.open_history() as history:
+                    references = history.recent_progress(self.kernel.name, report.command,
+                                                         self.kernel.defconfig, report.compiler)
+            except sqlite3.Error as error:
+                self.log.warning('Failed to read the build history: {}'.format(error))
+        if references:
+            self.log.debug('Estimating progress from builds of {} objects'.format(
+                ', '.join(str(reference.get('objects')) for reference in references)))
+        self._progress_shown = 0.0
+        return BuildProgress(self.kernel.name, references=references)
+
+    def show_progress(self, progress: BuildProgress, *, force: bool=False) -> None:
+        """Update the progress bar and the progress file at most once per interval."""
+        now = time.monotonic()
+        if not force and now - self._progress_shown < float(
+                self.app.config.get('progress', 'interval')):
+            return
+        self._progress_shown = now
+        try:
+            progress.write(self.export_path)
+        except OSError as error:
+            self.log.debug('Failed to write the build progress: {}'.format(error))
+        if sys.stderr.isatty():
+            sys.stderr.write('\r{}\x1b[K'.format(self.progress_line(progress)))
+            sys.stderr.flush()
+
+    @staticmethod
+    def progress_line(progress: BuildProgress, width: int=30) -> str:
+        """Format a progress bar, or a count without a comparable build."""
+        fraction = progress.fraction()
+        if fraction is None:
+            return '{} objects, {}, {}'.format(progress.objects, progress.stage,
+                                               format_duration(progress.elapsed))
+        filled = int(fraction * width)
+        return '[{}{}] {:>4.0%} {}/{} objects, {}, ETA {}'.format(
+            '#' * filled, '-' * (width - filled), fraction, progress.objects,
+            progress.expected_objects, progress.stage, format_duration(progress.remaining()))
+
+    def finish_progress(self, report: BuildReport, progress: BuildProgress,
+                        success: bool) -> None:
+        """Record the final progress of a build in its report and clear the bar."""
+        progress.finish(success)
+        self.show_progress(progress, force=True)
+        if sys.stderr.isatty():
+            sys.stderr.write('\r\x1b[K')
+            sys.stderr.flush()
+        report.progress = progress.to_dict()
+
+    @property
+    def dependency_index_path(self) -> Path:
+        """The index of the dependencies of the objects of the last build."""
+        return self.kernel.root / '.kbuilder' / 'dependency-index'
+
+    def update_dependency_index(self, result: MakeResult, start: float) -> None:
+        """Index the dependencies of the objects and time their compilation.
+
+        Args:
+            result: The make invocation which built the objects.
+            start: Time the build started, to tell which objects it rebuilt.
+        """
+        index = DependencyIndex.load(self.dependency_index_path, self.kernel.root,
+                                     self.kernel.object_dir)
+        parsed = index.update(self.kernel.makefile.runner.jobs)
+        rebuilt = index.rebuilt_since(start)
+        index.calibrate(result.cpu_time, rebuilt)
+        index.save(self.dependency_index_path)
+        self.log.debug('Indexed dependencies of {} objects, {} rebuilt'.format(
+            parsed, len(rebuilt)))
+
+    def impact(self, paths: List[str]) -> None:
+        """Print how many objects and compile-seconds changing files costs.
+
+        Without paths, the headers rebuilding the most objects are ranked.
+        """
+        object_dir = self.built_object_dir
+        index = DependencyIndex.load(self.dependency_index_path, self.kernel.root,
+                                     object_dir)
+        if not index.objects:
+            print('No build indexed, build the kernel first')
+            return
+
+        def cost(seconds: float) -> str:
+            return '~{} CPU'.format(format_duration(seconds)) if index.rate else 'untimed'
+
+        if not paths:
+            print('Headers rebuilding the most objects of {} when changed:\n'.format(
+                len(index.objects)))
+            for header, objects, seconds in index.ranking():
+                print('  {:>7} objects  {:>12}  {}'.format(objects, cost(seconds), header))
+            return
+        for path in paths:
+            path = Path(path).absolute()
+            for base in (self.kernel.root, object_dir):
+                try:
+                    path = path.relative_to(base)
+                    break
+                except ValueError:
+                    pass
+            objects, seconds = index.impact(path.as_posix())
+            print('{}: {} of {} objects, {}'.format(path, objects, len(index.objects),
+                                                    cost(seconds)))
 
     def build_kbuild_image(self) -> None:
         """Build a kbuild image."""
-        self.log.info('Building {0.release_version}'.format(self.kernel))
-        self.kernel.arch_clean()
-        self.kernel.build_kbuild_image(self.build_log_dir)
-        self.log.info('{0.kbuild_image} created'.format(self.kernel))
+        with self.reporting('kbuild_image') as report:
+            with report.phase('prepare'):
+                self.prepare_build()
+            self.log.info('Building {0.release_version}'.format(self.kernel))
+            self.make_kbuild_image(report)
+            self.prune_compiler_caches()
+            self.finish_build(self.kernel.kbuild_image)
+            report.add_artifact(self.kernel.kbuild_image, 'kbuild_image')
+            self.log.info('{0.kbuild_image} created'.format(self.kernel))
+            with report.phase('hooks'):
+                self.run_hooks('post_kbuild_image', self.kernel.kbuild_image)
+
+    def make_kbuild_image(self, report: BuildReport) -> None:
+        """Fetch the kbuild image from the artifact cache, or clean and compile it.
+
+        A compiled kbuild image is uploaded to the artifact cache.
+        """
+        key = self.artifact_key('kbuild_image')
+        if key and self.fetch_artifacts(key, self.kernel.object_dir, report):
+            return
+        with report.phase('clean'):
+            self.kernel.arch_clean()
+        self.compile_kbuild_image(report)
+        if key:
+            self.artifact_cache.store(key, self.kernel.object_dir, [
+                self.kernel.kbuild_image.relative_to(self.kernel.object_dir).as_posix()])
+
+    def artifact_key(self, command: str, **options: str) -> Optional[str]:
+        """Return the key of the artifacts of a build in the artifact cache.
+
+        Environment variables naming paths of this machine, such as those of
+        the compiler, are left out; the identity of the compiler is used
+        instead.
+
+        Args:
+            command: The build command.
+            options: Further settings the artifacts depend on.
+
+        Returns:
+            The key, or None if the artifact cache is disabled or the kernel
+            is not configured yet.
+        """
+        compiler = self.compiler
+        config_path = self.kernel.object_dir / '.config'
+        if not self.artifact_cache or not compiler or not config_path.exists():
+            return None
+        variables = {'make.' + name: value for name, value in
+                     self.kernel.environment.variables.items() if name != 'O'}
+        variables.update(('env.' + name, value) for name, value in
+                         self.kernel.environment.env.items()
+                         if name not in Compiler.environment_variables)
+        variables.update(('option.' + name, value) for name, value in options.items())
+        return self.artifact_cache.key(self.scan_tree(), command,
+                                       config=config_path.read_bytes(),
+                                       compiler_identity=compiler.identity,
+                                       revision=git_revision(self.kernel.root),
+                                       variables=variables)
+
+    def fetch_artifacts(self, key: str, directory: Path, report: BuildReport) -> List[Path]:
+        """Fetch the artifacts of a build from the artifact cache into a directory.
+
+        Returns:
+            The fetched artifacts, or an empty list if they are not cached or
+            could not be fetched.
+        """
+        try:
+            with report.phase('fetch'):
+                fetched = self.artifact_cache.fetch(key, directory)
+        except KbuilderRuntimeError as error:
+            self.log.warning('Failed to fetch build artifacts: {}'.format(error))
+            return []
+        if fetched:
+            self.log.info('Fetched {} build artifacts {} from {}'.format(
+                len(fetched), key[:12], self.remote_cache.url))
+        return fetched
+
+    def watch_kbuild_image(self) -> None:
+        """Rebuild the kbuild image whenever a source file changes.
+
+        The build log is streamed to the terminal. A build in progress is
+        cancelled when a newer edit arrives.
+
+        Raises:
+            KbuilderArgumentError: If the tree is built in place and is no
+                git tree, so build outputs can not be told from sources.
+        """
+        self.prepare_build()
+        exclude = []
+        if self.kernel.output_dir:
+            try:
+                exclude.append(self.kernel.output_dir.relative_to(self.kernel.root).as_posix())
+            except ValueError:
+                pass
+        debounce = float(self.app.config.get('watch', 'debounce'))
+        watcher = TreeWatcher(self.kernel.root, exclude=exclude, debounce=debounce)
+        if not self.kernel.output_dir and not watcher.git:
+            raise KbuilderArgumentError('Watching a tree which is not a git tree requires '
+                                        'an object directory, the build would restart itself')
+        with watcher:
+            self.log.info('Watching {} for changes'.format(self.kernel.root))
+            RebuildLoop(watcher, self._watch_build, self._cancel_watch_build).run()
+
+    def _watch_build(self, changes: Set[str]) -> None:
+        """Incrementally build the kbuild image after changes settled."""
+        self._watch_cancelled = False
+        if changes:
+            self.log.info('{} files changed, rebuilding'.format(len(changes)))
+        try:
+            result = self.kernel.build_kbuild_image(self.log_dir, on_line=print)
+        except subprocess.CalledProcessError:
+            self.write_back_logs()
+            if self._watch_cancelled:
+                self.log.info('Build cancelled by a newer change')
+            else:
+                self.log.error('Failed to compile {0.release_version}'.format(self.kernel))
+            return
+        self.finish_build(self.kernel.kbuild_image)
+        self.log.info('{0.kbuild_image} created in {1:.1f}s'.format(self.kernel,
+                                                                  result.duration))
+
+    def _cancel_watch_build(self) -> None:
+        """Cancel the build started by watch_kbuild_image."""
+        self._watch_cancelled = True
+        self.kernel.cancel_build()
+
+    def build_modules(self) -> List[Path]:
+        """Build, strip and sign the loadable modules.
+
+        Returns:
+            The paths of the processed modules.
+        """
+        with self.reporting('modules') as report:
+            with report.phase('prepare'):
+                self.prepare_build()
+            self.log.info('Building modules for {0.release_version}'.format(self.kernel))
+            output_dir = self.module_staging_dir / 'processed'
+            strip, signer = self._module_strip_program(), self._module_signer()
+            key = None
+            if self.artifact_cache:
+                key = self.artifact_key('modules', strip='yes' if strip else '',
+                                        sign=self._signer_identity(signer))
+            if key and self.fetch_modules(key, output_dir, report):
+                built = modules.find_modules(output_dir)
+                self.finish_build()
+                for module in built:
+                    report.add_artifact(module, 'module')
+                return built
+            with report.phase('modules'):
+                install_dir = self.kernel.build_modules(self.module_staging_dir / 'install',
+                                                        self.log_dir)
+            with report.phase('process_modules'):
+                processed = modules.process_modules(install_dir, output_dir,
+                                                    strip=strip, signer=signer)
+            built = modules.find_modules(output_dir)
+            self.finish_build()
+            for module in built:
+                report.add_artifact(module, 'module')
+            self.log.info('{} of {} modules changed'.format(len(processed), len(built)))
+            if key:
+                self.artifact_cache.store(key, output_dir, [
+                    path.relative_to(output_dir).as_posix()
+                    for path in built + modules.find_metadata(output_dir)])
+            return built
+
+    def fetch_modules(self, key: str, output_dir: Path, report: BuildReport) -> bool:
+        """Replace the processed modules by those of the artifact cache, if it has them.
+
+        Returns:
+            Whether the modules were fetched.
+        """
+        fetched_dir = self.module_staging_dir / 'fetched'
+        shutil.rmtree(str(fetched_dir), ignore_errors=True)
+        if not self.fetch_artifacts(key, fetched_dir, report):
+            shutil.rmtree(str(fetched_dir), ignore_errors=True)
+            return False
+        shutil.rmtree(str(output_dir), ignore_errors=True)
+        fetched_dir.rename(output_dir)
+        return True
+
+    def _module_strip_program(self) -> str:
+        """The strip program matching the active compiler, if enabled."""
+        if not get_bool(self.app.config, 'modules', 'strip'):
+            return None
+        compiler = self.compiler
+        if compiler and compiler.compiler_prefix.name:
+            return '{}strip'.format(compiler.compiler_prefix)
+        return 'strip'
+
+    def _module_signer(self) -> modules.ModuleSigner:
+        """The module signer configured for this kernel, if enabled."""
+        if not get_bool(self.app.config, 'modules', 'sign'):
+            return None
+        return modules.ModuleSigner(
+            self.kernel.root / 'scripts' / 'sign-file',
+            self.kernel.root / self.app.config.get('modules', 'sign_key'),
+            self.kernel.root / self.app.config.get('modules', 'sign_cert'),
+            hash_algo=self.app.config.get('modules', 'sign_hash'))
+
+    @staticmethod
+    def _signer_identity(signer: Optional[modules.ModuleSigner]) -> str:
+        """Identify the certificate and digest modules are signed with, if any.
+
+        Raises:
+            KbuilderConfigError: If the certificate cannot be read.
+        """
+        if not signer:
+            return ''
+        try:
+            return '{}:{}'.format(signer.hash_algo, modules.file_digest(signer.cert))
+        except OSError as error:
+            raise KbuilderConfigError('Failed to read the module signing certificate: {}'
+                                      .format(error))
 
     def build_defconfig(self):
         """Build a defconfig."""
-        self.log.info('making defconfig: ' + self.kernel.defconfig)
-        self.kernel.make_defconfig()
+        with self.reporting('defconfig') as report:
+            with report.phase('prepare'):
+                self.prepare_build()
+            self.log.info('making defconfig: ' + self.kernel.defconfig)
+            with report.phase('defconfig'):
+                self.kernel.make_defconfig()
+
+    def prepare_kernel(self) -> None:
+        """Prepare the kernel, restoring cached outputs when possible."""
+        compiler = self.compiler
+        if not compiler or not get_bool(self.app.config, 'prepare_cache', 'enable'):
+            self.kernel.prepare()
+            return
+
+        key = self.prepare_cache.key(self.kernel.root, self.kernel.object_dir,
+                                     self.kernel.arch, compiler.identity,
+                                     self.kernel.root / '.kbuilder' / 'prepare-index')
+        local = self.prepare_cache.snapshot_path(key).exists()
+        try:
+            restored = self.prepare_cache.restore(key, self.kernel.object_dir)
+        except KbuilderRuntimeError as error:
+            self.log.warning('Failed to restore prepared outputs: {}'.format(error))
+            restored = False
+        if restored:
+            self.log.info('Restored prepared outputs {}{}'.format(
+                key[:12], '' if local else ' from ' + self.remote_cache.url))
+            return
+        self.kernel.prepare()
+        self.prepare_cache.store(key, self.kernel.object_dir, self.kernel.arch)
+        self.log.info('Cached prepared outputs {}'.format(key[:12]))
 
     def init(self) -> None:
         "Initialize the build environment."
-        self.kernel.prepare()
+        self.prepare_build()
+        self.prepare_kernel()
+        self.wait_for_uploads()
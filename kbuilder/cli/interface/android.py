@@ -42,3 +42,8 @@ class IAndroidBuild(ILinuxBuild):
     def build_ota_package(self):
         """Build an OTA package."""
         pass
+
+    @abc.abstractmethod
+    def verify_ota_packages(self, arguments):
+        """Verify the signatures of OTA packages."""
+        pass
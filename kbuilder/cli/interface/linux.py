@@ -42,11 +42,81 @@ class ILinuxBuild(CementBaseHandler):
         """Initialize the build enviornment."""
         pass
 
+    @abc.abstractmethod
+    def revision(self, revision):
+        """Build a revision in a pooled git worktree within the context."""
+        pass
+
+    @abc.abstractmethod
+    def status(self) -> None:
+        """Show the files changed since the last successful build."""
+        pass
+
+    @abc.abstractmethod
+    def history(self, arguments) -> None:
+        """Show the latest builds and their regressions."""
+        pass
+
+    @abc.abstractmethod
+    def sizes(self, arguments) -> None:
+        """Show the section and symbol sizes of vmlinux or a module."""
+        pass
+
+    @abc.abstractmethod
+    def bloat(self, arguments) -> None:
+        """Compare the symbol sizes of two builds."""
+        pass
+
+    @abc.abstractmethod
+    def cache_server(self, arguments) -> None:
+        """Run the reference server of the remote cache."""
+        pass
+
+    @abc.abstractmethod
+    def serve(self, arguments) -> None:
+        """Serve the export directory over HTTP."""
+        pass
+
+    @abc.abstractmethod
+    def impact(self, paths) -> None:
+        """Show how many objects changing files rebuilds."""
+        pass
+
+    @abc.abstractmethod
+    def clean(self) -> None:
+        """Remove the build outputs."""
+        pass
+
+    @abc.abstractmethod
+    def config_get(self, names) -> None:
+        """Show the values and definitions of config symbols."""
+        pass
+
+    @abc.abstractmethod
+    def config_set(self, assignments) -> None:
+        """Set config symbols in the defconfig."""
+        pass
+
+    @abc.abstractmethod
+    def config_diff(self, paths) -> None:
+        """Compare kernel configurations."""
+        pass
+
+    @abc.abstractmethod
+    def config_why(self, names) -> None:
+        """Explain the values of config symbols."""
+        pass
+
     @abc.abstractmethod
     def build_kbuild_image(self):
         """Build a compressed kernel image."""
         pass
 
+    @abc.abstractmethod
+    def build_modules(self):
+        """Build, strip and sign the loadable modules."""
+        pass
+
     @abc.abstractmethod
     def build_defconfig(self):
         """Build the default configuration file."""
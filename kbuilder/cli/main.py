@@ -11,10 +11,16 @@ from kbuilder.core import exc
 app = App()
 
 
+def wait_for_build_hooks(app):
+    """Wait for the optional build hooks before the application closes."""
+    app.build_hooks.wait()
+
+
 def main():
     with app:
         try:
             app.hook.register('pre_run', parse_kernel_config)
+            app.hook.register('pre_close', wait_for_build_hooks)
             app.run()
 
         except exc.KbuilderError as e:
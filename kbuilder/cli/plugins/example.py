@@ -8,6 +8,12 @@ def example_plugin_hook(app):
     # do something with the ``app`` object here.
     pass
 
+
+def example_post_kbuild_image(app, kbuild_image):
+    # do something with the freshly built ``kbuild_image`` here, such as
+    # checksumming or uploading it.
+    pass
+
 class ExamplePluginController(CementBaseController):
     class Meta:
         # name that the controller is displayed at command line
@@ -49,3 +55,10 @@ def load(app):
 
     # register a hook (function) to run after arguments are parsed.
     hook.register('post_argument_parsing', example_plugin_hook)
+
+    # register a build hook to run concurrently after a kbuild image is built.
+    # Optional build hooks do not delay the command, and are waited for
+    # before the application closes; required ones are waited for right
+    # away. Either is reported as timed out once it runs past its timeout.
+    app.build_hooks.register('post_kbuild_image', example_post_kbuild_image,
+                             required=False, timeout=60)
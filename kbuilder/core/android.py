@@ -8,6 +8,8 @@ from typing import Optional
 from unipath import Path
 
 from kbuilder.core.linux import LinuxKernel
+from kbuilder.core.ota_signing import OtaSigner, SignedPackage
+from kbuilder.core.reproducible import write_zip
 
 
 class AndroidKernel(LinuxKernel):
@@ -45,19 +47,45 @@ class AndroidKernel(LinuxKernel):
         check_call('mkbootimg {} {} {}'.format(output, kernel, ramdisk), shell=True)
 
     def make_ota_package(self, *, kbuild_image_dir: Optional[Path]="",
-                         output_dir: Path, source_dir: Path=Path.cwd()) -> Path:
+                         output_dir: Path, source_dir: Path=Path.cwd(),
+                         epoch: Optional[int]=None) -> Path:
         """Create an Over the Air (OTA) package that can be installed via recovery.
 
         Keyword Args:
             output_dir: Where the otapackage will be stored
             source_dir: The directory to be zipped (default cwd)
             kbuild_image_dir: Optional path to to copy kbuild image into; relative to source_dir
+            epoch: Timestamp of a reproducible package, whose bytes only
+                depend on the contents of source_dir
 
         Returns:
             the path to the zip file created.
         """
-        if kbuild_image_dir:
-            shutil.copy(self.kbuild_image.as_posix(), (source_dir / kbuild_image_dir).as_posix())
-        archive_path = output_dir / self.custom_release.lower()
+        archive_path = self._stage_ota_package(kbuild_image_dir, output_dir, source_dir)
+        if epoch is not None:
+            archive = archive_path.with_name(archive_path.name + '.zip')
+            return Path(str(write_zip(source_dir, archive, epoch)))
         archive_name = archive_path.as_posix()
         return Path(shutil.make_archive(archive_name, 'zip', source_dir))
+
+    def make_signed_ota_package(self, signer: OtaSigner, *,
+                                kbuild_image_dir: Optional[Path]="", output_dir: Path,
+                                source_dir: Path=Path.cwd(),
+                                epoch: Optional[int]=None) -> SignedPackage:
+        """Create an OTA package signed while it is written.
+
+        Takes the same keyword arguments as make_ota_package.
+
+        Returns:
+            The signed package and its digests.
+        """
+        archive_path = self._stage_ota_package(kbuild_image_dir, output_dir, source_dir)
+        package = archive_path.with_name(archive_path.name + '.zip')
+        return signer.write_package(source_dir, package, epoch)
+
+    def _stage_ota_package(self, kbuild_image_dir: Optional[Path], output_dir: Path,
+                           source_dir: Path) -> Path:
+        """Copy the kbuild image into an OTA tree and return the package path without suffix."""
+        if kbuild_image_dir:
+            shutil.copy(self.kbuild_image.as_posix(), (source_dir / kbuild_image_dir).as_posix())
+        return output_dir / self.custom_release.lower()
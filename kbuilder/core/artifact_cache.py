@@ -0,0 +1,183 @@
+"""Build artifacts shared through the remote cache.
+
+Engineers and CI runners building the same commit with the same compiler
+and configuration produce the same kbuild image and modules. An
+ArtifactCache stores the artifacts of successful builds in a RemoteCache,
+keyed by the contents of the source tree, the .config, the identity of the
+compiler and the variables of the build, so other machines fetch them
+instead of building them again.
+
+Like prepared outputs, the artifacts of a build are stored as a manifest
+naming a blob per file, so files which did not change between two builds,
+such as most modules, are only transferred once. Manifests come from other
+machines, so the names in them are checked to stay inside the directory
+the artifacts are restored into.
+
+OTA packages are not cached: they are packed from the cached kernel and
+modules in seconds, and may be signed with a key of the local machine.
+"""
+
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.modules import file_digest
+from kbuilder.core.remote_cache import RemoteCache
+from kbuilder.core.tree_index import TreeIndex
+
+_digest = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _manifest_file(entry: Dict) -> Tuple[str, str, int]:
+    """Return the name, blob digest and mode of a file of a remote manifest.
+
+    Raises:
+        KeyError, TypeError, ValueError: If the entry is malformed, or its
+            name leaves the directory the artifacts are restored into.
+    """
+    name, digest = entry['name'], entry['digest']
+    if not isinstance(name, str):
+        raise TypeError('Artifact name is not a string: {!r}'.format(name))
+    if (posixpath.isabs(name) or posixpath.normpath(name) != name or
+            name.split('/')[0] in ('.', '..') or '\0' in name):
+        raise ValueError('Artifact leaves the directory: {}'.format(name))
+    if not isinstance(digest, str) or not _digest.match(digest):
+        raise ValueError('Invalid digest: {!r}'.format(digest))
+    return name, digest, int(entry['mode']) & 0o777
+
+
+class ArtifactCache(object):
+    """Build artifacts stored in a remote cache.
+
+    Properties:
+        remote: The RemoteCache the artifacts are stored in.
+        upload: Whether artifacts of new builds are uploaded.
+    """
+
+    # Outputs of in-tree builds which kbuild records no command file for.
+    untracked_outputs = ('.config', 'vmlinux', 'System.map')
+
+    def __init__(self, remote: RemoteCache, upload: bool=True) -> None:
+        self.remote = remote
+        self.upload = upload
+
+    def key(self, tree: TreeIndex, command: str, *, config: bytes, compiler_identity: str,
+            revision: Optional[str]=None,
+            variables: Optional[Dict[str, str]]=None) -> str:
+        """Return the key of the artifacts of a build.
+
+        Build outputs of in-tree builds are left out of the tree, so a tree
+        built before has the key of a clean checkout.
+
+        Args:
+            tree: An up to date index of the source tree.
+            command: The build command, such as kbuild_image.
+            config: The contents of the .config of the build.
+            compiler_identity: A string identifying the compiler.
+            revision: The commit of the source tree, which kbuild may record
+                in the kernel release.
+            variables: Further settings the artifacts depend on, such as
+                make variables.
+        """
+        digest = hashlib.sha256()
+        for value in (command, compiler_identity, revision or ''):
+            digest.update(value.encode() + b'\0')
+        for name, value in sorted((variables or {}).items()):
+            digest.update('{}={}'.format(name, value).encode() + b'\0')
+        digest.update(hashlib.sha256(config).digest())
+        for path in sorted(tree.entries):
+            name = posixpath.basename(path)
+            if (path in ArtifactCache.untracked_outputs or
+                    (tree.root / posixpath.dirname(path) / '.{}.cmd'.format(name)).exists()):
+                continue
+            digest.update(path.encode('utf-8', 'surrogateescape') + b'\0')
+            digest.update(tree.entries[path].digest)
+        return digest.hexdigest()
+
+    def store(self, key: str, root: Path, names: Iterable[str]) -> None:
+        """Upload the artifacts of a successful build in the background.
+
+        The artifacts are copied first, so a later build may overwrite them
+        while they are uploaded.
+
+        Args:
+            key: The key of the build.
+            root: The directory of the artifacts.
+            names: The paths of the artifacts relative to root.
+        """
+        if not self.upload:
+            return
+        staging = Path(tempfile.mkdtemp(prefix='kbuilder-artifacts-'))
+        files = []
+        try:
+            for number, name in enumerate(names):
+                copy = staging / str(number)
+                shutil.copyfile(str(Path(root, name)), str(copy))
+                files.append({'name': name, 'digest': file_digest(copy),
+                              'size': copy.stat().st_size,
+                              'mode': stat.S_IMODE(Path(root, name).stat().st_mode)})
+        except BaseException:
+            shutil.rmtree(str(staging), ignore_errors=True)
+            raise
+        self.remote.upload(self._push, key, staging, files)
+
+    def _push(self, key: str, staging: Path, files: List[Dict]) -> int:
+        """Upload the staged copies of artifacts and their manifest.
+
+        Returns:
+            The amount of files the remote cache did not have yet.
+        """
+        try:
+            uploaded = self.remote.put_blobs({entry['digest']: staging / str(number)
+                                              for number, entry in enumerate(files)})
+            self.remote.put_manifest('artifacts-' + key, {'files': files})
+        finally:
+            shutil.rmtree(str(staging), ignore_errors=True)
+        return uploaded
+
+    def fetch(self, key: str, root: Path) -> List[Path]:
+        """Download the artifacts of a build into a directory.
+
+        The files are downloaded in parallel, and only replace files in
+        root once all of them were downloaded.
+
+        Returns:
+            The paths of the artifacts, or an empty list if the remote cache
+            does not have all of them.
+
+        Raises:
+            KbuilderRuntimeError: If fetching failed, or the manifest is
+                malformed or names files leaving root.
+        """
+        manifest = self.remote.get_manifest('artifacts-' + key)
+        if not manifest:
+            return []
+        try:
+            files = [_manifest_file(entry) for entry in manifest['files']]
+        except (KeyError, TypeError, ValueError) as error:
+            raise KbuilderRuntimeError('Corrupt manifest artifacts-{} from {}: {}'.format(
+                key, self.remote.url, error))
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        restored = []
+        with tempfile.TemporaryDirectory(prefix='.kbuilder-artifacts-',
+                                         dir=str(root)) as directory:
+            blobs = {digest: Path(directory, digest) for _, digest, _ in files}
+            if self.remote.prefetch(blobs):
+                return []
+            for name, digest, mode in files:
+                target = root / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                temp = target.with_name('.{}.tmp'.format(target.name))
+                shutil.copyfile(str(blobs[digest]), str(temp))
+                os.chmod(str(temp), mode)
+                os.replace(str(temp), str(target))
+                restored.append(target)
+        return restored
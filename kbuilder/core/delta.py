@@ -0,0 +1,411 @@
+"""Binary deltas between kernel builds.
+
+A patch has a layout similar to bsdiff: a control stream of
+(extra length, diff length, old offset) entries, a diff stream of bytes
+combined with bytes of the old file, and an extra stream of new bytes. All
+streams are compressed with lzma.
+
+Matches are found through an index of sampled blocks of the old file
+instead of a suffix array, so memory stays proportional to the size of the
+old file divided by the sampling stride. Right after a match, every offset
+of the new file is looked up; further away, offsets are skipped in strides
+coprime to the sampling stride, so dissimilar regions are passed quickly
+while matches longer than the product of both strides are still found.
+Matches are extended in both directions, and then extended approximately
+while most bytes still agree, which keeps the diff stream compressible
+when code moved and addresses shifted.
+
+A delta package stores patches for the members of an OTA package which
+changed since a previous one. This module only depends on the standard
+library, and doubles as the script which applies a delta package:
+
+    python3 apply_delta.py BASE_OTA DELTA_OTA OUTPUT_OTA
+"""
+
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+MAGIC = b'KBDIFF01'
+
+# Magic, new size, old sha256 and new sha256.
+HEADER = struct.Struct('<8sQ32s32s')
+
+# Extra length, diff length and old offset.
+CONTROL = struct.Struct('<QQQ')
+
+SECTION = struct.Struct('<Q')
+
+# Distance between the sampled blocks of the old file.
+BLOCK_STRIDE = 64
+
+# Bytes of a sampled block used as index key.
+KEY_SIZE = 16
+
+# Shortest exact match used as a diff.
+MIN_MATCH = 32
+
+# Bytes skipped in the new file after a miss, once it is more than
+# BLOCK_STRIDE bytes past the last match. Being coprime to BLOCK_STRIDE,
+# every shift between the files is still tried within BLOCK_STRIDE misses.
+MISS_STRIDE = BLOCK_STRIDE - 1
+
+CHUNK_SIZE = 4096
+
+# Bytes compared at a time while extending a match approximately.
+APPROXIMATE_CHUNK_SIZE = 64
+
+MANIFEST_NAME = 'kbuilder-delta.json'
+APPLY_SCRIPT_NAME = 'apply_delta.py'
+
+
+def _xor(first: bytes, second: bytes) -> bytes:
+    """Return the bytewise exclusive or of two equally long byte strings."""
+    return (int.from_bytes(first, 'little') ^
+            int.from_bytes(second, 'little')).to_bytes(len(first), 'little')
+
+
+def _map(file):
+    """Map a file into memory, returning empty bytes for an empty file."""
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def file_digest(path: str) -> bytes:
+    """Return the sha256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _match_forward(old, old_offset: int, new, new_offset: int) -> int:
+    """Return the length of the exact match starting at two offsets."""
+    length = 0
+    while True:
+        first = old[old_offset + length:old_offset + length + CHUNK_SIZE]
+        second = new[new_offset + length:new_offset + length + CHUNK_SIZE]
+        size = min(len(first), len(second))
+        if first[:size] != second[:size]:
+            difference = _xor(first[:size], second[:size])
+            return length + size - len(difference.lstrip(b'\0'))
+        length += size
+        if size < CHUNK_SIZE:
+            return length
+
+
+def _match_backward(old, old_offset: int, new, new_offset: int, limit: int) -> int:
+    """Return the length of the exact match ending at two offsets."""
+    length = 0
+    while length < limit:
+        size = min(CHUNK_SIZE, limit - length)
+        first = old[old_offset - length - size:old_offset - length]
+        second = new[new_offset - length - size:new_offset - length]
+        if first != second:
+            difference = _xor(first, second)
+            return length + size - len(difference.rstrip(b'\0'))
+        length += size
+    return length
+
+
+def _match_approximately(old, old_offset: int, new, new_offset: int) -> int:
+    """Return the length of the approximate match starting at two offsets.
+
+    The match continues while at least half of the bytes of every chunk
+    agree. Exactly matching runs are skipped at once.
+    """
+    length = 0
+    while True:
+        length += _match_forward(old, old_offset + length, new, new_offset + length)
+        first = old[old_offset + length:old_offset + length + APPROXIMATE_CHUNK_SIZE]
+        second = new[new_offset + length:new_offset + length + APPROXIMATE_CHUNK_SIZE]
+        size = min(len(first), len(second))
+        if not size:
+            return length
+        difference = _xor(first[:size], second[:size])
+        if difference.count(0) * 2 < size:
+            return length
+        length += size
+
+
+class _PatchWriter(object):
+    """Compresses the streams of a patch into temporary files."""
+
+    def __init__(self) -> None:
+        self.streams = []
+        for _ in range(3):
+            self.streams.append((tempfile.TemporaryFile(), lzma.LZMACompressor()))
+
+    def _write(self, stream: int, data: bytes) -> None:
+        file, compressor = self.streams[stream]
+        file.write(compressor.compress(data))
+
+    def add(self, new, extra_start: int, extra_length: int,
+            old, old_offset: int, diff_length: int) -> None:
+        """Add a control entry and its extra and diff bytes."""
+        self._write(0, CONTROL.pack(extra_length, diff_length, old_offset))
+        for start in range(extra_start, extra_start + extra_length, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, extra_start + extra_length)
+            self._write(2, new[start:end])
+        new_offset = extra_start + extra_length
+        for start in range(0, diff_length, CHUNK_SIZE):
+            size = min(CHUNK_SIZE, diff_length - start)
+            self._write(1, _xor(new[new_offset + start:new_offset + start + size],
+                                old[old_offset + start:old_offset + start + size]))
+
+    def write_to(self, file) -> None:
+        """Write the compressed streams, each preceded by its length."""
+        for stream, compressor in self.streams:
+            stream.write(compressor.flush())
+            file.write(SECTION.pack(stream.tell()))
+            stream.seek(0)
+            shutil.copyfileobj(stream, file)
+            stream.close()
+
+
+def make_patch(old_path: str, new_path: str, patch_path: str) -> None:
+    """Create a patch which turns an old file into a new file."""
+    with open(str(old_path), 'rb') as old_file, open(str(new_path), 'rb') as new_file:
+        old = _map(old_file)
+        new = _map(new_file)
+        index = {}
+        for offset in range(0, len(old) - KEY_SIZE + 1, BLOCK_STRIDE):
+            index.setdefault(old[offset:offset + KEY_SIZE], offset)
+
+        writer = _PatchWriter()
+        done = 0
+        position = 0
+        last_position = len(new) - KEY_SIZE
+        while position <= last_position:
+            offset = index.get(new[position:position + KEY_SIZE])
+            if offset is not None:
+                length = _match_forward(old, offset, new, position)
+            if offset is None or length < MIN_MATCH:
+                position += 1 if position - done < BLOCK_STRIDE else MISS_STRIDE
+                continue
+            back = _match_backward(old, offset, new, position,
+                                   min(offset, position - done))
+            old_start, new_start = offset - back, position - back
+            length += back
+            length += _match_approximately(old, old_start + length, new, new_start + length)
+            writer.add(new, done, new_start - done, old, old_start, length)
+            done = position = new_start + length
+        if done < len(new):
+            writer.add(new, done, len(new) - done, old, 0, 0)
+
+        header = HEADER.pack(MAGIC, len(new), file_digest(old_path), file_digest(new_path))
+        with open(str(patch_path), 'wb') as patch:
+            patch.write(header)
+            writer.write_to(patch)
+
+
+class _StreamReader(object):
+    """Decompresses a stream of a patch on demand."""
+
+    def __init__(self, file, offset: int, length: int) -> None:
+        self._file = file
+        self._position = offset
+        self._end = offset + length
+        self._decompressor = lzma.LZMADecompressor()
+
+    def read(self, size: int) -> bytes:
+        """Read exactly size decompressed bytes."""
+        chunks = []
+        remaining = size
+        while remaining and not self._decompressor.eof:
+            data = b''
+            if self._decompressor.needs_input:
+                if self._position >= self._end:
+                    break
+                self._file.seek(self._position)
+                data = self._file.read(min(1 << 16, self._end - self._position))
+                self._position += len(data)
+            chunk = self._decompressor.decompress(data, max_length=remaining)
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        if remaining:
+            raise ValueError('Truncated patch')
+        return b''.join(chunks)
+
+
+def apply_patch(old_path: str, patch_path: str, new_path: str) -> None:
+    """Recreate a new file from an old file and a patch.
+
+    Raises:
+        ValueError: If the patch is corrupt or does not apply to the old file.
+    """
+    with open(str(patch_path), 'rb') as patch:
+        magic, new_size, old_digest, new_digest = HEADER.unpack(patch.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a kbuilder patch'.format(patch_path))
+        if file_digest(old_path) != old_digest:
+            raise ValueError('{} does not apply to {}'.format(patch_path, old_path))
+        streams = []
+        offset = HEADER.size
+        for _ in range(3):
+            patch.seek(offset)
+            length, = SECTION.unpack(patch.read(SECTION.size))
+            streams.append(_StreamReader(patch, offset + SECTION.size, length))
+            offset += SECTION.size + length
+        control, diff, extra = streams
+
+        temp_path = '{}.tmp'.format(new_path)
+        digest = hashlib.sha256()
+        with open(str(old_path), 'rb') as old_file, open(temp_path, 'wb') as new:
+            old = _map(old_file)
+            written = 0
+            while written < new_size:
+                extra_length, diff_length, old_offset = CONTROL.unpack(
+                    control.read(CONTROL.size))
+                if old_offset + diff_length > len(old):
+                    raise ValueError('Corrupt patch {}'.format(patch_path))
+                for start in range(0, extra_length, CHUNK_SIZE):
+                    data = extra.read(min(CHUNK_SIZE, extra_length - start))
+                    digest.update(data)
+                    new.write(data)
+                for start in range(0, diff_length, CHUNK_SIZE):
+                    size = min(CHUNK_SIZE, diff_length - start)
+                    data = _xor(diff.read(size),
+                                old[old_offset + start:old_offset + start + size])
+                    digest.update(data)
+                    new.write(data)
+                written += extra_length + diff_length
+        if written != new_size or digest.digest() != new_digest:
+            os.remove(temp_path)
+            raise ValueError('{} produced a corrupt file'.format(patch_path))
+        os.replace(temp_path, str(new_path))
+
+
+def _extract(archive: zipfile.ZipFile, name: str, path: str) -> str:
+    """Extract a member of a zip archive to a file."""
+    with archive.open(name) as source, open(path, 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    return path
+
+
+def make_delta_package(base_path: str, target_path: str, output_path: str) -> dict:
+    """Create a delta package turning a base OTA package into a target one.
+
+    Unchanged members are copied from the base package when applying.
+    Changed members are stored as patches when those are smaller than the
+    compressed member, and in full otherwise.
+
+    Returns:
+        The manifest of the delta package.
+    """
+    entries = []
+    with zipfile.ZipFile(str(base_path)) as base, \
+            zipfile.ZipFile(str(target_path)) as target, \
+            zipfile.ZipFile(str(output_path), 'w', zipfile.ZIP_DEFLATED) as output, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        base_members = {info.filename: info for info in base.infolist()}
+        for info in target.infolist():
+            entry = {'name': info.filename, 'date_time': list(info.date_time),
+                     'external_attr': info.external_attr}
+            old = base_members.get(info.filename)
+            if info.filename.endswith('/'):
+                entry['action'] = 'directory'
+            elif old and old.CRC == info.CRC and old.file_size == info.file_size:
+                entry['action'] = 'copy'
+            else:
+                new_file = _extract(target, info.filename, os.path.join(temp_dir, 'new'))
+                entry['sha256'] = file_digest(new_file).hex()
+                entry['action'] = 'add'
+                if old and old.file_size:
+                    old_file = _extract(base, old.filename, os.path.join(temp_dir, 'old'))
+                    patch_file = new_file + '.patch'
+                    make_patch(old_file, new_file, patch_file)
+                    if os.path.getsize(patch_file) < info.compress_size:
+                        entry['action'] = 'patch'
+                        output.write(patch_file, 'patches/' + info.filename,
+                                     zipfile.ZIP_STORED)
+                if entry['action'] == 'add':
+                    output.write(new_file, 'files/' + info.filename)
+            entries.append(entry)
+
+        manifest = {'version': 1,
+                    'base': {'name': os.path.basename(str(base_path)),
+                             'sha256': file_digest(base_path).hex()},
+                    'target': os.path.basename(str(target_path)),
+                    'entries': entries}
+        output.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+        output.write(os.path.abspath(__file__), APPLY_SCRIPT_NAME)
+    return manifest
+
+
+def apply_delta_package(base_path: str, delta_path: str, output_path: str) -> None:
+    """Recreate a target OTA package from a base package and a delta package.
+
+    Raises:
+        ValueError: If the delta package does not apply to the base package.
+    """
+    with zipfile.ZipFile(str(delta_path)) as delta:
+        manifest = json.loads(delta.read(MANIFEST_NAME).decode())
+        if file_digest(base_path).hex() != manifest['base']['sha256']:
+            raise ValueError('{} is not based on {}'.format(delta_path, base_path))
+        temp_path = '{}.tmp'.format(output_path)
+        with zipfile.ZipFile(str(base_path)) as base, \
+                zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as output, \
+                tempfile.TemporaryDirectory() as temp_dir:
+            for entry in manifest['entries']:
+                name = entry['name']
+                if entry['action'] == 'directory':
+                    info = zipfile.ZipInfo(name, tuple(entry['date_time']))
+                    info.external_attr = entry['external_attr']
+                    output.writestr(info, b'')
+                    continue
+                if entry['action'] == 'copy':
+                    path = _extract(base, name, os.path.join(temp_dir, 'new'))
+                elif entry['action'] == 'patch':
+                    path = os.path.join(temp_dir, 'new')
+                    apply_patch(_extract(base, name, os.path.join(temp_dir, 'old')),
+                                _extract(delta, 'patches/' + name,
+                                         os.path.join(temp_dir, 'patch')), path)
+                else:
+                    path = _extract(delta, 'files/' + name, os.path.join(temp_dir, 'new'))
+                if 'sha256' in entry and file_digest(path).hex() != entry['sha256']:
+                    raise ValueError('Corrupt member {} of {}'.format(name, delta_path))
+                _write_member(output, path, entry)
+                os.remove(path)
+        os.replace(temp_path, str(output_path))
+
+
+def _write_member(output: zipfile.ZipFile, path: str, entry: dict) -> None:
+    """Add a file to a zip archive with the metadata of a manifest entry."""
+    info = zipfile.ZipInfo(entry['name'], tuple(entry['date_time']))
+    info.external_attr = entry['external_attr']
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.file_size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        if sys.version_info < (3, 6):
+            output.writestr(info, file.read())
+            return
+        with output.open(info, 'w') as member:
+            shutil.copyfileobj(file, member)
+
+
+def main(argv: list) -> int:
+    """Apply a delta package from the command line."""
+    if len(argv) != 4:
+        print('usage: {} BASE_OTA DELTA_OTA OUTPUT_OTA'.format(argv[0]), file=sys.stderr)
+        return 2
+    try:
+        apply_delta_package(argv[1], argv[2], argv[3])
+    except ValueError as error:
+        print('error: {}'.format(error), file=sys.stderr)
+        return 1
+    print('created {}'.format(argv[3]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
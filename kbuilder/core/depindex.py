@@ -0,0 +1,278 @@
+"""Reverse dependencies of kbuild objects.
+
+For every object, kbuild writes a .<object>.cmd file listing the source
+and every header the object was compiled from. A DependencyIndex parses
+these files in parallel and answers which objects a change of a file
+rebuilds, and how many compile-seconds that costs.
+
+Each object stores the ids of its dependencies in a compact array, and
+header ids are stable across updates, so rescanning after a build only
+parses the .cmd files which changed. The reverse arrays of the objects
+depending on each file are built once per update and saved with the
+index, so queries do not scan every object. Compile time is estimated with a rate
+of CPU seconds per dependency, calibrated from the objects each build
+actually rebuilt, since compile time grows with the headers an object
+includes.
+"""
+
+import os
+import pickle
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# The dependencies of an object follow its command line:
+#
+# deps_drivers/foo.o := \
+#   include/linux/kconfig.h \
+#     $(wildcard include/config/foo.h) \
+_wildcard = re.compile(r'\$\(wildcard [^)]*\)')
+_source = re.compile(r'^source_\S+ := (\S+)', re.M)
+
+
+def _parse_cmd_files(paths: List[str], root: str,
+                     object_dir: str) -> List[Tuple[str, int, List[str]]]:
+    """Parse .cmd files into (object, mtime, dependencies) tuples.
+
+    Dependencies are made relative to the source tree, or to the object
+    directory for generated headers; files outside both are skipped.
+    """
+    parsed = []
+    # Objects share most headers, so each spelling is only normalized once.
+    relative = {}
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, encoding='utf-8', errors='replace') as file:
+                text = file.read()
+        except OSError:
+            continue
+        start = text.find('\ndeps_')
+        end = text.find('\n\n', start)
+        target, _, deps = text[start + 6:end if end >= 0 else len(text)].partition(' := ')
+        if start < 0 or not target.endswith('.o'):
+            continue
+        entries = set(_wildcard.sub('', deps).split())
+        source = _source.search(text)
+        if source:
+            entries.add(source.group(1))
+        entries.discard('\\')
+        dependencies = []
+        for entry in entries:
+            dependency = relative.get(entry, False)
+            if dependency is False:
+                dependency = relative[entry] = _relative(entry, root, object_dir)
+            if dependency:
+                dependencies.append(dependency)
+        parsed.append((_relative(target, object_dir, object_dir) or target, mtime,
+                       dependencies))
+    return parsed
+
+
+def _relative(path: str, root: str, object_dir: str) -> Optional[str]:
+    """Return a path relative to the source tree or object directory."""
+    path = os.path.normpath(os.path.join(object_dir, path))
+    for base in (root, object_dir):
+        if path.startswith(base + os.sep):
+            return path[len(base) + 1:]
+    return None
+
+
+def find_cmd_files(object_dir: Path) -> List[str]:
+    """Return the paths of the .cmd files of the objects in an object directory."""
+    paths = []
+    for directory, dirs, files in os.walk(str(object_dir)):
+        dirs[:] = [name for name in dirs if not name.startswith(('.git', '.kbuilder'))]
+        paths.extend(os.path.join(directory, name) for name in files
+                     if name.startswith('.') and name.endswith('.o.cmd'))
+    return paths
+
+
+class DependencyIndex(object):
+    """The dependencies of the objects of a build.
+
+    Properties:
+        root: Root directory of the kernel source tree.
+        object_dir: Object directory of the build.
+        objects: Paths of the objects, relative to the object directory.
+        files: Paths of the dependencies, indexed by their ids.
+        dependencies: Arrays of the dependency ids of every object.
+        stamps: mtimes in nanoseconds of the .cmd files of every object.
+        dependents_of: Arrays of the numbers of the objects depending on
+            every dependency, indexed by its id.
+        rate: Estimated CPU seconds of compiling per dependency, or 0.0 if
+            no build was timed.
+    """
+
+    version = 2
+    batch_size = 256
+    min_calibration_objects = 16
+
+    def __init__(self, root: Path, object_dir: Path) -> None:
+        self.root = Path(root)
+        self.object_dir = Path(object_dir)
+        self.objects = []
+        self.files = []
+        self.dependencies = []
+        self.stamps = []
+        self.dependents_of = []
+        self.rate = 0.0
+        self._ids = None
+
+    @classmethod
+    def load(cls, path: Path, root: Path, object_dir: Path) -> 'DependencyIndex':
+        """Load an index, returning an empty index if it is missing or for another build."""
+        try:
+            with open(str(path), 'rb') as file:
+                version, index = pickle.load(file)
+        except (FileNotFoundError, EOFError, ValueError, AttributeError,
+                pickle.UnpicklingError):
+            return cls(root, object_dir)
+        if (version != DependencyIndex.version or index.root != Path(root) or
+                index.object_dir != Path(object_dir)):
+            return cls(root, object_dir)
+        return index
+
+    def save(self, path: Path) -> None:
+        """Atomically write the index to a file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + '.tmp')
+        ids, self._ids = self._ids, None
+        try:
+            with open(str(temp), 'wb') as file:
+                pickle.dump((DependencyIndex.version, self), file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            self._ids = ids
+        os.replace(str(temp), str(path))
+
+    def _file_ids(self) -> Dict[str, int]:
+        """Return a dict mapping the paths of dependencies to their ids."""
+        if self._ids is None:
+            self._ids = {name: number for number, name in enumerate(self.files)}
+        return self._ids
+
+    def _id(self, path: str) -> int:
+        """Return the id of a dependency, adding it if it is new."""
+        number = self._file_ids().get(path)
+        if number is None:
+            number = self._ids[path] = len(self.files)
+            self.files.append(path)
+        return number
+
+    def update(self, jobs: int=os.cpu_count()) -> int:
+        """Rescan the object directory, parsing changed .cmd files in parallel.
+
+        Returns:
+            The number of objects whose dependencies were parsed.
+        """
+        previous = {name: number for number, name in enumerate(self.objects)}
+        cmd_files = find_cmd_files(self.object_dir)
+        changed = []
+        kept = []
+        for path in cmd_files:
+            directory, name = os.path.split(path)
+            target = os.path.relpath(os.path.join(directory, name[1:-4]), str(self.object_dir))
+            number = previous.get(target)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if number is not None and self.stamps[number] == mtime:
+                kept.append(number)
+            else:
+                changed.append(path)
+
+        objects = [self.objects[number] for number in kept]
+        dependencies = [self.dependencies[number] for number in kept]
+        stamps = [self.stamps[number] for number in kept]
+        batches = [changed[start:start + DependencyIndex.batch_size]
+                   for start in range(0, len(changed), DependencyIndex.batch_size)]
+        root, object_dir = str(self.root), str(self.object_dir)
+        if len(batches) > 1 and jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = executor.map(_parse_cmd_files, batches, [root] * len(batches),
+                                       [object_dir] * len(batches))
+                results = list(results)
+        else:
+            results = [_parse_cmd_files(batch, root, object_dir) for batch in batches]
+        count = 0
+        lookup = self._file_ids().get
+        for result in results:
+            for target, mtime, files in result:
+                numbers = list(map(lookup, files))
+                if None in numbers:
+                    numbers = [self._id(name) if number is None else number
+                               for number, name in zip(numbers, files)]
+                numbers.sort()
+                objects.append(target)
+                stamps.append(mtime)
+                dependencies.append(array('I', numbers))
+                count += 1
+        self.objects, self.dependencies, self.stamps = objects, dependencies, stamps
+        self.dependents_of = [array('I') for _ in self.files]
+        for number, files in enumerate(dependencies):
+            for file in files:
+                self.dependents_of[file].append(number)
+        return count
+
+    def file_id(self, path: str) -> Optional[int]:
+        """Return the id of a dependency, or None if no object depends on it."""
+        return self._file_ids().get(path)
+
+    def dependents(self, path: str) -> List[int]:
+        """Return the numbers of the objects depending on a file."""
+        number = self.file_id(path)
+        if number is None:
+            return []
+        return list(self.dependents_of[number])
+
+    def cost(self, objects: Iterable[int]) -> float:
+        """Return the estimated CPU seconds of compiling objects."""
+        return self.rate * sum(len(self.dependencies[number]) for number in objects)
+
+    def impact(self, path: str) -> Tuple[int, float]:
+        """Return the number of objects a change of a file rebuilds, and their cost."""
+        objects = self.dependents(path)
+        return len(objects), self.cost(objects)
+
+    def ranking(self, count: int=20) -> List[Tuple[str, int, float]]:
+        """Return the headers rebuilding the most objects when changed.
+
+        Returns:
+            (header, objects, estimated CPU seconds) tuples, largest first.
+        """
+        headers = sorted(((number, len(objects))
+                          for number, objects in enumerate(self.dependents_of)
+                          if objects and self.files[number].endswith('.h')),
+                         key=lambda header: (-header[1], self.files[header[0]]))[:count]
+        return [(self.files[number], objects, self.cost(self.dependents_of[number]))
+                for number, objects in headers]
+
+    def rebuilt_since(self, timestamp: float) -> List[int]:
+        """Return the numbers of the objects written at or after a time."""
+        rebuilt = []
+        object_dir = str(self.object_dir)
+        for number, name in enumerate(self.objects):
+            try:
+                if os.stat(os.path.join(object_dir, name)).st_mtime >= timestamp:
+                    rebuilt.append(number)
+            except OSError:
+                pass
+        return rebuilt
+
+    def calibrate(self, cpu_time: float, objects: List[int]) -> None:
+        """Update the compile rate from the CPU time a build of objects took.
+
+        The rate is averaged with the previous one, so a single noisy build
+        does not dominate it. Builds of only a few objects are skipped, since
+        the CPU time make spends walking the tree dominates them.
+        """
+        weight = sum(len(self.dependencies[number]) for number in objects)
+        if len(objects) < DependencyIndex.min_calibration_objects or cpu_time <= 0:
+            return
+        rate = cpu_time / weight
+        self.rate = (self.rate + rate) / 2 if self.rate else rate
@@ -0,0 +1,138 @@
+"""Sections and symbols of ELF files such as vmlinux and modules.
+
+ElfFile maps a file into memory and only reads the headers and tables it
+is asked for, so reading the symbols of a vmlinux with several hundred
+megabytes of debug info only touches its symbol and string tables.
+"""
+
+import mmap
+import struct
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHN_LORESERVE = 0xFF00
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+STT_FILE = 4
+
+Section = namedtuple('Section', 'name type flags address offset size link')
+Symbol = namedtuple('Symbol', 'name type binding section value size')
+
+# Offsets of e_shoff, e_shentsize, e_shnum and e_shstrndx, the layout of a
+# section header, and the layout of a symbol by ELF class. Symbols are
+# unpacked as name, value, size, info, other and section index.
+_layouts = {1: (0x20, 'I', 0x2E, 'IIIIIIIIII', 'IIIBBH', (0, 1, 2, 3, 4, 5)),
+            2: (0x28, 'Q', 0x3A, 'IIQQQQIIQQ', 'IBBHQQ', (0, 4, 5, 1, 2, 3))}
+
+
+class ElfFile(object):
+    """An ELF file mapped into memory.
+
+    Properties:
+        path: The file.
+        sections: The sections of the file, in the order of their headers.
+
+    Raises:
+        ValueError: If the file is not an ELF file or is truncated.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(str(self.path), 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError('{} is not an ELF file'.format(self.path))
+        try:
+            self.sections = self._read_sections()
+        except (ValueError, struct.error):
+            self.close()
+            raise ValueError('{} is not an ELF file'.format(self.path))
+
+    def close(self) -> None:
+        """Unmap the file."""
+        self._map.close()
+
+    def __enter__(self) -> 'ElfFile':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def _read(self, offset: int, size: int) -> bytes:
+        if offset + size > len(self._map):
+            raise ValueError('{} is truncated'.format(self.path))
+        return self._map[offset:offset + size]
+
+    def _read_sections(self) -> List[Section]:
+        ident = self._read(0, 64)
+        if ident[:4] != b'\x7fELF' or ident[4] not in _layouts or ident[5] not in (1, 2):
+            raise ValueError
+        self._order = '<' if ident[5] == 1 else '>'
+        shoff_at, shoff_format, counts_at, header_format, symbol_format, self._fields = (
+            _layouts[ident[4]])
+        self._symbol = struct.Struct(self._order + symbol_format)
+        shoff, = struct.unpack_from(self._order + shoff_format, ident, shoff_at)
+        entsize, count, strndx = struct.unpack_from(self._order + 'HHH', ident, counts_at)
+        table = self._read(shoff, entsize * count)
+        headers = [struct.unpack_from(self._order + header_format, table, entsize * number)
+                   for number in range(count)]
+        if not headers or strndx >= count:
+            return []
+        names = self._read(headers[strndx][4], headers[strndx][5])
+
+        sections = []
+        for name, type_, flags, address, offset, size, link, *_ in headers:
+            name = names[name:names.index(b'\0', name)].decode('ascii', 'replace')
+            sections.append(Section(name, type_, flags, address, offset, size, link))
+        return sections
+
+    def symbols(self) -> Iterator[Symbol]:
+        """Iterate over the symbols of the symbol table.
+
+        Undefined symbols and symbols of special sections, such as absolute
+        ones, have no section.
+        """
+        name_at, value_at, size_at, info_at, _, index_at = self._fields
+        for table in self.sections:
+            if table.type != SHT_SYMTAB:
+                continue
+            if table.link >= len(self.sections):
+                raise ValueError('{} has no symbol names'.format(self.path))
+            strings = self.sections[table.link]
+            names = self._read(strings.offset, strings.size)
+            data = self._read(table.offset, table.size - table.size % self._symbol.size)
+            for fields in self._symbol.iter_unpack(data):
+                index = fields[index_at]
+                section = (self.sections[index] if 0 < index < min(len(self.sections),
+                                                                  SHN_LORESERVE) else None)
+                start = fields[name_at]
+                end = names.find(b'\0', start)
+                name = names[start:end if end >= 0 else None].decode('ascii', 'replace')
+                info = fields[info_at]
+                yield Symbol(name, info & 0xF, info >> 4, section, fields[value_at],
+                             fields[size_at])
+
+
+def read_sections(path: Path) -> List[Section]:
+    """Read the section headers of an ELF file.
+
+    Raises:
+        ValueError: If the file is not an ELF file.
+    """
+    with ElfFile(path) as elf:
+        return elf.sections
+
+
+def section_sizes(path: Path) -> Dict[str, int]:
+    """Return the sizes of the sections of an ELF file loaded into memory."""
+    return {section.name: section.size for section in read_sections(path)
+            if section.flags & SHF_ALLOC and section.size}
@@ -0,0 +1,110 @@
+"""Detection of the first failure in parallel build output.
+
+With many jobs, make keeps running the jobs already started after one
+fails, and their output buries the error. A FailureDetector watches the
+output as it streams, and reports the first failing target as soon as make
+prints it, so the build can be cancelled and the target rebuilt alone.
+"""
+
+import re
+from collections import deque
+from subprocess import CalledProcessError
+from typing import Callable, List, Optional
+
+# make[2]: *** [scripts/Makefile.build:250: drivers/foo.o] Error 1
+_make_error = re.compile(r'^(?:\S*make)(?:\[\d+\])?: \*\*\* \[(?:\S+:\d+: )?(?P<target>[^\]]+)\] ')
+
+# make[1]: *** No rule to make target 'foo.h', needed by 'drivers/foo.o'.  Stop.
+_missing_rule = re.compile(r"^(?:\S*make)(?:\[\d+\])?: \*\*\* No rule to make target "
+                           r"'[^']+', needed by '(?P<target>[^']+)'")
+
+# drivers/foo.c:12:5: error: ...
+_compiler_error = re.compile(r'^(?P<source>[^:\s]+\.[cSs]):\d+(?::\d+)?: (?:fatal )?error:')
+
+_other_error = re.compile(r'(?: error:|undefined reference to|\bError \d+$)')
+
+
+def _object_of(source: str) -> str:
+    """Return the object kbuild compiles a source file to."""
+    return source[:source.rindex('.')] + '.o'
+
+
+def _relative_target(target: str) -> str:
+    """Strip the leading ./ and ../ components kbuild prints with O=."""
+    while target.startswith(('./', '../')):
+        target = target.split('/', 1)[1]
+    return target
+
+
+class FailureDetector(object):
+    """Finds the first failing target in streaming make output.
+
+    Properties:
+        target: The first failing target, or None.
+        errors: The lines leading up to and including the first failure.
+    """
+
+    context_lines = 30
+
+    def __init__(self, on_failure: Optional[Callable[[], None]]=None) -> None:
+        """Initialize a new FailureDetector.
+
+        Args:
+            on_failure: Called once, as soon as the first failing target is known.
+        """
+        self.on_failure = on_failure
+        self.target = None
+        self.errors = []
+        self._recent = deque(maxlen=FailureDetector.context_lines)
+        self._lines = 0
+        self._first_error = None
+        self._source = None
+
+    @property
+    def failed(self) -> bool:
+        """Whether a failing target was found."""
+        return self.target is not None
+
+    def feed(self, line: str) -> None:
+        """Process a line of make output."""
+        if self.failed:
+            return
+        self._recent.append(line)
+        self._lines += 1
+        match = _compiler_error.match(line)
+        if match and not self._source:
+            self._source = _relative_target(match.group('source'))
+        if self._first_error is None and (match or _other_error.search(line)):
+            self._first_error = self._lines
+
+        match = _make_error.match(line) or _missing_rule.match(line)
+        if not match:
+            return
+        target = _relative_target(match.group('target').strip())
+        if self._source and ('.' not in target or target.startswith('_')):
+            target = _object_of(self._source)
+        self.target = target
+        # Start a few lines before the first error, if it is still buffered.
+        first_error = self._first_error or self._lines
+        start = max(0, len(self._recent) - (self._lines - first_error) - 6)
+        self.errors = list(self._recent)[start:]
+        if self.on_failure:
+            self.on_failure()
+
+
+class MakeTargetError(CalledProcessError):
+    """A build stopped at its first failing target.
+
+    Properties:
+        target: The failing target.
+        errors: The lines of output leading up to the failure.
+    """
+
+    def __init__(self, returncode: int, cmd: List[str], target: str,
+                 errors: List[str]) -> None:
+        super().__init__(returncode, cmd)
+        self.target = target
+        self.errors = errors
+
+    def __str__(self) -> str:
+        return 'Failed to make {}'.format(self.target)
@@ -1,10 +1,13 @@
 """Core Compiler abstractions."""
 
 import os
+import subprocess
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional
 
-from kbuilder.core.arch import Arch
+from kbuilder.core.arch import Arch, ArchError
+from kbuilder.core.make import BuildEnvironment
+from kbuilder.core.toolchain_cache import ToolchainCache
 
 
 class Compiler(object):
@@ -12,6 +15,9 @@ class Compiler(object):
 
     compiler_prefixes = {'aarch64': Arch.arm64, 'arm-eabi': Arch.arm}
 
+    # Variables set by any kind of compiler, replaced when switching compilers.
+    environment_variables = ('CROSS_COMPILE', 'SUBARCH', 'LLVM', 'LLVM_IAS', 'PATH')
+
     def __init__(self, root: str) -> None:
         """Initialize a new Compiler.
 
@@ -34,26 +40,37 @@ class Compiler(object):
         """
         return self.root.isdir() and Path(self.root, 'bin').isdir()
 
-    def __enter__(self):
-        """Set this self as the compiler to compile targets."""
-        self.set_as_active()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Do not supresses any errors.
-
-        Positional arguments:
-        exc_type -- the type of exception
-        exc_val -- the value of the exception
-        exc_tb -- the traceback of the exception
-        """
-        return False
-
     @property
     def name(self):
         """The name of this."""
         return self._name
 
+    @property
+    def identity(self) -> str:
+        """A string which changes whenever the compiler is replaced.
+
+        It is made of the version and target machine the compiler driver
+        reports, so copies of a toolchain on different machines or at
+        different paths share it. A driver which does not run is identified
+        by the name of the compiler only.
+        """
+        driver = self.driver()
+        try:
+            version = subprocess.check_output([driver, '--version'], universal_newlines=True,
+                                              stderr=subprocess.DEVNULL)
+            machine = subprocess.check_output([driver, '-dumpmachine'],
+                                              universal_newlines=True,
+                                              stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError):
+            return '{} {}'.format(type(self).__name__, self.name)
+        # Further lines of the version may name the installation directory.
+        version = version.strip().split('\n', 1)[0]
+        return '{} {} {}'.format(type(self).__name__, version, machine.strip())
+
+    def driver(self) -> str:
+        """Return the path of the compiler driver."""
+        return str(self.compiler_prefix) + 'gcc'
+
     @property
     def target_arch(self):
         """The target architecture of this compiler."""
@@ -109,16 +126,188 @@ class Compiler(object):
                 target_arch = Compiler.compiler_prefixes[arch_prefix]
                 return target_arch
 
-    def set_as_active(self):
-        """Set this self as the active compiler to compile with."""
-        os.putenv('CROSS_COMPILE', self.compiler_prefix)
-        os.putenv('SUBARCH', self.target_arch.name)
+    def supports(self, arch: Arch) -> bool:
+        """Return whether this compiler can build for an architecture."""
+        return self.target_arch == arch
+
+    def make_variables(self, arch: Optional[Arch]=None) -> Dict[str, str]:
+        """Return the make variables which select this compiler.
+
+        Args:
+            arch: Architecture of the kernel being built (default target_arch).
+        """
+        arch = arch or self.target_arch
+        return {'CROSS_COMPILE': str(self.compiler_prefix),
+                'SUBARCH': arch.name}
+
+    def search_path(self) -> List[str]:
+        """Return the directories put in front of PATH while building with this."""
+        return []
+
+    def set_as_active(self, environment: BuildEnvironment, arch: Optional[Arch]=None):
+        """Set this self as the compiler of a build environment.
+
+        The variables are passed to make in its environment, which only
+        affects the builds using this build environment, and the search
+        path of the compiler is put in front of PATH. Variables of the
+        compiler previously set are removed.
+
+        Args:
+            environment: The BuildEnvironment of the kernel being built.
+            arch: Architecture of the kernel being built (default target_arch).
+        """
+        for name in Compiler.environment_variables:
+            environment.env.pop(name, None)
+        environment.env.update(self.make_variables(arch))
+        directories = self.search_path()
+        if directories:
+            path = os.environ.get('PATH', '')
+            environment.env['PATH'] = os.pathsep.join(directories + [path] if path else
+                                                      directories)
+
+
+class ClangCompiler(Compiler):
+    """Store relevant info of a clang/LLVM toolchain.
+
+    Clang is a cross compiler for every architecture, so the kernel
+    architecture decides the target triple. The whole LLVM toolchain is
+    selected with LLVM=1.
+    """
+
+    target_triples = {Arch.arm: 'arm-linux-gnueabi-',
+                      Arch.arm64: 'aarch64-linux-gnu-',
+                      Arch.x86: 'x86_64-linux-gnu-'}
+
+    @staticmethod
+    def is_clang(root: str) -> bool:
+        """Return whether a directory contains a clang toolchain."""
+        return Path(root, 'bin', 'clang').exists()
+
+    def find_compiler_prefix(self) -> str:
+        """Return the prefix of the LLVM binaries of this."""
+        return (self.root / 'bin' / 'llvm-').as_posix()
+
+    def _find_target_arch(self) -> Arch:
+        """Clang does not have a single target architecture."""
+        return None
+
+    def supports(self, arch: Arch) -> bool:
+        """Return whether this compiler can build for an architecture."""
+        return arch in ClangCompiler.target_triples
+
+    def make_variables(self, arch: Optional[Arch]=None) -> Dict[str, str]:
+        """Return the make variables which select this compiler.
+
+        Args:
+            arch: Architecture of the kernel being built.
+
+        Raises:
+            ArchError: If no architecture is given.
+        """
+        if arch not in ClangCompiler.target_triples:
+            raise ArchError('clang requires a supported kernel architecture')
+        return {'CROSS_COMPILE': ClangCompiler.target_triples[arch],
+                'SUBARCH': arch.name,
+                'LLVM': '1',
+                'LLVM_IAS': '1'}
 
+    def driver(self) -> str:
+        """Return the path of clang."""
+        return (self.root / 'bin' / 'clang').as_posix()
 
-def scandir(compiler_dir: str, target_arch: Optional[Arch] = None) -> List:
+    def search_path(self) -> List[str]:
+        """LLVM=1 runs clang, ld.lld and the other tools by name from PATH."""
+        return [os.path.abspath((self.root / 'bin').as_posix())]
+
+
+def detect(root: str) -> Compiler:
+    """Return a compiler of the type located in a directory."""
+    if ClangCompiler.is_clang(root):
+        return ClangCompiler(root)
+    return Compiler(root)
+
+
+class ArchivedCompiler(Compiler):
+    """A compiler in a toolchain archive, extracted on first use.
+
+    Until the archive is extracted, the target architecture is guessed from
+    the name of the archive.
+    """
+
+    def __init__(self, name: str, cache: ToolchainCache) -> None:
+        """Initialize a new ArchivedCompiler.
+
+        Args:
+            name: Name of the toolchain archive.
+            cache: The cache the toolchain is extracted into.
+        """
+        self.cache = cache
+        self.root = cache.path(name)
+        self._name = name
+        self._compiler = None
+
+    def __getstate__(self) -> Dict:
+        """Do not pickle the extracted compiler, which may be evicted."""
+        state = dict(self.__dict__)
+        state['_compiler'] = None
+        return state
+
+    @property
+    def extracted(self) -> bool:
+        """Whether the toolchain is currently extracted."""
+        return self.cache.is_extracted(self.name)
+
+    @property
+    def compiler(self) -> Compiler:
+        """The extracted compiler, extracting the archive if necessary."""
+        self.cache.ensure(self.name)
+        if not self._compiler:
+            self._compiler = detect(self.root)
+        return self._compiler
+
+    @property
+    def identity(self) -> str:
+        return self.compiler.identity
+
+    @property
+    def target_arch(self):
+        if self.extracted:
+            return self.compiler.target_arch
+        for arch_prefix, arch in Compiler.compiler_prefixes.items():
+            if self.name.startswith(arch_prefix):
+                return arch
+        return None
+
+    @property
+    def compiler_prefix(self):
+        return self.compiler.compiler_prefix
+
+    def supports(self, arch: Arch) -> bool:
+        """Return whether this compiler can build for an architecture.
+
+        An archive whose architecture is unknown may support any.
+        """
+        if self.extracted:
+            return self.compiler.supports(arch)
+        if 'clang' in self.name or 'llvm' in self.name:
+            return arch in ClangCompiler.target_triples
+        return self.target_arch in (arch, None)
+
+    def make_variables(self, arch: Optional[Arch]=None) -> Dict[str, str]:
+        return self.compiler.make_variables(arch)
+
+    def driver(self) -> str:
+        return self.compiler.driver()
+
+    def search_path(self) -> List[str]:
+        return self.compiler.search_path()
+
+
+def scandir(compiler_dir: str, target_arch: Optional[Arch] = None,
+            cache: Optional[ToolchainCache] = None) -> List:
     """Return a list of compilers located in a directory.
 
-    A compiler is considered valid if it has a gcc executable in its
+    A compiler is considered valid if it has a gcc or clang executable in its
      'bin' directory.
 
     Positional arguments:
@@ -129,13 +318,22 @@ def scandir(compiler_dir: str, target_arch: Optional[Arch] = None) -> List:
         If empty, then compilers of any architecture may be returned
         otherwise only compilers with the matching architecture will be
         returned (default None).
+    cache -- a ToolchainCache whose archives are listed as well, whether
+        extracted or not (default None).
     """
 
     compilers = []
     entries = sorted(os.scandir(compiler_dir), key=lambda x: x.name)
 
     for entry in entries:
-        compiler = Compiler(entry.path)
-        if compiler and (not target_arch or compiler.target_arch == target_arch):
+        compiler = detect(entry.path)
+        if compiler and (not target_arch or compiler.supports(target_arch)):
             compilers.append(compiler)
+
+    if cache:
+        names = {compiler.name for compiler in compilers}
+        for name in cache.archives():
+            compiler = ArchivedCompiler(name, cache)
+            if name not in names and (not target_arch or compiler.supports(target_arch)):
+                compilers.append(compiler)
     return compilers
@@ -0,0 +1,331 @@
+"""A database of past builds.
+
+BuildHistory records every build report in an SQLite database together
+with the commit, compiler and defconfig it was built from, and the section
+sizes of vmlinux. Builds of the same kernel, command and defconfig form a
+series in which regressions of build time and image size are detected.
+
+Build times are noisy, so a time regression is a change point in the
+series after which builds are significantly slower by a Mann-Whitney U
+test. Sizes are deterministic, so a size regression is a
+step between two builds which is still present in the latest build.
+"""
+
+import json
+import math
+import sqlite3
+import subprocess
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from kbuilder.core.report import BuildReport
+
+BuildRecord = namedtuple('BuildRecord', 'id started command kernel revision compiler '
+                                        'defconfig success duration image_size warnings')
+
+
+class Regression(namedtuple('Regression', 'metric before after revision compiler '
+                                          'p_value unit')):
+    """A lasting increase of a metric of a build series.
+
+    Properties:
+        metric: Name of the metric, such as 'build time' or 'Image'.
+        before: Typical value before the change.
+        after: Typical value since the change.
+        revision: Commit of the first build with the increase.
+        compiler: Compiler of that build, if it differs from the one before.
+        p_value: Significance of a time regression, None for sizes.
+        unit: 's' for times, 'B' for sizes.
+    """
+
+    @property
+    def change(self) -> float:
+        """Relative increase of the metric."""
+        return self.after / self.before - 1 if self.before else 0.0
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    command TEXT NOT NULL,
+    kernel TEXT NOT NULL,
+    revision TEXT,
+    compiler TEXT,
+    defconfig TEXT,
+    success INTEGER NOT NULL,
+    duration REAL,
+    image_size INTEGER,
+    warnings INTEGER,
+    report TEXT
+);
+CREATE INDEX IF NOT EXISTS builds_series ON builds (kernel, command, defconfig, success);
+CREATE TABLE IF NOT EXISTS phases (
+    build_id INTEGER NOT NULL REFERENCES builds (id),
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_build ON phases (build_id);
+CREATE TABLE IF NOT EXISTS sections (
+    build_id INTEGER NOT NULL REFERENCES builds (id),
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sections_build ON sections (build_id);
+"""
+
+# Sections of vmlinux checked for size regressions.
+tracked_sections = ('.text', '.rodata', '.data', '.bss')
+
+
+def git_revision(root: Path) -> Optional[str]:
+    """Return the abbreviated commit checked out in a tree, if it is a git tree."""
+    try:
+        return subprocess.check_output(
+            ['git', '-C', str(root), 'rev-parse', '--short=12', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rank_sum(before: Sequence[float], after: Sequence[float]) -> Tuple[float, float]:
+    """Return the rank sum of the first group and the tie correction term."""
+    values = sorted([(value, 0) for value in before] + [(value, 1) for value in after])
+    rank_sum = 0.0
+    ties = 0.0
+    start = 0
+    while start < len(values):
+        end = start
+        while end + 1 < len(values) and values[end + 1][0] == values[start][0]:
+            end += 1
+        rank = (start + end) / 2 + 1
+        rank_sum += rank * sum(1 for _, group in values[start:end + 1] if group == 0)
+        count = end - start + 1
+        ties += count ** 3 - count
+        start = end + 1
+    return rank_sum, ties
+
+
+def mann_whitney(before: Sequence[float], after: Sequence[float]) -> float:
+    """Return the two-sided p-value of a Mann-Whitney U test.
+
+    Uses the normal approximation with tie and continuity corrections,
+    which is accurate enough with five or more samples per group.
+    """
+    n1, n2 = len(before), len(after)
+    n = n1 + n2
+    rank_sum, ties = _rank_sum(before, after)
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    deviation = abs(rank_sum - n1 * (n1 + 1) / 2 - n1 * n2 / 2)
+    z = max(deviation - 0.5, 0) / math.sqrt(variance)
+    return math.erfc(z / math.sqrt(2))
+
+
+def _change_point(values: Sequence[float], min_samples: int) -> Optional[int]:
+    """Return the split of a series which best separates it into two means.
+
+    This is the least squares change point, which unlike a rank statistic
+    is not drawn towards the middle of the series by a few high samples.
+    """
+    total = sum(values)
+    best, best_split = -1.0, None
+    prefix = sum(values[:min_samples - 1])
+    for split in range(min_samples, len(values) - min_samples + 1):
+        prefix += values[split - 1]
+        shift = prefix / split - (total - prefix) / (len(values) - split)
+        score = split * (len(values) - split) * shift * shift
+        if score > best:
+            best, best_split = score, split
+    return best_split
+
+
+def _median(values: Sequence[float]) -> float:
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class BuildHistory(object):
+    """Past builds stored in an SQLite database.
+
+    Properties:
+        path: The database file.
+        window: Amount of recent builds of a series checked for regressions.
+        min_samples: Least amount of builds on either side of a time change.
+        significance: p-value below which a time change is significant.
+        time_threshold: Least relative increase of a time regression.
+        size_threshold: Least increase in bytes of a size regression.
+    """
+
+    def __init__(self, path: Path, *, window: int=50, min_samples: int=5,
+                 significance: float=0.01, time_threshold: float=0.05,
+                 size_threshold: int=16 << 10) -> None:
+        self.path = Path(path)
+        self.window = window
+        self.min_samples = min_samples
+        self.significance = significance
+        self.time_threshold = time_threshold
+        self.size_threshold = size_threshold
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), timeout=30)
+        self.connection.executescript(_schema)
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def __enter__(self) -> 'BuildHistory':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def record(self, report: BuildReport, *, revision: Optional[str]=None,
+               defconfig: Optional[str]=None,
+               sections: Optional[Dict[str, int]]=None) -> int:
+        """Store a finished build.
+
+        Returns:
+            The id of the build.
+        """
+        image_size = next((artifact['size'] for artifact in report.artifacts
+                           if artifact['kind'] == 'kbuild_image'), None)
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO builds (started, command, kernel, revision, compiler, defconfig, '
+                'success, duration, image_size, warnings, report) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (report.started, report.command, report.kernel, revision, report.compiler,
+                 defconfig, int(report.success), report.duration, image_size,
+                 report.warnings, json.dumps(report.to_dict())))
+            build_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO phases VALUES (?, ?, ?)',
+                [(build_id, name, seconds) for name, seconds in report.phases])
+            self.connection.executemany(
+                'INSERT INTO sections VALUES (?, ?, ?)',
+                [(build_id, name, size) for name, size in sorted((sections or {}).items())])
+        return build_id
+
+    def builds(self, kernel: str, limit: int=20) -> List[BuildRecord]:
+        """Return the latest builds of a kernel, newest first."""
+        rows = self.connection.execute(
+            'SELECT id, started, command, kernel, revision, compiler, defconfig, success, '
+            'duration, image_size, warnings FROM builds WHERE kernel = ? '
+            'ORDER BY id DESC LIMIT ?', (kernel, limit))
+        return [BuildRecord(*row) for row in rows]
+
+    def recent_progress(self, kernel: str, command: str, defconfig: Optional[str],
+                        compiler: Optional[str], limit: int=10) -> List[Dict]:
+        """Return the progress of the latest successful builds of a series and compiler.
+
+        Incremental and full builds are both included, newest first, so the
+        progress of a build can be compared with one of similar size.
+        """
+        rows = self.connection.execute(
+            'SELECT report FROM builds WHERE kernel = ? AND command = ? AND defconfig IS ? '
+            'AND compiler IS ? AND success = 1 ORDER BY id DESC LIMIT ?',
+            (kernel, command, defconfig, compiler, limit))
+        references = []
+        for report, in rows:
+            try:
+                progress = json.loads(report).get('progress')
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if progress:
+                references.append(progress)
+        return references
+
+    def phases(self, build_ids: Sequence[int], name: str) -> Dict[int, float]:
+        """Return the seconds a phase took in builds."""
+        return self._by_build('SELECT build_id, seconds FROM phases WHERE name = ?',
+                              name, build_ids)
+
+    def section_sizes(self, build_ids: Sequence[int], name: str) -> Dict[int, int]:
+        """Return the sizes of a section of vmlinux in builds."""
+        return self._by_build('SELECT build_id, size FROM sections WHERE name = ?',
+                              name, build_ids)
+
+    def _by_build(self, query: str, name: str, build_ids: Sequence[int]) -> Dict:
+        placeholders = ', '.join('?' * len(build_ids))
+        rows = self.connection.execute(
+            '{} AND build_id IN ({})'.format(query, placeholders), [name] + list(build_ids))
+        return dict(rows)
+
+    def regressions(self, kernel: str, command: str,
+                    defconfig: Optional[str]) -> List[Regression]:
+        """Detect regressions in the recent successful builds of a series."""
+        rows = self.connection.execute(
+            'SELECT id, revision, compiler, duration, image_size FROM builds '
+            'WHERE kernel = ? AND command = ? AND defconfig IS ? AND success = 1 '
+            'ORDER BY id DESC LIMIT ?', (kernel, command, defconfig, self.window)).fetchall()
+        rows.reverse()
+        if len(rows) < 2:
+            return []
+        ids = [row[0] for row in rows]
+        builds = [(row[1], row[2]) for row in rows]
+
+        def series(values: Dict[int, float]) -> List[Tuple[Tuple, float]]:
+            return [(build, values[build_id]) for build_id, build in zip(ids, builds)
+                    if values.get(build_id) is not None]
+
+        regressions = []
+        times = [('build time', series({row[0]: row[3] for row in rows})),
+                 ('compile time', series(self.phases(ids, 'compile')))]
+        for metric, values in times:
+            regression = self._time_regression(metric, values)
+            if regression:
+                regressions.append(regression)
+        sizes = [('Image', series({row[0]: row[4] for row in rows}))]
+        sizes.extend(('vmlinux ' + name, series(self.section_sizes(ids, name)))
+                     for name in tracked_sections)
+        for metric, values in sizes:
+            regression = self._size_regression(metric, values)
+            if regression:
+                regressions.append(regression)
+        return regressions
+
+    def _time_regression(self, metric: str,
+                         values: List[Tuple[Tuple, float]]) -> Optional[Regression]:
+        """Find a lasting slowdown in a series of times.
+
+        The change point is located by least squares, and a Mann-Whitney
+        test of the builds on either side decides whether it is significant.
+        """
+        samples = [value for _, value in values]
+        split = _change_point(samples, self.min_samples)
+        if split is None:
+            return None
+        before, after = samples[:split], samples[split:]
+        typical_before, typical_after = _median(before), _median(after)
+        if typical_after < typical_before * (1 + self.time_threshold):
+            return None
+        p_value = mann_whitney(before, after)
+        if p_value >= self.significance:
+            return None
+        return Regression(metric, typical_before, typical_after, values[split][0][0],
+                          self._changed_compiler(values, split), p_value, 's')
+
+    def _size_regression(self, metric: str,
+                         values: List[Tuple[Tuple, int]]) -> Optional[Regression]:
+        """Find a size increase which is still present in the latest build."""
+        if len(values) < 2:
+            return None
+        latest = values[-1][1]
+        split = len(values) - 1
+        while split > 0 and abs(values[split - 1][1] - latest) < self.size_threshold:
+            split -= 1
+        if not split or latest - values[split - 1][1] < self.size_threshold:
+            return None
+        return Regression(metric, values[split - 1][1], latest, values[split][0][0],
+                          self._changed_compiler(values, split), None, 'B')
+
+    @staticmethod
+    def _changed_compiler(values: List[Tuple[Tuple, float]], split: int) -> Optional[str]:
+        """Return the compiler at a split of a series if it differs from the one before."""
+        compiler = values[split][0][1]
+        return compiler if compiler != values[split - 1][0][1] else None
@@ -0,0 +1,228 @@
+"""Concurrent post-build hooks.
+
+Plugins register callbacks at defined hook points, such as after a kbuild
+image is built. The callbacks of all hook points run on a thread pool of
+max_workers threads. Callers wait for required callbacks only; optional
+callbacks keep running in the background until wait() is called, which
+the application does before it closes.
+
+The timeout of a callback applies whether it is required or not, and
+starts once the callback starts running, not while it waits for a free
+worker. A thread cannot be interrupted, so a callback which runs past its
+timeout is reported as timed out and no longer waited for by run() and
+wait(); the interpreter still joins its thread before it exits.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from kbuilder.core.exc import KbuilderArgumentError
+
+Hook = namedtuple('Hook', 'func required timeout')
+
+
+class HookResult(namedtuple('HookResult', 'point name required duration result error')):
+    """The outcome of a single hook callback.
+
+    Properties:
+        point: The hook point the callback was registered at.
+        name: Name of the callback.
+        required: Whether the caller waited for the callback.
+        duration: Seconds the callback ran for, or None if it did not finish.
+        result: Return value of the callback.
+        error: Exception raised by the callback, or TimeoutError.
+    """
+
+    @property
+    def ok(self) -> bool:
+        """Whether the callback finished without an error."""
+        return self.error is None
+
+
+class HookPipeline(object):
+    """Hook points whose callbacks run concurrently on a thread pool.
+
+    Properties:
+        max_workers: Amount of threads of the pool, the maximum amount of
+            callbacks running at once.
+    """
+
+    def __init__(self, points: Iterable[str]=(), *, max_workers: int=4,
+                 on_background_result: Optional[Callable[[HookResult], None]]=None) -> None:
+        """Initialize a new HookPipeline.
+
+        Args:
+            points: Names of the hook points to define.
+            max_workers: Maximum amount of callbacks running at once.
+            on_background_result: Called with the result of every optional
+                callback once it finishes.
+        """
+        self.max_workers = max_workers
+        self.on_background_result = on_background_result
+        self._hooks = {point: [] for point in points}
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='hook')
+        self._background = []
+        self._lock = threading.Lock()
+
+    @property
+    def points(self) -> List[str]:
+        """The names of the defined hook points."""
+        return sorted(self._hooks)
+
+    def define(self, point: str) -> None:
+        """Define a new hook point."""
+        self._hooks.setdefault(point, [])
+
+    def register(self, point: str, func: Callable, *, required: bool=True,
+                 timeout: Optional[float]=None) -> None:
+        """Register a callback at a hook point.
+
+        Args:
+            point: Name of the hook point.
+            func: Callback invoked with the arguments the hook point is run with.
+            required: Whether callers wait for the callback to finish.
+            timeout: Seconds the callback may run for before it is reported
+                as timed out, by run() for required callbacks and by wait()
+                for optional ones.
+
+        Raises:
+            KbuilderArgumentError: If the hook point is not defined.
+        """
+        if point not in self._hooks:
+            raise KbuilderArgumentError('Undefined hook point: {}'.format(point))
+        self._hooks[point].append(Hook(func, required, timeout))
+
+    def run(self, point: str, *args, **kwargs) -> List[HookResult]:
+        """Run all callbacks of a hook point concurrently.
+
+        Waits until every required callback finished or timed out. A timed
+        out callback cannot be interrupted, so it is left running.
+
+        Returns:
+            The results of the required callbacks.
+        """
+        hooks = self._hooks.get(point, [])
+        if not hooks:
+            return []
+
+        required = []
+        for hook in hooks:
+            call = self._submit(point, hook, args, kwargs)
+            if hook.required:
+                required.append(call)
+            else:
+                with self._lock:
+                    self._background.append(call)
+                call.future.add_done_callback(lambda future, call=call: self._report(call))
+
+        results = []
+        for call in required:
+            call.wait()
+            results.append(call.result())
+        return results
+
+    def wait(self, timeout: Optional[float]=None) -> None:
+        """Wait for optional callbacks still running in the background.
+
+        Callbacks which run past their own timeout are reported as timed
+        out and no longer waited for.
+
+        Args:
+            timeout: Seconds to wait for callbacks without a timeout of
+                their own, or None to wait until they finish.
+        """
+        limit = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            background = list(self._background)
+        for call in background:
+            if not call.wait(limit) and call.timed_out():
+                self._report(call)
+        with self._lock:
+            self._background = [call for call in self._background
+                                if not call.future.done() and not call.reported]
+
+    def _submit(self, point: str, hook: Hook, args: tuple, kwargs: Dict) -> '_Call':
+        """Queue a callback on the thread pool."""
+        call = _Call(point, hook)
+        call.future = self._executor.submit(call.run, args, kwargs)
+        return call
+
+    def _report(self, call: '_Call') -> None:
+        """Report the result of an optional callback once."""
+        with self._lock:
+            if call.reported:
+                return
+            call.reported = True
+        if self.on_background_result:
+            self.on_background_result(call.result())
+
+
+class _Call(object):
+    """A callback submitted to the thread pool."""
+
+    def __init__(self, point: str, hook: Hook) -> None:
+        self.point = point
+        self.hook = hook
+        self.future = None
+        self.started = None
+        self.running = threading.Event()
+        self.reported = False
+
+    def run(self, args: tuple, kwargs: Dict) -> tuple:
+        """Call the callback, returning its duration and return value."""
+        self.started = time.monotonic()
+        self.running.set()
+        result = self.hook.func(*args, **kwargs)
+        return time.monotonic() - self.started, result
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """Time the callback times out at, once it started running."""
+        if self.started is None or self.hook.timeout is None:
+            return None
+        return self.started + self.hook.timeout
+
+    def timed_out(self) -> bool:
+        """Whether the callback is still running past its timeout."""
+        deadline = self.deadline
+        return (not self.future.done() and deadline is not None and
+                time.monotonic() >= deadline)
+
+    def wait(self, limit: Optional[float]=None) -> bool:
+        """Wait until the callback finished, timed out or the limit passed.
+
+        Returns:
+            Whether the callback finished.
+        """
+        while not self.future.done():
+            now = time.monotonic()
+            deadlines = [deadline for deadline in (self.deadline, limit) if deadline is not None]
+            if deadlines and min(deadlines) <= now:
+                return False
+            remaining = min(deadlines) - now if deadlines else None
+            if self.started is None and self.hook.timeout is not None:
+                # The timeout starts once a worker runs the callback.
+                self.running.wait(remaining)
+            else:
+                wait([self.future], timeout=remaining)
+        return True
+
+    def result(self) -> HookResult:
+        """Convert the outcome of the callback into a HookResult."""
+        return _result(self.point, self.hook, None if self.timed_out() else self.future)
+
+
+def _result(point: str, hook: Hook, future) -> HookResult:
+    """Convert the future of a callback into a HookResult."""
+    name = getattr(hook.func, '__name__', repr(hook.func))
+    if future is None:
+        return HookResult(point, name, hook.required, None, None,
+                          TimeoutError('{} timed out after {}s'.format(name, hook.timeout)))
+    error = future.exception()
+    if error:
+        return HookResult(point, name, hook.required, None, None, error)
+    duration, result = future.result()
+    return HookResult(point, name, hook.required, duration, result, None)
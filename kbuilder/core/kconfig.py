@@ -0,0 +1,797 @@
+"""Indexed Kconfig symbols and kernel configurations.
+
+Questions about config symbols otherwise take grepping .config or running
+menuconfig. A KconfigIndex parses the Kconfig files of a tree once into
+symbols with their type, prompt, defaults, dependencies, selects and
+defining files. The index is persisted with the stat data of every parsed
+file, so later queries only stat the Kconfig files and read the symbols
+they need.
+
+Example:
+    .. code-block:: python
+        from kbuilder.core.kconfig import KconfigIndex, read_config
+
+        index = KconfigIndex.load(Path('.kbuilder/kconfig-index'), root, 'arm64')
+        values = read_config(root / '.config')
+        print('\\n'.join(index.explain('USB_STORAGE', values)))
+"""
+
+import glob
+import os
+import pickle
+import re
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+TRISTATE = {'n': 0, 'm': 1, 'y': 2}
+_TRISTATE_NAMES = 'nmy'
+
+_TYPES = {'bool': 'bool', 'boolean': 'bool', 'tristate': 'tristate',
+          'string': 'string', 'hex': 'hex', 'int': 'int'}
+
+_quoted = re.compile(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'')
+_condition = re.compile(r'\s+if\s+')
+_variable = re.compile(r'\$\(?(\w+)\)?')
+_config_line = re.compile(r'^CONFIG_(\w+)=(.*)$')
+_unset_line = re.compile(r'^# CONFIG_(\w+) is not set$')
+_word = re.compile(r'[^\s!()=<>&|"\']+')
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+Definition = namedtuple('Definition', 'file line prompt depends defaults choice')
+
+
+class Symbol(object):
+    """A config symbol.
+
+    Properties:
+        name: Name of the symbol, without the CONFIG_ prefix.
+        type: bool, tristate, string, hex, int, or None if never defined.
+        definitions: Definition tuples of every `config` entry of the symbol.
+            Each holds the file and line, the prompt, the dependencies
+            including those of enclosing menus and if blocks, the
+            (value, condition) defaults and the prompt of an enclosing choice.
+        selects: (symbol, condition) tuples of the symbols this symbol selects.
+        implies: (symbol, condition) tuples of the symbols this symbol implies.
+        selected_by: (symbol, condition) tuples of the symbols selecting this symbol.
+        implied_by: (symbol, condition) tuples of the symbols implying this symbol.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.type = None
+        self.definitions = []
+        self.selects = []
+        self.implies = []
+        self.selected_by = []
+        self.implied_by = []
+
+    @property
+    def depends(self) -> str:
+        """The dependencies of the symbol, or '' if it has none."""
+        expressions = [definition.depends for definition in self.definitions]
+        if not expressions or '' in expressions:
+            return ''
+        return _disjunction(expressions)
+
+    @property
+    def prompt(self) -> Optional[str]:
+        """The first prompt of the symbol, or None if it is not user visible."""
+        return next((definition.prompt for definition in self.definitions
+                     if definition.prompt), None)
+
+    @property
+    def locations(self) -> List[str]:
+        """The file:line of every definition of the symbol."""
+        return ['{}:{}'.format(definition.file, definition.line)
+                for definition in self.definitions]
+
+
+def _parenthesize(expression: str) -> str:
+    """Parenthesize an expression unless it is a single operand."""
+    if re.fullmatch(r'!?[\w.$-]+(?:\s*!?=\s*[\w.$"\'-]+)?', expression):
+        return expression
+    return '({})'.format(expression)
+
+
+def _conjunction(expressions: Sequence[str]) -> str:
+    """Join expressions with &&."""
+    expressions = [expression for expression in expressions if expression]
+    if len(expressions) == 1:
+        return expressions[0]
+    return ' && '.join(_parenthesize(expression) for expression in expressions)
+
+
+def _disjunction(expressions: Sequence[str]) -> str:
+    """Join expressions with ||."""
+    if len(expressions) == 1:
+        return expressions[0]
+    return ' || '.join(_parenthesize(expression) for expression in expressions)
+
+
+def _unquote(text: str) -> str:
+    """Return the contents of a quoted string, or the text unchanged."""
+    match = _quoted.fullmatch(text.strip())
+    if not match:
+        return text.strip()
+    return re.sub(r'\\(.)', r'\1', next(group for group in match.groups() if group is not None))
+
+
+def _split_condition(text: str) -> Tuple[str, str]:
+    """Split `VALUE [if CONDITION]` into the value and the condition."""
+    text = text.strip()
+    match = _quoted.match(text)
+    if match:
+        value, rest = text[:match.end()], text[match.end():]
+        rest = rest.strip()
+        return value, rest[2:].strip() if rest.startswith('if') else ''
+    parts = _condition.split(text, 1)
+    return parts[0].strip(), parts[1].strip() if len(parts) > 1 else ''
+
+
+class _Entry(object):
+    """A config, menu or choice entry whose attributes are being parsed."""
+
+    def __init__(self, symbol: Optional[Symbol], file: str, line: int,
+                 depends: List[str], choice: Optional[str]=None) -> None:
+        self.symbol = symbol
+        self.file = file
+        self.line = line
+        self.prompt = None
+        self.depends = list(depends)
+        self.defaults = []
+        self.choice = choice
+
+    def definition(self) -> Definition:
+        return Definition(self.file, self.line, self.prompt, _conjunction(self.depends),
+                          self.defaults, self.choice)
+
+
+class _Parser(object):
+    """Parses Kconfig files into the symbols of a KconfigIndex."""
+
+    def __init__(self, index: 'KconfigIndex') -> None:
+        self.index = index
+        self.variables = {'SRCARCH': index.srcarch, 'ARCH': index.srcarch,
+                          'HEADER_ARCH': index.srcarch, 'KCONFIG_EXT_PREFIX': ''}
+        self.blocks = []
+        self.entry = None
+
+    def expand(self, text: str) -> str:
+        """Substitute the environment variables of a source statement."""
+        return _variable.sub(lambda match: self.variables.get(
+            match.group(1), os.environ.get(match.group(1), '')), text)
+
+    def finish_entry(self) -> None:
+        """Store the definition of the current entry."""
+        if self.entry and self.entry.symbol:
+            if not self.entry.symbol.definitions:
+                self.index.order.append(self.entry.symbol.name)
+            self.entry.symbol.definitions.append(self.entry.definition())
+        self.entry = None
+
+    def inherited_depends(self) -> List[str]:
+        """The dependencies of enclosing menus, choices and if blocks."""
+        return [expression for block in self.blocks for expression in block.depends]
+
+    def enclosing_choice(self) -> Optional[str]:
+        """The prompt of the innermost enclosing choice, if any."""
+        for block in reversed(self.blocks):
+            if block.choice is not None:
+                return block.choice
+        return None
+
+    def parse_file(self, relative: str) -> None:
+        """Parse a Kconfig file, following its source statements."""
+        path = self.index.root / relative
+        try:
+            stat = path.stat()
+            with open(str(path), encoding='utf-8', errors='replace') as file:
+                text = file.read()
+        except OSError:
+            return
+        self.index.stamps[relative] = (stat.st_mtime_ns, stat.st_size)
+
+        help_indent = None
+        in_help = False
+        lines = iter(enumerate(text.splitlines(), 1))
+        for number, line in lines:
+            while line.endswith('\\'):
+                line = line[:-1].rstrip() + ' ' + next(lines, (0, ''))[1].lstrip()
+            expanded = line.expandtabs(8)
+            stripped = expanded.strip()
+            if in_help:
+                if not stripped:
+                    continue
+                indent = len(expanded) - len(expanded.lstrip())
+                if help_indent is None:
+                    help_indent = indent if indent > keyword_indent else -1
+                if help_indent >= 0 and indent >= help_indent:
+                    continue
+                in_help = False
+            if not stripped or stripped.startswith('#'):
+                continue
+            keyword, _, argument = stripped.partition(' ')
+            argument = argument.strip()
+            if keyword in ('help', '---help---'):
+                in_help = True
+                help_indent = None
+                keyword_indent = len(expanded) - len(expanded.lstrip())
+            else:
+                self.parse_line(relative, number, keyword, argument)
+        self.finish_entry()
+
+    def parse_line(self, relative: str, number: int, keyword: str, argument: str) -> None:
+        """Parse a statement of a Kconfig file."""
+        entry = self.entry
+        if keyword in ('config', 'menuconfig'):
+            self.finish_entry()
+            symbol = self.index.symbol(argument)
+            self.entry = _Entry(symbol, relative, number, self.inherited_depends(),
+                                self.enclosing_choice())
+        elif keyword in ('menu', 'choice'):
+            self.finish_entry()
+            block = _Entry(None, relative, number, [])
+            if keyword == 'menu':
+                block.prompt = _unquote(argument)
+            else:
+                block.choice = ''
+            self.blocks.append(block)
+            self.entry = block
+        elif keyword == 'if':
+            self.finish_entry()
+            self.blocks.append(_Entry(None, relative, number, [argument]))
+        elif keyword in ('endmenu', 'endchoice', 'endif'):
+            self.finish_entry()
+            if self.blocks:
+                self.blocks.pop()
+        elif keyword in ('source', 'rsource', 'osource', 'orsource'):
+            self.finish_entry()
+            self.source(relative, keyword, _unquote(argument))
+        elif keyword in ('comment', 'mainmenu'):
+            self.finish_entry()
+            self.entry = _Entry(None, relative, number, [])
+        elif not entry:
+            return
+        elif keyword in _TYPES or keyword in ('def_bool', 'def_tristate'):
+            type_ = _TYPES.get(keyword) or keyword[4:]
+            if entry.symbol and not entry.symbol.type:
+                entry.symbol.type = type_
+            if keyword.startswith('def_'):
+                entry.defaults.append(_split_condition(argument))
+            elif argument:
+                self.prompt(entry, argument)
+        elif keyword == 'prompt':
+            self.prompt(entry, argument)
+        elif keyword == 'default':
+            entry.defaults.append(_split_condition(argument))
+        elif keyword == 'depends':
+            if argument.startswith('on'):
+                entry.depends.append(argument[2:].strip())
+        elif keyword in ('select', 'imply') and entry.symbol:
+            target, condition = _split_condition(argument)
+            target = self.index.symbol(target)
+            if keyword == 'select':
+                entry.symbol.selects.append((target.name, condition))
+                target.selected_by.append((entry.symbol.name, condition))
+            else:
+                entry.symbol.implies.append((target.name, condition))
+                target.implied_by.append((entry.symbol.name, condition))
+
+    @staticmethod
+    def prompt(entry: _Entry, argument: str) -> None:
+        """Set the prompt of an entry."""
+        prompt, condition = _split_condition(argument)
+        entry.prompt = _unquote(prompt)
+        if entry.choice is not None and entry.symbol is None:
+            entry.choice = entry.prompt
+        if condition and entry.symbol:
+            # A prompt condition only limits visibility; keep it for explanations.
+            entry.prompt = '{} (if {})'.format(entry.prompt, condition)
+
+    def source(self, relative: str, keyword: str, argument: str) -> None:
+        """Parse the files named by a source statement."""
+        pattern = self.expand(argument)
+        if keyword.endswith('rsource'):
+            pattern = os.path.join(os.path.dirname(relative), pattern)
+        pattern = os.path.normpath(pattern)
+        if any(char in pattern for char in '*?['):
+            directory = os.path.dirname(pattern.split('*')[0].split('?')[0])
+            try:
+                stat = (self.index.root / directory).stat()
+                self.index.stamps[directory + '/'] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+            paths = sorted(os.path.relpath(path, str(self.index.root)) for path in
+                           glob.glob(str(self.index.root / pattern)))
+        else:
+            paths = [pattern]
+        for path in paths:
+            if path not in self.index.stamps:
+                self.parse_file(path)
+
+
+class _StoredSymbols(object):
+    """The symbols of a saved index, unpickled one at a time on first use."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+        self.cache = {}
+
+    def get(self, name: str, default: Optional[Symbol]=None) -> Optional[Symbol]:
+        if name not in self.cache:
+            row = self.connection.execute('SELECT data FROM symbols WHERE name = ?',
+                                          (name,)).fetchone()
+            self.cache[name] = pickle.loads(row[0]) if row else None
+        symbol = self.cache[name]
+        return default if symbol is None else symbol
+
+    def names(self) -> List[str]:
+        """Return the names of the defined symbols in the order of their definition."""
+        return [name for name, in self.connection.execute(
+            'SELECT name FROM symbols WHERE position IS NOT NULL ORDER BY position')]
+
+
+class KconfigIndex(object):
+    """The config symbols of a kernel tree.
+
+    A saved index is an SQLite database holding every symbol in a row of
+    its own, so loading it only reads the stat data of the Kconfig files,
+    and queries only unpickle the symbols they look at.
+
+    Properties:
+        root: Root directory of the tree.
+        srcarch: Architecture directory name the index was parsed for.
+        symbols: A mapping of symbol names to Symbol objects.
+        order: Names of the defined symbols in the order of their definition.
+        stamps: A dict mapping the relative paths of parsed Kconfig files
+            to their (mtime in nanoseconds, size).
+    """
+
+    version = 1
+
+    def __init__(self, root: Path, srcarch: str, symbols=None,
+                 stamps: Optional[Dict[str, Tuple[int, int]]]=None) -> None:
+        self.root = Path(root)
+        self.srcarch = srcarch
+        self.symbols = {} if symbols is None else symbols
+        self.stamps = stamps or {}
+        self._order = [] if symbols is None else None
+
+    @property
+    def order(self) -> List[str]:
+        if self._order is None:
+            self._order = self.symbols.names()
+        return self._order
+
+    @classmethod
+    def parse(cls, root: Path, srcarch: str) -> 'KconfigIndex':
+        """Parse the Kconfig files of a tree for an architecture."""
+        index = cls(root, srcarch)
+        parser = _Parser(index)
+        # Since Linux 4.18 the top level Kconfig sources the architecture.
+        if (index.root / 'Kconfig').is_file():
+            parser.parse_file('Kconfig')
+        else:
+            parser.parse_file('arch/{}/Kconfig'.format(srcarch))
+        return index
+
+    @classmethod
+    def load(cls, path: Path, root: Path, srcarch: str) -> 'KconfigIndex':
+        """Load an index, parsing the tree again if it is missing or stale.
+
+        A parsed index is saved to the path.
+        """
+        index = cls._open(path, root, srcarch)
+        if index is None or index.is_stale():
+            index = cls.parse(root, srcarch)
+            index.save(path)
+        return index
+
+    @classmethod
+    def _open(cls, path: Path, root: Path, srcarch: str) -> Optional['KconfigIndex']:
+        """Open a saved index, or return None if it is missing or for another tree."""
+        if not Path(path).is_file():
+            return None
+        try:
+            connection = sqlite3.connect(str(path))
+            meta = dict(connection.execute('SELECT key, value FROM meta'))
+            stamps = {relative: (mtime, size) for relative, mtime, size in
+                      connection.execute('SELECT path, mtime, size FROM stamps')}
+        except sqlite3.DatabaseError:
+            return None
+        if meta != {'version': str(KconfigIndex.version), 'srcarch': srcarch,
+                    'root': str(root)}:
+            connection.close()
+            return None
+        return cls(root, srcarch, _StoredSymbols(connection), stamps)
+
+    def save(self, path: Path) -> None:
+        """Atomically write the index to a database file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + '.tmp')
+        if temp.exists():
+            temp.unlink()
+        positions = {name: position for position, name in enumerate(self.order)}
+        connection = sqlite3.connect(str(temp))
+        with connection:
+            connection.executescript("""
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE stamps (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER);
+                CREATE TABLE symbols (name TEXT PRIMARY KEY, position INTEGER, data BLOB);
+            """)
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('version', str(KconfigIndex.version)), ('srcarch', self.srcarch),
+                ('root', str(self.root))])
+            connection.executemany('INSERT INTO stamps VALUES (?, ?, ?)', [
+                (relative, mtime, size) for relative, (mtime, size) in self.stamps.items()])
+            connection.executemany('INSERT INTO symbols VALUES (?, ?, ?)', [
+                (name, positions.get(name),
+                 pickle.dumps(symbol, protocol=pickle.HIGHEST_PROTOCOL))
+                for name, symbol in self.symbols.items()])
+        connection.close()
+        os.replace(str(temp), str(path))
+
+    def is_stale(self) -> bool:
+        """Return whether a parsed Kconfig file or sourced directory changed."""
+        root = str(self.root)
+        for relative, stamp in self.stamps.items():
+            try:
+                stat = os.stat(os.path.join(root, relative))
+            except OSError:
+                return True
+            if (stat.st_mtime_ns, stat.st_size) != stamp:
+                return True
+        return not self.stamps
+
+    def symbol(self, name: str) -> Symbol:
+        """Return a symbol, adding it to the index if it is new."""
+        name = strip_prefix(name)
+        symbol = self.symbols.get(name)
+        if symbol is None:
+            symbol = self.symbols[name] = Symbol(name)
+        return symbol
+
+    def get(self, name: str) -> Optional[Symbol]:
+        """Return a defined symbol, or None."""
+        symbol = self.symbols.get(strip_prefix(name))
+        return symbol if symbol and symbol.definitions else None
+
+    def explain(self, name: str, values: Dict[str, str],
+                defconfig: Optional[Dict[str, str]]=None, depth: int=8) -> List[str]:
+        """Explain the value of a symbol in a configuration.
+
+        The dependencies of the symbol are listed with their values, and
+        the chain of selects, implies, defconfig settings and defaults
+        which enabled it is followed recursively.
+
+        Args:
+            name: Name of the symbol.
+            values: Symbol values of the configuration, from read_config.
+            defconfig: Symbol values of the defconfig the configuration was
+                made from, if known.
+            depth: Number of select levels to follow.
+
+        Returns:
+            The lines of the explanation.
+        """
+        lines = []
+        self._explain(strip_prefix(name), values, defconfig or {}, depth, 0, set(), lines)
+        return lines
+
+    def _explain(self, name: str, values: Dict[str, str], defconfig: Dict[str, str],
+                 depth: int, level: int, seen: set, lines: List[str]) -> None:
+        indent = '  ' * level
+        symbol = self.symbols.get(name) or Symbol(name)
+        value = values.get(name, 'n')
+        details = ', '.join(filter(None, [symbol.type or 'undefined'] + symbol.locations[:1]))
+        lines.append('{}CONFIG_{}={}  ({})'.format(indent, name, value, details))
+        if name in seen:
+            lines[-1] += ' [see above]'
+            return
+        seen.add(name)
+        indent += '  '
+
+        depends = symbol.depends
+        if depends:
+            lines.append('{}depends on {} [{}]'.format(
+                indent, depends, _TRISTATE_NAMES[evaluate(depends, values)]))
+            for dependency in expression_symbols(depends):
+                lines.append('{}  CONFIG_{}={}'.format(
+                    indent, dependency, values.get(dependency, 'n')))
+
+        enabled = TRISTATE.get(value, 2 if value not in ('', 'n') else 0)
+        reasons = 0
+        for label, sources in (('selected by', symbol.selected_by),
+                               ('implied by', symbol.implied_by)):
+            for source, condition in sources:
+                if not evaluate(source, values) or (condition and not evaluate(condition, values)):
+                    continue
+                reasons += 1
+                lines.append('{}{} CONFIG_{}{}'.format(
+                    indent, label, source, ' if ' + condition if condition else ''))
+                if level < depth:
+                    self._explain(source, values, defconfig, depth, level + 2, seen, lines)
+        if name in defconfig:
+            reasons += 1
+            lines.append('{}set to {} in the defconfig'.format(indent, defconfig[name]))
+        for definition in symbol.definitions:
+            if definition.choice is not None and enabled:
+                reasons += 1
+                lines.append('{}chosen in choice "{}"'.format(indent, definition.choice))
+        if enabled and not reasons:
+            default = self.active_default(symbol, values)
+            if default:
+                lines.append('{}default {}{}'.format(
+                    indent, default[0], ' if ' + default[1] if default[1] else ''))
+        if not enabled and depends and not evaluate(depends, values):
+            lines.append('{}dependencies unmet'.format(indent))
+
+    @staticmethod
+    def active_default(symbol: Symbol, values: Dict[str, str]) -> Optional[Tuple[str, str]]:
+        """Return the first (value, condition) default of a symbol which applies."""
+        for definition in symbol.definitions:
+            for default, condition in definition.defaults:
+                if not condition or evaluate(condition, values):
+                    return default, condition
+        return None
+
+    def unmet_dependencies(self, name: str, values: Dict[str, str]) -> List[str]:
+        """Return the dependencies of a symbol which are not set in a configuration."""
+        symbol = self.symbols.get(strip_prefix(name))
+        if not symbol or not symbol.depends or evaluate(symbol.depends, values):
+            return []
+        return [dependency for dependency in expression_symbols(symbol.depends)
+                if not TRISTATE.get(values.get(dependency, 'n'), 2)]
+
+
+def strip_prefix(name: str) -> str:
+    """Strip the CONFIG_ prefix from a symbol name."""
+    return name[7:] if name.startswith('CONFIG_') else name
+
+
+def _tokenize(expression: str) -> Iterator[str]:
+    """Split a Kconfig expression into tokens.
+
+    Macros such as $(cc-option,...) are returned as single tokens.
+    """
+    position = 0
+    length = len(expression)
+    while position < length:
+        char = expression[position]
+        if char.isspace():
+            position += 1
+        elif expression.startswith(('&&', '||', '!=', '<=', '>='), position):
+            yield expression[position:position + 2]
+            position += 2
+        elif char in '!()=<>':
+            yield char
+            position += 1
+        elif char in '"\'':
+            match = _quoted.match(expression, position)
+            end = match.end() if match else length
+            yield expression[position:end]
+            position = end
+        elif expression.startswith('$(', position):
+            level, end = 0, position
+            while end < length:
+                level += {'(': 1, ')': -1}.get(expression[end], 0)
+                end += 1
+                if not level:
+                    break
+            yield expression[position:end]
+            position = end
+        else:
+            match = _word.match(expression, position)
+            end = match.end() if match else position + 1
+            yield expression[position:end]
+            position = end
+
+
+def _is_symbol(token: str) -> bool:
+    """Return whether a token names a symbol."""
+    return bool(_identifier.fullmatch(token)) and token not in TRISTATE
+
+
+def expression_symbols(expression: str) -> List[str]:
+    """Return the symbols an expression refers to, in order."""
+    symbols = []
+    for token in _tokenize(expression):
+        if _is_symbol(token) and token not in symbols:
+            symbols.append(token)
+    return symbols
+
+
+def evaluate(expression: str, values: Dict[str, str]) -> int:
+    """Evaluate a Kconfig expression to a tristate 0 (n), 1 (m) or 2 (y).
+
+    Args:
+        expression: The expression, e.g. `USB && (PCI || OF) && !X86_32`.
+        values: Symbol values of a configuration, from read_config.
+            Symbols without a value are n. Macros such as $(cc-option,...)
+            evaluate to y, since the symbols depending on toolchain
+            checks record their results in the configuration.
+    """
+    tokens = list(_tokenize(expression))
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> Optional[str]:
+        nonlocal position
+        token = peek()
+        position += 1
+        return token
+
+    def value_of(token: str) -> str:
+        if token.startswith(('"', "'")):
+            return _unquote(token)
+        if _is_symbol(token):
+            return _unquote(values.get(token, 'n'))
+        return token
+
+    def tristate_of(token: str) -> int:
+        if token.startswith('$('):
+            return 2
+        if token.startswith(('"', "'")):
+            return 0
+        return TRISTATE.get(value_of(token), 0)
+
+    def compare(left: str, operator: str, right: str) -> int:
+        left, right = value_of(left), value_of(right)
+        if operator in ('=', '!='):
+            return 2 if (left == right) == (operator == '=') else 0
+        try:
+            left, right = int(left, 0), int(right, 0)
+        except ValueError:
+            pass
+        try:
+            result = {'<': left < right, '>': left > right,
+                      '<=': left <= right, '>=': left >= right}[operator]
+        except TypeError:
+            return 0
+        return 2 if result else 0
+
+    def primary() -> int:
+        token = take()
+        if token == '(':
+            result = disjunction()
+            take()
+            return result
+        if token == '!':
+            return 2 - primary()
+        if token is None:
+            return 0
+        if peek() in ('=', '!=', '<', '>', '<=', '>='):
+            operator = take()
+            return compare(token, operator, take() or '')
+        return tristate_of(token)
+
+    def conjunction() -> int:
+        result = primary()
+        while peek() == '&&':
+            take()
+            result = min(result, primary())
+        return result
+
+    def disjunction() -> int:
+        result = conjunction()
+        while peek() == '||':
+            take()
+            result = max(result, conjunction())
+        return result
+
+    return disjunction() if tokens else 2
+
+
+def read_config(path: Path) -> Dict[str, str]:
+    """Read the symbol values of a .config or defconfig file.
+
+    Returns:
+        A dict mapping symbol names without the CONFIG_ prefix to values as
+        written in the file. Symbols which are not set have the value n.
+    """
+    values = {}
+    with open(str(path), encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.strip()
+            match = _config_line.match(line) or _unset_line.match(line)
+            if match:
+                values[match.group(1)] = match.group(2) if match.re is _config_line else 'n'
+    return values
+
+
+ConfigChanges = namedtuple('ConfigChanges', 'added changed removed')
+
+
+def diff_configs(old: Dict[str, str], new: Dict[str, str]) -> ConfigChanges:
+    """Compare the symbol values of two configurations.
+
+    Symbols which are not set are treated like missing symbols.
+
+    Returns:
+        ConfigChanges of the (name, value) tuples only set in the new
+        configuration, the (name, old value, new value) tuples of changed
+        symbols and the (name, value) tuples only set in the old one.
+    """
+    old = {name: value for name, value in old.items() if value != 'n'}
+    new = {name: value for name, value in new.items() if value != 'n'}
+    return ConfigChanges(
+        sorted((name, new[name]) for name in new.keys() - old.keys()),
+        sorted((name, old[name], new[name]) for name in new.keys() & old.keys()
+               if old[name] != new[name]),
+        sorted((name, old[name]) for name in old.keys() - new.keys()))
+
+
+def format_value(symbol: Optional[Symbol], value: str) -> str:
+    """Normalize a value given on the command line for a config file.
+
+    Raises:
+        ValueError: If the value does not suit the type of the symbol.
+    """
+    type_ = symbol.type if symbol else None
+    if type_ in ('bool', 'tristate'):
+        if value not in TRISTATE or (type_ == 'bool' and value == 'm'):
+            raise ValueError('CONFIG_{} is a {}, not {}'.format(symbol.name, type_, value))
+    elif type_ == 'int':
+        int(value, 10)
+    elif type_ == 'hex':
+        int(value, 16)
+        if not value.lower().startswith('0x'):
+            value = '0x' + value
+    elif type_ == 'string' and not _quoted.fullmatch(value):
+        value = '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+    return value
+
+
+def set_config_values(path: Path, assignments: Dict[str, str],
+                      order: Sequence[str]=()) -> None:
+    """Set symbols in a .config or defconfig file in place.
+
+    Existing lines of the symbols are replaced. New symbols are inserted
+    before the first line of a symbol defined after them in Kconfig, which
+    is where savedefconfig places them, or appended.
+
+    Args:
+        path: The configuration file.
+        assignments: A dict mapping symbol names to values; a value of n
+            writes `# CONFIG_X is not set`.
+        order: Names of the symbols in the order of their definition.
+    """
+    path = Path(path)
+    try:
+        lines = path.read_text().splitlines()
+    except FileNotFoundError:
+        lines = []
+    positions = {name: position for position, name in enumerate(order)}
+
+    def line_of(name: str, value: str) -> str:
+        if value == 'n':
+            return '# CONFIG_{} is not set'.format(name)
+        return 'CONFIG_{}={}'.format(name, value)
+
+    def name_of(line: str) -> Optional[str]:
+        match = _config_line.match(line) or _unset_line.match(line)
+        return match.group(1) if match else None
+
+    remaining = dict(assignments)
+    for number, line in enumerate(lines):
+        name = name_of(line)
+        if name in remaining:
+            lines[number] = line_of(name, remaining.pop(name))
+    for name, value in remaining.items():
+        position = positions.get(name)
+        insert_at = len(lines)
+        if position is not None:
+            for number, line in enumerate(lines):
+                if positions.get(name_of(line), -1) > position:
+                    insert_at = number
+                    break
+        lines.insert(insert_at, line_of(name, value))
+
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_text(''.join(line + '\n' for line in lines))
+    os.replace(str(temp), str(path))
@@ -2,18 +2,21 @@
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional
 
 from cached_property import cached_property
 
 from kbuilder.core.arch import Arch
-from kbuilder.core.make import Makefile
+from kbuilder.core.failure import FailureDetector, MakeTargetError
+from kbuilder.core.make import BuildEnvironment, Makefile, MakeResult
 
 
 class LinuxKernel(object):
     """A high level interface for the Linux Kernel.
 
     Provides access to attributes and common operations of the Linux Kernel.
+    make is invoked in the BuildEnvironment of the kernel, so several kernels
+    can be built concurrently from one process.
     """
     kbuild_image_name = {Arch.arm: 'zImage',
                          Arch.arm64: 'Image.gz-dtb',
@@ -28,19 +31,26 @@ class LinuxKernel(object):
                      'tools']
 
     def __init__(self, root: str, *, arch: Arch=None,
-                 defconfig: str='defconfig') -> None:
+                 defconfig: str='defconfig', output_dir: Optional[str]=None,
+                 name: Optional[str]=None) -> None:
         """Initialze a new Kernel.
 
         Args:
             root: kernel root directory.
             arch: kernel architecture.
             defconfig: default configuration file.
+            output_dir: optional directory for build output files (make O=).
+            name: name of the kernel, by default the name of its root.
         """
         self._root = Path(root)
+        self._name = name
         self._extra_version = None
         self._defconfig = defconfig
         self._arch = arch
-        self.makefile = Makefile(root)
+        self._output_dir = None
+        self.environment = BuildEnvironment(self._root)
+        self.makefile = Makefile(root, environment=self.environment)
+        self.output_dir = output_dir
 
     @property
     def root(self):
@@ -49,8 +59,13 @@ class LinuxKernel(object):
 
     @property
     def name(self):
-        """The name of the kernel root directory."""
-        return self.root.name
+        """The name of the kernel, by default the name of the kernel root directory."""
+        return self._name or self.root.name
+
+    def at(self, root: str, *, output_dir: Optional[str]=None) -> 'LinuxKernel':
+        """Return this kernel checked out in another directory, such as a worktree."""
+        return type(self)(root, arch=self.arch, defconfig=self.defconfig,
+                          output_dir=output_dir, name=self.name)
 
     @cached_property
     def linux_version(self):
@@ -90,6 +105,26 @@ class LinuxKernel(object):
             return '{0.release_version}-{0.extra_version}'.format(self)
         return self.release_version
 
+    @property
+    def output_dir(self):
+        """The directory of build output files, or None for in-tree builds."""
+        return self._output_dir
+
+    @output_dir.setter
+    def output_dir(self, directory: Optional[str]):
+        """Set output_dir and pass it to make as O=."""
+        if directory:
+            self._output_dir = Path(directory).absolute()
+            self.makefile.variables['O'] = self._output_dir.as_posix()
+        else:
+            self._output_dir = None
+            self.makefile.variables.pop('O', None)
+
+    @property
+    def object_dir(self):
+        """The directory containing the compiled kernel files."""
+        return self.output_dir or self.root
+
     @property
     def arch(self):
         """The architecture of the kernel."""
@@ -102,22 +137,32 @@ class LinuxKernel(object):
         The defconfig file specifies which modules to build for the kernel."""
         return self._defconfig
 
-    @cached_property
+    @property
+    def modules_enabled(self) -> bool:
+        """Whether the kernel configuration enables loadable modules."""
+        try:
+            config = (self.object_dir / '.config').read_text()
+        except FileNotFoundError:
+            return False
+        return 'CONFIG_MODULES=y' in config.splitlines()
+
+    @property
+    def built_in_tree(self) -> bool:
+        """Whether the source tree holds the configuration of an in-tree build.
+
+        kbuild refuses to build such a tree into another object directory
+        until `make mrproper` removed it.
+        """
+        paths = [self.root / '.config', self.root / 'include' / 'config']
+        if self.arch:
+            paths.append(self.root / 'arch' / self.arch.name / 'include' / 'generated')
+        return any(path.exists() for path in paths)
+
+    @property
     def kbuild_image(self):
         """The absolute path to the compressed kernel image."""
         kbuild_image = LinuxKernel.kbuild_image_name[self.arch]
-        return self.root / 'arch' / self.arch.name / 'boot' / kbuild_image
-
-    def __enter__(self):
-        """Change the current directory the kernel root."""
-        self._prev_dir = Path.cwd()
-        os.chdir(self.root)
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Revert the current directory to the original directory."""
-        os.chdir(self._prev_dir)
-        return False
+        return self.object_dir / 'arch' / self.arch.name / 'boot' / kbuild_image
 
     @staticmethod
     def find_root(kernel_sub_directory: str) -> Path:
@@ -158,8 +203,7 @@ class LinuxKernel(object):
         This form of cleaning is useful for rebuilding the kernel with the same
         Compiler, since only files that were changed will be recompiled.
         """
-        with self:
-            self.makefile.make('archclean')
+        self.makefile.make('archclean')
 
     def clean(self) -> None:
         """Remove all compiled kernel files.
@@ -167,32 +211,103 @@ class LinuxKernel(object):
         This form of cleaning is useful when switching the compiler to build the
         kernel since all files need to be recompiled.
         """
-        with self:
-            self.makefile.make('clean')
+        self.makefile.make('clean')
 
     def make_defconfig(self) -> None:
         """Make the default configuration file."""
-        with self:
-            self.makefile.make(self.defconfig)
+        self.makefile.make(self.defconfig)
 
     def prepare(self) -> None:
         "Prepare the build environment."
-        with self:
-            self.makefile.make('prepare')
+        self.makefile.make('prepare')
 
-    def build_kbuild_image(self, log_dir: Optional[str]=None) -> None:
+    def build_kbuild_image(self, log_dir: Optional[str]=None, *,
+                           on_line: Optional[Callable[[str], None]]=None,
+                           fail_fast: bool=False, silent: bool=True) -> MakeResult:
         """Make the kernel kbuild image.
 
        Args:
             log_dir: Directory of the build log file.
                 The output of the compiler will be redirected
                 to a file in this directory .
+            on_line: Optionally called with every line of build output.
+            fail_fast: Whether to cancel the build at the first failing target.
+            silent: Whether to pass --quiet to make, which keeps kbuild from
+                printing a line per command.
 
         Raises:
             CalledProcessError: If The target fails to build.
+            MakeTargetError: If fail_fast is set and a target fails to build.
+
+        Returns:
+            The MakeResult of the build.
+        """
+        detector = FailureDetector(on_failure=self.cancel_build) if fail_fast else None
+        Path(log_dir).mkdir(exist_ok=True)
+        build_log = Path(log_dir, self.custom_release + '-log.txt')
+        with build_log.open('w') as log:
+            def write_line(line: str) -> None:
+                log.write(line + '\n')
+                if detector:
+                    detector.feed(line)
+                if on_line:
+                    on_line(line)
+            result = self.makefile.run('all', on_line=write_line, check=False,
+                                       silent=silent)
+        if detector and detector.failed:
+            raise MakeTargetError(result.returncode, result.args,
+                                  detector.target, detector.errors)
+        result.check_returncode()
+        return result
+
+    def reproduce_failure(self, target: str, log_dir: str,
+                          errors: Optional[List[str]]=None) -> Path:
+        """Rebuild a single failing target serially with verbose output.
+
+        Args:
+            target: The failing target, relative to the object directory.
+            log_dir: Directory of the error report.
+            errors: The lines of the parallel build leading up to the failure.
+
+        Returns:
+            The path of the error report.
+        """
+        result = self.makefile.run(target, jobs=1, variables={'V': '1'},
+                                   silent=False, capture=True, check=False)
+        report = Path(log_dir, self.custom_release + '-error.txt')
+        with report.open('w') as file:
+            file.write('Failing target: {}\n'.format(target))
+            if errors:
+                file.write('\nFirst error of the parallel build:\n')
+                file.write(''.join(line + '\n' for line in errors))
+            file.write('\nRebuilt with: {}\n\n'.format(' '.join(result.args)))
+            file.write(result.output)
+        return report
+
+    def cancel_build(self) -> None:
+        """Terminate all make invocations of this kernel."""
+        self.makefile.runner.cancel()
+
+    def build_modules(self, install_dir: str, log_dir: Optional[str]=None) -> Path:
+        """Make the loadable modules and install them into a directory.
+
+        Args:
+            install_dir: Directory passed to make as INSTALL_MOD_PATH.
+            log_dir: Directory of the build log file.
+
+        Returns:
+            The directory the modules of this kernel release were installed in.
+
+        Raises:
+            CalledProcessError: If the modules fail to build or install.
         """
-        with self:
+        install_dir = Path(install_dir)
+        install_dir.mkdir(parents=True, exist_ok=True)
+        output = self.makefile.make_output('modules')
+        output += '\n' + self.makefile.make_output(
+            'modules_install', variables={'INSTALL_MOD_PATH': install_dir.as_posix()})
+        if log_dir:
             Path(log_dir).mkdir(exist_ok=True)
-            build_log = Path(log_dir, self.custom_release + '-log.txt')
-            output = self.makefile.make_output('all')
+            build_log = Path(log_dir, self.custom_release + '-modules-log.txt')
             build_log.write_text(output)
+        return install_dir / 'lib' / 'modules' / self.release_version
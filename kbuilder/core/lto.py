@@ -0,0 +1,94 @@
+"""Managed ThinLTO caches.
+
+Clang kernels built with CONFIG_LTO_CLANG_THIN ask lld to cache ThinLTO
+backend results in the .thinlto-cache directory of the object tree. The
+cache is replaced with a link to a directory kept per kernel and config, so
+incremental LTO builds only relink the objects which changed, even after
+switching between configurations or cleaning the tree.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import List
+
+
+class ThinLtoCache(object):
+    """A size bounded store of ThinLTO caches.
+
+    Properties:
+        root: Directory containing a cache per kernel and config.
+        max_size: Maximum size in bytes of all caches combined.
+    """
+
+    link_name = '.thinlto-cache'
+
+    def __init__(self, root: Path, max_size: int) -> None:
+        self.root = Path(root)
+        self.max_size = max_size
+
+    def cache_dir(self, kernel_name: str, config: Path) -> Path:
+        """Return the cache directory of a kernel and its config file."""
+        try:
+            digest = hashlib.sha256(Path(config).read_bytes()).hexdigest()[:16]
+        except FileNotFoundError:
+            digest = 'noconfig'
+        return self.root / kernel_name / digest
+
+    def activate(self, object_dir: Path, kernel_name: str) -> Path:
+        """Link the cache of a kernel into its object directory.
+
+        An existing unmanaged cache directory is moved into the store.
+
+        Args:
+            object_dir: The kernel object directory.
+            kernel_name: Name used to separate caches of different kernels.
+
+        Returns:
+            The managed cache directory.
+        """
+        object_dir = Path(object_dir)
+        cache_dir = self.cache_dir(kernel_name, object_dir / '.config')
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        link = object_dir / ThinLtoCache.link_name
+
+        if link.is_dir() and not link.is_symlink():
+            for entry in link.iterdir():
+                os.replace(entry.as_posix(), (cache_dir / entry.name).as_posix())
+            link.rmdir()
+
+        temp_link = object_dir / (ThinLtoCache.link_name + '.tmp')
+        if temp_link.is_symlink():
+            temp_link.unlink()
+        temp_link.symlink_to(cache_dir.resolve())
+        os.replace(temp_link.as_posix(), link.as_posix())
+        os.utime(cache_dir.as_posix())
+        return cache_dir
+
+    def size(self) -> int:
+        """Return the combined size in bytes of all caches."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def prune(self) -> List[Path]:
+        """Remove the least recently used entries until under max_size.
+
+        Returns:
+            The paths of the removed cache entries.
+        """
+        entries = [(max(stat.st_atime, stat.st_mtime), stat.st_size, entry)
+                   for entry, stat in ((entry, entry.stat()) for entry in self._entries())]
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, entry in sorted(entries, key=lambda x: x[0]):
+            if total <= self.max_size:
+                break
+            entry.unlink()
+            total -= size
+            removed.append(entry)
+        return removed
+
+    def _entries(self) -> List[Path]:
+        """Return the files of all caches."""
+        if not self.root.is_dir():
+            return []
+        return [entry for entry in self.root.glob('*/*/*') if entry.is_file()]
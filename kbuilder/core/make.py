@@ -1,17 +1,338 @@
 """GNU make invocation.
 
-This module facilitates invoking the GNU make shell command.
+This module facilitates invoking GNU make. Make is run without a shell in
+its own process group, so a whole build tree can be cancelled or timed out.
+
+The working directory, environment and make variables of a build are held
+by a BuildEnvironment and passed to make when it is started, instead of
+being set on this process, so builds running concurrently in one process
+do not interfere.
 
 
 Example:
     .. code-block:: python
-        from kbuilder.core.make import make
+        from kbuilder.core.make import MakeRunner, make
 
         make('all', jobs=8)
+
+        runner = MakeRunner(variables={'ARCH': 'arm64', 'O': 'out'})
+        result = runner.run('Image.gz-dtb', 'modules', timeout=3600)
+        print(result.duration, result.cpu_time)
+
+        environment = BuildEnvironment('linux', env={'CROSS_COMPILE': 'aarch64-'})
+        MakeRunner(environment=environment).run('Image')
 """
 import os
+import signal
+import threading
+import time
+from collections import namedtuple
 from pathlib import Path
-from subprocess import CompletedProcess, check_call, check_output
+from subprocess import PIPE, STDOUT, CalledProcessError, Popen, TimeoutExpired
+from typing import Callable, Dict, List, Optional
+
+from kbuilder.core.priority import Cgroup, PriorityClass
+
+
+class MakeResult(namedtuple('MakeResult', 'args returncode duration rusage output cgroup')):
+    """The outcome of a make invocation.
+
+    Properties:
+        args: The argv list make was invoked with.
+        returncode: Exit status of make, negative if killed by a signal.
+        duration: Wall clock time in seconds.
+        rusage: Resource usage of make and all of its children.
+        output: Combined stdout and stderr if captured, None otherwise.
+        cgroup: Statistics of the transient cgroup make ran in, None otherwise.
+    """
+
+    @property
+    def cpu_time(self) -> float:
+        """User and system CPU time in seconds of make and its children."""
+        return self.rusage.ru_utime + self.rusage.ru_stime
+
+    @property
+    def max_rss(self) -> int:
+        """Largest resident set size in kilobytes of a single process."""
+        return self.rusage.ru_maxrss
+
+    def check_returncode(self) -> None:
+        """Raise a CalledProcessError if make was unsuccessful."""
+        if self.returncode:
+            raise CalledProcessError(self.returncode, self.args, self.output)
+
+
+class BuildEnvironment(object):
+    """The working directory, environment and make variables of a build.
+
+    Properties:
+        directory: Working directory of the processes of the build.
+        env: Environment variables overriding those of this process.
+        variables: make variables passed on the command line.
+    """
+
+    def __init__(self, directory: str='.', *, env: Optional[Dict[str, str]]=None,
+                 variables: Optional[Dict[str, str]]=None) -> None:
+        self.directory = directory
+        self.env = dict(env or {})
+        self.variables = dict(variables or {})
+
+    def copy(self) -> 'BuildEnvironment':
+        """Return an independent copy of this environment."""
+        return BuildEnvironment(self.directory, env=self.env, variables=self.variables)
+
+    def environ(self, env: Optional[Dict[str, str]]=None) -> Optional[Dict[str, str]]:
+        """Return the environment of a process of the build.
+
+        Args:
+            env: Environment variables overriding those of the build.
+
+        Returns:
+            The environment of this process with the overrides applied,
+            or None if there are none.
+        """
+        if not self.env and not env:
+            return None
+        full_env = dict(os.environ)
+        full_env.update(self.env)
+        full_env.update(env or {})
+        return full_env
+
+
+class MakeRunner(object):
+    """Run make through an argv list in its own process group.
+
+    Properties:
+        program: The make program to invoke.
+        jobs: Default amount of jobs.
+        environment: The BuildEnvironment of every invocation.
+        directory: Default directory passed to make -C, and the working
+            directory of make.
+        variables: make variables passed to every invocation.
+        env: Environment variables added to every invocation.
+        silent: Whether to pass --quiet to make by default.
+        priority: Default PriorityClass of invocations, None to inherit ours.
+        cgroup_parent: Delegated cgroup v2 to create the transient cgroups of
+            builds in (default: the cgroup of this process).
+        memory_high: memory.high in bytes overriding the priority class.
+        on_warning: Called with a message once for every cgroup limit which
+            could not be applied.
+    """
+
+    kill_grace_period = 5.0
+
+    def __init__(self, program: str='make', *, jobs: int=os.cpu_count(),
+                 directory: str='.', variables: Optional[Dict[str, str]]=None,
+                 env: Optional[Dict[str, str]]=None, silent: bool=True,
+                 priority: Optional[PriorityClass]=None,
+                 environment: Optional[BuildEnvironment]=None) -> None:
+        self.program = program
+        self.jobs = jobs
+        self.environment = environment or BuildEnvironment(directory, env=env,
+                                                           variables=variables)
+        self.silent = silent
+        self.priority = priority
+        self.cgroup_parent = None
+        self.memory_high = None
+        self.on_warning = None
+        self._warned = set()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        """Default directory passed to make -C."""
+        return self.environment.directory
+
+    @directory.setter
+    def directory(self, directory: str) -> None:
+        self.environment.directory = directory
+
+    @property
+    def variables(self) -> Dict[str, str]:
+        """make variables passed to every invocation."""
+        return self.environment.variables
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """Environment variables added to every invocation."""
+        return self.environment.env
+
+    def command(self, *targets: str, jobs: Optional[int]=None,
+                directory: Optional[str]=None,
+                variables: Optional[Dict[str, str]]=None,
+                silent: Optional[bool]=None) -> List[str]:
+        """Return the argv list used to invoke make.
+
+        Variables of a single invocation override the default variables.
+        """
+        merged = dict(self.variables)
+        merged.update(variables or {})
+        silent = self.silent if silent is None else silent
+        argv = [self.program, '-j{}'.format(jobs or self.jobs),
+                '-C', str(directory or self.directory)]
+        if silent:
+            argv.append('--quiet')
+        argv.extend('{}={}'.format(name, value) for name, value in sorted(merged.items()))
+        argv.extend(targets)
+        return argv
+
+    def run(self, *targets: str, jobs: Optional[int]=None,
+            directory: Optional[str]=None,
+            variables: Optional[Dict[str, str]]=None,
+            env: Optional[Dict[str, str]]=None,
+            timeout: Optional[float]=None, capture: bool=False,
+            on_line: Optional[Callable[[str], None]]=None,
+            check: bool=True, silent: Optional[bool]=None,
+            priority: Optional[PriorityClass]=None) -> MakeResult:
+        """Invoke make and wait for it to exit.
+
+        If the wait is interrupted or times out, the whole process group of
+        make is terminated.
+
+        Args:
+            targets: Targets to make.
+            jobs: Amount of jobs (default self.jobs).
+            directory: Directory passed to make -C (default self.directory).
+            variables: make variables of this invocation.
+            env: Environment variables of this invocation.
+            timeout: Seconds to wait before cancelling make.
+            capture: Whether to return the output of make.
+            on_line: Called with every line of output as it is produced.
+            check: Whether to raise CalledProcessError on failure.
+            silent: Whether to pass --quiet to make (default self.silent).
+            priority: PriorityClass of this invocation (default self.priority).
+
+        Raises:
+            CalledProcessError: If check is set and make is unsuccessful.
+            TimeoutExpired: If make did not exit within timeout.
+
+        Returns:
+            A MakeResult.
+        """
+        argv = self.command(*targets, jobs=jobs, directory=directory,
+                            variables=variables, silent=silent)
+        full_env = self.environment.environ(env)
+        pipe = capture or on_line is not None
+        priority = priority or self.priority
+        cgroup = None
+        command = argv
+        if priority:
+            cgroup = Cgroup.create(priority, self.cgroup_parent, self.memory_high)
+            command = priority.command(argv, cgroup)
+            if cgroup:
+                self._warn_skipped(cgroup)
+
+        start = time.monotonic()
+        try:
+            process = Popen(command, cwd=str(self.directory), env=full_env,
+                            start_new_session=True,
+                            stdout=PIPE if pipe else None,
+                            stderr=STDOUT if pipe else None,
+                            universal_newlines=True)
+        except BaseException:
+            if cgroup:
+                cgroup.remove()
+            raise
+        with self._lock:
+            self._processes.add(process)
+
+        lines = []
+        reader = None
+        if pipe:
+            reader = threading.Thread(target=_read_lines,
+                                      args=(process.stdout, lines if capture else None, on_line))
+            reader.start()
+
+        status = {}
+        exited = threading.Event()
+        waiter = threading.Thread(target=_wait_process, args=(process, status, exited))
+        waiter.start()
+
+        try:
+            if not exited.wait(timeout):
+                self._terminate(process, exited)
+                raise TimeoutExpired(argv, timeout, ''.join(lines) if capture else None)
+        except BaseException:
+            self._terminate(process, exited)
+            raise
+        finally:
+            waiter.join()
+            if reader:
+                reader.join()
+            with self._lock:
+                self._processes.discard(process)
+            cgroup_stats = None
+            if cgroup:
+                cgroup_stats = cgroup.stats()
+                cgroup.remove()
+
+        result = MakeResult(argv, status['returncode'], time.monotonic() - start,
+                            status['rusage'], ''.join(lines) if capture else None,
+                            cgroup_stats)
+        if check:
+            result.check_returncode()
+        return result
+
+    def cancel(self) -> None:
+        """Terminate the process groups of all running invocations.
+
+        Safe to call from another thread; the cancelled invocations return
+        with a negative returncode.
+        """
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            _kill_group(process, signal.SIGTERM)
+
+    def _warn_skipped(self, cgroup: Cgroup) -> None:
+        """Report the limits of a cgroup which could not be applied."""
+        for name in cgroup.skipped:
+            if self.on_warning and name not in self._warned:
+                self._warned.add(name)
+                self.on_warning('cgroup limit {} could not be applied in {}; set '
+                                'priority.cgroup_parent to a delegated cgroup without '
+                                'processes of its own'.format(name, cgroup.path.parent))
+
+    def _terminate(self, process: Popen, exited: threading.Event) -> None:
+        """Terminate the process group of make, killing it if necessary."""
+        if exited.is_set():
+            return
+        _kill_group(process, signal.SIGTERM)
+        if not exited.wait(MakeRunner.kill_grace_period):
+            _kill_group(process, signal.SIGKILL)
+            exited.wait()
+
+
+def _kill_group(process: Popen, sig: int) -> None:
+    """Send a signal to the process group led by a process."""
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _wait_process(process: Popen, status: dict, exited: threading.Event) -> None:
+    """Wait for a process to exit and record its status and resource usage."""
+    _, wait_status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(wait_status):
+        process.returncode = -os.WTERMSIG(wait_status)
+    else:
+        process.returncode = os.WEXITSTATUS(wait_status)
+    status['returncode'] = process.returncode
+    status['rusage'] = rusage
+    exited.set()
+
+
+def _read_lines(stream, lines: Optional[List[str]],
+                on_line: Optional[Callable[[str], None]]) -> None:
+    """Read a stream line by line until it is closed."""
+    with stream:
+        for line in stream:
+            if lines is not None:
+                lines.append(line)
+            if on_line:
+                on_line(line.rstrip('\n'))
 
 
 class Makefile(object):
@@ -19,61 +340,72 @@ class Makefile(object):
 
     Properties:
         path: the default path to invoke make command
+        variables: make variables passed to every invocation
+        environment: the BuildEnvironment of every invocation
+        runner: the MakeRunner used to invoke make
     """
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, variables: Optional[Dict[str, str]]=None,
+                 environment: Optional[BuildEnvironment]=None):
         self.path = path
-        self._prev_path = None
+        environment = environment or BuildEnvironment(path)
+        environment.variables.update(variables or {})
+        self.runner = MakeRunner(environment=environment)
 
-    def __enter__(self):
-        """Change the current directory the kernel root."""
-        self._prev_path = Path.cwd()
-        self.path.chdir()
-        return self
+    @property
+    def variables(self) -> Dict[str, str]:
+        """make variables passed to every invocation."""
+        return self.runner.variables
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Revert the current directory to the original directory."""
-        os.chdir(self._prev_path.as_posix())
-        return False
+    @property
+    def environment(self) -> BuildEnvironment:
+        """The BuildEnvironment of every invocation."""
+        return self.runner.environment
 
     def __bool__(self):
         """Check if the path property is set"""
         return bool(self.path)
 
-    def make(self, *args, **kwargs):
-        return make(*args, directory=self.path, **kwargs)
+    def run(self, *targets: str, **kwargs) -> MakeResult:
+        """Invoke make in path. Refer to MakeRunner.run()."""
+        return self.runner.run(*targets, **kwargs)
 
-    def make_output(self, *args, **kwargs) -> str:
-        return make_output(*args, directory=self.path, **kwargs)
+    def make(self, recipe: str, **kwargs) -> MakeResult:
+        return self.run(*recipe.split(), **kwargs)
+
+    def make_output(self, recipe: str, **kwargs) -> str:
+        return self.run(*recipe.split(), capture=True, **kwargs).output.rstrip()
 
     def make_output_last_line(self, *args, **kwargs) -> str:
-        return make_output_last_line(*args, directory=self.path, **kwargs)
+        return self.make_output(*args, **kwargs).split('\n')[-1]
 
 
-def make(recipe: str, *, jobs: int=os.cpu_count(), directory:  str='.', **kwargs) -> CompletedProcess:
-    """Execute a make recipe in the shell.
+def make(recipe: str, *, jobs: int=os.cpu_count(), directory:  str='.', **kwargs) -> MakeResult:
+    """Execute a make recipe.
 
     Args:
         recipe: Recipe to invoke.
         jobs: Amount of threads to invoke recipe (default os.cpu_count()).
         directory: The directory to invoke the make command.
+        variables: Optional make variables to pass on the command line.
 
     Raises:
           A CalledProcessError if the recipe is unsuccessful.
 
     Returns:
-          A CompletedProcess object.
+          A MakeResult object.
     """
-    command = _format_make_command(recipe, jobs=jobs, directory=directory, **kwargs)
-    return check_call(command, shell=True)
+    runner = MakeRunner(jobs=jobs, directory=directory)
+    return runner.run(*recipe.split(), **kwargs)
 
 
 def make_output(recipe: str, *, jobs: int=os.cpu_count(), directory:  str='.', **kwargs) -> str:
-    """Execute a make recipe in the shell and return output.
+    """Execute a make recipe and return output.
 
     Args:
         recipe: Recipe to invoke.
         jobs: Amount of threads to invoke recipe (default os.cpu_count()).
         directory: The directory to invoke the make command.
+        variables: Optional make variables to pass on the command line.
 
     Raises:
           A CalledProcessError if the recipe is unsuccessful.
@@ -81,12 +413,12 @@ def make_output(recipe: str, *, jobs: int=os.cpu_count(), directory:  str='.', *
     Returns:
           Output of make with trailing whitespace trimmed.
     """
-    command = _format_make_command(recipe, jobs=jobs, directory=directory, **kwargs)
-    return check_output(command, shell=True, universal_newlines=True).rstrip()
+    runner = MakeRunner(jobs=jobs, directory=directory)
+    return runner.run(*recipe.split(), capture=True, **kwargs).output.rstrip()
 
 
 def make_output_last_line(*args, **kwargs) -> str:
-    """Execute a make recipe in the shell and return output.
+    """Execute a make recipe and return output.
 
     Args:
         refer to make_output()
@@ -98,7 +430,3 @@ def make_output_last_line(*args, **kwargs) -> str:
           Last line of output of make with trailing whitespace trimmed.
     """
     return make_output(*args, **kwargs).split('\n')[-1]
-
-
-def _format_make_command(recipe: str, *, jobs: int, directory:  str) -> str:
-    return 'make {} -j{} -C {} --quiet'.format(recipe, jobs, directory)
@@ -0,0 +1,241 @@
+"""Loadable kernel module abstractions.
+
+Modules are installed by kbuild into a staging directory, then stripped and
+optionally signed in parallel before being packaged.
+
+Packages hold the modules in a flat directory, as Android expects them, so
+the depmod files which name modules by path are rewritten to name them by
+file name. The binary indexes of depmod are left out; the text files are
+what the modprobe of Android reads.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from subprocess import check_call
+from typing import Dict, Iterable, List, Optional
+
+from kbuilder.core.exc import KbuilderRuntimeError
+
+# depmod files which name modules by their path in the module directory.
+_path_metadata = ('modules.dep', 'modules.order')
+
+
+class ModuleSigner(object):
+    """Sign modules with the kernel's scripts/sign-file helper."""
+
+    def __init__(self, sign_file: Path, key: Path, cert: Path, *,
+                 hash_algo: str='sha256') -> None:
+        """Initialize a new ModuleSigner.
+
+        Args:
+            sign_file: Path to the kernel's sign-file program.
+            key: Private key used to sign the modules.
+            cert: X.509 certificate matching the private key.
+            hash_algo: Digest algorithm passed to sign-file.
+        """
+        self.sign_file = Path(sign_file)
+        self.key = Path(key)
+        self.cert = Path(cert)
+        self.hash_algo = hash_algo
+
+    def sign(self, module: Path) -> None:
+        """Append a signature to a module in place."""
+        check_call([self.sign_file.as_posix(), self.hash_algo, self.key.as_posix(),
+                    self.cert.as_posix(), Path(module).as_posix()])
+
+
+class ModuleManifest(object):
+    """Digests of the modules processed by the previous build.
+
+    The manifest maps the path of each installed module to the digest of
+    its unstripped contents, allowing unchanged modules to be skipped.
+    """
+
+    file_name = '.kbuilder-modules.json'
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.options = {}
+        self.digests = {}
+
+    @classmethod
+    def load(cls, directory: Path) -> 'ModuleManifest':
+        """Load the manifest stored in a directory, if any."""
+        manifest = cls(Path(directory, cls.file_name))
+        try:
+            data = json.loads(manifest.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return manifest
+        manifest.options = data.get('options', {})
+        manifest.digests = data.get('digests', {})
+        return manifest
+
+    def save(self) -> None:
+        """Write the manifest to disk."""
+        data = {'options': self.options, 'digests': self.digests}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(data, indent=2, sort_keys=True))
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_modules(directory: Path) -> List[Path]:
+    """Return the sorted paths of all modules located in a directory."""
+    return sorted(Path(directory).rglob('*.ko'))
+
+
+def find_metadata(directory: Path) -> List[Path]:
+    """Return the sorted paths of the depmod text files of a module directory."""
+    return sorted(path for path in Path(directory).glob('modules.*')
+                  if path.is_file() and path.suffix not in ('.bin', '.ko'))
+
+
+def _process_module(source: Path, destination: Path, strip: Optional[str],
+                    signer: Optional[ModuleSigner]) -> Path:
+    """Copy a module to its destination, then strip and sign it."""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source.as_posix(), destination.as_posix())
+    if strip:
+        check_call([strip, '--strip-debug', destination.as_posix()])
+    if signer:
+        signer.sign(destination)
+    return destination
+
+
+def process_modules(install_dir: Path, output_dir: Path, *,
+                    strip: Optional[str]=None,
+                    signer: Optional[ModuleSigner]=None,
+                    jobs: int=os.cpu_count()) -> List[Path]:
+    """Strip and sign installed modules on a process pool.
+
+    Modules whose contents did not change since the previous call are
+    skipped, as are modules processed with the same strip and sign options.
+    The depmod text files are copied along.
+
+    Args:
+        install_dir: Directory modules were installed into by modules_install.
+        output_dir: Directory to store the processed modules.
+        strip: Optional strip program used to remove debug symbols.
+        signer: Optional signer used to sign the stripped modules.
+        jobs: Amount of processes to use (default os.cpu_count()).
+
+    Returns:
+        The paths of the modules which were processed by this call.
+
+    Raises:
+        CalledProcessError: If a module could not be stripped or signed.
+    """
+    install_dir = Path(install_dir)
+    output_dir = Path(output_dir)
+    manifest = ModuleManifest.load(output_dir)
+    options = {'strip': strip or '',
+               'sign': signer.cert.as_posix() if signer else ''}
+    if manifest.options != options:
+        manifest.digests = {}
+    manifest.options = options
+
+    digests = {}
+    pending = []
+    for module in find_modules(install_dir):
+        name = module.relative_to(install_dir).as_posix()
+        digests[name] = file_digest(module)
+        destination = output_dir / name
+        if manifest.digests.get(name) != digests[name] or not destination.exists():
+            pending.append((module, destination))
+
+    for name in set(manifest.digests) - set(digests):
+        try:
+            (output_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    processed = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_process_module, source, destination, strip, signer)
+                       for source, destination in pending]
+            processed = [future.result() for future in futures]
+
+    for metadata in find_metadata(install_dir):
+        shutil.copy2(metadata.as_posix(), (output_dir / metadata.name).as_posix())
+
+    manifest.digests = digests
+    manifest.save()
+    return processed
+
+
+def flatten_metadata(text: str) -> str:
+    """Replace the module paths in modules.dep or modules.order by file names."""
+    lines = []
+    for line in text.splitlines():
+        target, colon, dependencies = line.partition(':')
+        flat = target.rsplit('/', 1)[-1]
+        if colon:
+            flat += ':' + ''.join(' ' + path.rsplit('/', 1)[-1]
+                                  for path in dependencies.split())
+        lines.append(flat)
+    return ''.join(line + '\n' for line in lines)
+
+
+def copy_modules(modules: Iterable[Path], destination: Path, *,
+                 metadata_dir: Optional[Path]=None) -> Dict[str, Path]:
+    """Copy modules into a flat directory, skipping identical files.
+
+    Modules and depmod files left over from previous copies are removed.
+
+    Args:
+        modules: Paths of the modules to copy.
+        destination: Directory to copy the modules into.
+        metadata_dir: Directory of the depmod files of the modules, which
+            are copied along.
+
+    Returns:
+        A dict mapping module names to their new paths.
+
+    Raises:
+        KbuilderRuntimeError: If two modules have the same file name.
+    """
+    destination = Path(destination)
+    modules = list(modules)
+    sources = {}
+    for module in modules:
+        if module.name in sources:
+            raise KbuilderRuntimeError('Modules {} and {} would both be copied to {}'.format(
+                sources[module.name], module, destination / module.name))
+        sources[module.name] = module
+
+    destination.mkdir(parents=True, exist_ok=True)
+    copied = {}
+    for module in modules:
+        target = destination / module.name
+        if not target.exists() or file_digest(target) != file_digest(module):
+            shutil.copy2(module.as_posix(), target.as_posix())
+        copied[module.name] = target
+
+    written = set()
+    for metadata in find_metadata(metadata_dir) if metadata_dir else []:
+        target = destination / metadata.name
+        if metadata.name in _path_metadata:
+            target.write_text(flatten_metadata(metadata.read_text()))
+        else:
+            shutil.copy2(metadata.as_posix(), target.as_posix())
+        written.add(metadata.name)
+
+    for stale in destination.glob('*.ko'):
+        if stale.name not in copied:
+            stale.unlink()
+    for stale in find_metadata(destination):
+        if stale.name not in written:
+            stale.unlink()
+    return copied
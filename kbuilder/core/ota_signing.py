@@ -0,0 +1,355 @@
+"""Whole-file signatures of OTA packages, computed while they are written.
+
+Recovery verifies an OTA package by a PKCS#7 signature stored at the end
+of the zip comment, like signapk -w writes it. The signature covers the
+whole file except the comment and its length, so signing usually reads
+the package again after it was written.
+
+DigestingFile instead digests the bytes as zipfile writes them. zipfile
+sees a file it cannot seek in, so it never rewrites local headers and
+describes each member in a data descriptor after its contents. Once the
+central directory is written, the digest is signed with openssl and the
+comment with the signature is appended, so the package is read once,
+while it is written.
+
+Besides the whole-file sha256, the signed bytes are digested in 1 MiB
+chunks like APK Signature Scheme v2 does, so downloads of packages can
+be checked chunk by chunk.
+"""
+
+import hashlib
+import io
+import os
+import ssl
+import struct
+import subprocess
+import tempfile
+import zipfile
+from collections import namedtuple
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.reproducible import add_members
+
+CHUNK_SIZE = 1 << 20
+
+# Size of the end of central directory record without its comment, and of
+# the footer recovery reads at the end of the comment.
+_eocd_size = 22
+_footer_size = 6
+_message = b'signed by kbuilder\0'
+
+_oid_signed_data = bytes.fromhex('06092a864886f70d010702')
+_oid_data = bytes.fromhex('06092a864886f70d010701')
+_sha256 = bytes.fromhex('300d06096086480165030402010500')
+_signature_algorithms = {
+    # rsaEncryption
+    bytes.fromhex('06092a864886f70d010101'): bytes.fromhex('300d06092a864886f70d0101010500'),
+    # id-ecPublicKey, signed with ecdsa-with-SHA256
+    bytes.fromhex('06072a8648ce3d0201'): bytes.fromhex('300a06082a8648ce3d040302'),
+}
+
+SignedPackage = namedtuple('SignedPackage', 'path sha256 signed_sha256 chunk_sha256')
+SignedPackage.__doc__ = """A signed OTA package.
+
+Properties:
+    path: The package.
+    sha256: Hex digest of the whole file.
+    signed_sha256: Hex digest of the signed bytes.
+    chunk_sha256: Hex digests of the 1 MiB chunks of the signed bytes.
+"""
+
+
+def chunk_digest(chunk: bytes) -> bytes:
+    """Return the digest of a chunk in the manner of APK Signature Scheme v2."""
+    return hashlib.sha256(b'\xa5' + struct.pack('<I', len(chunk)) + chunk).digest()
+
+
+class ChunkedDigest(object):
+    """The sha256 digest of a stream, and the digests of its chunks.
+
+    Properties:
+        whole: sha256 of the stream.
+        chunks: Digests of the complete chunks.
+    """
+
+    def __init__(self) -> None:
+        self.whole = hashlib.sha256()
+        self.chunks = []
+        self._chunk = bytearray()
+
+    def update(self, data: bytes) -> None:
+        """Digest the next bytes of the stream."""
+        self.whole.update(data)
+        self._chunk += data
+        while len(self._chunk) >= CHUNK_SIZE:
+            self.chunks.append(chunk_digest(bytes(self._chunk[:CHUNK_SIZE])))
+            del self._chunk[:CHUNK_SIZE]
+
+    def finish(self) -> Tuple[bytes, List[bytes]]:
+        """Return the digest of the stream and the digests of all its chunks."""
+        chunks = list(self.chunks)
+        if self._chunk:
+            chunks.append(chunk_digest(bytes(self._chunk)))
+        return self.whole.digest(), chunks
+
+
+class DigestingFile(io.RawIOBase):
+    """A file which digests what is written to it and cannot seek.
+
+    The last two bytes written are held back from the digest, since the
+    comment length at the end of a zip file is not signed.
+
+    Properties:
+        file: The underlying file.
+        digest: ChunkedDigest of the bytes written but held back.
+    """
+
+    def __init__(self, file) -> None:
+        super().__init__()
+        self.file = file
+        self.digest = ChunkedDigest()
+        self._held = b''
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        raise io.UnsupportedOperation('seek')
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.file.write(data)
+        self._position += len(data)
+        held = self._held + data
+        self.digest.update(held[:-2])
+        self._held = held[-2:]
+        return len(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+def _der(tag: int, content: bytes) -> bytes:
+    """Encode a DER element."""
+    if len(content) < 0x80:
+        return bytes([tag, len(content)]) + content
+    length = len(content).to_bytes((len(content).bit_length() + 7) // 8, 'big')
+    return bytes([tag, 0x80 | len(length)]) + length + content
+
+
+def _der_children(data: bytes, start: int=0, end: Optional[int]=None) -> List[Tuple]:
+    """Split DER elements into (tag, element start, content start, end) tuples."""
+    end = len(data) if end is None else end
+    children = []
+    while start < end:
+        tag, length = data[start], data[start + 1]
+        content = start + 2
+        if length & 0x80:
+            count = length & 0x7F
+            length = int.from_bytes(data[content:content + count], 'big')
+            content += count
+        if content + length > end:
+            raise ValueError('truncated DER element')
+        children.append((tag, start, content, content + length))
+        start = content + length
+    return children
+
+
+def _read_certificate(path: Path) -> bytes:
+    """Read a PEM or DER certificate as DER."""
+    data = Path(path).read_bytes()
+    if data.lstrip().startswith(b'-----BEGIN'):
+        return ssl.PEM_cert_to_DER_cert(data.decode('ascii'))
+    return data
+
+
+def _certificate_fields(certificate: bytes) -> Tuple[bytes, bytes, bytes]:
+    """Return the issuer, serial number and public key algorithm of a certificate."""
+    (_, _, content, end), = _der_children(certificate)
+    _, _, tbs_content, tbs_end = _der_children(certificate, content, end)[0]
+    fields = _der_children(certificate, tbs_content, tbs_end)
+    if fields[0][0] == 0xA0:
+        fields = fields[1:]
+    serial, issuer, public_key = fields[0], fields[2], fields[5]
+    key_algorithm = _der_children(certificate, public_key[2], public_key[3])[0]
+    oid = _der_children(certificate, key_algorithm[2], key_algorithm[3])[0]
+    return (certificate[issuer[1]:issuer[3]], certificate[serial[1]:serial[3]],
+            certificate[oid[1]:oid[3]])
+
+
+def _signature(signed_data: bytes) -> bytes:
+    """Return the signature of the single signer of a PKCS#7 SignedData.
+
+    Raises:
+        ValueError: If it is no SignedData, or signs authenticated attributes.
+    """
+    (_, _, content, end), = _der_children(signed_data)
+    oid, wrapped = _der_children(signed_data, content, end)[:2]
+    if signed_data[oid[1]:oid[3]] != _oid_signed_data:
+        raise ValueError('signature is no PKCS#7 SignedData')
+    _, _, content, end = _der_children(signed_data, wrapped[2], wrapped[3])[0]
+    signer_infos = _der_children(signed_data, content, end)[-1]
+    _, _, content, end = _der_children(signed_data, signer_infos[2], signer_infos[3])[0]
+    fields = _der_children(signed_data, content, end)
+    if any(tag == 0xA0 for tag, *_ in fields):
+        raise ValueError('signatures of authenticated attributes are not supported')
+    algorithm = _der_children(signed_data, fields[2][2], fields[2][3])[0]
+    if signed_data[algorithm[1]:algorithm[3]] != _sha256[2:13]:
+        raise ValueError('signature does not use sha256')
+    return signed_data[fields[-1][2]:fields[-1][3]]
+
+
+class OtaSigner(object):
+    """Sign OTA packages with a private key using openssl.
+
+    Properties:
+        key: Private key in PEM or DER format, such as testkey.pk8.
+        cert: X.509 certificate of the key in PEM or DER format.
+        openssl: The openssl program.
+    """
+
+    def __init__(self, key: Path, cert: Path, *, openssl: str='openssl') -> None:
+        self.key = Path(key)
+        self.cert = Path(cert)
+        self.openssl = openssl
+
+    def _pkeyutl(self, arguments: List[str], data: bytes) -> subprocess.CompletedProcess:
+        """Run openssl pkeyutl on a sha256 digest.
+
+        Raises:
+            KbuilderRuntimeError: If openssl cannot be run.
+        """
+        try:
+            return subprocess.run([self.openssl, 'pkeyutl'] + arguments +
+                                  ['-pkeyopt', 'digest:sha256'],
+                                  input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as error:
+            raise KbuilderRuntimeError('Failed to run {}: {}'.format(self.openssl, error))
+
+    def sign_digest(self, digest: bytes) -> bytes:
+        """Return a detached PKCS#7 signature of data with a sha256 digest.
+
+        Raises:
+            KbuilderRuntimeError: If openssl fails.
+            ValueError: If the certificate cannot be parsed or uses an
+                unsupported key type.
+        """
+        certificate = _read_certificate(self.cert)
+        issuer, serial, key_algorithm = _certificate_fields(certificate)
+        if key_algorithm not in _signature_algorithms:
+            raise ValueError('unsupported key type of {}'.format(self.cert))
+        result = self._pkeyutl(['-sign', '-inkey', str(self.key)], digest)
+        if result.returncode:
+            raise KbuilderRuntimeError('Failed to sign with {}: {}'.format(
+                self.key, result.stderr.decode(errors='replace').strip()))
+        signature = result.stdout
+        signer_info = _der(0x30, b''.join([
+            _der(0x02, b'\x01'), _der(0x30, issuer + serial), _sha256,
+            _signature_algorithms[key_algorithm], _der(0x04, signature)]))
+        signed_data = _der(0x30, b''.join([
+            _der(0x02, b'\x01'), _der(0x31, _sha256), _der(0x30, _oid_data),
+            _der(0xA0, certificate), _der(0x31, signer_info)]))
+        return _der(0x30, _oid_signed_data + _der(0xA0, signed_data))
+
+    def comment(self, digest: bytes) -> bytes:
+        """Return the zip comment signing data with a sha256 digest.
+
+        Raises:
+            ValueError: If the signature contains the signature of an end
+                of central directory record, which recovery rejects.
+        """
+        signature = self.sign_digest(digest)
+        comment = _message + signature
+        footer = struct.pack('<HHH', len(signature) + _footer_size, 0xFFFF,
+                             len(comment) + _footer_size)
+        comment += footer
+        if b'PK\x05\x06' in comment:
+            raise ValueError('signature contains an end of central directory signature')
+        return comment
+
+    def write_package(self, source_dir: Path, package: Path,
+                      epoch: Optional[int]=None) -> SignedPackage:
+        """Archive a directory into a signed OTA package.
+
+        Args:
+            source_dir: The directory to archive.
+            package: The package to write.
+            epoch: Timestamp of a reproducible package, see
+                kbuilder.core.reproducible.write_zip.
+        """
+        package = Path(package)
+        temp = package.with_name('.{}.tmp'.format(package.name))
+        with open(str(temp), 'w+b') as file:
+            digesting = DigestingFile(file)
+            with zipfile.ZipFile(digesting, 'w', zipfile.ZIP_DEFLATED) as output:
+                add_members(output, source_dir, epoch)
+            signed_digest, chunks = digesting.digest.finish()
+            comment = self.comment(signed_digest)
+            end = struct.pack('<H', len(comment)) + comment
+            file.seek(-2, os.SEEK_END)
+            file.write(end)
+        whole = digesting.digest.whole.copy()
+        whole.update(end)
+        os.replace(str(temp), str(package))
+        return SignedPackage(package, whole.hexdigest(), signed_digest.hex(),
+                             [chunk.hex() for chunk in chunks])
+
+    def verify(self, package: Path) -> SignedPackage:
+        """Verify the whole-file signature of an OTA package.
+
+        Raises:
+            ValueError: If the package is not signed by the key of the
+                certificate.
+            KbuilderRuntimeError: If openssl fails to run.
+        """
+        package = Path(package)
+        with open(str(package), 'rb') as file:
+            size = file.seek(0, os.SEEK_END)
+            if size < _eocd_size + _footer_size:
+                raise ValueError('{} is not signed'.format(package))
+            file.seek(size - _footer_size)
+            signature_start, magic, comment_size = struct.unpack('<HHH', file.read(_footer_size))
+            if magic != 0xFFFF or comment_size + _eocd_size > size or \
+                    signature_start > comment_size or signature_start < _footer_size:
+                raise ValueError('{} is not signed'.format(package))
+            file.seek(size - comment_size - _eocd_size)
+            if file.read(4) != b'PK\x05\x06':
+                raise ValueError('{} has a malformed signature footer'.format(package))
+            file.seek(size - signature_start)
+            try:
+                signature = _signature(file.read(signature_start - _footer_size))
+            except IndexError:
+                raise ValueError('{} has a malformed signature'.format(package))
+
+            file.seek(0)
+            signed = ChunkedDigest()
+            whole = hashlib.sha256()
+            remaining = size - comment_size - 2
+            while remaining:
+                block = file.read(min(remaining, CHUNK_SIZE))
+                if not block:
+                    raise ValueError('{} is truncated'.format(package))
+                remaining -= len(block)
+                signed.update(block)
+                whole.update(block)
+            whole.update(file.read())
+            signed_digest, chunks = signed.finish()
+
+        with tempfile.NamedTemporaryFile() as signature_file:
+            signature_file.write(signature)
+            signature_file.flush()
+            result = self._pkeyutl(['-verify', '-certin', '-inkey', str(self.cert),
+                                    '-sigfile', signature_file.name], signed_digest)
+        if result.returncode:
+            raise ValueError('{} is not signed by {}'.format(package, self.cert))
+        return SignedPackage(package, whole.hexdigest(), signed_digest.hex(),
+                             [chunk.hex() for chunk in chunks])
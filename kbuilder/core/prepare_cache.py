@@ -0,0 +1,327 @@
+"""Snapshots of prepared kernel object directories.
+
+`make prepare` generates headers, asm-offsets and the host tools in
+scripts/. On a cold tree this takes a long time although the outputs only
+depend on the compiler, the kernel configuration and a small set of source
+files. A PrepareCache stores the outputs keyed by those inputs, so new
+worktrees and CI runners can restore them instead.
+
+With a RemoteCache, snapshots missing locally are fetched from a team
+cache, and new snapshots are uploaded to it in the background. Remotely,
+a snapshot is a manifest of its files, each stored as a blob addressed by
+its contents, so the files two snapshots share are only transferred once.
+Manifests come from other machines, so their members are checked to stay
+inside the object directory before a snapshot is built from them.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from kbuilder.core.arch import Arch
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.modules import file_digest
+from kbuilder.core.remote_cache import RemoteCache
+from kbuilder.core.toolchain_cache import is_safe_member
+from kbuilder.core.tree_index import TreeIndex
+
+_digest = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _cmd_file(path: Path) -> Path:
+    """Return the kbuild command file recording how a file was generated."""
+    return path.with_name('.{}.cmd'.format(path.name))
+
+
+def _manifest_member(member: Dict) -> Tuple[tarfile.TarInfo, Optional[str]]:
+    """Return the TarInfo of a member of a remote manifest, and its blob digest.
+
+    Raises:
+        KeyError, TypeError, ValueError: If the member is malformed, or
+            leaves the object directory.
+    """
+    name, kind = member['name'], member['type']
+    if not isinstance(name, str):
+        raise TypeError('Member name is not a string: {!r}'.format(name))
+    info = tarfile.TarInfo(name)
+    info.mode, info.mtime = int(member['mode']) & 0o7777, int(member['mtime'])
+    digest = None
+    if kind == 'dir':
+        info.type = tarfile.DIRTYPE
+    elif kind == 'symlink':
+        if not isinstance(member['link'], str):
+            raise TypeError('Link target is not a string: {!r}'.format(member['link']))
+        info.type, info.linkname = tarfile.SYMTYPE, member['link']
+    elif kind == 'file':
+        digest = member['digest']
+        if not isinstance(digest, str) or not _digest.match(digest):
+            raise ValueError('Invalid digest: {!r}'.format(digest))
+        info.size = int(member['size'])
+    else:
+        raise ValueError('Invalid member type: {!r}'.format(kind))
+    if not is_safe_member(info):
+        raise ValueError('Member leaves the object directory: {}'.format(name))
+    return info, digest
+
+
+class PrepareCache(object):
+    """A store of prepared object directory snapshots.
+
+    Properties:
+        root: Directory containing the snapshots.
+        max_entries: Amount of snapshots to keep.
+        remote: Optional RemoteCache shared with other machines.
+        upload: Whether new snapshots are uploaded to the remote cache.
+    """
+
+    # Directories which only contain generated files.
+    generated_dirs = ('include/generated', 'include/config',
+                      'arch/{arch}/include/generated')
+
+    # Command files of kbuild generated files in directories mixing sources
+    # and build outputs.
+    generated_cmd_files = (('scripts', '**/.*.cmd'),
+                           ('arch/{arch}/tools', '**/.*.cmd'),
+                           ('arch/{arch}/kernel/vdso', '**/.*.cmd'),
+                           ('arch/{arch}/kernel/vdso32', '**/.*.cmd'),
+                           ('kernel', '.*.s.cmd'),
+                           ('arch/{arch}/kernel', '.*.s.cmd'))
+
+    # Sources whose contents determine the prepared outputs.
+    inputs = ('Makefile', 'Kbuild', 'arch/{arch}/Makefile', 'scripts', 'include',
+              'arch/{arch}/include', 'arch/{arch}/tools', 'arch/{arch}/kernel/vdso',
+              'arch/{arch}/kernel/vdso32', 'arch/{arch}/kernel/asm-offsets.c',
+              'kernel/bounds.c')
+
+    def __init__(self, root: Path, max_entries: int=8,
+                 remote: Optional[RemoteCache]=None, upload: bool=True) -> None:
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.remote = remote
+        self.upload = upload
+
+    def key(self, source_dir: Path, object_dir: Path, arch: Arch,
+            compiler_identity: str, index_path: Optional[Path]=None) -> str:
+        """Return the key of the prepared outputs of a kernel.
+
+        Args:
+            source_dir: The kernel root.
+            object_dir: The kernel object directory.
+            arch: The kernel architecture.
+            compiler_identity: A string identifying the compiler.
+            index_path: Optional file to persist the index of the inputs in.
+        """
+        source_dir = Path(source_dir)
+        subdirs = [path.format(arch=arch.name) for path in PrepareCache.inputs]
+        index = TreeIndex.load(index_path, source_dir) if index_path else TreeIndex(source_dir)
+        index = index.scan(subdirs=subdirs)
+        if index_path:
+            index.save(index_path)
+
+        digest = hashlib.sha256()
+        digest.update(compiler_identity.encode())
+        digest.update(b'\0' + arch.name.encode() + b'\0')
+        try:
+            digest.update(Path(object_dir, '.config').read_bytes())
+        except FileNotFoundError:
+            pass
+        for path in sorted(index.entries):
+            if not _cmd_file(source_dir / path).exists():
+                digest.update(path.encode('utf-8', 'surrogateescape') + b'\0')
+                digest.update(index.entries[path].digest)
+        return digest.hexdigest()
+
+    def snapshot_path(self, key: str) -> Path:
+        """Return the path of the snapshot stored under a key."""
+        return self.root / '{}.tar'.format(key)
+
+    def outputs(self, object_dir: Path, arch: Arch) -> Iterator[str]:
+        """Yield the relative paths of the prepared outputs in an object directory."""
+        object_dir = Path(object_dir)
+        for directory in PrepareCache.generated_dirs:
+            directory = directory.format(arch=arch.name)
+            if (object_dir / directory).is_dir():
+                yield directory
+
+        for directory, pattern in PrepareCache.generated_cmd_files:
+            directory = directory.format(arch=arch.name)
+            for cmd_file in (object_dir / directory).glob(pattern):
+                target = cmd_file.with_name(cmd_file.name[1:-len('.cmd')])
+                if target.is_file():
+                    yield target.relative_to(object_dir).as_posix()
+                    yield cmd_file.relative_to(object_dir).as_posix()
+
+    def store(self, key: str, object_dir: Path, arch: Arch) -> Path:
+        """Store the prepared outputs of an object directory under a key.
+
+        Returns:
+            The path of the snapshot.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        snapshot = self.snapshot_path(key)
+        temp = snapshot.with_name('.{}.{}.tmp'.format(snapshot.name, os.getpid()))
+        with tarfile.open(temp.as_posix(), 'w') as tar:
+            for path in self.outputs(object_dir, arch):
+                tar.add(str(Path(object_dir, path)), arcname=path)
+        os.replace(temp.as_posix(), snapshot.as_posix())
+        self.prune()
+        if self.remote and self.upload:
+            self.remote.upload(self.push, key)
+        return snapshot
+
+    def push(self, key: str) -> int:
+        """Upload a snapshot to the remote cache.
+
+        Returns:
+            The amount of files the remote cache did not have yet.
+        """
+        members = []
+        with tempfile.TemporaryDirectory(dir=str(self.root)) as directory, \
+                tarfile.open(self.snapshot_path(key).as_posix()) as tar:
+            blobs = {}
+            for number, member in enumerate(tar):
+                entry = {'name': member.name, 'mode': member.mode, 'mtime': member.mtime}
+                if member.isdir():
+                    entry['type'] = 'dir'
+                elif member.issym():
+                    entry['type'] = 'symlink'
+                    entry['link'] = member.linkname
+                elif member.isfile():
+                    path = Path(directory, str(number))
+                    with tar.extractfile(member) as source, open(str(path), 'wb') as file:
+                        shutil.copyfileobj(source, file)
+                    entry['type'] = 'file'
+                    entry['digest'] = file_digest(path)
+                    entry['size'] = member.size
+                    blobs[entry['digest']] = path
+                else:
+                    continue
+                members.append(entry)
+            uploaded = self.remote.put_blobs(blobs)
+        self.remote.put_manifest('prepare-' + key, {'members': members})
+        return uploaded
+
+    def fetch(self, key: str) -> bool:
+        """Download a snapshot from the remote cache, fetching its files in parallel.
+
+        Returns:
+            Whether the remote cache had the snapshot.
+
+        Raises:
+            KbuilderRuntimeError: If fetching failed, or the manifest is
+                malformed or has members leaving the object directory.
+        """
+        manifest = self.remote.get_manifest('prepare-' + key)
+        if not manifest:
+            return False
+        try:
+            members = [_manifest_member(member) for member in manifest['members']]
+        except (KeyError, TypeError, ValueError) as error:
+            raise KbuilderRuntimeError('Corrupt manifest prepare-{} from {}: {}'.format(
+                key, self.remote.url, error))
+        self.root.mkdir(parents=True, exist_ok=True)
+        snapshot = self.snapshot_path(key)
+        temp = snapshot.with_name('.{}.{}.tmp'.format(snapshot.name, os.getpid()))
+        with tempfile.TemporaryDirectory(dir=str(self.root)) as directory:
+            blobs = {digest: Path(directory, digest) for _, digest in members if digest}
+            if self.remote.prefetch(blobs):
+                return False
+            with tarfile.open(temp.as_posix(), 'w') as tar:
+                for info, digest in members:
+                    if digest:
+                        with open(str(blobs[digest]), 'rb') as file:
+                            tar.addfile(info, file)
+                    else:
+                        tar.addfile(info)
+        os.replace(temp.as_posix(), snapshot.as_posix())
+        self.prune()
+        return True
+
+    def restore(self, key: str, object_dir: Path) -> bool:
+        """Restore the prepared outputs stored under a key.
+
+        The snapshot is extracted next to the object directory first. Each
+        generated directory is then swapped in with a rename, and each other
+        file is replaced atomically. All restored files are marked as newer
+        than the sources, which may have been checked out after the
+        snapshot was taken.
+
+        A snapshot missing locally is fetched from the remote cache first.
+        Members leaving the object directory are skipped, and where tarfile
+        supports extraction filters, the data filter checks them again.
+
+        Returns:
+            Whether a snapshot was restored.
+
+        Raises:
+            KbuilderRuntimeError: If fetching from the remote cache failed,
+                or the filter rejects a member.
+        """
+        snapshot = self.snapshot_path(key)
+        if not snapshot.exists() and not (self.remote and self.fetch(key)):
+            return False
+
+        object_dir = Path(object_dir)
+        staging = object_dir / '.kbuilder-prepare.tmp'
+        shutil.rmtree(staging.as_posix(), ignore_errors=True)
+        staging.mkdir(parents=True)
+        try:
+            options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+            with tarfile.open(snapshot.as_posix()) as tar:
+                members = [member for member in tar.getmembers() if is_safe_member(member)]
+                try:
+                    tar.extractall(staging.as_posix(), members, **options)
+                except tarfile.TarError as error:
+                    raise KbuilderRuntimeError('Unsafe member in prepare snapshot {}: {}'.format(
+                        key, error))
+            _touch_tree(staging, time.time())
+            self._swap_in(staging, object_dir)
+        finally:
+            shutil.rmtree(staging.as_posix(), ignore_errors=True)
+        os.utime(snapshot.as_posix())
+        return True
+
+    def _swap_in(self, staging: Path, object_dir: Path) -> None:
+        """Move extracted outputs from staging into the object directory."""
+        generated = []
+        for directory in PrepareCache.generated_dirs:
+            for path in staging.glob(directory.format(arch='*')):
+                generated.append(path.relative_to(staging))
+
+        for relative in generated:
+            target = object_dir / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            old = staging / '.old' / relative
+            if target.exists():
+                old.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(target.as_posix(), old.as_posix())
+            os.rename((staging / relative).as_posix(), target.as_posix())
+
+        for root, dirs, files in os.walk(staging.as_posix()):
+            dirs[:] = [name for name in dirs if name != '.old']
+            for name in files:
+                source = Path(root, name)
+                target = object_dir / source.relative_to(staging)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(source.as_posix(), target.as_posix())
+
+    def prune(self) -> List[Path]:
+        """Remove the least recently used snapshots beyond max_entries."""
+        snapshots = sorted(self.root.glob('*.tar'), key=lambda path: path.stat().st_mtime,
+                           reverse=True)
+        for snapshot in snapshots[self.max_entries:]:
+            snapshot.unlink()
+        return snapshots[self.max_entries:]
+
+
+def _touch_tree(directory: Path, timestamp: float) -> None:
+    """Set the modification time of every file in a directory."""
+    for root, _, files in os.walk(str(directory)):
+        for name in files:
+            os.utime(os.path.join(root, name), (timestamp, timestamp), follow_symlinks=False)
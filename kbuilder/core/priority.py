@@ -0,0 +1,256 @@
+"""Priority classes of builds.
+
+A PriorityClass lowers the CPU and I/O priority of a build with nice and
+ionice. Where a delegated cgroup v2 hierarchy is available, each build
+also runs in a transient child cgroup with cpu.weight, io.weight and
+memory.high set, so the kernel enforces the class across the whole make
+tree, and the cgroup accounts for the resources the tree used.
+
+The class is applied by prefixing the command with nice, ionice and a
+shell joining the cgroup, which exec the command in turn. No Python code
+runs between fork and exec, which would be unsafe with other threads
+running, such as those of concurrent builds.
+
+Example:
+    .. code-block:: python
+        from kbuilder.core.make import MakeRunner
+        from kbuilder.core.priority import PRIORITY_CLASSES
+
+        runner = MakeRunner(priority=PRIORITY_CLASSES['batch'])
+        result = runner.run('all')
+        print(result.cgroup)
+"""
+
+import itertools
+import os
+import shutil
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional
+
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+
+# Moves the shell into the cgroup given as $0, then execs the command.
+_JOIN_CGROUP = '{ echo $$ > "$0/cgroup.procs"; } 2>/dev/null; exec "$@"'
+
+
+class PriorityClass(namedtuple('PriorityClass', 'name nice ioprio_class ioprio_level '
+                                                'cpu_weight io_weight memory_high')):
+    """Scheduling priority of a build.
+
+    Properties:
+        name: Name of the class.
+        nice: Niceness of make and its children.
+        ioprio_class: I/O scheduling class.
+        ioprio_level: Level within a best-effort I/O scheduling class.
+        cpu_weight: cgroup cpu.weight, from 1 to 10000.
+        io_weight: cgroup io.weight, from 1 to 10000.
+        memory_high: cgroup memory.high as a fraction of the system memory,
+            or None for no limit.
+    """
+
+    def command(self, argv: List[str], cgroup: Optional['Cgroup']=None) -> List[str]:
+        """Return argv prefixed with the commands applying this class.
+
+        The niceness is only raised, never lowered. nice and ionice are
+        skipped if they are not installed, and the command runs even if
+        they or the cgroup cannot be applied.
+
+        Args:
+            argv: The command to run.
+            cgroup: The cgroup the command joins before it is executed.
+        """
+        prefix = []
+        if cgroup:
+            prefix += ['sh', '-c', _JOIN_CGROUP, str(cgroup.path)]
+        increment = self.nice - os.getpriority(os.PRIO_PROCESS, 0)
+        if increment > 0 and shutil.which('nice'):
+            prefix += ['nice', '-n', str(increment)]
+        if shutil.which('ionice'):
+            prefix += ['ionice', '-t', '-c', str(self.ioprio_class)]
+            if self.ioprio_class != IOPRIO_CLASS_IDLE:
+                prefix += ['-n', str(self.ioprio_level)]
+        return prefix + list(argv)
+
+
+PRIORITY_CLASSES = {
+    'interactive': PriorityClass('interactive', 0, IOPRIO_CLASS_BE, 4, 100, 100, None),
+    'normal': PriorityClass('normal', 5, IOPRIO_CLASS_BE, 6, 50, 50, 0.9),
+    'batch': PriorityClass('batch', 19, IOPRIO_CLASS_IDLE, 0, 10, 10, 0.5),
+}
+
+
+def total_memory() -> int:
+    """Return the size of the system memory in bytes."""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def cgroup2_mount() -> Optional[Path]:
+    """Return the mount point of the cgroup v2 hierarchy, if mounted."""
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if fields[2] == 'cgroup2':
+                    return Path(fields[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_cgroup() -> Optional[Path]:
+    """Return the directory of the cgroup v2 of this process, if any."""
+    mount = cgroup2_mount()
+    if not mount:
+        return None
+    try:
+        with open('/proc/self/cgroup') as cgroups:
+            for line in cgroups:
+                if line.startswith('0::'):
+                    return mount / line[3:].strip().lstrip('/')
+    except OSError:
+        pass
+    return None
+
+
+class Cgroup(object):
+    """A transient cgroup v2 holding a single build.
+
+    Properties:
+        path: Directory of the cgroup.
+        skipped: Interface files of the limits which could not be applied.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.skipped = []
+
+    @classmethod
+    def create(cls, priority: PriorityClass, parent: Optional[Path]=None,
+               memory_high: Optional[int]=None) -> Optional['Cgroup']:
+        """Create a child cgroup with the limits of a priority class.
+
+        Controllers missing in the parent are enabled where permitted;
+        limits of controllers which are not available are skipped and
+        recorded in the skipped property. Enabling controllers fails when
+        the parent holds processes itself, as the parent of the cgroup of
+        this process does by default; a delegated parent without processes
+        of its own avoids that.
+
+        Args:
+            priority: The priority class whose limits are applied.
+            parent: The delegated cgroup to create the child in
+                (default: the cgroup of this process).
+            memory_high: memory.high in bytes, overriding the priority class.
+
+        Returns:
+            The cgroup, or None if cgroup v2 is unavailable or not writable.
+        """
+        parent = Path(parent) if parent else current_cgroup()
+        if not parent or not os.access(str(parent), os.W_OK):
+            return None
+        path = parent / 'kbuilder-{}-{}'.format(os.getpid(), next(cls._counter))
+        try:
+            path.mkdir()
+        except OSError:
+            return None
+        cgroup = cls(path)
+
+        try:
+            available = (parent / 'cgroup.controllers').read_text().split()
+            enabled = (parent / 'cgroup.subtree_control').read_text().split()
+        except OSError:
+            available, enabled = [], []
+        missing = [name for name in ('cpu', 'io', 'memory')
+                   if name in available and name not in enabled]
+        if missing:
+            # Fails if the parent itself holds processes; limits are skipped then.
+            cgroup._write(parent / 'cgroup.subtree_control',
+                          ' '.join('+' + name for name in missing))
+
+        if memory_high is None and priority.memory_high:
+            memory_high = int(total_memory() * priority.memory_high)
+        limits = [('cpu.weight', str(priority.cpu_weight)),
+                  ('io.weight', 'default {}'.format(priority.io_weight))]
+        if memory_high:
+            limits.append(('memory.high', str(memory_high)))
+        for name, value in limits:
+            if not cgroup._write(path / name, value):
+                cgroup.skipped.append(name)
+        return cgroup
+
+    @staticmethod
+    def _write(path: Path, value: str) -> bool:
+        """Write a cgroup interface file, returning whether it succeeded."""
+        try:
+            with open(str(path), 'w') as file:
+                file.write(value)
+        except OSError:
+            return False
+        return True
+
+    def _read_keyed(self, name: str) -> Dict[str, int]:
+        """Read a flat keyed cgroup interface file such as cpu.stat."""
+        values = {}
+        try:
+            with open(str(self.path / name)) as file:
+                for line in file:
+                    key, _, value = line.partition(' ')
+                    if value.strip().isdigit():
+                        values[key] = int(value)
+        except OSError:
+            pass
+        return values
+
+    def stats(self) -> Dict[str, int]:
+        """Return the resources used by the processes of this cgroup.
+
+        Only statistics of available controllers are included.
+        """
+        stats = {}
+        cpu = self._read_keyed('cpu.stat')
+        for key in ('usage_usec', 'user_usec', 'system_usec', 'nr_throttled',
+                    'throttled_usec'):
+            if key in cpu:
+                stats['cpu_' + key] = cpu[key]
+        for name in ('memory.peak', 'memory.current'):
+            try:
+                stats[name.replace('.', '_')] = int((self.path / name).read_text())
+            except (OSError, ValueError):
+                pass
+        events = self._read_keyed('memory.events')
+        if 'high' in events:
+            stats['memory_high_events'] = events['high']
+        try:
+            io_stat = (self.path / 'io.stat').read_text()
+        except OSError:
+            io_stat = None
+        if io_stat is not None:
+            stats['io_rbytes'] = stats['io_wbytes'] = 0
+            for line in io_stat.splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key in ('rbytes', 'wbytes'):
+                        stats['io_' + key] += int(value)
+        return stats
+
+    def remove(self, timeout: float=5.0) -> None:
+        """Remove the cgroup once its processes exited, killing stragglers."""
+        deadline = time.monotonic() + timeout
+        killed = False
+        while True:
+            try:
+                self.path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    return
+                if not killed and time.monotonic() > deadline - timeout / 2:
+                    killed = self._write(self.path / 'cgroup.kill', '1')
+                time.sleep(0.05)
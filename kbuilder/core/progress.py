@@ -0,0 +1,221 @@
+"""Progress of kernel builds.
+
+Unless make is silent, kbuild prints a line such as ``  CC      kernel/fork.o``
+for every command it runs. BuildProgress counts the objects compiled in the
+streaming output, and tells the stage of the build from the commands:
+compiling the objects, linking vmlinux, and compressing and packing the
+kbuild image.
+
+The count is compared with the objects and the stage times of the last
+comparable build to estimate how much of the build is done and how long
+the rest takes. Early in the compile stage the estimate follows the time
+the last build took; the more objects are compiled, the more it follows
+the pace of the running build.
+
+The latest build is not necessarily comparable: after an incremental
+build of a few objects, a full build compiles thousands. Once the running
+build compiled clearly more objects than its reference, the smallest of
+the recent builds which still compiled enough objects becomes the
+reference. Without one, only the count is shown.
+
+The state of a running build is written as JSON, one file per kernel in
+a hidden directory of the export directory, where `kbuilder serve` lists
+it at /progress.
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+# The stages of a build, in the order they run.
+STAGES = ('compile', 'link', 'compression')
+
+# Directory of the progress files in the export directory.
+PROGRESS_DIR = '.progress'
+
+#   CC [M]  drivers/usb/core/hub.o
+_command = re.compile(r'^  (?P<command>[A-Z][A-Z0-9_]*)(?: \[M\])?\s+(?P<target>\S+)')
+
+_compile_commands = {'CC', 'AS', 'CPP', 'CXX', 'HOSTCC', 'HOSTCXX'}
+_link_commands = {'MODPOST', 'KSYM', 'KSYMS', 'SYSMAP', 'SORTEX', 'SORTTAB', 'BTF', 'BTFIDS'}
+_compression_commands = {'GZIP', 'BZIP2', 'LZMA', 'LZO', 'LZ4', 'XZKERN', 'ZSTD', 'ZSTD22',
+                         'CAT', 'MKIMAGE', 'UIMAGE'}
+
+
+def is_comparable(reference: Dict, objects: int) -> bool:
+    """Return whether a build which compiled objects so far may match a reference build.
+
+    A few more objects than the reference are tolerated, such as the
+    objects which embed the version.
+    """
+    return objects <= (reference.get('objects') or 0) * 1.25 + 16
+
+
+def command_stage(command: str, target: str) -> str:
+    """Return the stage of the build a kbuild command belongs to."""
+    if command in _compression_commands or ('/boot/' in target and '/dts/' not in target):
+        return 'compression'
+    name = target.rsplit('/', 1)[-1]
+    if command in _link_commands or name.startswith(('vmlinux', '.tmp_vmlinux')):
+        return 'link'
+    return 'compile'
+
+
+class BuildProgress(object):
+    """The progress of a kbuild image build.
+
+    Properties:
+        kernel: Name of the kernel being built.
+        reference: The progress of the build the estimates are based on as
+            returned by to_dict(), or None.
+        objects: Amount of objects compiled so far.
+        stage: The current stage.
+        stages: (name, seconds) tuples of the stages finished so far.
+        started: Time the build started.
+        finished: Whether make exited.
+        success: Whether make succeeded, once finished.
+    """
+
+    def __init__(self, kernel: str, *, references: Sequence[Dict]=(),
+                 clock: Callable[[], float]=time.monotonic) -> None:
+        """Initialize a new BuildProgress.
+
+        Args:
+            kernel: Name of the kernel being built.
+            references: The progress of recent builds, newest first. The
+                newest is the reference until the build outgrows it.
+            clock: Monotonic clock of the stage times.
+        """
+        self.kernel = kernel
+        self.reference = None
+        self.objects = 0
+        self.stage = STAGES[0]
+        self.stages = []
+        self.started = time.time()
+        self.finished = False
+        self.success = None
+        self._clock = clock
+        self._start = clock()
+        self._stage_start = self._start
+        self._references = list(references)
+        self._reference_stages = {}
+        self._use_reference(self._references[0] if self._references else None)
+
+    def _use_reference(self, reference: Optional[Dict]) -> None:
+        self.reference = reference
+        self._reference_stages = {stage['name']: stage['duration']
+                                  for stage in (reference or {}).get('stages', [])}
+
+    def feed(self, line: str) -> None:
+        """Follow a line of build output."""
+        match = _command.match(line)
+        if not match:
+            return
+        command, target = match.group('command', 'target')
+        stage = command_stage(command, target)
+        if STAGES.index(stage) > STAGES.index(self.stage):
+            self._enter(stage)
+        if command in _compile_commands and target.endswith('.o'):
+            self.objects += 1
+            if self.reference and not is_comparable(self.reference, self.objects):
+                self._use_reference(min(
+                    (reference for reference in self._references
+                     if (reference.get('objects') or 0) >= self.objects),
+                    key=lambda reference: reference['objects'], default=None))
+
+    def _enter(self, stage: str) -> None:
+        now = self._clock()
+        self.stages.append((self.stage, now - self._stage_start))
+        self.stage = stage
+        self._stage_start = now
+
+    def finish(self, success: bool) -> None:
+        """Record the end of the build and the time of its last stage."""
+        if not self.finished:
+            self.stages.append((self.stage, self._clock() - self._stage_start))
+        self.finished = True
+        self.success = success
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the build started."""
+        return self._clock() - self._start
+
+    @property
+    def expected_objects(self) -> Optional[int]:
+        """Amount of objects the last comparable build compiled."""
+        return self.reference.get('objects') if self.reference else None
+
+    def remaining(self) -> Optional[float]:
+        """Estimate the seconds until the build finishes.
+
+        Returns:
+            The estimate, or None without a comparable build.
+        """
+        if self.reference is None:
+            return None
+        if self.finished:
+            return 0.0
+        in_stage = self._clock() - self._stage_start
+        expected = self._reference_stages.get(self.stage, 0.0)
+        later = sum(self._reference_stages.get(stage, 0.0)
+                    for stage in STAGES[STAGES.index(self.stage) + 1:])
+        done = 0.0
+        if self.stage == 'compile' and self.expected_objects:
+            done = min(self.objects / self.expected_objects, 0.99)
+        if not done:
+            return max(expected - in_stage, 0.0) + later
+        by_reference = expected * (1 - done)
+        by_pace = in_stage * (1 - done) / done
+        return (1 - done) * by_reference + done * by_pace + later
+
+    def fraction(self) -> Optional[float]:
+        """Estimate the part of the build which is done, from 0 to 1.
+
+        Returns:
+            The estimate, or None without a comparable build.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        elapsed = self.elapsed
+        return elapsed / (elapsed + remaining) if elapsed + remaining else 1.0
+
+    def to_dict(self) -> Dict:
+        """Return the progress as JSON serializable dict."""
+        return {'kernel': self.kernel,
+                'started': self.started,
+                'elapsed': self.elapsed,
+                'stage': self.stage,
+                'objects': self.objects,
+                'expected_objects': self.expected_objects,
+                'fraction': self.fraction(),
+                'remaining': self.remaining(),
+                'stages': [{'name': name, 'duration': seconds}
+                           for name, seconds in self.stages],
+                'finished': self.finished,
+                'success': self.success}
+
+    def write(self, directory: Path) -> None:
+        """Atomically write the progress into the progress files of a directory."""
+        path = Path(directory, PROGRESS_DIR, '{}.json'.format(self.kernel))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name('.{}.{}.tmp'.format(path.name, os.getpid()))
+        temp.write_text(json.dumps(self.to_dict(), indent=2) + '\n')
+        os.replace(str(temp), str(path))
+
+
+def read_progress(directory: Path) -> Dict[str, Dict]:
+    """Return the progress of the latest build of each kernel in a directory."""
+    builds = {}
+    for path in sorted(Path(directory, PROGRESS_DIR).glob('*.json')):
+        try:
+            with open(str(path)) as file:
+                progress = json.load(file)
+            builds[progress['kernel']] = progress
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    return builds
@@ -0,0 +1,404 @@
+"""A remote tier of the build caches, shared by a team over HTTP.
+
+The protocol follows the HTTP caches of Bazel and similar build tools:
+
+    GET/HEAD/PUT /cas/<sha256>   a blob, addressed by the digest of its contents
+    GET/HEAD/PUT /ac/<key>       a JSON manifest of blobs, addressed by the
+                                 key of the inputs they were built from
+
+Blobs are shared between manifests, so outputs which did not change between
+two builds are only stored and transferred once. The server checks the
+digest of every uploaded blob, so a blob always matches its address, and
+clients check the digest of every downloaded blob as well. Manifests can
+not be checked that way: a client which may upload can store any manifest
+under any key, and every other client trusts it. The server therefore
+accepts uploads only with its token, sent as a bearer token in the
+Authorization header, unless it was started without one.
+
+A reference server is included, so a team cache can be run on any machine,
+taking its token from the KBUILDER_CACHE_TOKEN environment variable:
+
+    python3 -m kbuilder.core.remote_cache STORE_DIR [HOST:]PORT
+"""
+
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.modules import file_digest
+
+_digest = re.compile(r'^[0-9a-f]{64}$')
+_key = re.compile(r'^[0-9A-Za-z_.-]{1,128}$')
+
+
+class RemoteCache(object):
+    """A client of a remote cache.
+
+    Transfers of blobs run on a pool of threads, each with a persistent
+    connection to the server. Uploads run in a background thread which
+    uses the same pool. Errors are raised as KbuilderRuntimeError by the
+    synchronous methods, and returned by wait() for the uploads, so the
+    caller decides whether they fail a build.
+
+    Properties:
+        url: Base URL of the server.
+        jobs: Amount of concurrent transfers.
+        timeout: Seconds to wait for the server.
+        token: Token authorizing uploads, or None.
+    """
+
+    chunk_size = 1 << 20
+
+    def __init__(self, url: str, *, jobs: int=8, timeout: float=30.0,
+                 token: Optional[str]=None) -> None:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('Invalid remote cache URL: {}'.format(url))
+        self.url = url
+        self.jobs = jobs
+        self.timeout = timeout
+        self.token = token
+        self._parts = parts
+        self._local = threading.local()
+        self._transfers = ThreadPoolExecutor(max_workers=jobs)
+        self._background = ThreadPoolExecutor(max_workers=1)
+        self._uploads = []
+
+    def _connection(self) -> http.client.HTTPConnection:
+        """Return the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection_class = (http.client.HTTPSConnection if self._parts.scheme == 'https'
+                                else http.client.HTTPConnection)
+            connection = connection_class(self._parts.hostname, self._parts.port,
+                                          timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, body=None, headers: Optional[Dict]=None,
+                 sink=None) -> Optional[bytes]:
+        """Send a request, retrying once on a connection the server closed.
+
+        Args:
+            sink: A file the body of a successful response is written to
+                instead of being returned.
+
+        Returns:
+            The body of the response, or None if the server does not have it.
+
+        Raises:
+            KbuilderRuntimeError: If the request failed.
+        """
+        path = self._parts.path.rstrip('/') + path
+        if method == 'PUT' and self.token:
+            headers = dict(headers or {}, Authorization='Bearer ' + self.token)
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                if body is not None and hasattr(body, 'seek'):
+                    body.seek(0)
+                if sink is not None:
+                    sink.seek(0)
+                    sink.truncate()
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                if response.status == 200 and sink is not None:
+                    for chunk in iter(lambda: response.read(RemoteCache.chunk_size), b''):
+                        sink.write(chunk)
+                    data = b''
+                else:
+                    data = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                self._local.connection = None
+                if attempt or isinstance(error, TimeoutError):
+                    raise KbuilderRuntimeError('{} {}{} failed: {}'.format(
+                        method, self.url, path, error))
+                continue
+            if response.status == 404:
+                return None
+            if response.status not in (200, 201, 204):
+                raise KbuilderRuntimeError('{} {}{} failed: {} {}'.format(
+                    method, self.url, path, response.status, response.reason))
+            return data
+
+    def has_blob(self, digest: str) -> bool:
+        """Return whether the server has a blob."""
+        return self._request('HEAD', '/cas/' + digest) is not None
+
+    def get_blob(self, digest: str, path: Path) -> bool:
+        """Download a blob into a file.
+
+        Returns:
+            Whether the server had the blob.
+
+        Raises:
+            KbuilderRuntimeError: If the download failed or is corrupt.
+        """
+        path = Path(path)
+        temp = path.with_name('.{}.tmp'.format(path.name))
+        try:
+            with open(str(temp), 'wb') as file:
+                found = self._request('GET', '/cas/' + digest, sink=file) is not None
+            if found and file_digest(temp) != digest:
+                raise KbuilderRuntimeError('Corrupt blob {} from {}'.format(digest, self.url))
+            if found:
+                os.replace(str(temp), str(path))
+            return found
+        finally:
+            if temp.exists():
+                temp.unlink()
+
+    def put_blob(self, path: Path, digest: Optional[str]=None) -> bool:
+        """Upload a file as a blob, unless the server already has it.
+
+        Returns:
+            Whether the blob was uploaded.
+        """
+        digest = digest or file_digest(path)
+        if self.has_blob(digest):
+            return False
+        with open(str(path), 'rb') as file:
+            self._request('PUT', '/cas/' + digest, body=file, headers={
+                'Content-Length': str(os.fstat(file.fileno()).st_size),
+                'Content-Type': 'application/octet-stream'})
+        return True
+
+    def get_manifest(self, key: str) -> Optional[Dict]:
+        """Return the manifest stored under a key, if any."""
+        data = self._request('GET', '/ac/' + key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode())
+        except ValueError:
+            raise KbuilderRuntimeError('Corrupt manifest {} from {}'.format(key, self.url))
+
+    def put_manifest(self, key: str, manifest: Dict) -> None:
+        """Store a manifest under a key."""
+        self._request('PUT', '/ac/' + key, body=json.dumps(manifest).encode(),
+                      headers={'Content-Type': 'application/json'})
+
+    def prefetch(self, blobs: Dict[str, Path]) -> List[str]:
+        """Download blobs in parallel.
+
+        Args:
+            blobs: The files to download blobs into, by their digests.
+
+        Returns:
+            The digests of the blobs the server does not have.
+
+        Raises:
+            KbuilderRuntimeError: If a download failed.
+        """
+        found = self._transfers.map(lambda item: self.get_blob(*item), blobs.items())
+        return [digest for digest, exists in zip(blobs, list(found)) if not exists]
+
+    def put_blobs(self, blobs: Dict[str, Path]) -> int:
+        """Upload files as blobs in parallel, skipping those the server has.
+
+        Args:
+            blobs: The files to upload, by their digests.
+
+        Returns:
+            The amount of blobs uploaded.
+        """
+        uploaded = self._transfers.map(lambda item: self.put_blob(item[1], item[0]),
+                                       blobs.items())
+        return sum(uploaded)
+
+    def upload(self, function, *args) -> None:
+        """Run an upload in the background; wait() collects its outcome."""
+        self._uploads.append(self._background.submit(function, *args))
+
+    def wait(self) -> List[Exception]:
+        """Wait for the background uploads to finish.
+
+        Returns:
+            The errors of the uploads which failed.
+        """
+        uploads, self._uploads = self._uploads, []
+        errors = [upload.exception() for upload in uploads]
+        return [error for error in errors if error]
+
+    def close(self) -> None:
+        """Wait for the background uploads and release the threads."""
+        self._background.shutdown(wait=True)
+        self._transfers.shutdown(wait=True)
+
+
+class CacheStore(object):
+    """The storage of the reference cache server.
+
+    Blobs and manifests are files in a directory. Writes are atomic, so
+    concurrent uploads of the same blob are harmless, and the least recently
+    used entries are removed once the store exceeds its size budget.
+
+    Properties:
+        root: Directory of the store.
+        max_size: Size budget in bytes, or 0 for no limit.
+    """
+
+    def __init__(self, root: Path, max_size: int=0) -> None:
+        self.root = Path(root)
+        self.max_size = max_size
+        for kind in ('ac', 'cas'):
+            (self.root / kind).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(entry.stat().st_size for kind in ('ac', 'cas')
+                         for entry in os.scandir(str(self.root / kind)) if entry.is_file())
+
+    def path(self, kind: str, key: str) -> Optional[Path]:
+        """Return the file of an entry, or None if the address is invalid."""
+        if kind == 'cas' and _digest.match(key) or kind == 'ac' and _key.match(key):
+            return self.root / kind / key
+        return None
+
+    def write(self, kind: str, key: str, stream, length: int) -> None:
+        """Store an entry read from a stream.
+
+        Raises:
+            ValueError: If the contents of a blob do not match its digest.
+        """
+        path = self.path(kind, key)
+        temp = path.with_name('.{}.{}.tmp'.format(key, threading.get_ident()))
+        digest = hashlib.sha256()
+        try:
+            with open(str(temp), 'wb') as file:
+                remaining = length
+                while remaining:
+                    chunk = stream.read(min(RemoteCache.chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError('Truncated upload')
+                    digest.update(chunk)
+                    file.write(chunk)
+                    remaining -= len(chunk)
+            if kind == 'cas' and digest.hexdigest() != key:
+                raise ValueError('Contents do not match digest {}'.format(key))
+            os.replace(str(temp), str(path))
+        finally:
+            if temp.exists():
+                temp.unlink()
+        with self._lock:
+            self._size += length
+            if self.max_size and self._size > self.max_size:
+                self._prune()
+
+    def _prune(self) -> None:
+        """Remove the least recently used entries until the store is 90% full."""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for kind in ('ac', 'cas')
+                         for entry in os.scandir(str(self.root / kind))
+                         if entry.is_file() and not entry.name.startswith('.'))
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    """Serves the entries of the CacheStore of the server."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'kbuilder-cache'
+    # Headers and body are written separately; do not delay the body.
+    disable_nagle_algorithm = True
+
+    def _entry(self) -> Optional[Path]:
+        """Return the file addressed by the request, answering 404 if it is invalid."""
+        parts = self.path.split('/')
+        path = self.server.store.path(*parts[1:]) if len(parts) == 3 else None
+        if not path:
+            self.send_error(404)
+        return path
+
+    def _send_entry(self, head: bool) -> None:
+        path = self._entry()
+        if not path:
+            return
+        try:
+            file = open(str(path), 'rb')
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        with file:
+            os.utime(file.fileno())
+            self.send_response(200)
+            self.send_header('Content-Length', str(os.fstat(file.fileno()).st_size))
+            self.send_header('Content-Type', 'application/json' if '/ac/' in self.path
+                             else 'application/octet-stream')
+            self.end_headers()
+            if not head:
+                shutil.copyfileobj(file, self.wfile, RemoteCache.chunk_size)
+
+    def do_GET(self):
+        self._send_entry(head=False)
+
+    def do_HEAD(self):
+        self._send_entry(head=True)
+
+    def do_PUT(self):
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get('Authorization', ''),
+                                             'Bearer ' + token):
+            self.close_connection = True
+            self.send_error(401)
+            return
+        path = self._entry()
+        if not path:
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+            self.server.store.write(path.parent.name, path.name, self.rfile, length)
+        except (TypeError, ValueError) as error:
+            self.close_connection = True
+            self.send_error(400, str(error))
+            return
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+    """The reference cache server, answering each connection in a thread.
+
+    Properties:
+        store: The CacheStore of the entries.
+        token: Token uploads must be sent with, or None to accept any upload.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, store: CacheStore, host: str='', port: int=8090, *,
+                 token: Optional[str]=None) -> None:
+        self.store = store
+        self.token = token
+        super().__init__((host, port), _CacheRequestHandler)
+
+
+if __name__ == '__main__':
+    host, _, port = (sys.argv[2] if len(sys.argv) > 2 else '8090').rpartition(':')
+    CacheServer(CacheStore(Path(sys.argv[1])), host, int(port),
+                token=os.environ.get('KBUILDER_CACHE_TOKEN') or None).serve_forever()
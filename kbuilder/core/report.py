@@ -0,0 +1,192 @@
+"""Machine readable build results.
+
+A BuildReport records the phases, artifacts and outcome of a build. It can
+be written as a JSON document, and as metrics in the Prometheus text format
+for the node exporter's textfile collector.
+"""
+
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from kbuilder.core.modules import file_digest
+
+_warning = re.compile(r'\bwarning:')
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    """Write a file so readers never observe partial contents."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name('.{}.{}.tmp'.format(path.name, os.getpid()))
+    temp.write_text(text)
+    os.replace(temp.as_posix(), path.as_posix())
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    """Format labels of a Prometheus sample."""
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in sorted(labels.items()))
+    return '{' + ','.join(pairs) + '}'
+
+
+class BuildReport(object):
+    """Results of a single kbuilder build command.
+
+    Properties:
+        command: The build command, such as kbuild_image or ota_package.
+        kernel: Name of the kernel being built.
+        compiler: Name of the compiler used.
+        phases: A list of (name, seconds) tuples in the order they ran.
+        artifacts: A list of dicts describing the files produced.
+        warnings: Amount of compiler warnings.
+        error: Description of the error which failed the build, if any.
+        cgroup: Statistics of the cgroup the build ran in, if any.
+        sections: Sizes of the allocated sections of vmlinux, if built.
+        progress: The progress of the kbuild image build as a dict, if
+            followed.
+    """
+
+    def __init__(self, command: str, *, kernel: str, compiler: Optional[str]=None) -> None:
+        self.command = command
+        self.kernel = kernel
+        self.compiler = compiler
+        self.phases = []
+        self.artifacts = []
+        self.warnings = 0
+        self.error = None
+        self.cgroup = None
+        self.sections = None
+        self.progress = None
+        self.started = time.time()
+        self.duration = None
+        self._start = time.monotonic()
+
+    @property
+    def success(self) -> bool:
+        """Whether the build finished without an error."""
+        return self.error is None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase of the build."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - start))
+
+    def count_warnings(self, line: str) -> None:
+        """Count compiler warnings in a line of build output."""
+        if _warning.search(line):
+            self.warnings += 1
+
+    def add_artifact(self, path: Path, kind: str, *, sha256: Optional[str]=None,
+                     **fields) -> None:
+        """Record a file produced by the build.
+
+        Args:
+            sha256: Digest of the file if already known, to avoid reading it.
+            fields: Further properties of the artifact.
+        """
+        path = Path(path)
+        artifact = {'kind': kind,
+                    'path': path.absolute().as_posix(),
+                    'size': path.stat().st_size,
+                    'sha256': sha256 or file_digest(path)}
+        artifact.update(fields)
+        self.artifacts.append(artifact)
+
+    def fail(self, error: str) -> None:
+        """Mark the build as failed."""
+        self.error = str(error)
+
+    def finish(self) -> None:
+        """Record the total duration of the build."""
+        self.duration = time.monotonic() - self._start
+
+    def to_dict(self) -> Dict:
+        """Return the report as JSON serializable dict."""
+        return {'command': self.command,
+                'kernel': self.kernel,
+                'compiler': self.compiler,
+                'success': self.success,
+                'error': self.error,
+                'started': self.started,
+                'duration': self.duration,
+                'phases': [{'name': name, 'duration': seconds}
+                           for name, seconds in self.phases],
+                'artifacts': self.artifacts,
+                'warnings': self.warnings,
+                'cgroup': self.cgroup,
+                'sections': self.sections,
+                'progress': self.progress}
+
+    def write_json(self, path: Path) -> None:
+        """Write the report as a JSON document."""
+        _atomic_write(path, json.dumps(self.to_dict(), indent=2) + '\n')
+
+    def write_prometheus(self, path: Path) -> None:
+        """Write the report as metrics for the textfile collector.
+
+        The builds_total counter is carried over from the previous contents
+        of the file.
+        """
+        labels = {'kernel': self.kernel, 'compiler': self.compiler or '',
+                  'command': self.command}
+        totals = _read_counters(path, 'kbuilder_builds_total')
+        result_labels = dict(labels, result='success' if self.success else 'failure')
+        key = _labels(result_labels)
+        totals[key] = totals.get(key, 0) + 1
+
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List) -> None:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for sample_labels, value in samples:
+                if not isinstance(sample_labels, str):
+                    sample_labels = _labels(sample_labels)
+                lines.append('{}{} {}'.format(name, sample_labels, value))
+
+        metric('kbuilder_builds_total', 'counter', 'Builds finished by kbuilder.',
+               sorted(totals.items()))
+        metric('kbuilder_build_success', 'gauge', 'Whether the last build succeeded.',
+               [(labels, int(self.success))])
+        metric('kbuilder_build_duration_seconds', 'gauge', 'Duration of the last build.',
+               [(labels, self.duration or 0)])
+        metric('kbuilder_build_phase_duration_seconds', 'gauge',
+               'Duration of each phase of the last build.',
+               [(dict(labels, phase=name), seconds) for name, seconds in self.phases])
+        metric('kbuilder_build_warnings', 'gauge', 'Compiler warnings of the last build.',
+               [(labels, self.warnings)])
+        sizes = {}
+        for artifact in self.artifacts:
+            sizes[artifact['kind']] = sizes.get(artifact['kind'], 0) + artifact['size']
+        metric('kbuilder_build_artifact_size_bytes', 'gauge',
+               'Total size of the artifacts of the last build, by kind.',
+               [(dict(labels, artifact=kind), size) for kind, size in sorted(sizes.items())])
+        metric('kbuilder_build_last_timestamp_seconds', 'gauge',
+               'Time the last build started.', [(labels, self.started)])
+        _atomic_write(path, '\n'.join(lines) + '\n')
+
+
+def _read_counters(path: Path, name: str) -> Dict[str, int]:
+    """Read the samples of a metric from a Prometheus text file."""
+    counters = {}
+    try:
+        text = Path(path).read_text()
+    except FileNotFoundError:
+        return counters
+    for line in text.splitlines():
+        if line.startswith(name + '{'):
+            labels, _, value = line[len(name):].rpartition(' ')
+            try:
+                counters[labels] = int(float(value))
+            except ValueError:
+                pass
+    return counters
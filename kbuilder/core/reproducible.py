@@ -0,0 +1,117 @@
+"""Reproducible builds.
+
+Two builds of the same sources should produce the same bytes, so their
+artifacts can be deduplicated, cached and diffed. The kernel embeds the
+time, user and host of the build and a count of its builds in its version
+unless KBUILD_BUILD_TIMESTAMP, KBUILD_BUILD_USER, KBUILD_BUILD_HOST and
+KBUILD_BUILD_VERSION are set, and zip archives record the modification
+times, order and permissions of their files.
+
+Following https://reproducible-builds.org/specs/source-date-epoch/, the
+time of a build is SOURCE_DATE_EPOCH if set, and the time of the commit
+checked out otherwise.
+"""
+
+import os
+import shutil
+import subprocess
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+# The earliest time a zip archive can record.
+_zip_epoch = 315532800
+
+
+def source_date_epoch(root: Path, environ: Optional[Mapping[str, str]]=None) -> int:
+    """Return the time reproducible outputs of a tree record.
+
+    Returns:
+        SOURCE_DATE_EPOCH, or the commit time of HEAD, or 0 outside of
+        git trees.
+
+    Raises:
+        ValueError: If SOURCE_DATE_EPOCH is no timestamp.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get('SOURCE_DATE_EPOCH')
+    if value:
+        if not value.isdigit():
+            raise ValueError('SOURCE_DATE_EPOCH is no timestamp: {}'.format(value))
+        return int(value)
+    try:
+        return int(subprocess.check_output(
+            ['git', '-C', str(root), 'log', '-1', '--format=%ct'],
+            stderr=subprocess.DEVNULL).decode().strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return 0
+
+
+def build_variables(epoch: int, user: str, host: str) -> Dict[str, str]:
+    """Return the environment fixing the build stamp of the kernel."""
+    return {'SOURCE_DATE_EPOCH': str(epoch),
+            'KBUILD_BUILD_TIMESTAMP': time.strftime('%a %b %d %H:%M:%S UTC %Y',
+                                                    time.gmtime(epoch)),
+            'KBUILD_BUILD_USER': user,
+            'KBUILD_BUILD_HOST': host,
+            'KBUILD_BUILD_VERSION': '1'}
+
+
+def zip_date_time(epoch: int) -> Tuple[int, ...]:
+    """Return the date_time of zip members of a timestamp, in UTC."""
+    return time.gmtime(max(epoch, _zip_epoch))[:6]
+
+
+def add_members(output: zipfile.ZipFile, source_dir: Path, epoch: Optional[int]) -> None:
+    """Add the contents of a directory to a zip archive in a stable way.
+
+    Members are sorted by name and are readable by all, and executable by
+    all if any execute bit was set. Files are deflated at the default
+    level and symbolic links are followed, like shutil.make_archive does.
+
+    Args:
+        output: The archive.
+        source_dir: The directory to add.
+        epoch: Timestamp of all members, or None to keep the modification
+            times of the files.
+    """
+    source_dir = Path(source_dir)
+    members = []
+    for directory, dirs, files in os.walk(str(source_dir), followlinks=True):
+        directory = Path(directory)
+        members.extend((directory / name, True) for name in dirs)
+        members.extend((directory / name, False) for name in files)
+    members.sort(key=lambda member: member[0].relative_to(source_dir).as_posix())
+
+    for path, is_dir in members:
+        name = path.relative_to(source_dir).as_posix()
+        stat = path.stat()
+        date_time = zip_date_time(int(stat.st_mtime) if epoch is None else epoch)
+        if is_dir:
+            info = zipfile.ZipInfo(name + '/', date_time)
+            info.external_attr = (0o40755 << 16) | 0x10
+            info.create_system = 3
+            output.writestr(info, b'')
+            continue
+        info = zipfile.ZipInfo(name, date_time)
+        info.external_attr = (0o100755 if stat.st_mode & 0o111 else 0o100644) << 16
+        info.create_system = 3
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.file_size = stat.st_size
+        with open(str(path), 'rb') as source, output.open(info, 'w') as destination:
+            shutil.copyfileobj(source, destination, 1 << 20)
+
+
+def write_zip(source_dir: Path, archive: Path, epoch: int) -> Path:
+    """Archive a directory into a zip file which only depends on its contents.
+
+    Returns:
+        The archive.
+    """
+    archive = Path(archive)
+    temp = archive.with_name('.{}.tmp'.format(archive.name))
+    with zipfile.ZipFile(str(temp), 'w', zipfile.ZIP_DEFLATED) as output:
+        add_members(output, source_dir, epoch)
+    os.replace(str(temp), str(archive))
+    return archive
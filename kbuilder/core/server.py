@@ -0,0 +1,395 @@
+"""An HTTP server for the artifacts in the export directory.
+
+Every successful build records the artifacts it wrote into the export
+directory in its index.json, with the kernel, compiler and sha256 digest
+of each. ArtifactServer serves the files of the export directory, a
+JSON listing of the latest artifacts per kernel and compiler at /latest,
+and the progress of the latest build of each kernel at /progress.
+
+The server is a single asyncio event loop, so hundreds of concurrent
+downloads only cost a socket and a file each. File contents are written
+with sendfile, so they never pass through user space. Range requests let
+interrupted downloads resume, and ETags are the sha256 digests of the
+contents, so clients can tell whether an artifact which was rebuilt under
+the same name actually changed.
+"""
+
+import asyncio
+import email.utils
+import json
+import mimetypes
+import os
+import stat
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from kbuilder.core.modules import file_digest
+from kbuilder.core.progress import read_progress
+from kbuilder.core.report import BuildReport
+
+Request = namedtuple('Request', 'method path version headers')
+
+_reasons = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+            404: 'Not Found', 405: 'Method Not Allowed',
+            416: 'Range Not Satisfiable'}
+
+
+class ExportIndex(object):
+    """The artifacts of successful builds in the export directory.
+
+    Properties:
+        directory: The export directory.
+        entries: Dicts describing the artifacts, by their paths relative to
+            the export directory.
+    """
+
+    name = 'index.json'
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        self.entries = {}
+
+    @property
+    def path(self) -> Path:
+        """The file the index is stored in."""
+        return self.directory / ExportIndex.name
+
+    @classmethod
+    def load(cls, directory: Path) -> 'ExportIndex':
+        """Load the index of an export directory, which may be missing."""
+        index = cls(directory)
+        try:
+            with open(str(index.path)) as file:
+                index.entries = {entry['name']: entry for entry in json.load(file)['artifacts']}
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+        return index
+
+    def save(self) -> None:
+        """Atomically write the index, dropping artifacts which were deleted."""
+        self.entries = {name: entry for name, entry in self.entries.items()
+                        if (self.directory / name).is_file()}
+        artifacts = sorted(self.entries.values(), key=lambda entry: entry['name'])
+        temp = self.directory / '.{}.tmp'.format(ExportIndex.name)
+        temp.write_text(json.dumps({'artifacts': artifacts}, indent=2) + '\n')
+        os.replace(str(temp), str(self.path))
+
+    def add(self, report: BuildReport) -> int:
+        """Record the artifacts a build wrote into the export directory.
+
+        Returns:
+            The number of artifacts recorded.
+        """
+        count = 0
+        for artifact in report.artifacts:
+            try:
+                name = Path(artifact['path']).relative_to(
+                    self.directory.absolute()).as_posix()
+                info = os.stat(artifact['path'])
+            except (ValueError, OSError):
+                continue
+            self.entries[name] = {'name': name,
+                                  'kind': artifact['kind'],
+                                  'kernel': report.kernel,
+                                  'compiler': report.compiler,
+                                  'command': report.command,
+                                  'started': report.started,
+                                  'size': artifact['size'],
+                                  'sha256': artifact['sha256'],
+                                  'mtime_ns': info.st_mtime_ns}
+            if 'chunk_sha256' in artifact:
+                self.entries[name]['chunk_sha256'] = artifact['chunk_sha256']
+            count += 1
+        return count
+
+    def latest(self) -> Dict[str, Dict[str, Dict[str, Dict]]]:
+        """Return the latest artifact of each kind by kernel and compiler."""
+        latest = {}
+        for entry in sorted(self.entries.values(), key=lambda entry: entry['started']):
+            compilers = latest.setdefault(entry['kernel'], {})
+            compilers.setdefault(entry['compiler'] or '', {})[entry['kind']] = entry
+        return latest
+
+    def digest(self, name: str, info: os.stat_result) -> Optional[str]:
+        """Return the recorded digest of an artifact, if it was not changed since."""
+        entry = self.entries.get(name)
+        if entry and entry['size'] == info.st_size and entry['mtime_ns'] == info.st_mtime_ns:
+            return entry['sha256']
+        return None
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a Range header into the first and last byte it requests.
+
+    Returns:
+        None if the header is malformed or requests several ranges, in
+        which case the whole file is sent.
+
+    Raises:
+        ValueError: If the range starts beyond the end of the file.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, separator, last = ranges.strip().partition('-')
+    if not separator or not (first + last).isdigit():
+        return None
+    if not first:
+        length = int(last)
+        if not length:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    first, last = int(first), int(last) if last else size - 1
+    if first >= size:
+        raise ValueError('range starts beyond {} bytes'.format(size))
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def _parse_request(head: bytes) -> Optional[Request]:
+    """Parse the request line and headers of an HTTP request."""
+    try:
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        return None
+    if not version.startswith('HTTP/1.'):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+    return Request(method, unquote(urlsplit(target).path), version, headers)
+
+
+class ArtifactServer(object):
+    """Serves the export directory over HTTP.
+
+    Properties:
+        directory: The export directory.
+        host: Address to listen on; all interfaces if empty.
+        port: Port to listen on; any free port if 0.
+        timeout: Seconds an idle connection is kept open.
+    """
+
+    backlog = 1024
+
+    def __init__(self, directory: Path, *, host: str='', port: int=8000,
+                 timeout: float=30.0) -> None:
+        self.directory = Path(directory)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._index = None
+        self._index_stamp = None
+        self._digests = {}
+        self._server = None
+        self._connections = set()
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Start listening, returning the asyncio server."""
+        self._server = await asyncio.start_server(self._handle, self.host or None, self.port,
+                                                  backlog=ArtifactServer.backlog)
+        return self._server
+
+    async def close(self) -> None:
+        """Stop listening and close the open connections."""
+        self._server.close()
+        await self._server.wait_closed()
+        for task in self._connections:
+            task.cancel()
+        if self._connections:
+            await asyncio.wait(self._connections)
+
+    def serve_forever(self, on_start=None) -> None:
+        """Serve until interrupted.
+
+        Args:
+            on_start: Called with the addresses listened on once the server
+                accepts connections.
+        """
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(self.start())
+        try:
+            if on_start:
+                on_start([sock.getsockname()[:2] for sock in server.sockets])
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self.close())
+            loop.close()
+
+    @property
+    def index(self) -> ExportIndex:
+        """The index of the export directory, reloaded when it changed."""
+        try:
+            stamp = os.stat(str(self.directory / ExportIndex.name)).st_mtime_ns
+        except OSError:
+            stamp = None
+        if self._index is None or stamp != self._index_stamp:
+            self._index = ExportIndex.load(self.directory)
+            self._index_stamp = stamp
+        return self._index
+
+    def latest(self) -> Dict:
+        """Return the listing of the latest artifacts, with their URLs."""
+        latest = self.index.latest()
+        for compilers in latest.values():
+            for kinds in compilers.values():
+                for kind, entry in kinds.items():
+                    kinds[kind] = dict(entry, url='/' + quote(entry['name']))
+        return {'kernels': latest}
+
+    def progress(self) -> Dict:
+        """Return the progress of the latest build of each kernel."""
+        return {'builds': read_progress(self.directory)}
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of a connection until it is closed."""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  self.timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    return
+                request = _parse_request(head[:-4])
+                if not request:
+                    await self._send(writer, 400, keep_alive=False)
+                    return
+                keep_alive = (request.version == 'HTTP/1.1' and
+                              request.headers.get('connection', '').lower() != 'close')
+                keep_alive = await self._respond(request, writer, keep_alive)
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter,
+                       keep_alive: bool) -> bool:
+        """Answer a request, returning whether the connection may be reused."""
+        if request.method not in ('GET', 'HEAD'):
+            return await self._send(writer, 405, keep_alive=keep_alive,
+                                    headers=[('Allow', 'GET, HEAD')])
+        if request.path in ('/latest', '/progress'):
+            listing = self.latest() if request.path == '/latest' else self.progress()
+            body = (json.dumps(listing, indent=2) + '\n').encode()
+            return await self._send(writer, 200, body, keep_alive=keep_alive,
+                                    head=request.method == 'HEAD',
+                                    headers=[('Content-Type', 'application/json')])
+
+        name = self._artifact_name(request.path)
+        try:
+            file = open(str(self.directory / name), 'rb') if name else None
+        except OSError:
+            file = None
+        if not file:
+            return await self._send(writer, 404, keep_alive=keep_alive)
+        with file:
+            info = os.fstat(file.fileno())
+            if not stat.S_ISREG(info.st_mode):
+                return await self._send(writer, 404, keep_alive=keep_alive)
+            etag = '"{}"'.format(await self._digest(name, info))
+            headers = [('ETag', etag), ('Accept-Ranges', 'bytes'),
+                       ('Cache-Control', 'no-cache'),
+                       ('Last-Modified', email.utils.formatdate(info.st_mtime, usegmt=True))]
+            if_none_match = request.headers.get('if-none-match', '')
+            if if_none_match == '*' or etag in if_none_match.split(', '):
+                return await self._send(writer, 304, keep_alive=keep_alive, headers=headers)
+
+            status, first, length = 200, 0, info.st_size
+            requested = request.headers.get('range')
+            if requested and request.headers.get('if-range', etag) == etag:
+                try:
+                    byte_range = parse_range(requested, info.st_size)
+                except ValueError:
+                    headers.append(('Content-Range', 'bytes */{}'.format(info.st_size)))
+                    return await self._send(writer, 416, keep_alive=keep_alive,
+                                            headers=headers)
+                if byte_range:
+                    status, first, length = 206, byte_range[0], byte_range[1] - byte_range[0] + 1
+                    headers.append(('Content-Range', 'bytes {}-{}/{}'.format(
+                        first, byte_range[1], info.st_size)))
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            headers.append(('Content-Type', content_type))
+            self._write_head(writer, status, length, keep_alive, headers)
+            if request.method == 'GET' and length:
+                await self._send_file(writer, file, first, length)
+            else:
+                await writer.drain()
+        return keep_alive
+
+    def _artifact_name(self, path: str) -> Optional[str]:
+        """Return the path of a file relative to the export directory.
+
+        Hidden files, such as partially written ones, and paths leaving the
+        export directory, including through symbolic links, are never served.
+        """
+        parts = path.split('/')[1:]
+        if not parts or any(not part or part.startswith('.') or '\0' in part
+                            for part in parts):
+            return None
+        name = '/'.join(parts)
+        root = os.path.realpath(str(self.directory))
+        if not os.path.realpath(os.path.join(root, name)).startswith(root + os.sep):
+            return None
+        return name
+
+    async def _digest(self, name: str, info: os.stat_result) -> str:
+        """Return the sha256 digest of a file, hashing it once per version."""
+        digest = self.index.digest(name, info)
+        if digest:
+            return digest
+        key = (info.st_ino, info.st_size, info.st_mtime_ns)
+        cached = self._digests.get(name)
+        if not cached or cached[0] != key:
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(None, file_digest, self.directory / name)
+            cached = self._digests[name] = (key, future)
+        return await cached[1]
+
+    def _write_head(self, writer: asyncio.StreamWriter, status: int, length: int,
+                    keep_alive: bool, headers: List[Tuple[str, str]]) -> None:
+        """Write the status line and headers of a response."""
+        lines = ['HTTP/1.1 {} {}'.format(status, _reasons[status]),
+                 'Date: {}'.format(email.utils.formatdate(usegmt=True)),
+                 'Server: kbuilder',
+                 'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+        if status != 304:
+            lines.append('Content-Length: {}'.format(length))
+        lines.extend('{}: {}'.format(name, value) for name, value in headers)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, body: bytes=None, *,
+                    keep_alive: bool, head: bool=False,
+                    headers: List[Tuple[str, str]]=()) -> bool:
+        """Send a response with a body held in memory."""
+        headers = list(headers)
+        if body is None and status >= 400:
+            body = '{} {}\n'.format(status, _reasons[status]).encode()
+            headers.append(('Content-Type', 'text/plain'))
+        body = body or b''
+        self._write_head(writer, status, len(body), keep_alive, headers)
+        if not head:
+            writer.write(body)
+        await writer.drain()
+        return keep_alive
+
+    async def _send_file(self, writer: asyncio.StreamWriter, file, first: int,
+                         length: int) -> None:
+        """Send a part of a file.
+
+        The event loop uses sendfile for plain sockets, and falls back to
+        reading the file otherwise.
+        """
+        await writer.drain()
+        await asyncio.get_event_loop().sendfile(writer.transport, file, first, length)
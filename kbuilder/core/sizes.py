@@ -0,0 +1,201 @@
+"""Size profiles of kernel images and modules.
+
+A SizeProfile holds the sizes of the allocated sections and of the
+symbols of vmlinux or of a module. Profiles are saved next to the exported
+artifacts of a build as compressed JSON, so a build can be compared with
+a previous one long after its object directory was rebuilt.
+
+The comparison follows scripts/bloat-o-meter of the kernel: symbols are
+summed by name after dropping the numbered suffixes the compiler gives
+static and cloned functions, so renumbering alone is no change.
+"""
+
+import gzip
+import json
+import os
+import re
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List
+
+from kbuilder.core.elf import (SHF_ALLOC, SHF_EXECINSTR, SHF_WRITE, SHT_NOBITS, STT_FILE,
+                               STT_SECTION, ElfFile)
+
+_numbered = re.compile(r'\.[0-9]+')
+
+# Symbols which change with every build or only carry module metadata.
+_ignored_prefixes = ('__mod_', '__se_sys', '__se_compat', '__addressable_', '__UNIQUE_ID_')
+_ignored = {'linux_banner', 'vermagic'}
+
+
+def symbol_kind(flags: int, type_: int) -> str:
+    """Return the nm style kind of a symbol in a section with flags.
+
+    The kinds are 't' for text, 'd' for data, 'b' for bss and 'r' for
+    read only data.
+    """
+    if flags & SHF_EXECINSTR:
+        return 't'
+    if flags & SHF_WRITE:
+        return 'b' if type_ == SHT_NOBITS else 'd'
+    return 'r'
+
+
+class SizeProfile(namedtuple('SizeProfile', 'sections symbols')):
+    """The section and symbol sizes of an ELF file.
+
+    Properties:
+        sections: Sizes of the allocated sections by name.
+        symbols: (kind, size) tuples of the symbols by name.
+    """
+
+    suffix = '.sizes.json.gz'
+
+    @classmethod
+    def from_elf(cls, path: Path) -> 'SizeProfile':
+        """Measure an ELF file.
+
+        Raises:
+            ValueError: If the file is not an ELF file.
+        """
+        symbols = {}
+        with ElfFile(path) as elf:
+            sections = {section.name: section.size for section in elf.sections
+                        if section.flags & SHF_ALLOC and section.size}
+            for symbol in elf.symbols():
+                section = symbol.section
+                if (not symbol.size or section is None or not section.flags & SHF_ALLOC or
+                        symbol.type in (STT_SECTION, STT_FILE)):
+                    continue
+                name = symbol.name
+                if name.startswith(_ignored_prefixes) or name in _ignored:
+                    continue
+                if '.' in name:
+                    name = _numbered.sub('', name)
+                kind, size = symbols.get(name, (None, 0))
+                symbols[name] = (kind or symbol_kind(section.flags, section.type),
+                                 size + symbol.size)
+        return cls(sections, symbols)
+
+    @classmethod
+    def load(cls, path: Path) -> 'SizeProfile':
+        """Load a saved profile.
+
+        Raises:
+            ValueError: If the file is no profile.
+        """
+        try:
+            with gzip.open(str(path), 'rt') as file:
+                data = json.load(file)
+            return cls(data['sections'], {name: tuple(value)
+                                          for name, value in data['symbols'].items()})
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as error:
+            raise ValueError('{} is no size profile: {}'.format(path, error))
+
+    @classmethod
+    def read(cls, path: Path) -> 'SizeProfile':
+        """Measure an ELF file or load a saved profile.
+
+        Raises:
+            ValueError: If the file is neither.
+        """
+        if str(path).endswith(cls.suffix):
+            return cls.load(path)
+        return cls.from_elf(path)
+
+    def save(self, path: Path) -> None:
+        """Atomically write the profile."""
+        path = Path(path)
+        temp = path.with_name('.{}.tmp'.format(path.name))
+        with gzip.open(str(temp), 'wt', compresslevel=6) as file:
+            json.dump({'sections': self.sections, 'symbols': self.symbols}, file,
+                      sort_keys=True)
+        os.replace(str(temp), str(path))
+
+    @property
+    def total(self) -> int:
+        """Sum of the symbol sizes."""
+        return sum(size for _, size in self.symbols.values())
+
+    def largest(self, count: int) -> List[tuple]:
+        """Return the largest symbols as (name, kind, size) tuples."""
+        symbols = sorted(self.symbols.items(), key=lambda item: (-item[1][1], item[0]))
+        return [(name, kind, size) for name, (kind, size) in symbols[:count]]
+
+
+class SizeChange(namedtuple('SizeChange', 'name kind old new')):
+    """A symbol which was added, removed or resized; sizes are 0 if absent."""
+
+    @property
+    def delta(self) -> int:
+        """Growth of the symbol in bytes."""
+        return self.new - self.old
+
+
+class SizeDiff(object):
+    """The symbol size changes between two profiles.
+
+    Properties:
+        changes: SizeChange tuples, largest growth first.
+        before: Total symbol size of the old profile.
+        after: Total symbol size of the new profile.
+    """
+
+    def __init__(self, old: SizeProfile, new: SizeProfile) -> None:
+        changes = []
+        for name in old.symbols.keys() | new.symbols.keys():
+            old_kind, old_size = old.symbols.get(name, (None, 0))
+            new_kind, new_size = new.symbols.get(name, (None, 0))
+            if old_size != new_size:
+                changes.append(SizeChange(name, new_kind or old_kind, old_size, new_size))
+        changes.sort(key=lambda change: (-change.delta, change.name))
+        self.changes = changes
+        self.before = old.total
+        self.after = new.total
+        self._old = old.symbols
+        self._new = new.symbols
+
+    @property
+    def added(self) -> int:
+        """Amount of new symbols."""
+        return sum(1 for change in self.changes if change.name not in self._old)
+
+    @property
+    def removed(self) -> int:
+        """Amount of symbols which were dropped."""
+        return sum(1 for change in self.changes if change.name not in self._new)
+
+    @property
+    def grown(self) -> int:
+        """Amount of symbols which grew."""
+        return sum(1 for change in self.changes
+                   if change.delta > 0 and change.name in self._old)
+
+    @property
+    def shrunk(self) -> int:
+        """Amount of symbols which shrank."""
+        return sum(1 for change in self.changes
+                   if change.delta < 0 and change.name in self._new)
+
+    def lines(self) -> List[str]:
+        """Format the changes like scripts/bloat-o-meter."""
+        up = sum(change.delta for change in self.changes if change.delta > 0)
+        down = sum(change.delta for change in self.changes if change.delta < 0)
+        lines = ['add/remove: {}/{} grow/shrink: {}/{} up/down: {}/{} ({})'.format(
+                     self.added, self.removed, self.grown, self.shrunk, up, down, up + down),
+                 '{:<40} {:>7} {:>7} {:>7}'.format('Function', 'old', 'new', 'delta')]
+        for change in self.changes:
+            lines.append('{:<40} {:>7} {:>7} {:>+7}'.format(
+                change.name, change.old if change.name in self._old else '-',
+                change.new if change.name in self._new else '-', change.delta))
+        change = (self.after - self.before) / self.before if self.before else 0.0
+        lines.append('Total: Before={}, After={}, chg {:+.2%}'.format(
+            self.before, self.after, change))
+        return lines
+
+
+def section_changes(old: SizeProfile, new: SizeProfile) -> Dict[str, tuple]:
+    """Return the (old, new) sizes of the sections whose size changed."""
+    return {name: (old.sections.get(name, 0), new.sections.get(name, 0))
+            for name in sorted(old.sections.keys() | new.sections.keys())
+            if old.sections.get(name, 0) != new.sections.get(name, 0)}
@@ -0,0 +1,247 @@
+"""Kernel object directories kept in memory.
+
+Building with the object directory (make O=) on tmpfs removes nearly all
+disk writes from the build. The directory is kept between builds so
+incremental builds stay warm, while artifacts and logs are copied back to
+disk in the background so they survive a flush or reboot.
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+from subprocess import CalledProcessError, check_call
+from typing import List, Optional
+
+from kbuilder.core.exc import KbuilderRuntimeError
+
+
+def directory_size(directory: Path) -> int:
+    """Return the disk usage in bytes of all files in a directory."""
+    total = 0
+    for root, _, files in os.walk(str(directory)):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def filesystem_type(path: Path) -> str:
+    """Return the type of the filesystem a path is located on."""
+    path = os.path.realpath(str(path))
+    best, fs_type = '', ''
+    with open('/proc/mounts') as mounts:
+        for line in mounts:
+            fields = line.split()
+            mount_point = fields[1].replace('\\040', ' ')
+            if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+                    and len(mount_point) >= len(best):
+                best, fs_type = mount_point, fields[2]
+    return fs_type
+
+
+def available_memory() -> int:
+    """Return the amount of memory in bytes available without swapping."""
+    with open('/proc/meminfo') as meminfo:
+        for line in meminfo:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def memory_pressure() -> float:
+    """Return the share of time tasks stalled on memory in the last 10s.
+
+    Returns 0 when the kernel does not report pressure stall information.
+    """
+    try:
+        with open('/proc/pressure/memory') as pressure:
+            for line in pressure:
+                if line.startswith('some'):
+                    fields = dict(field.split('=') for field in line.split()[1:])
+                    return float(fields['avg10'])
+    except (FileNotFoundError, OSError):
+        pass
+    return 0.0
+
+
+class WriteBack(object):
+    """Copy files to disk on a background thread.
+
+    The thread exits once the queue is drained, but is not a daemon thread,
+    so pending copies finish before the interpreter exits.
+    """
+
+    def __init__(self) -> None:
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+        self.errors = []
+
+    def submit(self, source: Path, destination: Path) -> None:
+        """Queue a file to be copied to a destination path."""
+        with self._lock:
+            self._queue.put((Path(source), Path(destination)))
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name='kbuilder-writeback').start()
+
+    def join(self) -> None:
+        """Wait until all queued files have been copied."""
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if self._queue.empty():
+                    self._running = False
+                    return
+                source, destination = self._queue.get()
+            try:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                temp = destination.with_name(destination.name + '.tmp')
+                shutil.copy2(source.as_posix(), temp.as_posix())
+                os.replace(temp.as_posix(), destination.as_posix())
+            except OSError as error:
+                self.errors.append((source, error))
+            finally:
+                self._queue.task_done()
+
+
+class TmpfsObjectDir(object):
+    """A kernel object directory located on tmpfs.
+
+    Properties:
+        root: tmpfs directory holding the object directories of all kernels.
+        name: Name of the kernel owning the object directory.
+        writeback_dir: Directory on disk artifacts are copied back to.
+        min_available: Memory in bytes which must remain available.
+        max_pressure: Memory pressure (PSI some avg10) which triggers a flush.
+    """
+
+    state_file = 'tmpfs.json'
+    size_factor = 1.5
+    min_size = 1 << 30
+
+    def __init__(self, root: Path, name: str, writeback_dir: Path, *,
+                 min_available: int, max_pressure: float=10.0) -> None:
+        self.root = Path(root)
+        self.name = name
+        self.writeback_dir = Path(writeback_dir)
+        self.min_available = min_available
+        self.max_pressure = max_pressure
+        self.write_back = WriteBack()
+
+    @property
+    def path(self) -> Path:
+        """The object directory."""
+        return self.root / self.name
+
+    @property
+    def previous_sizes(self) -> List[int]:
+        """Sizes in bytes of the object directory after previous builds."""
+        try:
+            state = json.loads((self.writeback_dir / TmpfsObjectDir.state_file).read_text())
+        except (FileNotFoundError, ValueError):
+            return []
+        return state.get('sizes', [])
+
+    @property
+    def expected_size(self) -> int:
+        """The size in bytes the object directory is expected to grow to."""
+        sizes = self.previous_sizes
+        if not sizes:
+            return TmpfsObjectDir.min_size
+        return max(TmpfsObjectDir.min_size, int(max(sizes) * TmpfsObjectDir.size_factor))
+
+    def under_pressure(self) -> bool:
+        """Return whether the system is running low on memory."""
+        return (available_memory() < self.min_available or
+                memory_pressure() > self.max_pressure)
+
+    def acquire(self) -> Optional[Path]:
+        """Prepare the object directory for a build.
+
+        A tmpfs is mounted at root if it is not on tmpfs yet, which requires
+        root privileges. The object directory is flushed first if the system
+        is low on memory.
+
+        Returns:
+            The object directory, or None if there is not enough memory to
+            hold it.
+
+        Raises:
+            KbuilderRuntimeError: If root is not on a tmpfs and cannot be mounted.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        if filesystem_type(self.root) != 'tmpfs':
+            self._mount()
+
+        if self.under_pressure():
+            self.flush()
+
+        used = directory_size(self.path) if self.path.exists() else 0
+        stat = os.statvfs(self.root.as_posix())
+        free = stat.f_bavail * stat.f_frsize
+        needed = self.expected_size - used
+        if needed > free or needed > available_memory() - self.min_available:
+            return None
+
+        self.path.mkdir(exist_ok=True)
+        self._restore_config()
+        return self.path
+
+    def _mount(self) -> None:
+        """Mount a tmpfs sized from previous builds at root."""
+        options = 'size={},mode=0755'.format(self.expected_size * 2)
+        try:
+            check_call(['mount', '-t', 'tmpfs', '-o', options, 'kbuilder', self.root.as_posix()])
+        except (OSError, CalledProcessError) as error:
+            raise KbuilderRuntimeError(
+                '{} is not on a tmpfs and could not be mounted: {}'.format(self.root, error))
+
+    def _restore_config(self) -> None:
+        """Restore the kernel configuration into an empty object directory."""
+        config = self.path / '.config'
+        saved = self.writeback_dir / '.config'
+        if not config.exists() and saved.exists():
+            shutil.copy2(saved.as_posix(), config.as_posix())
+
+    def write_back_file(self, path: Path) -> Path:
+        """Copy a file of the object directory to disk in the background.
+
+        Returns:
+            The path the file will be copied to.
+        """
+        path = Path(path)
+        try:
+            relative = path.relative_to(self.path)
+        except ValueError:
+            relative = Path(path.name)
+        destination = self.writeback_dir / relative
+        self.write_back.submit(path, destination)
+        return destination
+
+    def finish_build(self, artifacts: List[Path]) -> None:
+        """Write back the artifacts of a successful build and record its size."""
+        for artifact in list(artifacts) + [self.path / '.config']:
+            if Path(artifact).exists():
+                self.write_back_file(artifact)
+
+        sizes = (self.previous_sizes + [directory_size(self.path)])[-10:]
+        self.writeback_dir.mkdir(parents=True, exist_ok=True)
+        state = self.writeback_dir / TmpfsObjectDir.state_file
+        state.write_text(json.dumps({'sizes': sizes}))
+
+    def flush(self) -> None:
+        """Write back pending files, then free the memory of the object directory."""
+        self.write_back.join()
+        config = self.path / '.config'
+        if config.exists():
+            self.writeback_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(config.as_posix(), (self.writeback_dir / '.config').as_posix())
+        shutil.rmtree(self.path.as_posix(), ignore_errors=True)
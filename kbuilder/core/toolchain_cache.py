@@ -0,0 +1,245 @@
+"""A cache of toolchains extracted from archives.
+
+Unpacked toolchains take tens of gigabytes. A ToolchainCache instead takes
+toolchain archives from a mirror directory and extracts each on first use.
+Extraction streams the output of an external decompressor, which runs in
+parallel with unpacking, into a staging directory renamed into place once
+complete. The least recently used toolchains are evicted to stay within a
+disk budget.
+"""
+
+import fcntl
+import json
+import os
+import posixpath
+import shutil
+import subprocess
+import tarfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.tmpfs import directory_size
+
+# Archive suffixes, external decompressors in order of preference and the
+# tarfile stream mode used without them.
+_formats = ((('.tar.zst', '.tzst'), (['zstd', '-dcq', '-T0'],), None),
+            (('.tar.xz', '.txz'), (['xz', '-dcq', '-T0'],), 'r|xz'),
+            (('.tar.gz', '.tgz'), (['pigz', '-dc'], ['gzip', '-dc']), 'r|gz'),
+            (('.tar.bz2', '.tbz2'), (['lbzip2', '-dc'], ['pbzip2', '-dc'],
+                                     ['bzip2', '-dc']), 'r|bz2'),
+            (('.tar',), (), 'r|'))
+
+STAMP_NAME = '.kbuilder-toolchain'
+
+
+def archive_name(path: Path) -> Optional[str]:
+    """Return the toolchain name of an archive, or None if it is no archive."""
+    name = Path(path).name
+    for suffixes, _, _ in _formats:
+        for suffix in suffixes:
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+    return None
+
+
+def is_safe_member(member: tarfile.TarInfo) -> bool:
+    """Return whether a member stays inside the extraction directory.
+
+    Symbolic links are resolved relative to their directory, and hard
+    links relative to the archive root; either must not leave it.
+    """
+    parts = Path(member.name).parts
+    if member.name.startswith('/') or '..' in parts:
+        return False
+    if member.issym() or member.islnk():
+        if member.linkname.startswith('/'):
+            return False
+        base = posixpath.dirname(member.name) if member.issym() else ''
+        target = posixpath.normpath(posixpath.join(base, member.linkname))
+        return target != '..' and not target.startswith('../')
+    return member.isfile() or member.isdir()
+
+
+class ToolchainCache(object):
+    """Toolchains extracted on demand from a mirror of archives.
+
+    Properties:
+        root: Directory the toolchains are extracted into.
+        mirror_dir: Directory of the toolchain archives.
+        max_size: Disk budget in bytes of the extracted toolchains.
+    """
+
+    def __init__(self, root: Path, mirror_dir: Path, max_size: int) -> None:
+        self.root = Path(root)
+        self.mirror_dir = Path(mirror_dir)
+        self.max_size = max_size
+
+    def archives(self) -> Dict[str, Path]:
+        """Return a dict mapping toolchain names to archives in the mirror."""
+        archives = {}
+        try:
+            entries = sorted(os.scandir(str(self.mirror_dir)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return archives
+        for entry in entries:
+            name = archive_name(entry.name)
+            if name and entry.is_file():
+                archives.setdefault(name, Path(entry.path))
+        return archives
+
+    def path(self, name: str) -> Path:
+        """Return the directory a toolchain is extracted into."""
+        return self.root / name
+
+    def is_extracted(self, name: str) -> bool:
+        """Return whether a toolchain is extracted."""
+        return (self.path(name) / STAMP_NAME).exists()
+
+    def ensure(self, name: str) -> Path:
+        """Extract a toolchain unless it is, and mark it as recently used.
+
+        Concurrent callers wait for a single extraction.
+
+        Raises:
+            KbuilderRuntimeError: If the toolchain is missing or fails to extract.
+
+        Returns:
+            The directory of the toolchain.
+        """
+        path = self.path(name)
+        stamp = path / STAMP_NAME
+        if not stamp.exists():
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(str(self.root / '.{}.lock'.format(name)), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not stamp.exists():
+                    self._extract(name)
+            self.evict(keep=[name])
+        os.utime(str(stamp))
+        return path
+
+    def _extract(self, name: str) -> None:
+        """Extract a toolchain archive and rename it into place."""
+        archive = self.archives().get(name)
+        if not archive:
+            raise KbuilderRuntimeError('No archive of toolchain {} in {}'.format(
+                name, self.mirror_dir))
+        staging = self.root / '.{}.tmp-{}'.format(name, os.getpid())
+        shutil.rmtree(str(staging), ignore_errors=True)
+        staging.mkdir()
+        try:
+            _unpack(archive, staging)
+            entries = list(staging.iterdir())
+            # Most archives contain a single top level directory.
+            top = entries[0] if len(entries) == 1 and entries[0].is_dir() else staging
+            (top / STAMP_NAME).write_text(json.dumps(
+                {'archive': archive.name, 'size': directory_size(top)}))
+            self._remove(self.path(name))
+            os.rename(str(top), str(self.path(name)))
+        finally:
+            shutil.rmtree(str(staging), ignore_errors=True)
+
+    def extracted(self) -> List[Path]:
+        """Return the directories of all extracted toolchains."""
+        if not self.root.is_dir():
+            return []
+        return [path for path in self.root.iterdir() if (path / STAMP_NAME).exists()]
+
+    def size(self) -> int:
+        """Return the disk usage in bytes of the extracted toolchains."""
+        return sum(_recorded_size(path) for path in self.extracted())
+
+    def evict(self, keep: Iterable[str]=()) -> List[str]:
+        """Remove the least recently used toolchains until under max_size.
+
+        Args:
+            keep: Names of toolchains never to evict.
+
+        Returns:
+            The names of the evicted toolchains.
+        """
+        keep = set(keep)
+        toolchains = sorted(self.extracted(),
+                            key=lambda path: (path / STAMP_NAME).stat().st_mtime)
+        total = sum(_recorded_size(path) for path in toolchains)
+        evicted = []
+        for path in toolchains:
+            if total <= self.max_size:
+                break
+            if path.name in keep:
+                continue
+            total -= _recorded_size(path)
+            self._remove(path)
+            evicted.append(path.name)
+        return evicted
+
+    def _remove(self, path: Path) -> None:
+        """Remove a toolchain, renaming it away first so it vanishes at once."""
+        trash = path.with_name('.{}.old-{}'.format(path.name, time.time()))
+        try:
+            os.rename(str(path), str(trash))
+        except FileNotFoundError:
+            return
+        shutil.rmtree(str(trash), ignore_errors=True)
+
+
+def _recorded_size(path: Path) -> int:
+    """Return the size of a toolchain recorded when it was extracted."""
+    try:
+        return json.loads((path / STAMP_NAME).read_text())['size']
+    except (OSError, ValueError, KeyError):
+        return directory_size(path)
+
+
+def _unpack(archive: Path, destination: Path) -> None:
+    """Stream an archive into a directory through the fastest decompressor.
+
+    Raises:
+        KbuilderRuntimeError: If the archive cannot be decompressed, or the
+            extraction filter rejects a member.
+    """
+    for suffixes, commands, mode in _formats:
+        if archive.name.endswith(suffixes):
+            break
+    else:
+        raise KbuilderRuntimeError('Unknown archive format: {}'.format(archive))
+
+    command = next((command for command in commands if shutil.which(command[0])), None)
+    if not command:
+        if not mode:
+            raise KbuilderRuntimeError('{} is required to extract {}'.format(
+                commands[0][0], archive))
+        with open(str(archive), 'rb') as file, tarfile.open(fileobj=file, mode=mode) as tar:
+            _extract_members(tar, destination)
+        return
+
+    process = subprocess.Popen(command + [str(archive)], stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+            _extract_members(tar, destination)
+    finally:
+        process.stdout.close()
+        if process.wait():
+            raise KbuilderRuntimeError('{} failed to decompress {}'.format(
+                command[0], archive))
+
+
+def _extract_members(tar: tarfile.TarFile, destination: Path) -> None:
+    """Extract the safe members of a tar stream in order.
+
+    Where tarfile supports extraction filters, the data filter checks the
+    members once more as they are extracted.
+
+    Raises:
+        KbuilderRuntimeError: If the filter rejects a member.
+    """
+    options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    for member in tar:
+        if is_safe_member(member):
+            try:
+                tar.extract(member, str(destination), **options)
+            except tarfile.TarError as error:
+                raise KbuilderRuntimeError('Unsafe member {} in toolchain archive: {}'.format(
+                    member.name, error))
@@ -0,0 +1,213 @@
+"""Near-instant removal of build outputs.
+
+`make clean` walks the whole tree before anything is removed. A Trash
+instead renames the build outputs into a trash directory on the same
+filesystem, which only takes a few renames, and a background reaper deletes
+the trash at idle I/O priority with parallel unlinkers.
+
+The reaper runs as a detached process, so it outlives kbuilder:
+
+    python3 -m kbuilder.core.trash TRASH_DIR
+"""
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from kbuilder.core.priority import PRIORITY_CLASSES
+
+# Outputs kept by `make clean`, relative to the object directory.
+kept_outputs = ('.config', 'Makefile', 'source', 'include', 'scripts', 'tools',
+                'arch/*/include', 'arch/*/tools', '.kbuilder')
+
+# Suffixes and names of kbuild outputs removed by `make clean`.
+generated_suffixes = ('.o', '.ko', '.a', '.cmd', '.d', '.mod', '.mod.c', '.order',
+                      '.symvers', '.tmp', '.dtb', '.dtbo', '.so', '.s', '.lds', '.lst',
+                      '.builtin', '.modinfo', '.symtypes', '.dwo', '.su', '.gcno')
+generated_names = ('vmlinux', 'System.map', '.version', '.tmp_versions',
+                   'Image', 'Image.gz', 'Image.gz-dtb', 'zImage', 'zImage-dtb',
+                   'bzImage', 'vmlinux.bin', 'vmlinux.lds')
+
+
+def is_kept(path: str) -> bool:
+    """Return whether a relative path is an output kept by `make clean`."""
+    parts = path.rstrip('/').split('/')
+    for kept in kept_outputs:
+        kept_parts = kept.split('/')
+        if len(parts) >= len(kept_parts) and all(
+                pattern in ('*', part) for pattern, part in zip(kept_parts, parts)):
+            return True
+    return False
+
+
+def object_dir_outputs(object_dir: Path) -> Iterator[str]:
+    """Yield the relative paths removed when cleaning an out-of-tree object directory.
+
+    Top level entries are yielded whole, except for arch/ whose
+    architecture directories keep their generated headers and tools.
+    """
+    object_dir = Path(object_dir)
+    for entry in sorted(os.listdir(str(object_dir))):
+        if entry == 'arch' and (object_dir / entry).is_dir():
+            for arch in sorted(os.listdir(str(object_dir / entry))):
+                arch_dir = object_dir / entry / arch
+                if not arch_dir.is_dir():
+                    yield '{}/{}'.format(entry, arch)
+                    continue
+                for child in sorted(os.listdir(str(arch_dir))):
+                    path = '{}/{}/{}'.format(entry, arch, child)
+                    if not is_kept(path):
+                        yield path
+        elif not is_kept(entry):
+            yield entry
+
+
+def _is_generated(path: str) -> bool:
+    """Return whether a relative path is a kbuild output."""
+    name = path.rstrip('/').rsplit('/', 1)[-1]
+    return name in generated_names or name.endswith(generated_suffixes)
+
+
+def source_tree_outputs(root: Path) -> List[str]:
+    """Return the relative paths of the build outputs of an in-tree build.
+
+    The index of ignored files git keeps is used where available, since
+    the kernel ignores exactly its build outputs. Otherwise the tree is
+    walked for the files kbuild recorded a command for.
+    """
+    root = Path(root)
+    try:
+        output = subprocess.check_output(
+            ['git', '-C', str(root), 'ls-files', '-z', '--others', '--ignored',
+             '--exclude-standard', '--directory'], stderr=subprocess.DEVNULL)
+        paths = [path for path in output.decode('utf-8', 'surrogateescape').split('\0')
+                 if path]
+    except (OSError, subprocess.CalledProcessError):
+        paths = _walk_outputs(root)
+    return [path.rstrip('/') for path in paths if _is_generated(path) and not is_kept(path)]
+
+
+def _walk_outputs(root: Path) -> List[str]:
+    """Return the relative paths of all kbuild outputs in a tree.
+
+    Sources share names and suffixes with outputs, such as the linker
+    scripts under arch/*/boot, so a file is only taken for an output when
+    kbuild wrote a .<name>.cmd file next to it. Besides the .cmd files
+    themselves, only the generated names at the top of the tree are
+    taken without one.
+    """
+    paths = []
+    for directory, dirs, files in os.walk(str(root)):
+        relative = os.path.relpath(directory, str(root))
+        relative = '' if relative == '.' else relative + '/'
+        dirs[:] = [name for name in dirs if not is_kept(relative + name) and name != '.git']
+        names = set(files)
+        for name in sorted(dirs + files):
+            if ((not relative and name in generated_names) or
+                    (name.startswith('.') and name.endswith('.cmd') and name in names) or
+                    '.{}.cmd'.format(name) in names):
+                paths.append(relative + name)
+        if not relative:
+            dirs[:] = [name for name in dirs if name not in generated_names]
+    return paths
+
+
+class Trash(object):
+    """A directory of build outputs waiting to be deleted.
+
+    Properties:
+        directory: The trash directory. It must be on the same filesystem as
+            the outputs moved into it.
+    """
+
+    reaper_jobs = 8
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+
+    def move(self, base: Path, paths: Iterable[str]) -> Path:
+        """Move paths relative to a base directory into a new trash entry.
+
+        Returns:
+            The trash entry.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = Path(tempfile.mkdtemp(prefix=time.strftime('%Y%m%d%H%M%S-'),
+                                      dir=str(self.directory)))
+        for path in paths:
+            target = entry / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(str(Path(base, path)), str(target))
+            except FileNotFoundError:
+                pass
+        return entry
+
+    def entries(self) -> List[Path]:
+        """Return the trash entries, oldest first."""
+        if not self.directory.is_dir():
+            return []
+        return sorted(path for path in self.directory.iterdir()
+                      if not path.name.startswith('.'))
+
+    def spawn_reaper(self) -> None:
+        """Start a detached process deleting the trash at low priority."""
+        priority = PRIORITY_CLASSES['batch']
+        argv = [sys.executable, '-m', 'kbuilder.core.trash', str(self.directory)]
+        subprocess.Popen(priority.command(argv), stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+    def reap(self) -> None:
+        """Delete all trash entries, unless another reaper is running.
+
+        Entries added while reaping are deleted as well.
+        """
+        lock_path = self.directory / '.reaper.lock'
+        entries = self.entries()
+        while entries:
+            with open(str(lock_path), 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+                for entry in entries:
+                    remove_tree(entry, self.reaper_jobs)
+            remaining = self.entries()
+            if set(entries) & set(remaining):
+                # Some entries could not be removed; leave them for later.
+                return
+            entries = remaining
+
+
+def remove_tree(path: Path, jobs: int) -> None:
+    """Remove a directory tree, unlinking its files from parallel threads."""
+    def unlink_all(paths: List[str]) -> None:
+        for name in paths:
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        batch = []
+        for directory, _, files in os.walk(str(path)):
+            batch.extend(os.path.join(directory, name) for name in files)
+            if len(batch) >= 256:
+                futures.append(executor.submit(unlink_all, batch))
+                batch = []
+        futures.append(executor.submit(unlink_all, batch))
+        wait(futures)
+    shutil.rmtree(str(path), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    Trash(sys.argv[1]).reap()
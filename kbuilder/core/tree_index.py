@@ -0,0 +1,179 @@
+"""Persistent fingerprints of kernel source trees.
+
+Like the git index, a TreeIndex stores the size, mtime, inode and digest of
+every source file. Rescanning trusts the stat data of unchanged files and
+only hashes files whose stat data changed, so detecting changes in a large
+tree costs little more than a directory walk.
+"""
+
+import hashlib
+import os
+import pickle
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+IndexEntry = namedtuple('IndexEntry', 'size mtime inode digest')
+
+
+class TreeChanges(namedtuple('TreeChanges', 'added modified removed')):
+    """Paths which differ between two indexes.
+
+    Properties:
+        added: Paths only present in the newer index.
+        modified: Paths whose contents differ.
+        removed: Paths only present in the older index.
+    """
+
+    def __bool__(self) -> bool:
+        """Return whether any path changed."""
+        return bool(self.added or self.modified or self.removed)
+
+    @property
+    def paths(self) -> List[str]:
+        """All changed paths, sorted."""
+        return sorted(self.added + self.modified + self.removed)
+
+
+class TreeIndex(object):
+    """An index of the source files of a tree.
+
+    Properties:
+        root: Root directory of the tree.
+        entries: A dict mapping relative paths to IndexEntry tuples.
+        timestamp: Time in nanoseconds the scan producing this index started.
+    """
+
+    version = 2
+
+    # Build outputs of kbuild which are never sources.
+    excluded_suffixes = ('.o', '.ko', '.a', '.cmd', '.d', '.mod', '.mod.c',
+                         '.order', '.symvers', '.tmp', '.dtb', '.dtbo', '.so',
+                         '.pyc', '.orig', '.rej', '.swp')
+    # Kernel images kbuild writes next to the sources of arch/*/boot.
+    excluded_prefixes = ('Image', 'zImage', 'bzImage', 'uImage')
+    excluded_dirs = ('include/generated', 'include/config', 'arch/arm/include/generated',
+                     'arch/arm64/include/generated', 'arch/x86/include/generated')
+    included_dotfiles = ('.config', '.gitignore')
+
+    def __init__(self, root: Path, entries: Optional[Dict[str, IndexEntry]]=None,
+                 timestamp: int=0) -> None:
+        self.root = Path(root)
+        self.entries = entries or {}
+        self.timestamp = timestamp
+
+    @classmethod
+    def load(cls, path: Path, root: Path) -> 'TreeIndex':
+        """Load an index, returning an empty index if it is missing or stale."""
+        try:
+            with open(str(path), 'rb') as file:
+                version, entries, timestamp = pickle.load(file)
+        except (FileNotFoundError, EOFError, ValueError, pickle.UnpicklingError):
+            return cls(root)
+        if version != TreeIndex.version:
+            return cls(root)
+        entries = {path: IndexEntry(*entry) for path, entry in entries.items()}
+        return cls(root, entries, timestamp)
+
+    def save(self, path: Path) -> None:
+        """Atomically write the index to a file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + '.tmp')
+        entries = {path: tuple(entry) for path, entry in self.entries.items()}
+        with open(str(temp), 'wb') as file:
+            pickle.dump((TreeIndex.version, entries, self.timestamp), file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temp), str(path))
+
+    @property
+    def fingerprint(self) -> str:
+        """A digest of the paths and contents of all files in the index."""
+        digest = hashlib.sha1()
+        for path in sorted(self.entries):
+            digest.update(path.encode('utf-8', 'surrogateescape'))
+            digest.update(b'\0')
+            digest.update(self.entries[path].digest)
+        return digest.hexdigest()
+
+    def scan(self, *, exclude: Iterable[str]=(), subdirs: Iterable[str]=('',),
+             jobs: int=os.cpu_count()) -> 'TreeIndex':
+        """Return a new index of the current state of the tree.
+
+        Files whose stat data did not change keep their digest. Files
+        modified within the timestamp of this index may have changed without
+        changing their mtime, so they are hashed again as well.
+
+        Args:
+            exclude: Relative paths of directories to skip.
+            subdirs: Relative paths of the directories and files to index.
+            jobs: Amount of threads hashing files in parallel.
+        """
+        timestamp = time.time_ns() if hasattr(time, 'time_ns') else int(time.time() * 1e9)
+        excluded = set(TreeIndex.excluded_dirs) | set(exclude)
+        entries = {}
+        pending = []
+        for path, stat in self._walk(subdirs, excluded):
+            old = self.entries.get(path)
+            if (old and old.size == stat.st_size and old.mtime == stat.st_mtime_ns and
+                    old.inode == stat.st_ino and old.mtime < self.timestamp):
+                entries[path] = old
+            else:
+                pending.append((path, stat))
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            digests = executor.map(self._hash, (path for path, _ in pending))
+            for (path, stat), digest in zip(pending, digests):
+                if digest is not None:
+                    entries[path] = IndexEntry(stat.st_size, stat.st_mtime_ns,
+                                               stat.st_ino, digest)
+        return TreeIndex(self.root, entries, timestamp)
+
+    def diff(self, newer: 'TreeIndex') -> TreeChanges:
+        """Return the paths which changed between this and a newer index."""
+        added = [path for path in newer.entries if path not in self.entries]
+        removed = [path for path in self.entries if path not in newer.entries]
+        modified = [path for path, entry in newer.entries.items()
+                    if path in self.entries and self.entries[path].digest != entry.digest]
+        return TreeChanges(sorted(added), sorted(modified), sorted(removed))
+
+    def _walk(self, subdirs: Iterable[str], excluded: set) -> Iterator[Tuple[str, os.stat_result]]:
+        """Yield the relative path and stat data of every source file."""
+        stack = [subdir for subdir in subdirs]
+        while stack:
+            relative = stack.pop()
+            try:
+                entries = list(os.scandir(str(self.root / relative)))
+            except FileNotFoundError:
+                continue
+            except NotADirectoryError:
+                yield relative, os.lstat(str(self.root / relative))
+                continue
+            for entry in entries:
+                name = entry.name
+                path = relative + '/' + name if relative else name
+                if name.startswith('.') and name not in TreeIndex.included_dotfiles:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if path not in excluded:
+                        stack.append(path)
+                elif not (name.endswith(TreeIndex.excluded_suffixes) or
+                          name.startswith(TreeIndex.excluded_prefixes)):
+                    yield path, entry.stat(follow_symlinks=False)
+
+    def _hash(self, path: str) -> Optional[bytes]:
+        """Return the digest of a file, or None if it disappeared."""
+        full_path = str(self.root / path)
+        digest = hashlib.sha1()
+        try:
+            if os.path.islink(full_path):
+                digest.update(os.readlink(full_path).encode('utf-8', 'surrogateescape'))
+            else:
+                with open(full_path, 'rb') as file:
+                    for block in iter(lambda: file.read(1 << 20), b''):
+                        digest.update(block)
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        return digest.digest()
@@ -0,0 +1,257 @@
+"""Watch kernel source trees and rebuild on change.
+
+Directories are watched with inotify. Bursts of events, such as an editor
+saving several files, are debounced into a single rebuild, and a rebuild in
+progress is cancelled as soon as a newer edit arrives.
+
+Without an object directory, kbuild writes vmlinux, linker scripts and
+generated headers between the sources while it builds. In git trees the
+paths git ignores are therefore not changes, unless they are tracked, so a
+build never restarts itself.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Set
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.tree_index import TreeIndex
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_event_header = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """A minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch a path for events, returning the watch descriptor."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self, timeout: Optional[float]=None):
+        """Yield (wd, mask, name) tuples of pending events.
+
+        Blocks up to timeout seconds for the first event.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            buffer = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _event_header.unpack_from(buffer, offset)
+            offset += _event_header.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self) -> None:
+        """Release the inotify instance."""
+        os.close(self.fd)
+
+
+class TreeWatcher(object):
+    """Report source files changed in a tree.
+
+    Properties:
+        root: Root directory of the watched tree.
+        exclude: Relative paths of directories which are not watched.
+        debounce: Seconds without events after which edits are settled.
+        git: Whether the tree is a git tree, whose ignored files are not
+            sources.
+    """
+
+    watch_mask = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+    def __init__(self, root: Path, *, exclude: Iterable[str]=(),
+                 debounce: float=0.5) -> None:
+        self.root = Path(root)
+        self.exclude = set(TreeIndex.excluded_dirs) | set(exclude)
+        self.debounce = debounce
+        self.git = (self.root / '.git').exists()
+        self._inotify = None
+        self._watches = {}
+
+    def __enter__(self):
+        """Start watching the tree."""
+        self._inotify = Inotify()
+        self._watch_tree('')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop watching the tree."""
+        self._inotify.close()
+        return False
+
+    def wait_for_change(self, timeout: Optional[float]=None) -> Set[str]:
+        """Block until at least one source file changed.
+
+        Returns:
+            The relative paths of the changed files, empty on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            changes = self._read_changes(remaining)
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def wait_until_settled(self, changes: Set[str]) -> Set[str]:
+        """Collect further changes until none arrive for debounce seconds."""
+        while True:
+            more = self._read_changes(self.debounce)
+            if not more:
+                return changes
+            changes |= more
+
+    def _read_changes(self, timeout: Optional[float]) -> Set[str]:
+        """Read pending events, returning the source files they affect."""
+        changes = set()
+        for wd, mask, name in self._inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                changes.add('')
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            path = directory + '/' + name if directory else name
+            if not name or self._ignored(name):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path not in self.exclude:
+                    self._watch_tree(path)
+                    changes.add(path)
+            else:
+                changes.add(path)
+        return self._sources(changes)
+
+    def _sources(self, paths: Set[str]) -> Set[str]:
+        """Drop the paths git ignores, which are build outputs unless tracked."""
+        if not self.git or not paths - {''}:
+            return paths
+        try:
+            result = subprocess.run(
+                ['git', '-C', str(self.root), 'check-ignore', '-z', '--stdin'],
+                input=b'\0'.join(os.fsencode(path) for path in paths if path),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            return paths
+        if result.returncode not in (0, 1):
+            return paths
+        return paths - {os.fsdecode(path) for path in result.stdout.split(b'\0') if path}
+
+    def _ignored(self, name: str) -> bool:
+        """Return whether a file name is not a source file."""
+        return ((name.startswith('.') and name not in TreeIndex.included_dotfiles) or
+                name.endswith(TreeIndex.excluded_suffixes) or
+                name.startswith(TreeIndex.excluded_prefixes) or name.endswith('~'))
+
+    def _watch_tree(self, relative: str) -> None:
+        """Watch a directory and all of its subdirectories."""
+        stack = [relative]
+        while stack:
+            relative = stack.pop()
+            try:
+                wd = self._inotify.add_watch(str(self.root / relative), TreeWatcher.watch_mask)
+            except OSError as error:
+                if error.errno == errno.ENOSPC:
+                    raise KbuilderRuntimeError(
+                        'Out of inotify watches, raise fs.inotify.max_user_watches')
+                continue
+            self._watches[wd] = relative
+            try:
+                entries = list(os.scandir(str(self.root / relative)))
+            except OSError:
+                continue
+            for entry in entries:
+                path = relative + '/' + entry.name if relative else entry.name
+                if (entry.is_dir(follow_symlinks=False) and not self._ignored(entry.name)
+                        and path not in self.exclude):
+                    stack.append(path)
+
+
+class RebuildLoop(object):
+    """Rebuild whenever the watched tree changes.
+
+    Properties:
+        watcher: The TreeWatcher reporting changes.
+        build: Called on a worker thread with the changed paths.
+        cancel: Called to cancel a build in progress.
+    """
+
+    def __init__(self, watcher: TreeWatcher, build: Callable[[Set[str]], None],
+                 cancel: Callable[[], None]) -> None:
+        self.watcher = watcher
+        self.build = build
+        self.cancel = cancel
+        self._thread = None
+
+    @property
+    def building(self) -> bool:
+        """Whether a build is in progress."""
+        return bool(self._thread and self._thread.is_alive())
+
+    def run(self, initial_build: bool=True) -> None:
+        """Watch for changes forever, or until interrupted."""
+        try:
+            if initial_build:
+                self._start(set())
+            while True:
+                changes = self.watcher.wait_for_change()
+                if self.building:
+                    self.cancel()
+                changes = self.watcher.wait_until_settled(changes)
+                self._stop()
+                self._start(changes)
+        finally:
+            if self.building:
+                self.cancel()
+            self._stop()
+
+    def _start(self, changes: Set[str]) -> None:
+        self._thread = threading.Thread(target=self.build, args=(changes,),
+                                        name='kbuilder-watch-build')
+        self._thread.start()
+
+    def _stop(self) -> None:
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,173 @@
+"""A pool of git worktrees for building other commits of a kernel tree.
+
+Building another commit in the kernel tree itself means switching the
+checkout, which touches the files the commits differ in and makes the
+next build of the current work rebuild them. WorktreePool keeps a few
+detached worktrees of the repository instead. Worktrees share the
+objects of the repository, so creating one only checks out the files.
+Each has its own persistent object directory, which stays warm for the
+next commit built in it.
+
+A worktree is taken by one build at a time through an fcntl lock, so
+several commits can build side by side. A commit is built in the
+worktree whose checkout differs in the fewest files from it, so moving a
+worktree to a new commit only rebuilds what changed in between.
+"""
+
+import fcntl
+import json
+import os
+import subprocess
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from kbuilder.core.exc import KbuilderRuntimeError
+
+Worktree = namedtuple('Worktree', 'slot source object_dir commit')
+Worktree.__doc__ = """A worktree of the pool checked out at a commit.
+
+Properties:
+    slot: Number of the worktree in the pool.
+    source: The checkout.
+    object_dir: Persistent object directory of builds of the checkout.
+    commit: The commit checked out.
+"""
+
+
+def _git(directory: Path, *arguments: str) -> str:
+    """Run git in a directory and return its output.
+
+    Raises:
+        KbuilderRuntimeError: If git fails.
+    """
+    try:
+        result = subprocess.run(['git', '-C', str(directory)] + list(arguments),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as error:
+        raise KbuilderRuntimeError('Failed to run git: {}'.format(error))
+    if result.returncode:
+        raise KbuilderRuntimeError('git {} failed: {}'.format(
+            arguments[0], result.stderr.decode(errors='replace').strip()))
+    return result.stdout.decode(errors='replace')
+
+
+class WorktreePool(object):
+    """Detached worktrees of a repository with persistent object directories.
+
+    Properties:
+        repository: The repository, such as the kernel tree.
+        directory: Directory of the worktrees, one numbered sub directory
+            per worktree.
+        size: Most amount of worktrees.
+    """
+
+    def __init__(self, repository: Path, directory: Path, size: int=4) -> None:
+        self.repository = Path(repository)
+        self.directory = Path(directory)
+        self.size = max(size, 1)
+
+    def resolve(self, revision: str) -> str:
+        """Return the commit a revision names in the repository.
+
+        Raises:
+            ValueError: If the revision names no commit.
+        """
+        try:
+            return _git(self.repository, 'rev-parse', '--verify', '--quiet',
+                        revision + '^{commit}').strip()
+        except KbuilderRuntimeError:
+            raise ValueError('Unknown revision: {}'.format(revision))
+
+    def _slot_dir(self, slot: int) -> Path:
+        return self.directory / str(slot)
+
+    def states(self) -> Dict[int, Dict]:
+        """Return the commit and last use of the worktrees created so far."""
+        states = {}
+        for slot in range(self.size):
+            try:
+                states[slot] = json.loads((self._slot_dir(slot) / 'state.json').read_text())
+            except (FileNotFoundError, ValueError):
+                pass
+        return states
+
+    def _distance(self, slot: int, state: Optional[Dict], commit: str) -> float:
+        """Return the amount of files differing between a worktree and a commit."""
+        if not state or not (self._slot_dir(slot) / 'src' / '.git').exists():
+            return float('inf')
+        if state['commit'] == commit:
+            return 0
+        try:
+            return len(_git(self.repository, 'diff', '--name-only', state['commit'],
+                            commit).splitlines())
+        except KbuilderRuntimeError:
+            return float('inf')
+
+    def _order(self, commit: str) -> List[int]:
+        """Return the worktrees by preference for building a commit."""
+        states = self.states()
+        return sorted(range(self.size), key=lambda slot: (
+            self._distance(slot, states.get(slot), commit),
+            states[slot]['used'] if slot in states else 0, slot))
+
+    @contextmanager
+    def acquire(self, revision: str) -> Iterator[Worktree]:
+        """Check out a revision in a worktree which no other build uses.
+
+        Waits for a worktree if all are in use.
+
+        Raises:
+            ValueError: If the revision names no commit.
+            KbuilderRuntimeError: If git fails to check it out.
+        """
+        commit = self.resolve(revision)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        order = self._order(commit)
+        lock = None
+        for slot in order:
+            lock = self._lock(slot, blocking=False)
+            if lock:
+                break
+        else:
+            slot = order[0]
+            lock = self._lock(slot, blocking=True)
+        try:
+            worktree = self._checkout(slot, commit)
+            self._save_state(slot, commit)
+            yield worktree
+        finally:
+            lock.close()
+
+    def _lock(self, slot: int, *, blocking: bool):
+        """Lock a worktree, returning the open lock file or None if it is taken."""
+        self._slot_dir(slot).mkdir(parents=True, exist_ok=True)
+        lock = open(str(self._slot_dir(slot) / 'lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _checkout(self, slot: int, commit: str) -> Worktree:
+        """Check out a commit in a worktree, creating it if needed."""
+        source = self._slot_dir(slot) / 'src'
+        if (source / '.git').exists():
+            _git(source, 'checkout', '--detach', '--force', '--quiet', commit)
+            _git(source, 'clean', '-ffdxq', '-e', '/.kbuilder')
+        else:
+            _git(self.repository, 'worktree', 'prune')
+            _git(self.repository, 'worktree', 'add', '--detach', '--force', str(source),
+                 commit)
+        object_dir = self._slot_dir(slot) / 'out'
+        object_dir.mkdir(exist_ok=True)
+        return Worktree(slot, source, object_dir, commit)
+
+    def _save_state(self, slot: int, commit: str) -> None:
+        path = self._slot_dir(slot) / 'state.json'
+        temp = path.with_name('.state.json.tmp')
+        temp.write_text(json.dumps({'commit': commit, 'used': time.time()}))
+        os.replace(str(temp), str(path))
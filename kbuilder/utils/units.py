@@ -0,0 +1,38 @@
+"""Conversions between human readable units and numbers."""
+
+_size_suffixes = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """Convert a size such as '512M' or '10G' into bytes.
+
+    Raises:
+        ValueError: If the size is not a number followed by an optional suffix.
+    """
+    size = str(size).strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    suffix = size[-1:] if size[-1:] in _size_suffixes else ''
+    number = size[:len(size) - len(suffix)]
+    return int(float(number) * _size_suffixes[suffix])
+
+
+def format_size(size: int) -> str:
+    """Convert an amount of bytes into a human readable size."""
+    for suffix in ('', 'K', 'M', 'G'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, suffix) if suffix else '{}'.format(size)
+        size /= 1024
+    return '{:.1f}T'.format(size)
+
+
+def format_duration(seconds: float) -> str:
+    """Convert seconds into a human readable duration such as '1h 02m' or '3m 20s'."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '{}s'.format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return '{}m {:02d}s'.format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h {:02d}m'.format(hours, minutes)
@@ -0,0 +1,135 @@
+"""Tests for kbuilder.cli.handler.linux."""
+
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from kbuilder.cli.handler.linux import LinuxBuildHandler
+from kbuilder.core.arch import Arch
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.hooks import HookPipeline
+from kbuilder.core.linux import LinuxKernel
+from kbuilder.core.report import BuildReport
+
+
+class RunHooksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.results = []
+        self.handler = LinuxBuildHandler()
+        self.handler.app = SimpleNamespace(build_hooks=HookPipeline(['post_kbuild_image']),
+                                           log_hook_result=self.results.append)
+
+    def test_required_hooks_succeed(self):
+        self.handler.app.build_hooks.register('post_kbuild_image', lambda app, image: image)
+        self.handler.run_hooks('post_kbuild_image', Path('Image'))
+        self.assertTrue(self.results[0].ok)
+
+    def test_failed_required_hook_fails_the_command(self):
+        def upload(app, image):
+            raise OSError('unreachable')
+
+        self.handler.app.build_hooks.register('post_kbuild_image', upload)
+        with self.assertRaisesRegex(KbuilderRuntimeError, 'upload'):
+            self.handler.run_hooks('post_kbuild_image', Path('Image'))
+        self.assertEqual(len(self.results), 1)
+
+
+class PrepareObjectDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = Path(self.directory.name, 'linux')
+        self.root.mkdir()
+        self.object_dir = Path(self.directory.name, 'tmpfs', 'linux')
+        self.handler = LinuxBuildHandler()
+        self.handler.app = SimpleNamespace(pargs=SimpleNamespace(tmpfs=True))
+        self.handler._kernel = LinuxKernel(str(self.root), arch=Arch.arm64)
+        self.handler.tmpfs = mock.Mock(path=self.object_dir)
+        self.handler.tmpfs.acquire.return_value = self.object_dir
+        self.handler.log = mock.Mock()
+
+    def test_builds_on_tmpfs(self):
+        self.handler.prepare_object_dir()
+        self.assertEqual(self.handler.kernel.output_dir, self.object_dir)
+
+    def test_builds_in_place_after_in_tree_builds(self):
+        (self.root / '.config').write_text('CONFIG_64BIT=y\n')
+        self.handler.prepare_object_dir()
+        self.assertIsNone(self.handler.kernel.output_dir)
+        self.handler.tmpfs.acquire.assert_not_called()
+        self.assertIn('mrproper', self.handler.log.warning.call_args[0][0])
+
+    def test_generated_directories_are_in_tree_builds(self):
+        for path in ('include/config', 'arch/arm64/include/generated'):
+            with self.subTest(path=path):
+                (self.root / path).mkdir(parents=True)
+                self.assertTrue(self.handler.kernel.built_in_tree)
+                (self.root / path).rmdir()
+        self.assertFalse(self.handler.kernel.built_in_tree)
+
+
+class ArtifactCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.handler = LinuxBuildHandler()
+        self.handler._kernel = LinuxKernel(directory.name, arch=Arch.arm64)
+        self.handler.log = mock.Mock()
+        self.handler.remote_cache = mock.Mock(url='http://cache')
+        self.handler.artifact_cache = mock.Mock()
+        self.report = BuildReport('kbuild_image', kernel='linux')
+        for name in ('artifact_key', 'compile_kbuild_image'):
+            patcher = mock.patch.object(self.handler, name)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        self.handler.artifact_key.return_value = 'key'
+        patcher = mock.patch.object(self.handler.kernel, 'arch_clean')
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_cached_kbuild_image_is_fetched(self):
+        image = self.handler.kernel.kbuild_image
+        self.handler.artifact_cache.fetch.return_value = [image]
+        self.handler.make_kbuild_image(self.report)
+        self.handler.artifact_cache.fetch.assert_called_once_with(
+            'key', self.handler.kernel.object_dir)
+        self.handler.compile_kbuild_image.assert_not_called()
+        self.handler.kernel.arch_clean.assert_not_called()
+        self.assertIn('fetch', dict(self.report.phases))
+
+    def test_compiled_kbuild_image_is_stored(self):
+        self.handler.artifact_cache.fetch.return_value = []
+        self.handler.make_kbuild_image(self.report)
+        self.handler.compile_kbuild_image.assert_called_once_with(self.report)
+        self.handler.artifact_cache.store.assert_called_once_with(
+            'key', self.handler.kernel.object_dir, ['arch/arm64/boot/Image.gz-dtb'])
+
+    def test_failed_fetch_builds(self):
+        self.handler.artifact_cache.fetch.side_effect = KbuilderRuntimeError('corrupt')
+        self.handler.make_kbuild_image(self.report)
+        self.handler.compile_kbuild_image.assert_called_once_with(self.report)
+        self.handler.log.warning.assert_called_once()
+
+
+    def test_artifact_key_leaves_out_local_paths(self):
+        kernel = self.handler.kernel
+        (kernel.object_dir / '.config').write_text('CONFIG_64BIT=y\n')
+        kernel.environment.variables.update(O='/dev/shm/kbuilder/linux', LOCALVERSION='-a')
+        kernel.environment.env.update(PATH='/opt/gcc/bin', CROSS_COMPILE='/opt/gcc/bin/aarch64-',
+                                      KBUILD_BUILD_USER='kbuilder')
+        compiler = mock.Mock(identity='GCC 7.3.0 aarch64')
+        with mock.patch.object(LinuxBuildHandler, 'compiler', new=compiler), \
+                mock.patch.object(self.handler, 'scan_tree'):
+            LinuxBuildHandler.artifact_key(self.handler, 'modules', strip='yes')
+        _, kwargs = self.handler.artifact_cache.key.call_args
+        self.assertEqual(kwargs['config'], b'CONFIG_64BIT=y\n')
+        self.assertEqual(kwargs['compiler_identity'], 'GCC 7.3.0 aarch64')
+        self.assertEqual(kwargs['variables'], {'make.LOCALVERSION': '-a',
+                                               'env.KBUILD_BUILD_USER': 'kbuilder',
+                                               'option.strip': 'yes'})
+
+
+if __name__ == '__main__':
+    unittest.main()
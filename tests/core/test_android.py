@@ -0,0 +1,60 @@
+"""Tests for kbuilder.core.android."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.android import AndroidKernel
+from kbuilder.core.arch import Arch
+from kbuilder.core.ota_signing import OtaSigner
+
+
+class AndroidKernelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.kernel = AndroidKernel(str(self.root / 'linux'), arch=Arch.arm64)
+        self.kernel.local_version = 'test-1.0.0'
+        self.kernel.kbuild_image.parent.mkdir(parents=True)
+        self.kernel.kbuild_image.write_bytes(b'kernel image')
+        self.source = self.root / 'ota'
+        (self.source / 'META-INF').mkdir(parents=True)
+        (self.source / 'META-INF' / 'updater-script').write_text('ui_print("kernel");\n')
+        (self.source / 'boot').mkdir()
+        self.output = self.root / 'export'
+        self.output.mkdir()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reproducible_ota_package(self):
+        packages = []
+        script = self.source / 'META-INF' / 'updater-script'
+        for mtime in (1000000000, 1200000000):
+            # Only the contents of the OTA tree matter
+            os.utime(str(script), (mtime, mtime))
+            package = self.kernel.make_ota_package(kbuild_image_dir='boot',
+                                                   output_dir=self.output,
+                                                   source_dir=self.source,
+                                                   epoch=1600000000)
+            self.assertEqual(Path(package), self.output / 'test-1.0.0.zip')
+            packages.append(Path(package).read_bytes())
+        self.assertEqual(packages[0], packages[1])
+
+    @unittest.skipUnless(shutil.which('openssl'), 'openssl is not installed')
+    def test_signed_ota_package(self):
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                               '-keyout', str(self.root / 'testkey.pem'),
+                               '-out', str(self.root / 'testkey.x509.pem'),
+                               '-days', '1', '-subj', '/CN=test'],
+                              stderr=subprocess.DEVNULL)
+        signer = OtaSigner(self.root / 'testkey.pem', self.root / 'testkey.x509.pem')
+        for epoch in (None, 1600000000):
+            signed = self.kernel.make_signed_ota_package(signer, kbuild_image_dir='boot',
+                                                         output_dir=self.output,
+                                                         source_dir=self.source, epoch=epoch)
+            self.assertEqual(signed.path, self.output / 'test-1.0.0.zip')
+            self.assertEqual(signer.verify(signed.path), signed)
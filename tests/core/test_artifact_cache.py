@@ -0,0 +1,109 @@
+"""Tests for kbuilder.core.artifact_cache."""
+
+import hashlib
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from kbuilder.core.artifact_cache import ArtifactCache
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.remote_cache import CacheServer, CacheStore, RemoteCache
+from kbuilder.core.tree_index import TreeIndex
+
+
+class ArtifactCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.server = CacheServer(CacheStore(self.root / 'store'), '127.0.0.1', 0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.remote = RemoteCache('http://127.0.0.1:{}'.format(self.server.server_address[1]),
+                                  jobs=4)
+        self.cache = ArtifactCache(self.remote)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def key(self, tree: Path, **options) -> str:
+        arguments = dict(config=b'CONFIG_64BIT=y\n', compiler_identity='GCC 7.3.0 aarch64')
+        arguments.update(options)
+        return self.cache.key(TreeIndex(tree).scan(jobs=1), 'kbuild_image', **arguments)
+
+    def test_key_ignores_in_tree_outputs(self):
+        tree = self.root / 'linux'
+        (tree / 'kernel').mkdir(parents=True)
+        (tree / 'kernel' / 'fork.c').write_text('int fork;\n')
+        key = self.key(tree)
+        (tree / 'kernel' / 'fork.o').write_bytes(b'object')
+        (tree / 'kernel' / 'config_data.h').write_text('generated\n')
+        (tree / 'kernel' / '.config_data.h.cmd').write_text('cmd_kernel/config_data.h := gen\n')
+        (tree / 'vmlinux').write_bytes(b'elf')
+        (tree / '.config').write_text('CONFIG_64BIT=y\n')
+        self.assertEqual(self.key(tree), key)
+
+        self.assertNotEqual(self.key(tree, config=b'CONFIG_64BIT=n\n'), key)
+        self.assertNotEqual(self.key(tree, compiler_identity='GCC 8.1.0 aarch64'), key)
+        self.assertNotEqual(self.key(tree, variables={'make.LOCALVERSION': '-test'}), key)
+        (tree / 'kernel' / 'fork.c').write_text('int fork = 1;\n')
+        self.assertNotEqual(self.key(tree), key)
+
+    def test_store_and_fetch(self):
+        build = self.root / 'build'
+        (build / 'arch' / 'arm64' / 'boot').mkdir(parents=True)
+        (build / 'arch' / 'arm64' / 'boot' / 'Image.gz-dtb').write_bytes(b'image')
+        (build / 'kernel').mkdir()
+        (build / 'kernel' / 'a.ko').write_bytes(b'module')
+        (build / 'kernel' / 'b.ko').write_bytes(b'module')
+        (build / 'kernel' / 'b.ko').chmod(0o600)
+        names = ['arch/arm64/boot/Image.gz-dtb', 'kernel/a.ko', 'kernel/b.ko']
+        self.cache.store('key', build, names)
+        # The upload does not read the files of the build.
+        (build / 'kernel' / 'a.ko').write_bytes(b'rebuilt')
+        self.assertEqual(self.remote.wait(), [])
+
+        fetched = self.root / 'fetched'
+        self.assertEqual(self.cache.fetch('key', fetched), [fetched / name for name in names])
+        self.assertEqual((fetched / 'arch' / 'arm64' / 'boot' / 'Image.gz-dtb').read_bytes(),
+                         b'image')
+        self.assertEqual((fetched / 'kernel' / 'a.ko').read_bytes(), b'module')
+        self.assertEqual((fetched / 'kernel' / 'b.ko').stat().st_mode & 0o777, 0o600)
+        self.assertEqual([path.name for path in fetched.iterdir()], ['arch', 'kernel'])
+        self.assertEqual(self.cache.fetch('missing', fetched), [])
+
+    def test_upload_disabled(self):
+        build = self.root / 'build'
+        build.mkdir()
+        (build / 'Image').write_bytes(b'image')
+        ArtifactCache(self.remote, upload=False).store('key', build, ['Image'])
+        self.assertEqual(self.remote.wait(), [])
+        self.assertEqual(self.cache.fetch('key', self.root / 'fetched'), [])
+
+    def test_unsafe_manifests_are_rejected(self):
+        blob = self.root / 'blob'
+        blob.write_bytes(b'contents')
+        self.remote.put_blob(blob)
+        file = {'name': 'Image', 'digest': hashlib.sha256(b'contents').hexdigest(),
+                'size': 8, 'mode': 0o644}
+        for number, entry in enumerate([dict(file, name='../Image'),
+                                        dict(file, name='/tmp/Image'),
+                                        dict(file, name='boot/../../Image'),
+                                        dict(file, name=''),
+                                        dict(file, digest='../blob'),
+                                        {'name': 'Image'}]):
+            self.remote.put_manifest('artifacts-{}'.format(number), {'files': [entry]})
+            with self.assertRaises(KbuilderRuntimeError):
+                self.cache.fetch(str(number), self.root / 'fetched')
+        self.assertFalse((self.root / 'Image').exists())
+
+        self.remote.put_manifest('artifacts-missing', {'files': [
+            dict(file, digest='0' * 64)]})
+        self.assertEqual(self.cache.fetch('missing', self.root / 'fetched'), [])
+        self.assertEqual(list((self.root / 'fetched').iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
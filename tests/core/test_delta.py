@@ -0,0 +1,66 @@
+"""Tests for kbuilder.core.delta."""
+
+import os
+import random
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from kbuilder.core import delta
+
+
+class PatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def round_trip(self, old: bytes, new: bytes) -> Path:
+        (self.root / 'old').write_bytes(old)
+        (self.root / 'new').write_bytes(new)
+        delta.make_patch(self.root / 'old', self.root / 'new', self.root / 'patch')
+        delta.apply_patch(self.root / 'old', self.root / 'patch', self.root / 'result')
+        self.assertEqual((self.root / 'result').read_bytes(), new)
+        return self.root / 'patch'
+
+    def test_small_edits_produce_small_patch(self):
+        rand = random.Random(0)
+        old = bytes(rand.getrandbits(8) for _ in range(1 << 18))
+        new = bytearray(old)
+        new[1000:1000] = b'inserted'
+        for _ in range(100):
+            offset = rand.randrange(len(new))
+            new[offset] = (new[offset] + 1) & 0xff
+        patch = self.round_trip(old, bytes(new))
+        self.assertLess(patch.stat().st_size, len(old) // 50)
+
+    def test_large_dissimilar_files(self):
+        rand = random.Random(1)
+        old = rand.getrandbits(8 * (4 << 20)).to_bytes(4 << 20, 'little')
+        # Zeros compress quickly, so the time is spent looking for matches.
+        new = bytes(8 << 20)
+        start = time.monotonic()
+        self.round_trip(old, new)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_shifted_blocks_are_found_after_dissimilar_data(self):
+        rand = random.Random(2)
+        old = rand.getrandbits(8 * (1 << 18)).to_bytes(1 << 18, 'little')
+        new = bytes(rand.getrandbits(8) for _ in range(10003)) + old[777:(1 << 17)]
+        patch = self.round_trip(old, new)
+        self.assertLess(patch.stat().st_size, 10003 + 4096)
+
+    def test_empty_files(self):
+        self.round_trip(b'', b'')
+        self.round_trip(b'', b'new')
+        self.round_trip(b'old', b'')
+
+    def test_wrong_base_is_rejected(self):
+        self.round_trip(b'a' * 100, b'b' * 100)
+        (self.root / 'other').write_bytes(b'c' * 100)
+        with self.assertRaises(ValueError):
+            delta.apply_patch(self.root / 'other', self.root / 'patch', self.root / 'result')
+        self.assertFalse(os.path.exists(str(self.root / 'result.tmp')))
@@ -0,0 +1,91 @@
+"""Tests for kbuilder.core.depindex."""
+
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from kbuilder.core.depindex import DependencyIndex
+
+CMD_FILE = """\
+cmd_drivers/{name}.o := gcc -c -o drivers/{name}.o {root}/drivers/{name}.c
+
+source_drivers/{name}.o := {root}/drivers/{name}.c
+
+deps_drivers/{name}.o := \\
+  {root}/include/linux/kconfig.h \\
+    $(wildcard include/config/foo.h) \\
+  include/generated/autoconf.h \\
+  /usr/lib/gcc/include/stddef.h \\
+{extra}
+drivers/{name}.o: $(deps_drivers/{name}.o)
+
+$(deps_drivers/{name}.o):
+"""
+
+
+class DependencyIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name) / 'linux'
+        self.object_dir = Path(self.directory.name) / 'out'
+        (self.object_dir / 'drivers').mkdir(parents=True)
+        self.write_cmd('foo', '  {}/include/linux/foo.h \\\n'.format(self.root))
+        self.write_cmd('bar', '')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_cmd(self, name, extra):
+        (self.object_dir / 'drivers' / '.{}.o.cmd'.format(name)).write_text(
+            CMD_FILE.format(name=name, root=self.root, extra=extra))
+
+    def test_update_indexes_dependents(self):
+        index = DependencyIndex(self.root, self.object_dir)
+        self.assertEqual(index.update(jobs=1), 2)
+        self.assertEqual(sorted(index.objects), ['drivers/bar.o', 'drivers/foo.o'])
+        self.assertEqual(index.impact('include/linux/kconfig.h')[0], 2)
+        self.assertEqual(index.impact('include/generated/autoconf.h')[0], 2)
+        self.assertEqual(index.impact('include/linux/foo.h')[0], 1)
+        self.assertEqual(index.impact('drivers/bar.c')[0], 1)
+        self.assertIsNone(index.file_id('include/config/foo.h'))
+        self.assertEqual([header for header, _, _ in index.ranking()],
+                         ['include/generated/autoconf.h', 'include/linux/kconfig.h',
+                          'include/linux/foo.h'])
+
+    def test_update_only_parses_changed_files(self):
+        path = Path(self.directory.name) / 'index'
+        index = DependencyIndex(self.root, self.object_dir)
+        index.update(jobs=1)
+        index.save(path)
+        index = DependencyIndex.load(path, self.root, self.object_dir)
+        self.assertEqual(index.update(jobs=1), 0)
+        time.sleep(0.01)
+        self.write_cmd('bar', '  {}/include/linux/foo.h \\\n'.format(self.root))
+        self.assertEqual(index.update(jobs=1), 1)
+        self.assertEqual(index.impact('include/linux/foo.h')[0], 2)
+
+    def test_reverse_dependencies_are_saved(self):
+        path = Path(self.directory.name) / 'index'
+        index = DependencyIndex(self.root, self.object_dir)
+        index.update(jobs=1)
+        index.save(path)
+        index = DependencyIndex.load(path, self.root, self.object_dir)
+        header = index.file_id('include/linux/foo.h')
+        self.assertEqual(list(index.dependents_of[header]),
+                         [index.objects.index('drivers/foo.o')])
+
+        (self.object_dir / 'drivers' / '.foo.o.cmd').unlink()
+        index.update(jobs=1)
+        self.assertEqual(index.dependents('include/linux/foo.h'), [])
+        self.assertEqual(index.dependents('include/linux/kconfig.h'),
+                         [index.objects.index('drivers/bar.o')])
+        self.assertEqual(len(index.dependents_of), len(index.files))
+
+    def test_calibrated_cost(self):
+        index = DependencyIndex(self.root, self.object_dir)
+        index.update(jobs=1)
+        index.calibrate(10.0, [0, 1] * 8)
+        weight = sum(len(files) for files in index.dependencies) * 8
+        self.assertAlmostEqual(index.rate, 10.0 / weight)
+        self.assertAlmostEqual(index.impact('include/linux/kconfig.h')[1], 10.0 / 8)
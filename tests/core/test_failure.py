@@ -0,0 +1,33 @@
+"""Tests for kbuilder.core.failure."""
+
+import unittest
+
+from kbuilder.core.failure import FailureDetector
+
+
+class FailureDetectorTestCase(unittest.TestCase):
+    def test_compiler_error_names_object(self):
+        calls = []
+        detector = FailureDetector(on_failure=lambda: calls.append(True))
+        for line in ['  CC      kernel/fork.o',
+                     '../drivers/foo/bar.c:12:5: error: y undeclared',
+                     'make[3]: *** [../scripts/Makefile.build:250: drivers/foo/bar.o] Error 1',
+                     'make[2]: *** [drivers/foo] Error 2']:
+            detector.feed(line)
+        self.assertEqual(detector.target, 'drivers/foo/bar.o')
+        self.assertEqual(calls, [True])
+        self.assertIn('../drivers/foo/bar.c:12:5: error: y undeclared', detector.errors)
+
+    def test_directory_target_falls_back_to_source(self):
+        detector = FailureDetector()
+        detector.feed('drivers/foo/bar.S:3: Error: bad instruction')
+        detector.feed('drivers/foo/baz.c:1:1: fatal error: foo.h: No such file')
+        detector.feed('make[1]: *** [drivers/foo] Error 2')
+        self.assertEqual(detector.target, 'drivers/foo/baz.o')
+
+    def test_link_failure(self):
+        detector = FailureDetector()
+        detector.feed("ld: kernel/fork.o: undefined reference to `foo'")
+        self.assertFalse(detector.failed)
+        detector.feed('make: *** [Makefile:1100: vmlinux] Error 1')
+        self.assertEqual(detector.target, 'vmlinux')
@@ -0,0 +1,71 @@
+"""Tests for kbuilder.core.gcc."""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.arch import Arch, ArchError
+from kbuilder.core.gcc import ClangCompiler, detect
+from kbuilder.core.make import BuildEnvironment
+
+
+class CompilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        for name in ('gcc/bin/aarch64-linux-android-gcc', 'clang/bin/clang'):
+            (self.root / name).parent.mkdir(parents=True)
+            (self.root / name).write_text('')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_gcc_variables(self):
+        gcc = detect(self.root / 'gcc')
+        self.assertEqual(gcc.target_arch, Arch.arm64)
+        self.assertEqual(gcc.make_variables(), {
+            'CROSS_COMPILE': str(self.root / 'gcc/bin/aarch64-linux-android-'),
+            'SUBARCH': 'arm64'})
+
+    def write_driver(self, path, version):
+        path.write_text('#!/bin/sh\n'
+                        'case "$1" in\n'
+                        '--version) echo "{}"; echo "InstalledDir: $(dirname "$0")";;\n'
+                        '-dumpmachine) echo aarch64-linux-android;;\n'
+                        'esac\n'.format(version))
+        path.chmod(0o755)
+
+    def test_identity_does_not_depend_on_the_location(self):
+        driver = self.root / 'gcc/bin/aarch64-linux-android-gcc'
+        self.write_driver(driver, 'aarch64-linux-android-gcc (GCC) 4.9.x')
+        identity = detect(self.root / 'gcc').identity
+        self.assertEqual(identity,
+                         'Compiler aarch64-linux-android-gcc (GCC) 4.9.x aarch64-linux-android')
+
+        copy = self.root / 'elsewhere/gcc/bin/aarch64-linux-android-gcc'
+        copy.parent.mkdir(parents=True)
+        self.write_driver(copy, 'aarch64-linux-android-gcc (GCC) 4.9.x')
+        self.assertEqual(detect(self.root / 'elsewhere/gcc').identity, identity)
+
+        self.write_driver(driver, 'aarch64-linux-android-gcc (GCC) 6.3.1')
+        self.assertNotEqual(detect(self.root / 'gcc').identity, identity)
+
+    def test_clang_path_is_only_set_in_the_environment(self):
+        clang = detect(self.root / 'clang')
+        self.assertIsInstance(clang, ClangCompiler)
+        self.assertTrue(clang.supports(Arch.x86))
+        with self.assertRaises(ArchError):
+            clang.make_variables()
+        variables = clang.make_variables(Arch.arm64)
+        self.assertNotIn('PATH', variables)
+        self.assertEqual(variables['CROSS_COMPILE'], 'aarch64-linux-gnu-')
+
+        environment = BuildEnvironment()
+        clang.set_as_active(environment, Arch.arm64)
+        self.assertEqual(environment.env['PATH'].split(os.pathsep)[0],
+                         str(self.root / 'clang' / 'bin'))
+        self.assertEqual(environment.env['LLVM'], '1')
+        detect(self.root / 'gcc').set_as_active(environment, Arch.arm64)
+        self.assertNotIn('PATH', environment.env)
+        self.assertNotIn('LLVM', environment.env)
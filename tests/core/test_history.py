@@ -0,0 +1,70 @@
+"""Tests for kbuilder.core.history."""
+
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.history import BuildHistory, mann_whitney
+from kbuilder.core.report import BuildReport
+
+
+class BuildHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.history = BuildHistory(Path(self.directory.name) / 'history.sqlite')
+        self.random = random.Random(0)
+
+    def tearDown(self):
+        self.history.close()
+        self.directory.cleanup()
+
+    def record(self, revision, duration, image_size, text_size=1 << 20):
+        report = BuildReport('kbuild_image', kernel='linux', compiler='gcc')
+        with report.phase('compile'):
+            pass
+        report.phases[-1] = ('compile', duration * 0.9)
+        report.artifacts.append({'kind': 'kbuild_image', 'size': image_size})
+        report.finish()
+        report.duration = duration
+        self.history.record(report, revision=revision, defconfig='test_defconfig',
+                            sections={'.text': text_size, '.bss': 4096})
+
+    def test_detects_lasting_slowdown_and_growth(self):
+        for number in range(20):
+            self.record('a{}'.format(number), 100 + self.random.uniform(-3, 3), 8 << 20)
+        for number in range(10):
+            self.record('b{}'.format(number), 112 + self.random.uniform(-3, 3),
+                        (8 << 20) + (120 << 10), text_size=(1 << 20) + (100 << 10))
+        regressions = {regression.metric: regression for regression in
+                       self.history.regressions('linux', 'kbuild_image', 'test_defconfig')}
+        self.assertEqual(sorted(regressions), ['Image', 'build time', 'compile time',
+                                               'vmlinux .text'])
+        self.assertEqual(regressions['build time'].revision, 'b0')
+        self.assertAlmostEqual(regressions['build time'].change, 0.12, delta=0.04)
+        self.assertEqual(regressions['Image'].after - regressions['Image'].before, 120 << 10)
+        self.assertEqual(regressions['Image'].revision, 'b0')
+
+    def test_recent_progress(self):
+        for objects in (100, 3):
+            report = BuildReport('kbuild_image', kernel='linux', compiler='gcc')
+            report.progress = {'objects': objects, 'stages': []}
+            report.finish()
+            self.history.record(report, defconfig='test_defconfig')
+        references = self.history.recent_progress('linux', 'kbuild_image', 'test_defconfig',
+                                                  'gcc')
+        self.assertEqual([reference['objects'] for reference in references], [3, 100])
+
+    def test_noise_is_no_regression(self):
+        for number in range(30):
+            self.record('a{}'.format(number), 100 + self.random.uniform(-5, 5), 8 << 20)
+        self.assertEqual(self.history.regressions('linux', 'kbuild_image', 'test_defconfig'),
+                         [])
+        builds = self.history.builds('linux', limit=5)
+        self.assertEqual([build.revision for build in builds],
+                         ['a29', 'a28', 'a27', 'a26', 'a25'])
+
+    def test_mann_whitney(self):
+        self.assertLess(mann_whitney([1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12]), 0.01)
+        self.assertGreater(mann_whitney([1, 3, 5, 7, 9, 11], [2, 4, 6, 8, 10, 12]), 0.5)
+        self.assertEqual(mann_whitney([5, 5, 5], [5, 5, 5]), 1.0)
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+from kbuilder.core.exc import KbuilderArgumentError
+from kbuilder.core.hooks import HookPipeline
+
+
+class TestHookPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        self.pipeline = HookPipeline(['post_kbuild_image'],
+                                     on_background_result=self.results.append)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self, image):
+        self.release.wait(10)
+        return image
+
+    def test_register_undefined_point(self):
+        with self.assertRaises(KbuilderArgumentError):
+            self.pipeline.register('post_undefined', print)
+
+    def test_required_hook_result(self):
+        self.pipeline.register('post_kbuild_image', lambda image: image + '.gz')
+        result, = self.pipeline.run('post_kbuild_image', 'Image')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.result, 'Image.gz')
+
+    def test_required_hook_error(self):
+        def fail(image):
+            raise ValueError(image)
+
+        self.pipeline.register('post_kbuild_image', fail)
+        result, = self.pipeline.run('post_kbuild_image', 'Image')
+        self.assertIsInstance(result.error, ValueError)
+
+    def test_required_hook_timeout(self):
+        self.pipeline.register('post_kbuild_image', self.block, timeout=0.1)
+        result, = self.pipeline.run('post_kbuild_image', 'Image')
+        self.assertIsInstance(result.error, TimeoutError)
+
+    def test_optional_hook_runs_in_background(self):
+        self.pipeline.register('post_kbuild_image', self.block, required=False)
+        self.assertEqual(self.pipeline.run('post_kbuild_image', 'Image'), [])
+        self.assertEqual(self.results, [])
+        self.release.set()
+        self.pipeline.wait()
+        result, = self.results
+        self.assertTrue(result.ok)
+        self.assertFalse(result.required)
+
+    def test_optional_hook_timeout(self):
+        self.pipeline.register('post_kbuild_image', self.block, required=False, timeout=0.1)
+        self.pipeline.run('post_kbuild_image', 'Image')
+        self.pipeline.wait()
+        result, = self.results
+        self.assertIsInstance(result.error, TimeoutError)
+
+        # The abandoned callback is reported only once.
+        self.release.set()
+        self.pipeline.wait()
+        self.assertEqual(len(self.results), 1)
+
+    def test_wait_timeout(self):
+        self.pipeline.register('post_kbuild_image', self.block, required=False)
+        self.pipeline.run('post_kbuild_image', 'Image')
+        self.pipeline.wait(timeout=0.1)
+        self.assertEqual(self.results, [])
+
+    def test_hooks_share_the_worker_threads(self):
+        pipeline = HookPipeline(['post_kbuild_image'], max_workers=1)
+        threads = []
+        for _ in range(3):
+            pipeline.register('post_kbuild_image',
+                              lambda image: threads.append(threading.current_thread()))
+        pipeline.run('post_kbuild_image', 'Image')
+        self.assertEqual(len(threads), 3)
+        self.assertEqual(len(set(threads)), 1)
+
+    def test_timeout_starts_when_the_hook_runs(self):
+        pipeline = HookPipeline(['post_kbuild_image'], max_workers=1)
+        pipeline.register('post_kbuild_image', lambda image: time.sleep(0.3), required=False)
+        pipeline.register('post_kbuild_image', lambda image: image + '.gz', timeout=0.2)
+        result, = pipeline.run('post_kbuild_image', 'Image')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.result, 'Image.gz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for kbuilder.core.kconfig."""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core import kconfig
+
+ARCH_KCONFIG = """\
+config ARM64
+\tdef_bool y
+\tselect HAVE_PCI
+\thelp
+\t  config NOT_A_SYMBOL
+
+source "drivers/Kconfig"
+
+config HAVE_PCI
+\tbool
+"""
+
+DRIVERS_KCONFIG = """\
+menu "Drivers"
+\tdepends on ARM64
+
+if HAVE_PCI
+config USB
+\ttristate "USB support"
+\tselect USB_COMMON
+
+config USB_STORAGE
+\ttristate "Mass storage" if !EXPERT
+\tdepends on USB && \\
+\t\t$(cc-option,-fno-pic)
+endif
+
+config USB_COMMON
+\ttristate
+endmenu
+"""
+
+
+class KconfigIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        (self.root / 'arch' / 'arm64').mkdir(parents=True)
+        (self.root / 'drivers').mkdir()
+        (self.root / 'arch' / 'arm64' / 'Kconfig').write_text(ARCH_KCONFIG)
+        (self.root / 'drivers' / 'Kconfig').write_text(DRIVERS_KCONFIG)
+        self.index_path = self.root / '.kbuilder' / 'kconfig-index'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_records_dependencies_of_blocks(self):
+        index = kconfig.KconfigIndex.parse(self.root, 'arm64')
+        self.assertEqual(index.order, ['ARM64', 'USB', 'USB_STORAGE', 'USB_COMMON',
+                                       'HAVE_PCI'])
+        storage = index.get('CONFIG_USB_STORAGE')
+        self.assertEqual(storage.type, 'tristate')
+        self.assertEqual(storage.locations, ['drivers/Kconfig:9'])
+        self.assertEqual(storage.depends,
+                         'ARM64 && HAVE_PCI && (USB && $(cc-option,-fno-pic))')
+        self.assertEqual(index.get('USB_COMMON').depends, 'ARM64')
+        self.assertEqual(index.get('USB_COMMON').selected_by, [('USB', '')])
+        self.assertIsNone(index.get('NOT_A_SYMBOL'))
+
+    def test_load_reparses_changed_files(self):
+        index = kconfig.KconfigIndex.load(self.index_path, self.root, 'arm64')
+        self.assertFalse(index.is_stale())
+        drivers = self.root / 'drivers' / 'Kconfig'
+        drivers.write_text(DRIVERS_KCONFIG + 'config NEW\n\tbool\n')
+        os.utime(str(drivers), ns=(0, 0))
+        index = kconfig.KconfigIndex.load(self.index_path, self.root, 'arm64')
+        self.assertIsNotNone(index.get('NEW'))
+
+    def test_explain_follows_selects(self):
+        index = kconfig.KconfigIndex.parse(self.root, 'arm64')
+        values = {'ARM64': 'y', 'HAVE_PCI': 'y', 'USB': 'm', 'USB_COMMON': 'm'}
+        lines = index.explain('USB_COMMON', values)
+        self.assertEqual(lines[0], 'CONFIG_USB_COMMON=m  (tristate, drivers/Kconfig:15)')
+        self.assertIn('  selected by CONFIG_USB', lines)
+        self.assertIn('    CONFIG_USB=m  (tristate, drivers/Kconfig:5)', lines)
+        self.assertEqual(index.unmet_dependencies('USB_STORAGE', {'ARM64': 'y'}),
+                         ['HAVE_PCI', 'USB'])
+
+
+class ConfigFileTestCase(unittest.TestCase):
+    def test_evaluate(self):
+        values = {'A': 'y', 'B': 'm', 'S': '"x"', 'N': '0x20'}
+        self.assertEqual(kconfig.evaluate('A && B', values), 1)
+        self.assertEqual(kconfig.evaluate('!B || C', values), 1)
+        self.assertEqual(kconfig.evaluate('S = "x" && N >= 16', values), 2)
+        self.assertEqual(kconfig.evaluate('A && !(B || C)', values), 1)
+
+    def test_set_config_values_keeps_kconfig_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'test_defconfig'
+            path.write_text('CONFIG_A=y\nCONFIG_D=y\n')
+            kconfig.set_config_values(path, {'C': 'y', 'D': 'n', 'E': '1'},
+                                      order=['A', 'B', 'C', 'D'])
+            self.assertEqual(path.read_text(), 'CONFIG_A=y\nCONFIG_C=y\n'
+                                               '# CONFIG_D is not set\nCONFIG_E=1\n')
+            self.assertEqual(kconfig.read_config(path),
+                             {'A': 'y', 'C': 'y', 'D': 'n', 'E': '1'})
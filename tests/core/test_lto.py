@@ -0,0 +1,46 @@
+"""Tests for kbuilder.core.lto."""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.lto import ThinLtoCache
+
+
+class ThinLtoCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.object_dir = self.root / 'out'
+        self.object_dir.mkdir()
+        (self.object_dir / '.config').write_text('CONFIG_LTO_CLANG_THIN=y\n')
+        self.cache = ThinLtoCache(self.root / 'store', 100)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_activate_moves_unmanaged_cache_into_the_store(self):
+        link = self.object_dir / ThinLtoCache.link_name
+        link.mkdir()
+        (link / 'llvmcache-1').write_text('backend')
+        cache_dir = self.cache.activate(self.object_dir, 'linux')
+        self.assertTrue(link.is_symlink())
+        self.assertEqual((cache_dir / 'llvmcache-1').read_text(), 'backend')
+        self.assertEqual(self.cache.activate(self.object_dir, 'linux'), cache_dir)
+
+        (self.object_dir / '.config').write_text('CONFIG_LTO_CLANG_THIN=y\nCONFIG_X=y\n')
+        self.assertNotEqual(self.cache.activate(self.object_dir, 'linux'), cache_dir)
+        self.assertEqual(link.resolve(), self.cache.cache_dir(
+            'linux', self.object_dir / '.config').resolve())
+
+    def test_prune_removes_least_recently_used_entries(self):
+        cache_dir = self.cache.activate(self.object_dir, 'linux')
+        for age, name in enumerate(('new', 'middle', 'old')):
+            path = cache_dir / name
+            path.write_bytes(bytes(40))
+            os.utime(str(path), (1000 - age, 1000 - age))
+        self.assertEqual(self.cache.size(), 120)
+        self.assertEqual([path.name for path in self.cache.prune()], ['old'])
+        self.assertEqual(self.cache.size(), 80)
+        self.assertEqual(self.cache.prune(), [])
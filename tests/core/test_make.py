@@ -0,0 +1,83 @@
+"""Tests for kbuilder.core.make."""
+
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from subprocess import CalledProcessError, TimeoutExpired
+
+from kbuilder.core.make import BuildEnvironment, MakeRunner
+
+MAKEFILE = """\
+all:
+\t@echo $(FOO) $$BAR
+where:
+\t@echo $$BAR $$(pwd)
+fail:
+\t@exit 3
+slow:
+\t@echo started; sleep 30
+"""
+
+
+class MakeRunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        Path(self.directory.name, 'Makefile').write_text(MAKEFILE)
+        self.runner = MakeRunner(directory=self.directory.name, jobs=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_command_passes_variables_as_arguments(self):
+        argv = self.runner.command('all', variables={'O': 'out', 'ARCH': 'arm64'})
+        self.assertEqual(argv[-3:], ['ARCH=arm64', 'O=out', 'all'])
+
+    def test_run_passes_variables_and_env(self):
+        result = self.runner.run('all', variables={'FOO': 'a b'},
+                                 env={'BAR': 'c'}, capture=True)
+        self.assertEqual(result.output.strip(), 'a b c')
+        self.assertEqual(result.returncode, 0)
+        self.assertGreaterEqual(result.duration, 0)
+
+    def test_run_raises_on_failure(self):
+        with self.assertRaises(CalledProcessError):
+            self.runner.run('fail')
+        self.assertNotEqual(self.runner.run('fail', check=False).returncode, 0)
+
+    def test_timeout_terminates_make(self):
+        with self.assertRaises(TimeoutExpired):
+            self.runner.run('slow', timeout=0.2)
+
+    def test_cancel_terminates_make(self):
+        lines = []
+
+        def cancel(line):
+            lines.append(line)
+            self.runner.cancel()
+
+        result = self.runner.run('slow', check=False, on_line=cancel)
+        self.assertLess(result.returncode, 0)
+        self.assertEqual(lines[0], 'started')
+
+    def test_environments_are_independent(self):
+        outputs = {}
+
+        def build(name):
+            directory = Path(self.directory.name, name)
+            directory.mkdir()
+            (directory / 'Makefile').write_text(MAKEFILE)
+            runner = MakeRunner(environment=BuildEnvironment(str(directory), env={'BAR': name}))
+            outputs[name] = runner.run('where', capture=True).output.split()
+
+        cwd = os.getcwd()
+        threads = [threading.Thread(target=build, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outputs['a'], ['a', str(Path(self.directory.name, 'a').resolve())])
+        self.assertEqual(outputs['b'], ['b', str(Path(self.directory.name, 'b').resolve())])
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertNotIn('BAR', os.environ)
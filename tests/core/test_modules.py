@@ -0,0 +1,48 @@
+"""Tests for kbuilder.core.modules."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.modules import copy_modules, process_modules
+
+
+class CopyModulesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.install = self.root / 'install'
+        for name in ('kernel/drivers/usb/usbcore.ko', 'kernel/drivers/usb/storage.ko'):
+            (self.install / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.install / name).write_text(name)
+        (self.install / 'modules.dep').write_text(
+            'kernel/drivers/usb/usbcore.ko:\n'
+            'kernel/drivers/usb/storage.ko: kernel/drivers/usb/usbcore.ko\n')
+        (self.install / 'modules.alias').write_text('alias usb:* usbcore\n')
+        (self.install / 'modules.dep.bin').write_bytes(b'\0')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_copies_flat_modules_and_depmod_files(self):
+        processed = self.root / 'processed'
+        process_modules(self.install, processed, jobs=1)
+        ota = self.root / 'ota'
+        ota.mkdir()
+        (ota / 'stale.ko').write_text('')
+        (ota / 'modules.softdep').write_text('')
+        built = sorted(processed.rglob('*.ko'))
+        copied = copy_modules(built, ota, metadata_dir=processed)
+        self.assertEqual(sorted(copied), ['storage.ko', 'usbcore.ko'])
+        self.assertEqual(sorted(path.name for path in ota.iterdir()),
+                         ['modules.alias', 'modules.dep', 'storage.ko', 'usbcore.ko'])
+        self.assertEqual((ota / 'modules.dep').read_text(),
+                         'usbcore.ko:\nstorage.ko: usbcore.ko\n')
+
+    def test_rejects_modules_with_the_same_name(self):
+        (self.install / 'kernel/fs').mkdir()
+        (self.install / 'kernel/fs/storage.ko').write_text('fs')
+        with self.assertRaises(KbuilderRuntimeError):
+            copy_modules(sorted(self.install.rglob('*.ko')), self.root / 'ota')
+        self.assertFalse((self.root / 'ota').exists())
@@ -0,0 +1,58 @@
+"""Tests for kbuilder.core.ota_signing."""
+
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from kbuilder.core.ota_signing import CHUNK_SIZE, OtaSigner
+
+
+@unittest.skipUnless(shutil.which('openssl'), 'openssl is not installed')
+class OtaSignerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                               '-keyout', str(self.root / 'testkey.pem'),
+                               '-out', str(self.root / 'testkey.x509.pem'),
+                               '-days', '1', '-subj', '/CN=test'],
+                              stderr=subprocess.DEVNULL)
+        self.signer = OtaSigner(self.root / 'testkey.pem', self.root / 'testkey.x509.pem')
+        self.source = self.root / 'ota'
+        (self.source / 'META-INF').mkdir(parents=True)
+        (self.source / 'META-INF' / 'updater-script').write_text('ui_print("kernel");\n')
+        (self.source / 'Image').write_bytes(bytes(range(256)) * (CHUNK_SIZE // 128 + 7))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_signs_while_writing(self):
+        package = self.root / 'ota.zip'
+        signed = self.signer.write_package(self.source, package, 1600000000)
+        data = package.read_bytes()
+        self.assertEqual(signed.sha256, hashlib.sha256(data).hexdigest())
+        comment_size = int.from_bytes(data[-2:], 'little')
+        self.assertEqual(signed.signed_sha256,
+                         hashlib.sha256(data[:-comment_size - 2]).hexdigest())
+        with zipfile.ZipFile(str(package)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('Image'), (self.source / 'Image').read_bytes())
+        self.assertEqual(self.signer.verify(package), signed)
+        self.assertEqual(len(signed.chunk_sha256),
+                         (len(data) - comment_size - 2) // CHUNK_SIZE + 1)
+
+    def test_rejects_modified_packages(self):
+        package = self.root / 'ota.zip'
+        self.signer.write_package(self.source, package)
+        data = bytearray(package.read_bytes())
+        data[100] ^= 1
+        package.write_bytes(bytes(data))
+        with self.assertRaises(ValueError):
+            self.signer.verify(package)
+        shutil.make_archive(str(self.root / 'unsigned'), 'zip', str(self.source))
+        with self.assertRaises(ValueError):
+            self.signer.verify(self.root / 'unsigned.zip')
@@ -0,0 +1,105 @@
+"""Tests for kbuilder.core.prepare_cache."""
+
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from kbuilder.core.arch import Arch
+from kbuilder.core.prepare_cache import PrepareCache
+
+
+class PrepareCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.source = self.root / 'linux'
+        for name, text in (('Makefile', 'VERSION = 4'), ('include/linux/types.h', ''),
+                           ('scripts/basic/fixdep.c', 'int main;'),
+                           ('drivers/usb/hub.c', 'int hub;')):
+            (self.source / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.source / name).write_text(text)
+        self.object_dir = self.root / 'out'
+        for name, text in (('.config', 'CONFIG_USB=y\n'),
+                           ('include/generated/autoconf.h', '#define CONFIG_USB 1\n'),
+                           ('include/config/auto.conf', 'CONFIG_USB=y\n'),
+                           ('scripts/basic/fixdep', 'tool'),
+                           ('scripts/basic/.fixdep.cmd', 'cmd_scripts/basic/fixdep'),
+                           ('drivers/usb/hub.o', 'object')):
+            (self.object_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.object_dir / name).write_text(text)
+        self.cache = PrepareCache(self.root / 'cache', max_entries=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def key(self, compiler='gcc 4.9'):
+        return self.cache.key(self.source, self.object_dir, Arch.arm64, compiler)
+
+    def test_key_changes_with_inputs(self):
+        key = self.key()
+        self.assertEqual(self.key(), key)
+        (self.source / 'drivers' / 'usb' / 'hub.c').write_text('int hub = 1;')
+        self.assertEqual(self.key(), key)
+
+        self.assertNotEqual(self.key('clang 9'), key)
+        self.assertNotEqual(self.cache.key(self.source, self.object_dir, Arch.arm,
+                                           'gcc 4.9'), key)
+        (self.object_dir / '.config').write_text('CONFIG_USB=m\n')
+        config_key = self.key()
+        self.assertNotEqual(config_key, key)
+        (self.source / 'include' / 'linux' / 'types.h').write_text('typedef int s32;')
+        self.assertNotEqual(self.key(), config_key)
+
+        # Outputs of a build in the source tree are no inputs.
+        (self.source / 'scripts' / 'basic' / 'fixdep').write_text('tool')
+        (self.source / 'scripts' / 'basic' / '.fixdep.cmd').write_text('cmd')
+        self.assertEqual(self.key(), self.key())
+
+    def test_store_and_restore(self):
+        snapshot = self.cache.store('key', self.object_dir, Arch.arm64)
+        with tarfile.open(str(snapshot)) as tar:
+            self.assertEqual(sorted(tar.getnames()), [
+                'include/config', 'include/config/auto.conf', 'include/generated',
+                'include/generated/autoconf.h', 'scripts/basic/.fixdep.cmd',
+                'scripts/basic/fixdep'])
+
+        target = self.root / 'target'
+        (target / 'include' / 'generated').mkdir(parents=True)
+        (target / 'include' / 'generated' / 'stale.h').write_text('')
+        start = time.time()
+        self.assertTrue(self.cache.restore('key', target))
+        self.assertFalse(self.cache.restore('missing', target))
+        self.assertEqual(sorted(path.name for path in (target / 'include/generated').iterdir()),
+                         ['autoconf.h'])
+        self.assertEqual((target / 'scripts' / 'basic' / 'fixdep').read_text(), 'tool')
+        self.assertGreaterEqual((target / 'scripts' / 'basic' / 'fixdep').stat().st_mtime,
+                                start - 1)
+        self.assertFalse((target / '.kbuilder-prepare.tmp').exists())
+
+    def test_restore_skips_members_leaving_the_object_directory(self):
+        self.cache.root.mkdir()
+        with tarfile.open(str(self.cache.snapshot_path('unsafe')), 'w') as tar:
+            for name, link in (('include/generated/passwd', '/etc/passwd'),
+                               ('include/generated/escape', '../../..'),
+                               ('include/generated/bounds.h', 'autoconf.h')):
+                info = tarfile.TarInfo(name)
+                info.type, info.linkname = tarfile.SYMTYPE, link
+                tar.addfile(info)
+        target = self.root / 'target'
+        target.mkdir()
+        self.assertTrue(self.cache.restore('unsafe', target))
+        self.assertEqual(os.listdir(str(target / 'include' / 'generated')), ['bounds.h'])
+
+    def test_prune_keeps_recently_used_snapshots(self):
+        self.cache.max_entries = 3
+        for age, key in enumerate(('new', 'middle', 'old')):
+            snapshot = self.cache.store(key, self.object_dir, Arch.arm64)
+            os.utime(str(snapshot), (1000 - age, 1000 - age))
+        self.cache.max_entries = 2
+        self.assertEqual([path.name for path in self.cache.prune()], ['old.tar'])
+        self.assertEqual(sorted(path.name for path in self.cache.root.glob('*.tar')),
+                         ['middle.tar', 'new.tar'])
+
@@ -0,0 +1,111 @@
+"""Tests for kbuilder.core.priority."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from kbuilder.core.priority import (IOPRIO_CLASS_BE, IOPRIO_CLASS_IDLE, PRIORITY_CLASSES,
+                                    Cgroup)
+
+
+class PriorityClassTestCase(unittest.TestCase):
+    def test_classes(self):
+        self.assertEqual(sorted(PRIORITY_CLASSES), ['batch', 'interactive', 'normal'])
+        for name, priority in PRIORITY_CLASSES.items():
+            self.assertEqual(priority.name, name)
+            self.assertTrue(0 <= priority.nice <= 19)
+            self.assertIn(priority.ioprio_class, (IOPRIO_CLASS_BE, IOPRIO_CLASS_IDLE))
+            self.assertTrue(0 <= priority.ioprio_level <= 7)
+            self.assertTrue(1 <= priority.cpu_weight <= 10000)
+            self.assertTrue(1 <= priority.io_weight <= 10000)
+            if priority.memory_high is not None:
+                self.assertTrue(0 < priority.memory_high <= 1)
+
+    def test_classes_are_ordered(self):
+        classes = [PRIORITY_CLASSES[name] for name in ('interactive', 'normal', 'batch')]
+        for higher, lower in zip(classes, classes[1:]):
+            self.assertLess(higher.nice, lower.nice)
+            self.assertGreater(higher.cpu_weight, lower.cpu_weight)
+            self.assertGreater(higher.io_weight, lower.io_weight)
+
+    def test_command(self):
+        with mock.patch('os.getpriority', return_value=5), \
+                mock.patch('shutil.which', return_value='/usr/bin/tool'):
+            self.assertEqual(PRIORITY_CLASSES['batch'].command(['make', 'all']),
+                             ['nice', '-n', '14', 'ionice', '-t', '-c', '3', 'make', 'all'])
+            self.assertEqual(PRIORITY_CLASSES['interactive'].command(['make']),
+                             ['ionice', '-t', '-c', '2', '-n', '4', 'make'])
+
+    @unittest.skipUnless(shutil.which('nice'), 'nice is not installed')
+    def test_command_runs_in_cgroup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cgroup = Cgroup(Path(directory))
+            argv = PRIORITY_CLASSES['batch'].command(['sh', '-c', 'echo $$; nice'], cgroup)
+            pid, niceness = subprocess.check_output(argv, universal_newlines=True).split()
+            self.assertEqual((cgroup.path / 'cgroup.procs').read_text().strip(), pid)
+        self.assertEqual(int(niceness), max(19, os.getpriority(os.PRIO_PROCESS, 0)))
+
+
+class CgroupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.parent = Path(self.directory.name)
+        (self.parent / 'cgroup.controllers').write_text('cpu io memory pids\n')
+        (self.parent / 'cgroup.subtree_control').write_text('pids\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_create(self):
+        cgroup = Cgroup.create(PRIORITY_CLASSES['batch'], self.parent, memory_high=1 << 30)
+        self.assertEqual(cgroup.path.parent, self.parent)
+        self.assertEqual((self.parent / 'cgroup.subtree_control').read_text(),
+                         '+cpu +io +memory')
+        self.assertEqual((cgroup.path / 'cpu.weight').read_text(), '10')
+        self.assertEqual((cgroup.path / 'io.weight').read_text(), 'default 10')
+        self.assertEqual((cgroup.path / 'memory.high').read_text(), str(1 << 30))
+        self.assertEqual(cgroup.skipped, [])
+
+    def test_create_records_skipped_limits(self):
+        write = Cgroup._write
+
+        def fail_limits(path, value):
+            return path.name == 'cgroup.subtree_control' and write(path, value)
+
+        with mock.patch.object(Cgroup, '_write', side_effect=fail_limits):
+            cgroup = Cgroup.create(PRIORITY_CLASSES['normal'], self.parent,
+                                   memory_high=1 << 30)
+        self.assertEqual(cgroup.skipped, ['cpu.weight', 'io.weight', 'memory.high'])
+
+    def test_create_without_cgroup(self):
+        self.assertIsNone(Cgroup.create(PRIORITY_CLASSES['batch'],
+                                        self.parent / 'missing'))
+
+    def test_stats(self):
+        cgroup = Cgroup(self.parent)
+        (self.parent / 'cpu.stat').write_text('usage_usec 3000000\nuser_usec 2000000\n'
+                                              'system_usec 1000000\nnr_periods 0\n')
+        (self.parent / 'memory.peak').write_text('1048576\n')
+        (self.parent / 'memory.current').write_text('max\n')
+        (self.parent / 'memory.events').write_text('low 0\nhigh 4\nmax 0\n')
+        (self.parent / 'io.stat').write_text(
+            '8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0\n'
+            '8:16 rbytes=1024 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n')
+        self.assertEqual(cgroup.stats(), {'cpu_usage_usec': 3000000,
+                                          'cpu_user_usec': 2000000,
+                                          'cpu_system_usec': 1000000,
+                                          'memory_peak': 1048576,
+                                          'memory_high_events': 4,
+                                          'io_rbytes': 5120,
+                                          'io_wbytes': 8192})
+
+    def test_stats_without_controllers(self):
+        self.assertEqual(Cgroup(self.parent).stats(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
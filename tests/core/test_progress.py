@@ -0,0 +1,89 @@
+"""Tests for kbuilder.core.progress."""
+
+import tempfile
+import unittest
+
+from kbuilder.core.progress import BuildProgress, read_progress
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class BuildProgressTestCase(unittest.TestCase):
+    def build(self, clock: Clock, reference=None) -> BuildProgress:
+        progress = BuildProgress('linux', references=[reference] if reference else [],
+                                 clock=clock)
+        for line in ('make[1]: Entering directory', '  CC      kernel/fork.o',
+                     '  CC [M]  drivers/usb/core/hub.o', '  AR      kernel/built-in.a',
+                     'kernel/fork.c:1:1: warning: unused', '  AS      arch/arm64/kernel/head.o'):
+            progress.feed(line)
+        clock.now = 60.0
+        progress.feed('  LD      vmlinux.o')
+        self.assertEqual(progress.stage, 'link')
+        progress.feed('  CC      init/version.o')
+        self.assertEqual(progress.stage, 'link')
+        clock.now = 70.0
+        progress.feed('  OBJCOPY arch/arm64/boot/Image')
+        progress.feed('  GZIP    arch/arm64/boot/Image.gz')
+        clock.now = 75.0
+        progress.finish(True)
+        return progress
+
+    def test_stages_and_objects(self):
+        progress = self.build(Clock())
+        self.assertEqual(progress.objects, 4)
+        self.assertEqual(progress.stages, [('compile', 60.0), ('link', 10.0),
+                                           ('compression', 5.0)])
+        self.assertIsNone(BuildProgress('linux').fraction())
+
+    def test_estimates_from_reference(self):
+        reference = self.build(Clock()).to_dict()
+        clock = Clock()
+        progress = BuildProgress('linux', references=[reference], clock=clock)
+        self.assertEqual(progress.remaining(), 75.0)
+        clock.now = 15.0
+        progress.feed('  CC      kernel/fork.o')
+        # A quarter of the objects in a quarter of the compile time
+        self.assertAlmostEqual(progress.remaining(), 45.0 + 15.0)
+        self.assertAlmostEqual(progress.fraction(), 0.2)
+        clock.now = 65.0
+        progress.feed('  LD      vmlinux')
+        self.assertAlmostEqual(progress.remaining(), 15.0)
+        with tempfile.TemporaryDirectory() as directory:
+            progress.write(directory)
+            state = read_progress(directory)['linux']
+        self.assertEqual((state['stage'], state['objects'], state['expected_objects']),
+                         ('link', 1, 4))
+
+    def test_larger_build_than_reference(self):
+        incremental = {'objects': 3, 'stages': [{'name': 'compile', 'duration': 2.0}]}
+        progress = BuildProgress('linux', references=[incremental], clock=Clock())
+        self.assertEqual(progress.expected_objects, 3)
+        for number in range(40):
+            progress.feed('  CC      kernel/file{}.o'.format(number))
+        # Only the count is shown without a build of comparable size
+        self.assertEqual(progress.objects, 40)
+        self.assertIsNone(progress.expected_objects)
+        self.assertIsNone(progress.remaining())
+        self.assertIsNone(progress.fraction())
+
+    def test_switches_to_comparable_reference(self):
+        incremental = {'objects': 3, 'stages': [{'name': 'compile', 'duration': 2.0}]}
+        full = {'objects': 100, 'stages': [{'name': 'compile', 'duration': 100.0},
+                                            {'name': 'link', 'duration': 10.0}]}
+        clock = Clock()
+        progress = BuildProgress('linux', references=[incremental, full], clock=clock)
+        self.assertEqual(progress.expected_objects, 3)
+        for number in range(19):
+            progress.feed('  CC      kernel/file{}.o'.format(number))
+        self.assertEqual(progress.expected_objects, 3)
+        clock.now = 20.0
+        progress.feed('  CC      kernel/file19.o')
+        self.assertEqual(progress.expected_objects, 100)
+        # A fifth of the objects in a fifth of the compile time
+        self.assertAlmostEqual(progress.remaining(), 80.0 + 10.0)
@@ -0,0 +1,120 @@
+"""Tests for kbuilder.core.remote_cache."""
+
+import hashlib
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from kbuilder.core.arch import Arch
+from kbuilder.core.exc import KbuilderRuntimeError
+from kbuilder.core.prepare_cache import PrepareCache
+from kbuilder.core.remote_cache import CacheServer, CacheStore, RemoteCache
+
+
+class RemoteCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.server = CacheServer(CacheStore(self.root / 'store'), '127.0.0.1', 0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.remote = RemoteCache(self.url, jobs=4)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_blobs_are_addressed_by_content(self):
+        path = self.root / 'blob'
+        path.write_bytes(b'contents')
+        digest = hashlib.sha256(b'contents').hexdigest()
+        self.assertTrue(self.remote.put_blob(path))
+        self.assertFalse(self.remote.put_blob(path))
+        self.assertEqual(self.remote.prefetch({digest: self.root / 'a',
+                                               '0' * 64: self.root / 'b'}), ['0' * 64])
+        self.assertEqual((self.root / 'a').read_bytes(), b'contents')
+        with self.assertRaises(KbuilderRuntimeError):
+            self.remote.put_blob(path, '1' * 64)
+
+    def test_prepare_snapshots_are_shared(self):
+        object_dir = self.root / 'out'
+        (object_dir / 'include' / 'generated').mkdir(parents=True)
+        (object_dir / 'include' / 'generated' / 'autoconf.h').write_text('#define A 1\n')
+        (object_dir / 'include' / 'config').mkdir()
+        (object_dir / 'include' / 'config' / 'a.h').write_text('')
+        (object_dir / 'scripts').mkdir()
+        (object_dir / 'scripts' / 'fixdep').write_text('tool')
+        (object_dir / 'scripts' / '.fixdep.cmd').write_text('cmd')
+        cache = PrepareCache(self.root / 'a', remote=self.remote)
+        cache.store('key', object_dir, Arch.arm64)
+        self.assertEqual(self.remote.wait(), [])
+
+        restored = self.root / 'restored'
+        restored.mkdir()
+        other = PrepareCache(self.root / 'b', remote=self.remote)
+        self.assertTrue(other.restore('key', restored))
+        self.assertFalse(other.restore('missing', restored))
+        self.assertEqual((restored / 'include' / 'generated' / 'autoconf.h').read_text(),
+                         '#define A 1\n')
+        self.assertEqual((restored / 'scripts' / 'fixdep').read_text(), 'tool')
+
+    def test_uploads_require_the_token(self):
+        server = CacheServer(CacheStore(self.root / 'private'), '127.0.0.1', 0, token='secret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        path = self.root / 'blob'
+        path.write_bytes(b'contents')
+        for token in (None, 'wrong'):
+            remote = RemoteCache(url, jobs=1, token=token)
+            self.addCleanup(remote.close)
+            with self.assertRaises(KbuilderRuntimeError):
+                remote.put_manifest('key', {'members': []})
+        remote = RemoteCache(url, jobs=1, token='secret')
+        self.addCleanup(remote.close)
+        self.assertTrue(remote.put_blob(path))
+        remote.put_manifest('key', {'members': []})
+        self.assertEqual(RemoteCache(url, jobs=1).get_manifest('key'), {'members': []})
+
+    def test_unsafe_manifests_are_rejected(self):
+        digest = hashlib.sha256(b'contents').hexdigest()
+        blob = self.root / 'blob'
+        blob.write_bytes(b'contents')
+        self.remote.put_blob(blob)
+        file = {'name': 'include/generated/a.h', 'mode': 0o644, 'mtime': 0, 'type': 'file',
+                'digest': digest, 'size': 8}
+        members = [dict(file, name='../escape.h'),
+                   dict(file, name='/tmp/escape.h'),
+                   dict(file, digest='../' + digest),
+                   dict(file, type='fifo'),
+                   {'name': 'include/generated/a.h', 'type': 'file'},
+                   dict(file, type='symlink', link='/etc/passwd'),
+                   dict(file, type='symlink', link='../../../etc/passwd'),
+                   dict(file, name=None)]
+        cache = PrepareCache(self.root / 'cache', remote=self.remote)
+        for number, member in enumerate(members):
+            self.remote.put_manifest('prepare-{}'.format(number), {'members': [member]})
+            with self.assertRaises(KbuilderRuntimeError):
+                cache.fetch(str(number))
+        self.remote.put_manifest('prepare-corrupt', {'files': []})
+        with self.assertRaises(KbuilderRuntimeError):
+            cache.fetch('corrupt')
+        self.assertEqual(list(cache.root.glob('*.tar')), [])
+
+        self.remote.put_manifest('prepare-safe', {'members': [
+            file, dict(file, name='include/generated/b.h', type='symlink', link='a.h')]})
+        self.assertTrue(cache.fetch('safe'))
+
+    def test_store_evicts_least_recently_used(self):
+        store = CacheStore(self.root / 'small', max_size=10)
+        for name in ('a', 'b', 'c'):
+            with open(str(self.root / 'blob'), 'w+b') as file:
+                file.write(b'123456')
+                file.seek(0)
+                store.write('ac', name, file, 6)
+        self.assertEqual(sorted(path.name for path in (self.root / 'small' / 'ac').iterdir()),
+                         ['c'])
@@ -0,0 +1,90 @@
+"""Tests for kbuilder.core.report."""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.report import BuildReport, _read_counters
+
+
+class BuildReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.image = self.root / 'Image.gz'
+        self.image.write_bytes(b'kernel')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def report(self, error=None):
+        report = BuildReport('kbuild_image', kernel='linux', compiler='gcc')
+        with report.phase('compile'):
+            report.count_warnings('kernel/fork.c:1:2: warning: unused variable')
+            report.count_warnings('  CC      kernel/fork.o')
+        report.add_artifact(self.image, 'kbuild_image')
+        if error:
+            report.fail(error)
+        report.finish()
+        return report
+
+    def test_json(self):
+        path = self.root / 'report.json'
+        self.report().write_json(path)
+        document = json.loads(path.read_text())
+        self.assertTrue(document['success'])
+        self.assertEqual(document['warnings'], 1)
+        self.assertEqual([phase['name'] for phase in document['phases']], ['compile'])
+        artifact, = document['artifacts']
+        self.assertEqual(artifact['size'], 6)
+        self.assertEqual(artifact['sha256'],
+                         '6923dd1bc0460082c5d55a831908c24a282860b7f1cd6c2b79cf1bc8857c639c')
+
+    def test_failure(self):
+        report = self.report(error='make failed')
+        self.assertFalse(report.success)
+        self.assertEqual(report.to_dict()['error'], 'make failed')
+
+    def test_prometheus(self):
+        path = self.root / 'kbuilder.prom'
+        self.report().write_prometheus(path)
+        text = path.read_text()
+        self.assertIn('# TYPE kbuilder_builds_total counter', text)
+        self.assertIn('kbuilder_build_success{command="kbuild_image",compiler="gcc",'
+                      'kernel="linux"} 1', text)
+        self.assertIn('artifact="kbuild_image"', text)
+        self.assertIn('phase="compile"', text)
+
+    def test_prometheus_counters_carry_over(self):
+        path = self.root / 'kbuilder.prom'
+        self.report().write_prometheus(path)
+        self.report().write_prometheus(path)
+        self.report(error='make failed').write_prometheus(path)
+
+        counters = _read_counters(path, 'kbuilder_builds_total')
+        labels = '{command="kbuild_image",compiler="gcc",kernel="linux",result="{}"}'
+        self.assertEqual(counters, {labels.replace('{}', 'success'): 2,
+                                    labels.replace('{}', 'failure'): 1})
+
+    def test_read_counters(self):
+        path = self.root / 'kbuilder.prom'
+        self.assertEqual(_read_counters(path, 'kbuilder_builds_total'), {})
+        path.write_text('# TYPE kbuilder_builds_total counter\n'
+                        'kbuilder_builds_total{kernel="a b"} 3\n'
+                        'kbuilder_builds_total{kernel="c"} NaNx\n'
+                        'kbuilder_builds_total_other{kernel="d"} 1\n')
+        self.assertEqual(_read_counters(path, 'kbuilder_builds_total'),
+                         {'{kernel="a b"}': 3})
+
+    def test_labels_are_escaped(self):
+        path = self.root / 'kbuilder.prom'
+        report = BuildReport('kbuild_image', kernel='my "kernel"')
+        report.finish()
+        report.write_prometheus(path)
+        self.assertIn('kernel="my \\"kernel\\""', path.read_text())
+        self.assertEqual(len(_read_counters(path, 'kbuilder_builds_total')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
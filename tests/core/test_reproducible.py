@@ -0,0 +1,54 @@
+"""Tests for kbuilder.core.reproducible."""
+
+import hashlib
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from kbuilder.core.reproducible import build_variables, source_date_epoch, write_zip
+
+
+class ReproducibleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_tree(self, name: str, order, mtime: int, mode: int) -> Path:
+        tree = self.root / name
+        for path in order:
+            (tree / path).parent.mkdir(parents=True, exist_ok=True)
+            (tree / path).write_bytes(path.encode() * 100)
+            os.chmod(str(tree / path), mode)
+            os.utime(str(tree / path), (mtime, mtime))
+        return tree
+
+    def test_zip_only_depends_on_contents(self):
+        first = self.make_tree('a', ['boot/Image', 'META-INF/update-binary', 'z'],
+                               1000000000, 0o600)
+        second = self.make_tree('b', ['z', 'META-INF/update-binary', 'boot/Image'],
+                                1500000000, 0o664)
+        digests = [hashlib.sha256(write_zip(tree, self.root / (tree.name + '.zip'),
+                                            1600000000).read_bytes()).hexdigest()
+                   for tree in (first, second)]
+        self.assertEqual(digests[0], digests[1])
+        with zipfile.ZipFile(str(self.root / 'a.zip')) as archive:
+            self.assertEqual(archive.namelist(), ['META-INF/', 'META-INF/update-binary',
+                                                  'boot/', 'boot/Image', 'z'])
+            info = archive.getinfo('boot/Image')
+            self.assertEqual(info.date_time, (2020, 9, 13, 12, 26, 40))
+            self.assertEqual(info.external_attr >> 16, 0o100644)
+            self.assertEqual(archive.read('z'), b'z' * 100)
+
+    def test_source_date_epoch(self):
+        self.assertEqual(source_date_epoch(self.root, {'SOURCE_DATE_EPOCH': '1234'}), 1234)
+        self.assertEqual(source_date_epoch(self.root, {}), 0)
+        with self.assertRaises(ValueError):
+            source_date_epoch(self.root, {'SOURCE_DATE_EPOCH': 'yesterday'})
+        variables = build_variables(0, 'user', 'host')
+        self.assertEqual(variables['KBUILD_BUILD_TIMESTAMP'], 'Thu Jan 01 00:00:00 UTC 1970')
+        self.assertEqual(variables['KBUILD_BUILD_HOST'], 'host')
@@ -0,0 +1,110 @@
+"""Tests for kbuilder.core.server."""
+
+import asyncio
+import hashlib
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.report import BuildReport
+from kbuilder.core.server import ArtifactServer, ExportIndex, parse_range
+
+
+class ArtifactServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.export = Path(self.directory.name)
+        self.content = bytes(range(256)) * 4096
+        (self.export / 'kernel-1.0.zip').write_bytes(self.content)
+        (self.export / '.partial.zip').write_bytes(b'partial')
+        self.loop = asyncio.new_event_loop()
+        self.server = ArtifactServer(self.export, host='127.0.0.1', port=0)
+        listener = self.loop.run_until_complete(self.server.start())
+        self.port = listener.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        self.directory.cleanup()
+
+    def get(self, *requests):
+        """Send requests over one connection, returning (status, headers, body) tuples."""
+        async def exchange():
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+            responses = []
+            for path, headers in requests:
+                lines = ['GET {} HTTP/1.1'.format(path), 'Host: localhost']
+                lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+                head = (await reader.readuntil(b'\r\n\r\n')).decode().split('\r\n')
+                fields = dict(line.split(': ', 1) for line in head[1:] if line)
+                body = await reader.readexactly(int(fields.get('Content-Length', 0)))
+                responses.append((int(head[0].split()[1]), fields, body))
+            writer.close()
+            await writer.wait_closed()
+            return responses
+        return self.loop.run_until_complete(exchange())
+
+    def test_serves_ranges_with_content_etags(self):
+        (full, fields, body), (partial, range_fields, part), (unchanged, _, _) = self.get(
+            ('/kernel-1.0.zip', {}),
+            ('/kernel-1.0.zip', {'Range': 'bytes=1000-1999'}),
+            ('/kernel-1.0.zip', {'If-None-Match': '"{}"'.format(
+                hashlib.sha256(self.content).hexdigest())}))
+        self.assertEqual((full, body), (200, self.content))
+        self.assertEqual(fields['ETag'], '"{}"'.format(hashlib.sha256(self.content).hexdigest()))
+        self.assertEqual((partial, part), (206, self.content[1000:2000]))
+        self.assertEqual(range_fields['Content-Range'],
+                         'bytes 1000-1999/{}'.format(len(self.content)))
+        self.assertEqual(unchanged, 304)
+
+    def test_serves_empty_files_on_kept_alive_connections(self):
+        (self.export / 'empty.txt').write_bytes(b'')
+        (empty, fields, body), (full, _, content) = self.get(('/empty.txt', {}),
+                                                             ('/kernel-1.0.zip', {}))
+        self.assertEqual((empty, fields['Content-Length'], body), (200, '0', b''))
+        self.assertEqual((full, content), (200, self.content))
+
+    def test_hides_files_outside_the_export_directory(self):
+        statuses = [status for status, _, _ in self.get(('/.partial.zip', {}),
+                                                        ('/../etc/passwd', {}),
+                                                        ('/missing.zip', {}))]
+        self.assertEqual(statuses, [404, 404, 404])
+
+    def test_hides_symlinks_leaving_the_export_directory(self):
+        outside = tempfile.TemporaryDirectory()
+        self.addCleanup(outside.cleanup)
+        Path(outside.name, 'secret').write_text('secret')
+        (self.export / 'secret.zip').symlink_to(Path(outside.name, 'secret'))
+        (self.export / 'linked').symlink_to(outside.name)
+        (self.export / 'kernel.zip').symlink_to('kernel-1.0.zip')
+        statuses = [status for status, _, _ in self.get(('/secret.zip', {}),
+                                                        ('/linked/secret', {}),
+                                                        ('/kernel.zip', {}))]
+        self.assertEqual(statuses, [404, 404, 200])
+
+    def test_lists_latest_artifacts(self):
+        index = ExportIndex(self.export)
+        builds = [(1.0, 'gcc-6', 'a.zip'), (2.0, 'gcc-7', 'b.zip'), (3.0, 'gcc-6', 'c.zip')]
+        for started, compiler, name in builds:
+            (self.export / name).write_bytes(name.encode())
+            report = BuildReport('ota_package', kernel='linux', compiler=compiler)
+            report.started = started
+            report.add_artifact(self.export / name, 'ota_package')
+            index.add(report)
+        index.save()
+        status, _, body = self.get(('/latest', {}))[0]
+        latest = json.loads(body.decode())['kernels']['linux']
+        self.assertEqual(status, 200)
+        self.assertEqual({compiler: kinds['ota_package']['url']
+                          for compiler, kinds in latest.items()},
+                         {'gcc-6': '/c.zip', 'gcc-7': '/b.zip'})
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=1000-', 1000)
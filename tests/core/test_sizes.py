@@ -0,0 +1,96 @@
+"""Tests for kbuilder.core.elf and kbuilder.core.sizes."""
+
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.elf import SHF_ALLOC, SHF_EXECINSTR, SHF_WRITE, ElfFile
+from kbuilder.core.sizes import SizeDiff, SizeProfile
+
+
+def write_elf(path: Path, symbols, debug_size: int=0) -> None:
+    """Write a 64 bit ELF file with .text, .data, .bss and .debug_info sections.
+
+    Args:
+        symbols: (name, section index, size) tuples, where sections are
+            numbered from 1 in the order above.
+        debug_size: Size of the .debug_info section, which is left sparse.
+    """
+    strtab = bytearray(1)
+    symtab = bytearray(24)
+    for name, section, size in symbols:
+        symtab += struct.pack('<IBBHQQ', len(strtab), 0x12 if section == 1 else 0x11, 0,
+                              section, 0, size)
+        strtab += name.encode() + b'\0'
+    # name, type, flags, contents, link
+    sections = [('.text', 1, SHF_ALLOC | SHF_EXECINSTR, bytes(0x1000), 0),
+                ('.data', 1, SHF_ALLOC | SHF_WRITE, bytes(0x200), 0),
+                ('.bss', 8, SHF_ALLOC | SHF_WRITE, 0x400, 0),
+                ('.symtab', 2, 0, bytes(symtab), 5),
+                ('.strtab', 3, 0, bytes(strtab), 0),
+                ('.debug_info', 1, 0, debug_size, 0)]
+    shstrtab = b'\0' + b''.join(name.encode() + b'\0'
+                                 for name, *_ in sections) + b'.shstrtab\0'
+    sections.append(('.shstrtab', 3, 0, shstrtab, 0))
+
+    header = bytearray(64)
+    table = bytearray(64)
+    writes = []
+    offset = 64
+    for name, type_, flags, contents, link in sections:
+        size = contents if isinstance(contents, int) else len(contents)
+        table += struct.pack('<IIQQQQIIQQ', shstrtab.index(name.encode() + b'\0'), type_,
+                             flags, 0, offset, size, link, 0, 1, 24 if type_ == 2 else 0)
+        if isinstance(contents, bytes):
+            writes.append((offset, contents))
+        if type_ != 8:
+            offset += size
+    writes.append((offset, table))
+    header[:6] = b'\x7fELF\x02\x01'
+    struct.pack_into('<Q', header, 0x28, offset)
+    struct.pack_into('<HHH', header, 0x3A, 64, len(sections) + 1, len(sections))
+    with open(str(path), 'wb') as file:
+        file.write(header)
+        for offset, contents in writes:
+            file.seek(offset)
+            file.write(contents)
+
+class SizeProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reads_sections_and_symbols(self):
+        write_elf(self.root / 'vmlinux', [('start_kernel', 1, 200),
+                                          ('helper.constprop.0', 1, 40),
+                                          ('helper.constprop.1', 1, 8), ('jiffies', 2, 8),
+                                          ('buffer', 3, 64), ('vermagic', 2, 16)])
+        with ElfFile(self.root / 'vmlinux') as elf:
+            self.assertEqual([section.name for section in elf.sections],
+                             ['', '.text', '.data', '.bss', '.symtab', '.strtab',
+                              '.debug_info', '.shstrtab'])
+        profile = SizeProfile.from_elf(self.root / 'vmlinux')
+        self.assertEqual(profile.sections, {'.text': 0x1000, '.data': 0x200, '.bss': 0x400})
+        self.assertEqual(profile.symbols, {'start_kernel': ('t', 200),
+                                           'helper.constprop': ('t', 48),
+                                           'jiffies': ('d', 8), 'buffer': ('b', 64)})
+        profile.save(self.root / 'vmlinux.sizes.json.gz')
+        (self.root / 'vmlinux.sizes.json.gz.tmp').write_text('not an ELF file')
+        self.assertEqual(SizeProfile.read(self.root / 'vmlinux.sizes.json.gz'), profile)
+        with self.assertRaises(ValueError):
+            SizeProfile.read(self.root / 'vmlinux.sizes.json.gz.tmp')
+
+    def test_diff(self):
+        old = SizeProfile({}, {'a': ('t', 100), 'b': ('t', 50), 'c': ('d', 8)})
+        new = SizeProfile({}, {'a': ('t', 120), 'b': ('t', 40), 'd': ('r', 30)})
+        diff = SizeDiff(old, new)
+        self.assertEqual([(change.name, change.delta) for change in diff.changes],
+                         [('d', 30), ('a', 20), ('c', -8), ('b', -10)])
+        lines = diff.lines()
+        self.assertEqual(lines[0], 'add/remove: 1/1 grow/shrink: 1/1 up/down: 50/-18 (32)')
+        self.assertEqual(lines[2].split(), ['d', '-', '30', '+30'])
+        self.assertEqual(lines[-1], 'Total: Before=158, After=190, chg +20.25%')
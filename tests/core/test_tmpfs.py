@@ -0,0 +1,45 @@
+"""Tests for kbuilder.core.tmpfs."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.tmpfs import TmpfsObjectDir, WriteBack
+
+
+class TmpfsObjectDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.tmpfs = TmpfsObjectDir(self.root / 'tmpfs', 'linux', self.root / 'disk',
+                                    min_available=0)
+        self.tmpfs.path.mkdir(parents=True)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_back(self):
+        write_back = WriteBack()
+        (self.root / 'log.txt').write_text('log')
+        write_back.submit(self.root / 'log.txt', self.root / 'logs' / 'log.txt')
+        write_back.join()
+        self.assertEqual((self.root / 'logs' / 'log.txt').read_text(), 'log')
+        self.assertEqual(write_back.errors, [])
+
+    def test_finish_build_and_flush(self):
+        self.assertEqual(self.tmpfs.expected_size, TmpfsObjectDir.min_size)
+        image = self.tmpfs.path / 'arch' / 'arm64' / 'boot' / 'Image'
+        image.parent.mkdir(parents=True)
+        image.write_bytes(bytes(4096))
+        (self.tmpfs.path / '.config').write_text('CONFIG_64BIT=y\n')
+        self.tmpfs.finish_build([image])
+        self.tmpfs.write_back.join()
+        self.assertTrue((self.root / 'disk' / 'arch' / 'arm64' / 'boot' / 'Image').exists())
+        self.assertEqual(len(self.tmpfs.previous_sizes), 1)
+        self.assertGreaterEqual(self.tmpfs.previous_sizes[0], 4096)
+
+        self.tmpfs.flush()
+        self.assertFalse(self.tmpfs.path.exists())
+        self.tmpfs.path.mkdir()
+        self.tmpfs._restore_config()
+        self.assertEqual((self.tmpfs.path / '.config').read_text(), 'CONFIG_64BIT=y\n')
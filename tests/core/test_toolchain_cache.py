@@ -0,0 +1,80 @@
+"""Tests for kbuilder.core.toolchain_cache."""
+
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.toolchain_cache import ToolchainCache, is_safe_member
+
+
+def _member(name, kind=tarfile.REGTYPE, linkname=''):
+    member = tarfile.TarInfo(name)
+    member.type = kind
+    member.linkname = linkname
+    return member
+
+
+class IsSafeMemberTestCase(unittest.TestCase):
+    def test_files_and_directories(self):
+        self.assertTrue(is_safe_member(_member('gcc/bin/gcc')))
+        self.assertTrue(is_safe_member(_member('gcc/bin', tarfile.DIRTYPE)))
+        self.assertFalse(is_safe_member(_member('/etc/passwd')))
+        self.assertFalse(is_safe_member(_member('gcc/../../passwd')))
+        self.assertFalse(is_safe_member(_member('gcc/dev', tarfile.CHRTYPE)))
+
+    def test_symlinks(self):
+        self.assertTrue(is_safe_member(_member('gcc/bin/ld', tarfile.SYMTYPE, 'ld.bfd')))
+        self.assertTrue(is_safe_member(_member('gcc/bin/ld', tarfile.SYMTYPE,
+                                               '../libexec/ld')))
+        self.assertFalse(is_safe_member(_member('gcc/bin/ld', tarfile.SYMTYPE, '/usr/bin/ld')))
+        self.assertFalse(is_safe_member(_member('gcc/bin/ld', tarfile.SYMTYPE,
+                                                '../../../usr/bin/ld')))
+        self.assertFalse(is_safe_member(_member('escape', tarfile.SYMTYPE, '..')))
+
+    def test_hard_links(self):
+        self.assertTrue(is_safe_member(_member('gcc/bin/cc', tarfile.LNKTYPE, 'gcc/bin/gcc')))
+        self.assertFalse(is_safe_member(_member('gcc/bin/cc', tarfile.LNKTYPE, '/usr/bin/gcc')))
+        self.assertFalse(is_safe_member(_member('gcc/bin/cc', tarfile.LNKTYPE, '../gcc')))
+
+
+class ToolchainCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.mirror = self.root / 'mirror'
+        self.mirror.mkdir()
+        self.cache = ToolchainCache(self.root / 'toolchains', self.mirror, 1 << 30)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_archive(self, name, members):
+        with tarfile.open(str(self.mirror / name), 'w:gz') as tar:
+            for member, data in members:
+                member.size = len(data)
+                member.mode = 0o755
+                tar.addfile(member, io.BytesIO(data) if data else None)
+
+    def test_extracts_safe_members_only(self):
+        self.write_archive('gcc.tar.gz', [
+            (_member('gcc', tarfile.DIRTYPE), b''),
+            (_member('gcc/bin', tarfile.DIRTYPE), b''),
+            (_member('gcc/bin/gcc'), b'#!/bin/sh\n'),
+            (_member('gcc/bin/cc', tarfile.SYMTYPE, 'gcc'), b''),
+            (_member('gcc/bin/passwd', tarfile.SYMTYPE, '/etc/passwd'), b''),
+            (_member('gcc/escape', tarfile.SYMTYPE, '../..'), b''),
+            (_member('gcc/escape/outside'), b'outside'),
+        ])
+        path = self.cache.ensure('gcc')
+        self.assertEqual((path / 'bin' / 'cc').read_text(), '#!/bin/sh\n')
+        self.assertTrue(os.access(str(path / 'bin' / 'gcc'), os.X_OK))
+        self.assertFalse(os.path.lexists(str(path / 'bin' / 'passwd')))
+        self.assertFalse((path / 'escape').is_symlink())
+        self.assertFalse((self.root / 'outside').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests for kbuilder.core.trash."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.trash import Trash, object_dir_outputs, source_tree_outputs
+
+
+class TrashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name, 'linux')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create(self, *paths):
+        for path in paths:
+            path = self.root / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(path.name)
+
+    def test_source_tree_outputs_without_git(self):
+        self.create('Makefile', '.config', 'vmlinux', '.vmlinux.cmd', 'System.map',
+                    'kernel/fork.c', 'kernel/fork.o', 'kernel/.fork.o.cmd',
+                    'arch/arm/boot/bootp/bootp.lds',
+                    'arch/arm/boot/compressed/vmlinux.lds.S',
+                    'arch/arm/boot/compressed/vmlinux.lds',
+                    'arch/arm/boot/compressed/.vmlinux.lds.cmd',
+                    'arch/arm/boot/zImage', 'arch/arm/boot/.zImage.cmd',
+                    'tools/perf/util/setup.o', 'tools/perf/util/.setup.o.cmd',
+                    'Documentation/sphinx/rules.d/kernel.o',
+                    'scripts/basic/fixdep', 'scripts/basic/.fixdep.cmd',
+                    '.tmp_versions/fork.mod')
+        self.assertEqual(sorted(source_tree_outputs(self.root)), [
+            '.tmp_versions', '.vmlinux.cmd', 'System.map',
+            'arch/arm/boot/.zImage.cmd', 'arch/arm/boot/compressed/.vmlinux.lds.cmd',
+            'arch/arm/boot/compressed/vmlinux.lds', 'arch/arm/boot/zImage',
+            'kernel/.fork.o.cmd', 'kernel/fork.o', 'vmlinux'])
+
+    def test_object_dir_outputs(self):
+        self.create('.config', 'Makefile', 'source', 'vmlinux', 'kernel/fork.o',
+                    'include/generated/autoconf.h', 'arch/arm64/include/generated/asm.h',
+                    'arch/arm64/boot/Image', 'arch/arm64/kernel/head.o')
+        self.assertEqual(list(object_dir_outputs(self.root)),
+                         ['arch/arm64/boot', 'arch/arm64/kernel', 'kernel', 'vmlinux'])
+
+    def test_move_and_reap(self):
+        self.create('kernel/fork.o', 'vmlinux', 'kernel/fork.c')
+        trash = Trash(Path(self.directory.name, 'trash'))
+        entry = trash.move(self.root, ['kernel/fork.o', 'vmlinux', 'missing.o'])
+        self.assertTrue((entry / 'kernel' / 'fork.o').exists())
+        self.assertFalse((self.root / 'vmlinux').exists())
+        self.assertTrue((self.root / 'kernel' / 'fork.c').exists())
+        self.assertEqual(trash.entries(), [entry])
+        trash.reap()
+        self.assertEqual(trash.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
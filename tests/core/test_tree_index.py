@@ -0,0 +1,51 @@
+"""Tests for kbuilder.core.tree_index."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.tree_index import TreeIndex
+
+
+class TreeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        (self.root / 'drivers').mkdir()
+        (self.root / 'drivers' / 'foo.c').write_text('int foo;')
+        (self.root / 'drivers' / 'foo.o').write_text('object')
+        (self.root / 'drivers' / '.foo.o.cmd').write_text('cmd')
+        (self.root / 'Makefile').write_text('all:')
+        boot = self.root / 'arch' / 'arm64' / 'boot'
+        (boot / 'dts').mkdir(parents=True)
+        (boot / 'dts' / 'board.dts').write_text('/dts-v1/;')
+        (boot / 'dts' / 'board.dtb').write_bytes(b'\xd0\x0d')
+        for image in ('Image', 'Image.gz', 'Image.gz-dtb'):
+            (boot / image).write_bytes(b'image')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scan_skips_build_outputs(self):
+        index = TreeIndex(self.root).scan()
+        self.assertEqual(sorted(index.entries), ['Makefile', 'arch/arm64/boot/dts/board.dts',
+                                                 'drivers/foo.c'])
+
+    def test_diff_reports_changed_paths(self):
+        old = TreeIndex(self.root).scan()
+        (self.root / 'drivers' / 'foo.c').write_text('int foo = 1;')
+        (self.root / 'drivers' / 'bar.c').write_text('int bar;')
+        (self.root / 'Makefile').unlink()
+        new = old.scan()
+        changes = old.diff(new)
+        self.assertEqual(changes.added, ['drivers/bar.c'])
+        self.assertEqual(changes.modified, ['drivers/foo.c'])
+        self.assertEqual(changes.removed, ['Makefile'])
+        self.assertNotEqual(old.fingerprint, new.fingerprint)
+
+    def test_saved_index_round_trips(self):
+        index = TreeIndex(self.root).scan()
+        index.save(self.root / '.kbuilder' / 'index')
+        loaded = TreeIndex.load(self.root / '.kbuilder' / 'index', self.root)
+        self.assertEqual(loaded.entries, index.entries)
+        self.assertFalse(index.diff(loaded.scan()))
@@ -0,0 +1,90 @@
+"""Tests for kbuilder.core.watch."""
+
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.watch import RebuildLoop, TreeWatcher
+
+GITIGNORE = """\
+vmlinux
+System.map
+modules.builtin
+*.lds
+/lib/crc32table.h
+"""
+
+
+class Stop(Exception):
+    pass
+
+
+class StoppingWatcher(object):
+    """Stop the rebuild loop once the tree stays unchanged for a second.
+
+    The loop is also stopped after a few rebuilds, which would never end
+    if builds reacted to their own outputs.
+    """
+
+    def __init__(self, watcher: TreeWatcher, max_changes: int=5) -> None:
+        self.watcher = watcher
+        self.max_changes = max_changes
+
+    def wait_for_change(self):
+        changes = self.watcher.wait_for_change(timeout=1.0)
+        self.max_changes -= 1
+        if not changes or not self.max_changes:
+            raise Stop()
+        return changes
+
+    def wait_until_settled(self, changes):
+        return self.watcher.wait_until_settled(changes)
+
+
+@unittest.skipUnless(shutil.which('git'), 'git is not installed')
+class TreeWatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        (self.root / 'lib').mkdir()
+        (self.root / 'arch/arm/boot/bootp').mkdir(parents=True)
+        (self.root / '.gitignore').write_text(GITIGNORE)
+        (self.root / 'lib' / 'crc32.c').write_text('int crc;')
+        (self.root / 'arch/arm/boot/bootp/bootp.lds').write_text('SECTIONS {}')
+        subprocess.check_call(['git', '-C', str(self.root), 'init', '-q'])
+        subprocess.check_call(['git', '-C', str(self.root), 'add', '-f', '.'])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_outputs(self):
+        for name in ('vmlinux', 'System.map', 'modules.builtin', 'lib/crc32table.h',
+                     'arch/arm/boot/vmlinux.lds', 'lib/crc32.o', '.tmp_vmlinux1'):
+            (self.root / name).write_text('output')
+
+    def test_ignores_build_outputs(self):
+        with TreeWatcher(self.root, debounce=0.1) as watcher:
+            self.write_outputs()
+            self.assertEqual(watcher.wait_for_change(timeout=0.3), set())
+            (self.root / 'lib' / 'crc32.c').write_text('int crc = 1;')
+            (self.root / 'arch/arm/boot/bootp/bootp.lds').write_text('SECTIONS { }')
+            (self.root / 'lib' / 'new.c').write_text('int new;')
+            changes = watcher.wait_until_settled(watcher.wait_for_change(timeout=1.0))
+        self.assertEqual(changes, {'lib/crc32.c', 'lib/new.c',
+                                   'arch/arm/boot/bootp/bootp.lds'})
+
+    def test_rebuild_loop_does_not_react_to_build_outputs(self):
+        builds = []
+
+        def build(changes):
+            builds.append(changes)
+            self.write_outputs()
+            if len(builds) == 1:
+                (self.root / 'lib' / 'crc32.c').write_text('int crc = 2;')
+
+        with TreeWatcher(self.root, debounce=0.1) as watcher:
+            with self.assertRaises(Stop):
+                RebuildLoop(StoppingWatcher(watcher), build, lambda: None).run()
+        self.assertEqual(builds, [set(), {'lib/crc32.c'}])
@@ -0,0 +1,50 @@
+"""Tests for kbuilder.core.worktree."""
+
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from kbuilder.core.worktree import WorktreePool
+
+
+def git(directory: Path, *arguments: str) -> str:
+    return subprocess.check_output(
+        ['git', '-C', str(directory), '-c', 'user.name=test', '-c', 'user.email=test@test']
+        + list(arguments)).decode().strip()
+
+
+@unittest.skipUnless(shutil.which('git'), 'git is not installed')
+class WorktreePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = Path(self.directory.name) / 'linux'
+        self.repository.mkdir()
+        git(self.repository, 'init', '-q')
+        for version in ('1', '2'):
+            (self.repository / 'Makefile').write_text('VERSION = {}\n'.format(version))
+            git(self.repository, 'add', 'Makefile')
+            git(self.repository, 'commit', '-qm', version)
+        self.pool = WorktreePool(self.repository, Path(self.directory.name) / 'pool', 2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reuses_worktrees(self):
+        with self.pool.acquire('HEAD~1') as worktree:
+            self.assertEqual((worktree.source / 'Makefile').read_text(), 'VERSION = 1\n')
+            (worktree.object_dir / 'vmlinux').write_text('')
+            (worktree.source / 'stale.o').write_text('')
+        with self.pool.acquire('HEAD') as worktree:
+            self.assertEqual(worktree.slot, 0)
+            self.assertEqual((worktree.source / 'Makefile').read_text(), 'VERSION = 2\n')
+            self.assertTrue((worktree.object_dir / 'vmlinux').exists())
+            self.assertFalse((worktree.source / 'stale.o').exists())
+            with self.pool.acquire('HEAD') as other:
+                self.assertEqual(other.slot, 1)
+        self.assertEqual((self.repository / 'Makefile').read_text(), 'VERSION = 2\n')
+        self.assertEqual(self.pool.states()[0]['commit'], git(self.repository, 'rev-parse',
+                                                              'HEAD'))
+        with self.assertRaises(ValueError):
+            self.pool.resolve('no-such-branch')
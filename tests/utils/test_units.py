@@ -0,0 +1,26 @@
+"""Tests for kbuilder.utils.units."""
+
+import unittest
+
+from kbuilder.utils.units import format_duration, format_size, parse_size
+
+
+class UnitsTestCase(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('16K'), 16 << 10)
+        self.assertEqual(parse_size(' 1.5gb '), 3 << 29)
+        self.assertEqual(parse_size('30G'), 30 << 30)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_format_size(self):
+        self.assertEqual(format_size(1023), '1023')
+        self.assertEqual(format_size(1536), '1.5K')
+        self.assertEqual(format_size(-(20 << 20)), '-20.0M')
+        self.assertEqual(format_size(3 << 40), '3.0T')
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(59.4), '59s')
+        self.assertEqual(format_duration(200), '3m 20s')
+        self.assertEqual(format_duration(3720), '1h 02m')